@@ -1,29 +1,56 @@
 #!/usr/bin/env python3
 # scripts/bankgen.py  (refactored to kirkomi-utils logger + relative imports)
+#
+# Keep module-level imports light: --validate-config / --set-config / --dry-run run
+# constantly in orchestration and must not pay for pandas, tqdm or the LLM provider
+# stack. Stage modules are imported inside the functions that run them
+# (budgets enforced by scripts/bench_startup.py).
 
 import argparse
 import sys
 from typing import Dict, Any
 
 # Project-local modules (relative imports since this file is inside scripts/)
-from scripts.config import load_config, save_config
-from scripts.helpers import estimate_cost_tokens
-from scripts import generate_personas, generate_transactions
+from scripts.config import (
+    AppConfig, ConfigError, coerce_value, configure, get_config, load_config, parse_overrides, save_config,
+)
+from scripts.metrics import metrics
+from scripts import profiling
 import logging
 
 # Shared logger from kirkomi_utils
 from kirkomi_utils.logging.logger import log
 
 
-def confirm_cost(stage: str) -> None:
+def confirm_cost(stage: str, mode: str = "sync") -> None:
     """
     Show a stage-specific cost estimate (project logic) and confirm with the user.
     """
-    cfg = load_config()
-    tokens, cost = estimate_cost_tokens(stage, cfg)
+    from scripts.helpers import estimate_cost_tokens
 
+    cfg = get_config()
+    tokens, cost = estimate_cost_tokens(stage, cfg, mode=mode)
+    _ask_to_proceed(stage, tokens, cost, cfg.model)
+
+
+def confirm_calls(stage: str, calls: int, mode: str = "sync") -> None:
+    """
+    Like confirm_cost, but for an exact number of LLM calls (used by `bankgen build`).
+    """
+    from scripts.helpers import estimate_cost_for_calls
+
+    cfg = get_config()
+    tokens, cost = estimate_cost_for_calls(calls, cfg, mode=mode)
+    log.info(f"{calls:,} stale {stage} artifacts to regenerate", tag="COST")
+    _ask_to_proceed(stage, tokens, cost, cfg.model)
+
+
+def _ask_to_proceed(stage: str, tokens: int, cost: float, model) -> None:
+    if get_config().llm_cassette_mode == "replay":
+        log.info(f"Replaying recorded LLM responses for {stage}; no API calls are made.", tag="COST")
+        return
     log.info(f"Estimated token usage for {stage}: {tokens:,} tokens", tag="COST")
-    log.info(f"Approximate cost: ${cost:.2f} USD using model={cfg.get('model')}", tag="COST")
+    log.info(f"Approximate cost: ${cost:.2f} USD using model={model}", tag="COST")
 
     proceed = input("⚠️  Proceed with generation? (y/yes to continue): ").strip().lower()
     if proceed not in {"y", "yes"}:
@@ -31,45 +58,204 @@ def confirm_cost(stage: str) -> None:
         sys.exit(0)
 
 
-def run_personas() -> None:
-    log.info("Running persona generation...", tag="RUN")
-    generate_personas.main()
+def run_personas(mode: str = "sync") -> None:
+    from scripts import generate_personas
+
+    log.info(f"Running persona generation (mode={mode})...", tag="RUN")
+    with metrics.stage("personas"), profiling.profile_stage("personas"):
+        generate_personas.main(mode)
     log.info("Persona generation complete.", tag="RUN")
 
 
-def run_transactions() -> None:
-    log.info("Running transaction generation...", tag="RUN")
-    generate_transactions.main()
+def run_transactions(mode: str = "sync") -> None:
+    from scripts import generate_transactions
+
+    log.info(f"Running transaction generation (mode={mode})...", tag="RUN")
+    with metrics.stage("transactions"), profiling.profile_stage("transactions"):
+        generate_transactions.main(mode)
     log.info("Transaction generation complete.", tag="RUN")
 
 
-def update_config(key: str, value: str) -> None:
+def run_command(args, name: str, fn) -> None:
     """
-    Update a single config key with type preserved from the existing config.
+    Run a subcommand as a single metrics/profiling stage and export the metrics reports.
     """
-    cfg: Dict[str, Any] = load_config()
-    if key not in cfg:
-        log.error(f"Invalid config key: {key}", tag="CFG")
-        log.info(f"Valid keys are: {list(cfg.keys())}", tag="CFG")
-        return
+    get_config()  # surface config errors before doing any work
+
+    if args.profile:
+        out_dir = profiling.enable()
+        log.info(f"🧪 Profiling enabled; reports go to {out_dir}", tag="PROFILE")
 
     try:
-        cast_value = type(cfg[key])(value)
-    except Exception:
-        # If casting fails (e.g., bools), try a small helper
-        lowered = value.strip().lower()
-        if isinstance(cfg[key], bool):
-            if lowered in {"true", "1", "yes", "y"}:
-                cast_value = True
-            elif lowered in {"false", "0", "no", "n"}:
-                cast_value = False
-            else:
-                log.error(f"Failed to parse boolean value for {key}: {value!r}", tag="CFG")
-                return
-        else:
-            log.error(f"Failed to cast value for {key}: {value!r} to {type(cfg[key]).__name__}", tag="CFG")
-            return
+        with metrics.stage(name), profiling.profile_stage(name):
+            fn()
+    finally:
+        write_metrics_reports()
+
+
+def run_build(args) -> None:
+    """
+    `bankgen build`: regenerate only the persona batches / user histories whose inputs changed.
+    """
+    from scripts import build
+
+    if args.mode == "batch":
+        log.error("bankgen build supports --mode sync or async.", tag="BUILD")
+        sys.exit(2)
+
+    confirm = None if args.plan else (lambda stage, calls: confirm_calls(stage, calls, args.mode))
+    run_command(args, "build", lambda: build.build(mode=args.mode, plan_only=args.plan, confirm=confirm))
+
+
+def run_render(args) -> None:
+    """
+    `bankgen render`: render HTML/PDF statements from the generated transactions.
+    """
+    from scripts import render
+
+    run_command(args, "render", lambda: render.render_all(fmt=args.format, workers=args.workers, limit=args.limit))
+
+
+def run_serve(args) -> None:
+    """
+    `bankgen serve`: Open Banking-shaped mock API over the generated transactions.
+    """
+    from scripts import serve
+
+    run_command(args, "serve", lambda: serve.serve(host=args.host, port=args.port, rebuild_index=args.rebuild_index))
+
+
+def run_replay(args) -> None:
+    """
+    `bankgen replay`: all users' transactions merged into one chronological JSON Lines event stream.
+    """
+    from scripts import replay
+
+    run_command(args, "replay", lambda: replay.replay(
+        speed=args.speed, out=args.out, address=args.socket, labels=args.labels,
+        from_time=args.from_time, to_time=args.to_time, limit=args.limit, rebuild_index=args.rebuild_index,
+    ))
+
+
+def run_features(args) -> None:
+    """
+    `bankgen features`: per-user income feature store joined to declared persona income.
+    """
+    from scripts import features
+
+    run_command(args, "features", lambda: features.build_features(out_path=args.out, rebuild_index=args.rebuild_index))
+
+
+def run_noise(args) -> None:
+    """
+    `bankgen noise`: regenerate description_raw locally from description_cleaned / merchant_name.
+    """
+    from scripts import noise
+
+    run_command(args, "noise", lambda: noise.renoise_dataset(
+        out_dir=args.out, seed=args.seed, variant=args.variant, in_place=args.in_place,
+    ))
+
+
+def run_augment(args) -> None:
+    """
+    `bankgen augment`: derive N perturbed users from every generated history.
+    """
+    from scripts import augment
+
+    run_command(args, "augment", lambda: augment.augment_dataset(variants=args.variants, seed=args.seed, out_dir=args.out))
+
 
+def run_stats(args) -> None:
+    """
+    `bankgen stats`: single-pass sketch profile of the dataset, optionally diffed against an older profile.
+    """
+    from scripts import stats
+
+    run_command(args, "stats", lambda: stats.run_stats(out_path=args.out, diff_path=args.diff, top=args.top))
+
+
+def run_catalog(args) -> None:
+    """
+    `bankgen catalog`: global merchant / payer catalog and a dictionary-encoded copy of the transactions.
+    """
+    from scripts import catalog
+
+    if args.restore:
+        run_command(args, "catalog", lambda: catalog.restore_dataset(args.restore))
+    else:
+        run_command(args, "catalog", catalog.build_catalog)
+
+
+def run_unshard(args) -> None:
+    """
+    `bankgen unshard`: expand compressed transaction shards into per-user CSVs.
+    """
+    from scripts import writer
+
+    run_command(args, "unshard", lambda: writer.unshard(remove=args.remove))
+
+
+def run_queue(args) -> None:
+    """
+    `bankgen queue`: seed the durable job queue with stale work, show its status or requeue failures.
+    """
+    from scripts import jobqueue, worker
+
+    def _run() -> None:
+        cfg = get_config()
+        queue = jobqueue.JobQueue.from_config(cfg)
+        if args.action == "seed":
+            seed = worker.seed_personas if args.kind == "personas" else worker.seed_transactions
+            log.info(f"Queued {seed(cfg, queue, confirm_calls)} {args.kind} jobs in {queue.path}", tag="QUEUE")
+        elif args.action == "requeue":
+            kinds = [args.kind] if args.kind else jobqueue.JOB_KINDS
+            log.info(f"Requeued {queue.requeue_failed(kinds)} failed jobs", tag="QUEUE")
+        worker.queue_status(queue)
+
+    run_command(args, "queue", _run)
+
+
+def run_worker(args) -> None:
+    """
+    `bankgen worker`: pull jobs from the queue until it is drained (any number of these can run).
+    """
+    from scripts import jobqueue, worker
+
+    kinds = [args.kind] if args.kind else jobqueue.JOB_KINDS
+    run_command(args, "worker", lambda: worker.run_worker(kinds, max_jobs=args.max_jobs, wait=args.wait))
+
+
+COMMANDS = {
+    "build": run_build,
+    "render": run_render,
+    "serve": run_serve,
+    "replay": run_replay,
+    "features": run_features,
+    "noise": run_noise,
+    "augment": run_augment,
+    "stats": run_stats,
+    "catalog": run_catalog,
+    "unshard": run_unshard,
+    "queue": run_queue,
+    "worker": run_worker,
+}
+
+
+def update_config(key: str, value: str) -> None:
+    """
+    Persist a single config key to config.yaml, cast to the type AppConfig declares for it.
+    For per-run changes use --override / BANKGEN_* instead; this rewrites the shared file.
+    """
+    try:
+        cast_value = coerce_value(key, value)
+    except ConfigError as e:
+        for err in e.errors:
+            log.error(err, tag="CFG")
+        log.info(f"Valid keys are: {[k for k in AppConfig.__dataclass_fields__ if k != 'provider_options']}", tag="CFG")
+        return
+
+    cfg: Dict[str, Any] = load_config()
     try:
         cfg[key] = cast_value
         save_config(cfg)
@@ -83,32 +269,72 @@ def handle_generation(args) -> None:
     Orchestrate which generation stages to run based on CLI args.
     """
     log.debug("Starting generation pipeline")
-    cfg = load_config()  # noqa: F841 (kept to ensure config load errors surface early)
-    log.debug(f"Loaded config")
-
-    if args.run == "personas":
-        confirm_cost("personas")
-        run_personas()
-    elif args.run == "transactions":
-        confirm_cost("transactions")
-        run_transactions()
-    else:
-        confirm_cost("personas")
-        run_personas()
-        confirm_cost("transactions")
-        run_transactions()
+    cfg = get_config()  # load + validate once; surfaces config errors before any stage runs
+    log.debug(f"Loaded config: num_users={cfg.num_users} months={cfg.months} output_dir={cfg.output_dir}")
+
+    if args.profile:
+        out_dir = profiling.enable()
+        log.info(f"🧪 Profiling enabled; reports go to {out_dir}", tag="PROFILE")
+
+    try:
+        if args.run == "personas":
+            confirm_cost("personas", args.mode)
+            run_personas(args.mode)
+        elif args.run == "transactions":
+            confirm_cost("transactions", args.mode)
+            run_transactions(args.mode)
+        else:
+            confirm_cost("personas", args.mode)
+            run_personas(args.mode)
+            confirm_cost("transactions", args.mode)
+            run_transactions(args.mode)
+    finally:
+        write_metrics_reports()
+
+
+def write_metrics_reports() -> None:
+    """
+    Export the run's metrics as a Prometheus textfile + JSON run report under logs/metrics/.
+    """
+    try:
+        prom_path, json_path = metrics.write_reports()
+        log.info(f"📈 Metrics written to {prom_path} and {json_path}", tag="METRICS")
+    except Exception as e:
+        log.exception(f"Failed to write metrics reports: {e}", tag="METRICS")
 
 
 def get_parser() -> argparse.ArgumentParser:
-    parser = argparse.ArgumentParser(description="Synthetic Bank Generator CLI")
+    parser = argparse.ArgumentParser(
+        description="Synthetic Bank Generator CLI",
+        epilog="Global options go before a subcommand, e.g. `bankgen --mode async build`.",
+    )
     parser.add_argument(
         "-r", "--run",
         choices=["personas", "transactions"],
         help="Run a specific stage (personas or transactions). If not provided, runs both.",
     )
+    parser.add_argument(
+        "-m", "--mode",
+        choices=["sync", "async", "batch"], default="sync",
+        help="LLM call mode: sync (default), async (concurrent live calls) or batch (offline Batch API, ~50%% cheaper).",
+    )
+    parser.add_argument(
+        "-c", "--config", metavar="PATH",
+        help="Config file to use (default: scripts/config.yaml or $BANKGEN_CONFIG)",
+    )
+    parser.add_argument(
+        "-o", "--override", action="append", metavar="KEY=VALUE", default=[],
+        help="Per-run config override, repeatable; never written to config.yaml "
+             "(e.g. -o num_users=500 -o provider_options.openai.request_timeout_s=60). "
+             "Environment equivalents: BANKGEN_NUM_USERS=500.",
+    )
+    parser.add_argument(
+        "--profile", action="store_true",
+        help="Profile each stage (cProfile, tracemalloc, event-loop lag) and write reports to logs/profile/",
+    )
     parser.add_argument(
         "--validate-config", action="store_true",
-        help="Validate config.yaml keys and types",
+        help="Validate config.yaml keys and types (with env/CLI overrides applied)",
     )
     parser.add_argument(
         "--dry-run", action="store_true",
@@ -118,33 +344,93 @@ def get_parser() -> argparse.ArgumentParser:
         "--set-config", nargs=2, metavar=("KEY", "VALUE"),
         help="Set config key and value (e.g., num_users 500)",
     )
+
+    subparsers = parser.add_subparsers(dest="command", metavar="COMMAND")
+    build_parser = subparsers.add_parser(
+        "build",
+        help="Incrementally regenerate only artifacts whose prompt/model/temperature/persona changed",
+    )
+    build_parser.add_argument(
+        "--plan", action="store_true",
+        help="Only report which persona batches / users are stale; make no LLM calls",
+    )
+
+    render_parser = subparsers.add_parser("render", help="Render UK-style HTML/PDF statements from transactions")
+    render_parser.add_argument("--format", choices=["html", "pdf"], help="Output format (default: render_format)")
+    render_parser.add_argument("--workers", type=int, help="Process pool size (default: render_workers or CPU count)")
+    render_parser.add_argument("--limit", type=int, help="Render at most N users (smoke tests / benchmarks)")
+
+    serve_parser = subparsers.add_parser("serve", help="Serve transactions through an OBIE-style mock API")
+    serve_parser.add_argument("--host", help="Bind address (default: serve_host)")
+    serve_parser.add_argument("--port", type=int, help="Port (default: serve_port)")
+    serve_parser.add_argument("--rebuild-index", action="store_true", help="Rebuild the transaction index even if fresh")
+
+    replay_parser = subparsers.add_parser("replay", help="Stream all transactions in global time order as JSON Lines events")
+    replay_parser.add_argument("--speed", type=float, default=0.0,
+                               help="Booking-time seconds per wall-clock second, e.g. 86400 = a day per second "
+                                    "(default: 0, as fast as possible)")
+    sink = replay_parser.add_mutually_exclusive_group()
+    sink.add_argument("--out", help="Write events to this file instead of stdout")
+    sink.add_argument("--socket", metavar="ADDR",
+                      help="Listen on host:port (TCP) or a filesystem path (Unix socket) and stream to the first client")
+    replay_parser.add_argument("--labels", action="store_true", help="Add risk_flag / source_type / is_income as \"Labels\"")
+    replay_parser.add_argument("--from", dest="from_time", help="Start at this booking time (ISO 8601)")
+    replay_parser.add_argument("--to", dest="to_time", help="Stop after this booking time (ISO 8601)")
+    replay_parser.add_argument("--limit", type=int, help="Stop after N events")
+    replay_parser.add_argument("--rebuild-index", action="store_true", help="Rebuild the transaction index even if fresh")
+
+    features_parser = subparsers.add_parser("features", help="Compute per-user income features vs declared persona income")
+    features_parser.add_argument("--out", help="Output CSV (default: <output_dir>/features/user_features.csv)")
+    features_parser.add_argument("--rebuild-index", action="store_true", help="Rebuild the transaction index even if fresh")
+
+    noise_parser = subparsers.add_parser("noise", help="Regenerate messy description_raw strings locally (no LLM calls)")
+    noise_parser.add_argument("--seed", type=int, help="Noise seed (default: noise_seed)")
+    noise_parser.add_argument("--variant", type=int, default=0, help="Variant number; each gives an independent rendering")
+    target = noise_parser.add_mutually_exclusive_group()
+    target.add_argument("--out", help="Output dataset directory (default: <output_dir>/noise-<seed>-<variant>)")
+    target.add_argument("--in-place", action="store_true", help="Overwrite description_raw in <output_dir>/transactions")
+
+    augment_parser = subparsers.add_parser("augment", help="Derive N perturbed users per history (no LLM calls)")
+    augment_parser.add_argument("--variants", type=int, help="Derived users per history (default: augment_variants)")
+    augment_parser.add_argument("--seed", type=int, help="Seed (default: augment_seed)")
+    augment_parser.add_argument("--out", help="Output dataset directory (default: <output_dir>/augmented)")
+
+    stats_parser = subparsers.add_parser("stats", help="Stream the dataset once into sketches and write a JSON profile")
+    stats_parser.add_argument("--out", help="Profile JSON (default: <output_dir>/stats/profile.json)")
+    stats_parser.add_argument("--diff", metavar="OLD_PROFILE", help="Compare against an earlier profile and warn on mode collapse")
+    stats_parser.add_argument("--top", type=int, default=20, help="Heavy hitters to report per field (default: 20)")
+
+    catalog_parser = subparsers.add_parser("catalog", help="Build the merchant/payer catalog and id-encoded transactions")
+    catalog_parser.add_argument("--restore", metavar="DIR",
+                                help="Instead, join the catalog back into per-user CSVs under DIR/transactions/")
+
+    unshard_parser = subparsers.add_parser("unshard", help="Expand output_layout: shards into per-user transaction CSVs")
+    unshard_parser.add_argument("--remove", action="store_true", help="Delete each shard once it is expanded")
+
+    queue_parser = subparsers.add_parser("queue", help="Seed / inspect the durable job queue used by `bankgen worker`")
+    queue_parser.add_argument("action", choices=["seed", "status", "requeue"],
+                              help="seed: queue stale work; status: job counts; requeue: retry failed jobs")
+    queue_parser.add_argument("kind", nargs="?", choices=["personas", "transactions"],
+                              help="Job kind (required for seed)")
+
+    worker_parser = subparsers.add_parser("worker", help="Pull and run queued jobs (start as many as you like)")
+    worker_parser.add_argument("--kind", choices=["personas", "transactions"], help="Only run jobs of this kind")
+    worker_parser.add_argument("--max-jobs", type=int, help="Exit after completing N jobs")
+    worker_parser.add_argument("--wait", action="store_true",
+                               help="Keep polling while jobs are leased elsewhere or pending, instead of exiting when none is claimable")
     return parser
 
 
 def _validate_config() -> None:
     """
-    Validate expected keys/types in the project config.
+    Validate expected keys/types in the project config (AppConfig schema, overrides applied).
     Note: DO NOT validate API keys here — LLM keys live in env/.env and are managed by kirkomi_utils.llm.
     """
-    required_schema = {
-        "num_users": int,
-        "months": int,
-        "batch_size": int,
-        "tx_batch_size": int,
-        "output_dir": str,
-    }
-
-    errors = []
-    cfg = load_config()
-    for k, expected_type in required_schema.items():
-        if k not in cfg:
-            errors.append(f"Missing key: {k}")
-        elif not isinstance(cfg[k], expected_type):
-            errors.append(f"Invalid type for {k}: expected {expected_type.__name__}, got {type(cfg[k]).__name__}")
-
-    if errors:
-        for e in errors:
-            log.error(e, tag="CFG")
+    try:
+        get_config()
+    except ConfigError as e:
+        for err in e.errors:
+            log.error(err, tag="CFG")
         log.error("❌ Config validation failed.", tag="CFG")
     else:
         log.info("✅ Config is valid.", tag="CFG")
@@ -157,6 +443,11 @@ def main() -> None:
     args = parser.parse_args()
     log.debug(f"Parsed args: {args}", tag="CLI")
 
+    try:
+        configure(args.config, parse_overrides(args.override))
+    except ConfigError as e:
+        parser.error(str(e))
+
     if args.validate_config:
         log.info("🔍 Validating config...", tag="CFG")
         _validate_config()
@@ -164,10 +455,12 @@ def main() -> None:
 
     if args.dry_run:
         log.info("🔧 DRY RUN", tag="DRYRUN")
-        if args.run:
-            log.info(f"Would run: generate-{args.run}", tag="DRYRUN")
+        if args.command:
+            log.info(f"Would run: {args.command} (mode={args.mode})", tag="DRYRUN")
+        elif args.run:
+            log.info(f"Would run: generate-{args.run} (mode={args.mode})", tag="DRYRUN")
         else:
-            log.info("Would run: generate-personas and generate-transactions", tag="DRYRUN")
+            log.info(f"Would run: generate-personas and generate-transactions (mode={args.mode})", tag="DRYRUN")
         return
 
     if args.set_config:
@@ -175,7 +468,19 @@ def main() -> None:
         update_config(key, value)
         return
 
-    handle_generation(args)
+    if args.command == "queue" and args.action == "seed" and not args.kind:
+        parser.error("bankgen queue seed needs a kind: personas or transactions")
+
+    try:
+        if args.command:
+            COMMANDS[args.command](args)
+            return
+        handle_generation(args)
+    except ConfigError as e:
+        for err in e.errors:
+            log.error(err, tag="CFG")
+        log.error("❌ Invalid configuration; nothing was run.", tag="CFG")
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -141,12 +141,13 @@ example_personas="""[
 
 """
 
-#full_persona_1_shot 1151 tokens
-full_persona_1_shot = """
+persona_intro = """
 You are a data generator creating ultra-realistic UK financial personas for raw Open Banking transaction simulation.  
 
-Generate exactly {n} distinct profiles in one JSON array.  
-Profiles must be diverse — different ages, locations, income mixes, life stories.  
+"""
+
+# Diversity brief shared by the JSON and tabular persona prompts.
+persona_brief = """Profiles must be diverse — different ages, locations, income mixes, life stories.  
 
 Focus on £2500–£6000/month earners where income looks fragmented or unclear.  
 Include edge cases:
@@ -184,7 +185,11 @@ Personas must be diverse across these income types (blend them too):
 
 ---
 
-Output Format = JSON array of {n} profiles  
+"""
+
+#full_persona_1_shot 1151 tokens
+full_persona_1_shot = persona_intro + """Generate exactly {n} distinct profiles in one JSON array.  
+""" + persona_brief + """Output Format = JSON array of {n} profiles  
 Each profile = JSON object with the following fields:
 """+json_personas+"""
 
@@ -197,6 +202,129 @@ Examples:
 """
 
 
+# Schema-constrained output contract (llm_output_format: structured): the json_personas fields as a
+# JSON Schema (strict-mode subset: every property required, no additional properties). Sent as the
+# provider's response_format where supported and checked locally by scripts/structured.py.
+def _strings(description):
+    return {"type": "array", "items": {"type": "string"}, "description": description}
+
+
+def _object(properties):
+    return {"type": "object", "properties": properties, "required": list(properties), "additionalProperties": False}
+
+
+PERSONA_SCHEMA = _object({
+    "full_name": {"type": "string"},
+    "age": {"type": "integer"},
+    "gender": {"type": "string"},
+    "location": {"type": "string", "description": "UK city or town"},
+    "ethnicity": {"type": "string", "description": "e.g. White British, British Pakistani"},
+    "occupations": _strings("e.g. Uber Driver, Private Tutor, Etsy Seller"),
+    "persona_summary": {
+        "type": "string",
+        "description": "Detailed narrative: job mix, income types, struggles, payment irregularities, transfers, notable "
+                       "events, what their last 6 months looked like. Include numbers, employer/agency names, government "
+                       "support, and flags for anything suspicious or complex.",
+    },
+    "income_streams": _object({
+        "formal_sources": _strings("e.g. Hays Recruitment, NHS Trust Leeds"),
+        "informal_sources": _strings("e.g. Private Tuition, Cash from eBay"),
+        "government_support": _strings("e.g. Universal Credit, Housing Benefit"),
+        "employers_last_6_months": _strings("with city/region relevance, e.g. NHS Trust - Leeds"),
+        "payment_frequency": {"type": "string", "description": "e.g. weekly payouts from gig apps + irregular tutoring"},
+        "average_monthly_income_in_gbp": {"type": "number"},
+        "monthly_income_variance_in_percent": {"type": "number", "description": "e.g. 28.6"},
+        "monthly_income_standard_deviation_in_gbp": {"type": "number", "description": "e.g. 750.00"},
+        "income_events_last_6_months": {
+            "type": "array",
+            "items": _object({
+                "date": {"type": "string", "description": "YYYY-MM-DD"},
+                "amount": {"type": "number"},
+                "type": {"type": "string", "enum": ["BACS", "FPS", "CHQ", "CASH"]},
+                "source": {"type": "string", "description": "e.g. Reed Payroll, Private Client, Amazon Flex, Unknown Transfer"},
+            }),
+        },
+    }),
+    "expense_behavior": _object({
+        "spend_categories": _strings("e.g. Fuel, Groceries, Crypto, POS payments, Direct Debits"),
+        "regular_obligations": _strings("e.g. EE Mobile, Rent via SO, BrightHouse DD"),
+        "financial_stress_signals": _strings("e.g. Overdraft, Cash deposits, Returned DD, Crypto"),
+    }),
+    "notable_events": _strings(
+        "e.g. £500 grant from DWP, April income spike from crypto, February DD bounce, One-off £10k transfer from friend"
+    ),
+    "income_estimation_challenges": _strings(
+        "Mixed employer names, one-off or irregular spikes, peer-to-peer disguised as payroll, family transfers "
+        "mimicking income, repeated Wise/PayPal/Stripe income making inference unclear"
+    ),
+})
+
+# {schema} is empty when the provider enforces the schema itself, else the schema as JSON.
+full_persona_structured = persona_intro + """Generate exactly {n} distinct profiles.  
+""" + persona_brief + """Output Format = {{"personas": [...]}} with {n} profiles
+{schema}
+"""
+
+
+# Compact output contract (llm_output_format: tabular): one header line + one pipe-delimited row per
+# persona, lists joined with ";". scripts/tabular.py expands rows back into the json_personas schema.
+# Header name -> persona field ("a.b" = key b of object a).
+TABULAR_PERSONA_COLUMNS = {
+    "name": "full_name",
+    "age": "age",
+    "gender": "gender",
+    "location": "location",
+    "ethnicity": "ethnicity",
+    "occupations": "occupations",
+    "formal": "income_streams.formal_sources",
+    "informal": "income_streams.informal_sources",
+    "govt": "income_streams.government_support",
+    "employers": "income_streams.employers_last_6_months",
+    "pay_freq": "income_streams.payment_frequency",
+    "avg_gbp": "income_streams.average_monthly_income_in_gbp",
+    "var_pct": "income_streams.monthly_income_variance_in_percent",
+    "std_gbp": "income_streams.monthly_income_standard_deviation_in_gbp",
+    "events": "income_streams.income_events_last_6_months",
+    "spend": "expense_behavior.spend_categories",
+    "obligations": "expense_behavior.regular_obligations",
+    "stress": "expense_behavior.financial_stress_signals",
+    "notable": "notable_events",
+    "challenges": "income_estimation_challenges",
+    "summary": "persona_summary",
+}
+
+tabular_personas = """
+First line is exactly this header, then one line per profile, fields separated by "|":
+""" + "|".join(TABULAR_PERSONA_COLUMNS) + """
+
+- name, age, gender, location (UK city or town), ethnicity (e.g. White British, British Pakistani)
+- occupations: e.g. Uber Driver;Private Tutor;Etsy Seller
+- formal / informal / govt: formal sources, informal sources and government support (may be empty)
+- employers: employers in the last 6 months, with city/region relevance (e.g. NHS Trust - Leeds)
+- pay_freq: payment frequency, e.g. weekly payouts from gig apps + irregular tutoring
+- avg_gbp / var_pct / std_gbp: average monthly income in GBP, monthly income variance in percent, monthly income standard deviation in GBP
+- events: income events in the last 6 months, each "YYYY-MM-DD amount TYPE source" with TYPE one of BACS, FPS, CHQ, CASH
+- spend / obligations / stress: spend categories, regular obligations, financial stress signals
+- notable: notable events, e.g. £500 grant from DWP;February DD bounce;One-off £10k transfer from friend
+- challenges: income estimation challenges (mixed employer names, one-off spikes, P2P disguised as payroll,
+  family transfers mimicking income, repeated Wise/PayPal/Stripe income making inference unclear)
+- summary: detailed narrative — job mix, income types, struggles, payment irregularities, transfers, notable
+  events, what their last 6 months looked like; include numbers, employer/agency names, government support
+  and flags for anything suspicious or complex
+
+Lists are joined with ";" (empty field = empty list). Never use "|" inside a field, or ";" inside a list item.
+
+Example row:
+Tariq Mahmood|38|Male|Leeds|British Pakistani|Care Assistant;Private Tutor;Handyman|NHS Trust - Leeds;Hays Recruitment|Private Tuition;Odd Handyman Work|Universal Credit|NHS Trust - Leeds;Hays Recruitment|Weekly BACS/FPS, monthly private cash|3250.0|22.5|750.75|2025-01-15 490.73 FPS Hays Recruitment;2025-01-24 1644.12 CASH Private Client;2025-02-12 925.33 BACS NHS Trust - Leeds;2025-03-07 1444.57 CHQ Tuition - Sarah M;2025-04-20 3000.00 BACS Unknown Transfer;2025-05-10 875.90 FPS Hays Recruitment|Groceries;Fuel;Mobile Top-Up;Home Supplies|EE Mobile;Rent via SO;Catalogue Credit|Cash deposits;Overdraft usage;Bounced DD|Cheque deposit in March from private tutoring;Overdraft fee in February;£3000 payroll-like transfer in April from unknown sender|Cash inflows and cheque payments with unclear labels;Peer-to-peer transfer mimicking payroll;Multiple agencies using different transaction formats|Tariq is a care assistant in Leeds who also tutors high school students and takes on odd handyman jobs. Over the past six months he has received regular BACS payments from NHS Trust - Leeds and Hays Recruitment, interspersed with cash and cheque payments from private clients. In April he received a suspicious £3,000 transfer labelled as payroll from an unknown sender. His income averages £3,250/month but is irregular, with unclear senders and informal work.
+"""
+
+full_persona_tabular = persona_intro + """Generate exactly {n} distinct profiles as rows of one pipe-delimited table.  
+""" + persona_brief + """Output Format = header line + {n} profile rows
+""" + tabular_personas + """
+✳ Output only the header line and {n} rows. No JSON, no markdown, no extra text or commentary.
+"""
+
+
 old_prompt = '''[{
         "role": "system",
         "content": "You are a financial persona generator for synthetic bank data modeling."
@@ -219,4 +347,88 @@ Generate {n} ultra-realistic UK gig/temp economy personas with traits:
 Return as a JSON list of objects.
 """
     }]
-    '''
\ No newline at end of file
+    '''
+
+# Component pools for the combinatorial persona sampler (persona_source: sampler).
+# Each prompt is called once; scripts/persona_sampler.py combines the pools locally.
+# Placeholders: {n} = items per list.
+
+pool_intro = """You are building reference data for a generator of realistic UK financial personas
+(gig workers, freelancers, side hustlers, sole traders, seasonal/agency staff, commission earners,
+cash-heavy workers and blended PAYE + freelance + benefits earners).
+"""
+
+pool_names = pool_intro + """
+Return one JSON object keyed by UK ethnicity label (at least 10 groups reflecting the UK population,
+e.g. "White British", "British Pakistani", "British Indian", "Black British Caribbean", "Polish", "Irish").
+Each value is an object with exactly these keys:
+  "male": [{n} common male first names for that group],
+  "female": [{n} common female first names for that group],
+  "surnames": [{n} common surnames for that group]
+
+✳ Output only raw JSON. No extra text or commentary.
+"""
+
+pool_towns = pool_intro + """
+Return a JSON array of {n} UK cities and towns spread across England, Scotland, Wales and Northern Ireland,
+weighted towards places with large gig and agency workforces. Each item:
+  {{"town": string, "region": string}}
+
+✳ Output only raw JSON array. No extra text or commentary.
+"""
+
+pool_occupations = pool_intro + """
+Return a JSON array of {n} occupations held by UK workers with fragmented or unclear income. Each item:
+  {{
+    "occupation": string,                 // e.g. "Deliveroo Rider", "Bank Nurse", "Freelance Web Developer"
+    "archetype": "gig" | "freelance" | "side_hustle" | "self_employed" | "seasonal" | "commission" | "cash_heavy" | "blended",
+    "formal_sources": [string],           // 2-4 real-sounding UK platforms, agencies or employers, e.g. "Hays Recruitment", "Uber BV"
+    "informal_sources": [string],         // 0-3, e.g. "Private Tuition", "Cash from eBay"
+    "payment_frequency": string           // e.g. "weekly gig payouts", "monthly invoices + cash"
+  }}
+
+✳ Output only raw JSON array. No extra text or commentary.
+"""
+
+pool_income_archetypes = pool_intro + """
+Return a JSON array of {n} income archetypes. Each describes the shape of a monthly income, not a person:
+  {{
+    "name": string,                          // e.g. "Weekly gig payouts with winter dip"
+    "archetype": "gig" | "freelance" | "side_hustle" | "self_employed" | "seasonal" | "commission" | "cash_heavy" | "blended",
+    "median_monthly_income_gbp": number,     // mostly £2500-£6000
+    "income_cv": number,                     // month-to-month coefficient of variation, 0.05-0.8
+    "government_support": [string],          // may be empty, e.g. ["Universal Credit"]
+    "spend_categories": [string],
+    "regular_obligations": [string],
+    "financial_stress_signals": [string],
+    "income_estimation_challenges": [string]
+  }}
+
+✳ Output only raw JSON array. No extra text or commentary.
+"""
+
+pool_event_templates = pool_intro + """
+Return a JSON array of {n} notable bank-statement event templates for such personas: one-off inflows,
+bounced direct debits, overdraft breaches, suspicious payroll-like transfers, refunds, grants, crypto.
+Each item is a string using only these placeholders: {{amount}} (GBP number), {{source}} (payer name), {{month}} (month name).
+e.g. "£{{amount}} transfer from {{source}} labelled as payroll in {{month}}", "Direct debit bounced in {{month}}"
+
+✳ Output only raw JSON array. No extra text or commentary.
+"""
+
+persona_pool_prompts = {
+    "names": pool_names,
+    "towns": pool_towns,
+    "occupations": pool_occupations,
+    "income_archetypes": pool_income_archetypes,
+    "event_templates": pool_event_templates,
+}
+
+# Lazy narrative for a sampled persona (persona_summary_mode: llm). Placeholder: {persona} = JSON.
+persona_summary_prompt = """Write the persona_summary for this UK financial persona: one paragraph, 3-5 sentences.
+Describe their job mix, income types, struggles, payment irregularities, transfers and notable events over
+the last 6 months. Use the numbers, employer/agency names and government support from the data, and flag
+anything suspicious or complex. Output only the paragraph.
+
+{persona}
+"""
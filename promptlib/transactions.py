@@ -29,7 +29,7 @@ json_transactions = """
   - "fraud_like"
 """
 
-rules_new = """Rules:
+rules_body = """Rules:
 
 1) Volume: produce 60–150 transactions total (depend on persona). Distribute over time; avoid implausible same-day duplicates.
 
@@ -64,7 +64,9 @@ For any "unexplained inflow" or "fraud_like", generate 2–3 follow-up transacti
 
 9) Round-tripping: occasionally simulate rapid in/out transfers that create synthetic loops; label as "synthetic_loop".
 
-10) Output constraints:
+"""
+
+rules_new = rules_body + """10) Output constraints:
 - Return only the JSON array (no commentary).
 - Ensure numeric/date formats are valid and ISO-8601 timestamps include timezone.
 - Maintain variety: different description patterns, ref codes, casing, truncations, and realistic randomness.
@@ -157,4 +159,132 @@ Each transaction must include the following fields:
 
 ---
 
-""" + rules_new
\ No newline at end of file
+""" + rules_new
+# Compact output contract (llm_output_format: tabular): one header line + pipe-delimited rows,
+# enums as short codes. scripts/tabular.py expands it back into the json_transactions schema.
+SOURCE_TYPE_CODES = {
+    "PL": "platform",
+    "AG": "agency",
+    "TU": "tuition",
+    "GV": "govt",
+    "RF": "refund",
+    "DD": "dd",
+    "PO": "pos",
+    "AT": "atm",
+    "CD": "cash_deposit",
+    "CQ": "cheque",
+    "P2": "p2p",
+    "FR": "fraud_like",
+}
+
+RISK_FLAG_CODES = {
+    "GB": "gambling",
+    "UI": "unexplained inflow",
+    "SL": "synthetic_loop",
+    "FL": "fraud_like",
+    "OF": "overdraft_fee",
+    "BD": "bounced_dd",
+}
+
+# Header name -> json_transactions field (transaction_type is implied by the sign of amt).
+TABULAR_TRANSACTION_COLUMNS = {
+    "ts": "timestamp",
+    "amt": "amount",
+    "cur": "currency",
+    "src": "source_type",
+    "risk": "risk_flag",
+    "inc": "is_income",
+    "merchant": "merchant_name",
+    "raw": "description_raw",
+    "clean": "description_cleaned",
+}
+
+tabular_transactions = """
+First line is exactly this header, then one line per transaction, fields separated by "|":
+""" + "|".join(TABULAR_TRANSACTION_COLUMNS) + """
+
+- ts: UTC timestamp without seconds or offset, e.g. 2025-03-11T14:32
+- amt: signed amount (positive = income, negative = spending), e.g. -12.40
+- cur: currency code; leave empty for GBP
+- src: source_type code: """ + ", ".join(f"{code}={name}" for code, name in SOURCE_TYPE_CODES.items()) + """
+- risk: risk_flag code, empty if none: """ + ", ".join(f"{code}={name}" for code, name in RISK_FLAG_CODES.items()) + """
+- inc: 1 if is_income else 0
+- merchant: merchant_name for card/ecommerce transactions, else empty
+- raw: description_raw, the messy bank-feed string
+- clean: description_cleaned, readable version
+
+Example rows:
+2025-03-11T14:32|412.50||AG||1||FPS CREDIT HAYSTEMPS WK12 REF:TS932|Payment from Hays Recruitment
+2025-03-12T08:05|-3.45||PO||0|Greggs|POSGREGGS1023LDN|POS spend at Greggs
+2025-03-14T19:40|-25.00||PO|GB|0|Bet365|BET365 LTD 0208|Bet365 gambling spend
+"""
+
+rules_tabular = """10) Output constraints:
+- Return only the header line and rows (no JSON, no markdown, no commentary).
+- Never use "|" inside a field; leave unknown fields empty rather than writing null.
+- Maintain variety: different description patterns, ref codes, casing, truncations, and realistic randomness.
+"""
+
+full_transaction_tabular = """
+You are generating a {months}-month UK Open Banking-style transaction history for the following gig worker profile:
+
+{persona}
+
+---
+
+OUTPUT: pipe-delimited table of transactions
+""" + tabular_transactions + """
+---
+
+""" + rules_body + rules_tabular
+
+
+# Schema-constrained output contract (llm_output_format: structured): the json_transactions fields
+# as a JSON Schema (strict-mode subset: every property required, nullable = ["string", "null"]).
+# Sent as the provider's response_format where supported and checked locally by scripts/structured.py.
+TRANSACTION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "timestamp": {"type": "string", "description": "ISO 8601 with timezone, e.g. 2025-03-11T14:32:00+00:00"},
+        "amount": {"type": "number", "description": "Signed: positive = income, negative = spending"},
+        "transaction_type": {"type": "string", "enum": ["CREDIT", "DEBIT"]},
+        "currency": {"type": "string", "description": "Currency code: GBP, or USD / EUR if applicable"},
+        "description_raw": {
+            "type": "string",
+            "description": "The messy bank-feed string, e.g. FPS CREDIT NHS LEE WK11 REF:TSH32, POSGREGGS1023LDN, DD EE LTD REF:9918",
+        },
+        "description_cleaned": {"type": "string", "description": "Readable version, e.g. Payment from NHS Trust, POS spend at Greggs"},
+        "merchant_name": {"type": ["string", "null"], "description": "Merchant name for card/ecommerce transactions, else null"},
+        "mcc": {"type": ["string", "null"], "description": "Merchant category code matching merchant_name, else null"},
+        "is_income": {"type": "boolean"},
+        "risk_flag": {"type": ["string", "null"], "enum": [*RISK_FLAG_CODES.values(), None]},
+        "source_type": {
+            "type": "string",
+            "enum": list(SOURCE_TYPE_CODES.values()),
+            "description": "platform (Uber, Deliveroo), agency (Hays, Reed, NHS Professionals), tuition, govt (DWP, HMRC), "
+                           "refund, dd (Direct Debit), pos, atm, cash_deposit, cheque, p2p (friend/family), fraud_like",
+        },
+    },
+    "required": ["timestamp", "amount", "transaction_type", "currency", "description_raw", "description_cleaned",
+                 "merchant_name", "mcc", "is_income", "risk_flag", "source_type"],
+    "additionalProperties": False,
+}
+
+rules_structured = """10) Output constraints:
+- Follow the response schema; the meaning of each field is in its description.
+- Maintain variety: different description patterns, ref codes, casing, truncations, and realistic randomness.
+"""
+
+# {schema} is empty when the provider enforces the schema itself, else the schema as JSON.
+full_transaction_structured = """
+You are generating a {months}-month UK Open Banking-style transaction history for the following gig worker profile:
+
+{persona}
+
+---
+
+OUTPUT: {{"transactions": [...]}}
+{schema}
+---
+
+""" + rules_body + rules_structured
@@ -0,0 +1,347 @@
+# augment.py
+"""
+Deterministic variant multiplier (`bankgen augment`).
+
+Derives N perturbed users from every generated history, so one LLM call yields N+1
+users. Per derived user (seeded, whole-dataset numpy — no per-row Python):
+
+    time shift          whole history moved by up to ±AUGMENT_SHIFT_DAYS, rows jittered by minutes
+    amount scaling      income x a factor drawn from the persona's own monthly variance,
+                        spending tracks income; small per-row noise on top
+    payee swaps         a share of merchants / employers replaced, consistently across the
+                        history, by another payee of the same source_type and direction
+                        from the dataset's own vocabulary
+    recurring items     some recurring debits (>= RECURRING_MIN regular payments to one payee)
+                        dropped; some users gain a recurring series borrowed from another user
+    description_raw     regenerated for every row by the noise engine (scripts/noise.py)
+
+Derived users get new ids (<user_id>_v<k>) and a persona record with the same
+adjustments: declared income and income events scaled, event dates shifted, swapped
+employers renamed. personas.csv gains a `source_user_id` column so variants of one
+history can be kept on the same side of a train/test split.
+
+Output: a complete dataset (originals + variants) under <output_dir>/augmented/.
+"""
+
+from __future__ import annotations
+
+import re
+import shutil
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from kirkomi_utils.logging.logger import log
+from .config import AppConfig, get_config
+from .dataset import read_personas, transaction_files
+from .features import DECLARED_FIELDS
+from .metrics import metrics
+from .noise import is_credit, noisy_descriptions, payer_name
+
+FILES_PER_CHUNK = 2_000
+
+AUGMENT_SHIFT_DAYS = 30
+JITTER_MINUTES = 90
+DEFAULT_CV = 0.15          # when the persona does not declare its income variance
+INCOME_FACTOR_RANGE = (0.6, 1.6)
+SPEND_SIGMA = 0.05         # spending factor = income factor x lognormal(0, SPEND_SIGMA)
+ROW_SIGMA = 0.03           # per-row amount noise
+
+# Payees that can be swapped for a peer; govt / cash / ATM / fraud rows keep theirs.
+SWAP_SOURCES = {"platform", "agency", "tuition", "pos", "dd", "refund", "p2p"}
+SWAP_RATE = 0.3
+RECURRING_MIN = 3
+DROP_RATE = 0.15           # per recurring series
+ADD_RATE = 0.3             # per derived user
+
+_NUMBER = r"(-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?)"
+_MONEY_KEYS = (
+    *DECLARED_FIELDS["declared_monthly_income_gbp"],
+    *DECLARED_FIELDS["declared_monthly_income_std_gbp"],
+    "amount",
+)
+_MONEY = re.compile(r"""(['"](?:""" + "|".join(_MONEY_KEYS) + r""")['"]\s*:\s*)""" + _NUMBER)
+_DATE = re.compile(r"""(['"]date['"]\s*:\s*['"])(\d{4}-\d{2}-\d{2})""")
+_VARIANCE = re.compile(
+    r"""['"](?:""" + "|".join(DECLARED_FIELDS["declared_monthly_income_variance_pct"]) + r""")['"]\s*:\s*""" + _NUMBER
+)
+# Persona fields that may name an employer.
+_PERSONA_TEXT_FIELDS = ("income_streams", "persona_summary", "notable_events")
+
+
+def _read(path: Path) -> pd.DataFrame:
+    return pd.read_csv(path, dtype=str, keep_default_na=False)
+
+
+def _declared_cv(persona: Optional[Dict[str, str]]) -> float:
+    match = _VARIANCE.search((persona or {}).get("income_streams", ""))
+    cv = float(match.group(1)) / 100 if match else DEFAULT_CV
+    return cv if 0 < cv < 2 else DEFAULT_CV
+
+
+def _group_starts(keys: np.ndarray, n_groups: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(members sorted by group, start offset per group, size per group)."""
+    order = np.argsort(keys, kind="stable")
+    counts = np.bincount(keys, minlength=n_groups)
+    return order, np.cumsum(counts) - counts, counts
+
+
+def _ranges(starts: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """Concatenated arange(start, start + count) for every pair (vectorised)."""
+    total = int(counts.sum())
+    return np.repeat(starts - (np.cumsum(counts) - counts), counts) + np.arange(total)
+
+
+class _Chunk:
+    """Source rows of up to FILES_PER_CHUNK users, decoded to arrays once."""
+
+    def __init__(self, frame: pd.DataFrame, lengths: np.ndarray) -> None:
+        self.frame = frame
+        self.n_users = len(lengths)
+        self.user = np.repeat(np.arange(self.n_users), lengths)
+
+        parsed = pd.to_datetime(frame["timestamp"], utc=True, errors="coerce", format="ISO8601")
+        self.ts_ok = parsed.notna().to_numpy()
+        self.ts = ((parsed - pd.Timestamp(0, tz="UTC")) // pd.Timedelta(seconds=1)).fillna(0).to_numpy(np.int64)
+        amount = pd.to_numeric(frame["amount"], errors="coerce").to_numpy()
+        self.amount_ok = ~np.isnan(amount)
+        self.amount = np.nan_to_num(amount)
+        self.credit = is_credit(frame)
+        income = frame["is_income"].str.strip().str.lower().isin(["true", "1", "yes", "y"]) \
+            if "is_income" in frame else pd.Series(False, index=frame.index)
+        self.income = income.to_numpy() & self.credit
+
+        # Payee = (source_type, direction, description_cleaned, merchant_name); group = (source_type, direction).
+        keys = pd.DataFrame({
+            "source": frame["source_type"].str.strip().str.lower() if "source_type" in frame else "",
+            "credit": self.credit,
+            "cleaned": frame.get("description_cleaned", ""),
+            "merchant": frame.get("merchant_name", ""),
+        })
+        self.payee = keys.groupby(["source", "credit", "cleaned", "merchant"], sort=False).ngroup().to_numpy()
+        self.n_payees = int(self.payee.max(initial=-1)) + 1
+        first_row = np.full(self.n_payees, len(frame), dtype=np.int64)
+        np.minimum.at(first_row, self.payee, np.arange(len(frame)))
+        self.payee_row = first_row
+        payee_keys = keys.iloc[first_row]
+        self.payee_group = payee_keys.groupby(["source", "credit"], sort=False).ngroup().to_numpy()
+        self.payee_swappable = payee_keys["source"].isin(SWAP_SOURCES).to_numpy()
+
+        first_ts = np.full(self.n_users, np.iinfo(np.int64).max)
+        np.minimum.at(first_ts, self.user[self.ts_ok], self.ts[self.ts_ok])
+        self.first_ts = np.where(first_ts == np.iinfo(np.int64).max, 0, first_ts)
+
+        # Recurring series: >= RECURRING_MIN debits from one user to one payee.
+        series_key = self.user * max(1, self.n_payees) + self.payee
+        uniq, inverse, counts = np.unique(series_key, return_inverse=True, return_counts=True)
+        recurring = (counts[inverse] >= RECURRING_MIN) & ~self.credit & self.ts_ok
+        series_ids, self.series = np.unique(inverse[recurring], return_inverse=True)
+        self.series_of_row = np.full(len(frame), -1)
+        self.series_of_row[recurring] = self.series
+        self.n_series = len(series_ids)
+        self.series_rows, self.series_start, self.series_count = _group_starts(self.series, self.n_series)
+        self.series_rows = np.flatnonzero(recurring)[self.series_rows]
+
+    def payee_name(self, payee: int) -> str:
+        """Display name of a payee as personas spell it ('Payment from Deliveroo' -> 'Deliveroo')."""
+        row = self.frame.iloc[self.payee_row[payee]]
+        return payer_name(row.get("merchant_name", "") or row.get("description_cleaned", ""))
+
+
+def _augment_chunk(chunk: _Chunk, cv: np.ndarray, variants: int, rng: np.random.Generator):
+    """
+    Returns (source row per output row, derived-user index per output row, ts, amount,
+    payee, per-user shift seconds, per-user income factor, per-user swaps {(old, new)}).
+    Derived user d = (k - 1) * n_users + source user, for variant k = 1..variants.
+    """
+    n_users, n_rows = chunk.n_users, len(chunk.user)
+    n_derived = variants * n_users
+    src_user = np.tile(np.arange(n_users), variants)
+
+    shift = rng.integers(-AUGMENT_SHIFT_DAYS, AUGMENT_SHIFT_DAYS + 1, n_derived) * 86400
+    income_factor = np.clip(np.exp(rng.normal(0, cv[src_user])), *INCOME_FACTOR_RANGE)
+    spend_factor = income_factor * np.exp(rng.normal(0, SPEND_SIGMA, n_derived))
+    adds = rng.random(n_derived) < ADD_RATE
+    add_pick = rng.random(n_derived)
+
+    # Expanded rows: every source row once per variant.
+    rows = np.tile(np.arange(n_rows), variants)
+    derived = np.repeat(np.arange(variants), n_rows) * n_users + chunk.user[rows]
+
+    # Drop whole recurring series per derived user.
+    series = chunk.series_of_row[rows]
+    in_series = series >= 0
+    drop_key = derived[in_series] * max(1, chunk.n_series) + series[in_series]
+    uniq, inverse = np.unique(drop_key, return_inverse=True)
+    dropped = np.zeros(len(rows), dtype=bool)
+    dropped[in_series] = (rng.random(len(uniq)) < DROP_RATE)[inverse]
+    rows, derived = rows[~dropped], derived[~dropped]
+    base_ts = chunk.ts[rows]
+
+    # Borrow a recurring series from the chunk, moved onto the receiving user's timeline.
+    if chunk.n_series:
+        takers = np.flatnonzero(adds)
+        picked = (add_pick[takers] * chunk.n_series).astype(np.int64)
+        counts = chunk.series_count[picked]
+        borrowed = chunk.series_rows[_ranges(chunk.series_start[picked], counts)]
+        takers = np.repeat(takers, counts)
+        borrowed_ts = chunk.ts[borrowed] - chunk.first_ts[chunk.user[borrowed]] + chunk.first_ts[src_user[takers]]
+        rows = np.concatenate([rows, borrowed])
+        derived = np.concatenate([derived, takers])
+        base_ts = np.concatenate([base_ts, borrowed_ts])
+
+    # Payee swaps, consistent per (derived user, payee).
+    payee = chunk.payee[rows]
+    swap_key = derived * max(1, chunk.n_payees) + payee
+    uniq, inverse = np.unique(swap_key, return_inverse=True)
+    old = uniq % max(1, chunk.n_payees)
+    members, group_start, group_size = _group_starts(chunk.payee_group, int(chunk.payee_group.max(initial=-1)) + 1)
+    group = chunk.payee_group[old]
+    new = members[group_start[group] + (rng.random(len(uniq)) * group_size[group]).astype(np.int64)]
+    new = np.where(chunk.payee_swappable[old] & (rng.random(len(uniq)) < SWAP_RATE), new, old)
+    payee = new[inverse]
+    swapped = new != old
+    swaps: Dict[int, List[Tuple[int, int]]] = {}
+    for d, a, b in zip((uniq[swapped] // max(1, chunk.n_payees)).tolist(), old[swapped].tolist(), new[swapped].tolist()):
+        swaps.setdefault(d, []).append((a, b))
+
+    jitter = rng.integers(-JITTER_MINUTES, JITTER_MINUTES + 1, len(rows)) * 60
+    ts = base_ts + shift[derived] + jitter
+    factor = np.where(chunk.income[rows], income_factor[derived], spend_factor[derived])
+    amount = np.round(chunk.amount[rows] * factor * np.exp(rng.normal(0, ROW_SIGMA, len(rows))), 2)
+    return rows, derived, ts, amount, payee, shift, income_factor, swaps
+
+
+def _derived_frame(chunk: _Chunk, rows, derived, ts, amount, payee, new_ids: List[str]) -> Tuple[pd.DataFrame, np.ndarray]:
+    order = np.lexsort((ts, derived))
+    rows, derived, ts, amount, payee = rows[order], derived[order], ts[order], amount[order], payee[order]
+
+    out = chunk.frame.iloc[rows].reset_index(drop=True)
+    src_ts, src_amount = out["timestamp"].to_numpy(), out["amount"].to_numpy()
+    iso = np.char.add(ts.astype("datetime64[s]").astype(str), "+00:00")
+    out["timestamp"] = np.where(chunk.ts_ok[rows], iso, src_ts)
+    out["amount"] = np.where(chunk.amount_ok[rows], amount.astype(str), src_amount)
+    payee_rows = chunk.payee_row[payee]
+    for column in ("description_cleaned", "merchant_name"):
+        if column in out:
+            out[column] = chunk.frame[column].to_numpy()[payee_rows]
+    out["user_id"] = np.asarray(new_ids, dtype=object)[derived]
+    return out, np.bincount(derived, minlength=len(new_ids))
+
+
+def _derived_persona(persona: Dict[str, str], new_id: str, shift_s: int, factor: float,
+                     renames: List[Tuple[str, str]]) -> Dict[str, str]:
+    row = dict(persona)
+    row["user_id"] = new_id
+    row["source_user_id"] = persona.get("user_id", "")
+    streams = row.get("income_streams", "")
+    streams = _MONEY.sub(lambda m: f"{m.group(1)}{round(float(m.group(2)) * factor, 2)}", streams)
+    shift_days = int(round(shift_s / 86400))
+    streams = _DATE.sub(
+        lambda m: m.group(1) + str(np.datetime64(m.group(2)) + np.timedelta64(shift_days, "D")), streams
+    )
+    row["income_streams"] = streams
+    for old, new in renames:
+        pattern = re.compile(rf"\b{re.escape(old)}\b")
+        for field in _PERSONA_TEXT_FIELDS:
+            if row.get(field):
+                row[field] = pattern.sub(new, row[field])
+    return row
+
+
+def _write_users(frame: pd.DataFrame, ids: List[str], lengths: np.ndarray, tx_dir: Path) -> int:
+    """
+    Write one CSV per user from a frame sorted by user: render the whole chunk once and
+    split the text at user boundaries (falls back to per-user writes if a field spans lines).
+    """
+    text = frame.to_csv(index=False, lineterminator="\n")
+    lines = text.split("\n")
+    nbytes = 0
+    if len(lines) != len(frame) + 2:
+        offset = 0
+        for user_id, n in zip(ids, lengths.tolist()):
+            path = tx_dir / f"{user_id}.csv"
+            frame.iloc[offset:offset + n].to_csv(path, index=False)
+            offset += n
+            nbytes += path.stat().st_size
+        return nbytes
+    header = lines[0] + "\n"
+    offset = 1
+    for user_id, n in zip(ids, lengths.tolist()):
+        body = header + "".join(line + "\n" for line in lines[offset:offset + n])
+        offset += n
+        (tx_dir / f"{user_id}.csv").write_text(body, encoding="utf-8")
+        nbytes += len(body)
+    return nbytes
+
+
+@log.log_timed("AUGMENT")
+def augment_dataset(variants: Optional[int] = None, seed: Optional[int] = None, out_dir: Optional[str] = None,
+                    cfg: Optional[AppConfig] = None) -> Path:
+    """Write originals + `variants` derived users per history to out_dir (default <output_dir>/augmented)."""
+    cfg = cfg or get_config()
+    variants = cfg.augment_variants if variants is None else variants
+    seed = cfg.augment_seed if seed is None else seed
+    src_dir = Path(cfg.output_dir)
+    dest = Path(out_dir) if out_dir else src_dir / "augmented"
+    files = transaction_files(src_dir)
+    if not files:
+        log.warning(f"No transactions found under {src_dir / 'transactions'}", tag="AUGMENT")
+        return dest
+    tx_dir = dest / "transactions"
+    tx_dir.mkdir(parents=True, exist_ok=True)
+
+    personas = read_personas(src_dir)
+    persona_rows: List[Dict[str, str]] = []
+    t0 = time.perf_counter()
+    rows_out = users_out = 0
+    width = len(str(variants))
+
+    for c0 in range(0, len(files), FILES_PER_CHUNK):
+        paths = files[c0:c0 + FILES_PER_CHUNK]
+        frames = [_read(p) for p in paths]
+        source_ids = [p.stem for p in paths]
+        for path, user_id in zip(paths, source_ids):
+            shutil.copyfile(path, tx_dir / path.name)
+            if user_id in personas:
+                persona_rows.append({**personas[user_id], "source_user_id": user_id})
+        lengths = np.array([len(f) for f in frames])
+        if not lengths.sum() or not variants:
+            continue
+
+        chunk = _Chunk(pd.concat(frames, ignore_index=True), lengths)
+        cv = np.array([_declared_cv(personas.get(u)) for u in source_ids])
+        rng = np.random.default_rng([seed, c0])
+        rows, derived, ts, amount, payee, shift, factor, swaps = _augment_chunk(chunk, cv, variants, rng)
+        new_ids = [f"{source_ids[d % chunk.n_users]}_v{str(d // chunk.n_users + 1).zfill(width)}"
+                   for d in range(variants * chunk.n_users)]
+        frame, per_user = _derived_frame(chunk, rows, derived, ts, amount, payee, new_ids)
+        frame["description_raw"] = noisy_descriptions(frame, seed, c0)
+
+        t1 = time.perf_counter()
+        nbytes = _write_users(frame, new_ids, per_user, tx_dir)
+        metrics.record_write(len(frame), time.perf_counter() - t1, nbytes)
+
+        names = {p: chunk.payee_name(p) for pairs in swaps.values() for pair in pairs for p in pair}
+        for d, new_id in enumerate(new_ids):
+            source = personas.get(source_ids[d % chunk.n_users])
+            if source is None:
+                continue
+            renames = [(names[a], names[b]) for a, b in swaps.get(d, []) if names[a] and names[b] and names[a] != names[b]]
+            persona_rows.append(_derived_persona(source, new_id, int(shift[d]), float(factor[d]), renames))
+        rows_out += len(frame)
+        users_out += len(new_ids)
+
+    if persona_rows:
+        pd.DataFrame(persona_rows).to_csv(dest / "personas.csv", index=False)
+    metrics.inc("augment_users_total", users_out)
+    metrics.inc("augment_rows_total", rows_out)
+    log.info(
+        f"✅ {len(files)} histories x {variants} variants -> {users_out} derived users, {rows_out} rows "
+        f"in {time.perf_counter() - t0:.2f}s -> {dest}",
+        tag="AUGMENT",
+    )
+    return dest
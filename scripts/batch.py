@@ -0,0 +1,265 @@
+# batch.py
+"""
+Offline Batch API support.
+
+Live calls (LLMClient.chat / chat_async) are priced at the full rate and share the
+account's rate limits. The provider Batch API takes a JSONL file of requests, runs
+them within a completion window at roughly half the price, and returns a JSONL file
+of results keyed by `custom_id`.
+
+Flow:
+    requests  -> write_batch_file()   -> <output_dir>/batches/<name>-<ts>.input.jsonl
+              -> backend.submit()     -> batch_id
+              -> backend.poll()       -> until a terminal status
+              -> backend.fetch()      -> <output_dir>/batches/<name>-<ts>.output.jsonl
+              -> read_batch_results() -> {custom_id: BatchResult}
+
+Backends (selected by `batch_backend` in config.yaml):
+    openai  - OpenAI Files + Batches API (credentials from env/.env, like kirkomi_utils.llm)
+    local   - stand-in that serves results from `batch_local_dir/responses.jsonl` on disk,
+              for offline runs and tests. Each line uses the provider output format:
+              {"custom_id": "...", "response": {"status_code": 200, "body": {...}}, "error": null}
+"""
+
+from __future__ import annotations
+
+import json
+import time
+import shutil
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+from kirkomi_utils.logging.logger import log
+from .config import AppConfig
+from .metrics import metrics, usage_tokens
+
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+@dataclass
+class BatchRequest:
+    custom_id: str
+    messages: Sequence[Dict[str, str]]
+    options: Dict[str, Any] = field(default_factory=dict)   # extra body parameters, e.g. response_format
+
+
+@dataclass
+class BatchResult:
+    custom_id: str
+    content: str = ""
+    usage: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+
+
+# -----------------------------------------------------------------------------
+# JSONL rendering / parsing
+# -----------------------------------------------------------------------------
+
+def write_batch_file(path: Path, requests: Sequence[BatchRequest], cfg: AppConfig) -> Path:
+    """
+    Render requests into the provider batch input format (one JSON object per line).
+    model/temperature/max_tokens come from the app config, same as the live client.
+    """
+    body_defaults: Dict[str, Any] = {"model": cfg.model}
+    if cfg.temperature is not None:
+        body_defaults["temperature"] = cfg.temperature
+    if cfg.max_tokens is not None:
+        body_defaults["max_completion_tokens"] = cfg.max_tokens
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        for req in requests:
+            line = {
+                "custom_id": req.custom_id,
+                "method": "POST",
+                "url": BATCH_ENDPOINT,
+                "body": {**body_defaults, **req.options, "messages": list(req.messages)},
+            }
+            f.write(json.dumps(line, ensure_ascii=False) + "\n")
+    return path
+
+
+def parse_result_line(line: Dict[str, Any]) -> BatchResult:
+    """
+    Convert one provider output line into a BatchResult.
+    """
+    custom_id = line.get("custom_id", "")
+    if line.get("error"):
+        return BatchResult(custom_id=custom_id, error=json.dumps(line["error"]))
+
+    response = line.get("response") or {}
+    if response.get("status_code", 200) != 200:
+        return BatchResult(custom_id=custom_id, error=f"HTTP {response.get('status_code')}")
+
+    body = response.get("body") or {}
+    try:
+        content = body["choices"][0]["message"]["content"] or ""
+    except (KeyError, IndexError, TypeError):
+        return BatchResult(custom_id=custom_id, error="Malformed response body")
+    return BatchResult(custom_id=custom_id, content=content, usage=body.get("usage") or {})
+
+
+def read_batch_results(path: Path) -> Dict[str, BatchResult]:
+    results: Dict[str, BatchResult] = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for raw in f:
+            raw = raw.strip()
+            if not raw:
+                continue
+            result = parse_result_line(json.loads(raw))
+            results[result.custom_id] = result
+    return results
+
+
+# -----------------------------------------------------------------------------
+# Backends
+# -----------------------------------------------------------------------------
+
+class OpenAIBatchBackend:
+    """
+    OpenAI Files + Batches API. The SDK reads OPENAI_API_KEY from the environment.
+    """
+
+    def __init__(self) -> None:
+        from openai import OpenAI  # deferred: only needed for real batch submissions
+        self.client = OpenAI()
+
+    def submit(self, input_path: Path) -> str:
+        with open(input_path, "rb") as f:
+            uploaded = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=uploaded.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window="24h",
+        )
+        return batch.id
+
+    def poll(self, batch_id: str) -> str:
+        return self.client.batches.retrieve(batch_id).status
+
+    def fetch(self, batch_id: str, dest_path: Path) -> Path:
+        batch = self.client.batches.retrieve(batch_id)
+        lines = []
+        # Successful lines live in the output file; per-request failures in the error file.
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                lines.append(self.client.files.content(file_id).text.strip())
+        dest_path.write_text("\n".join(l for l in lines if l) + "\n", encoding="utf-8")
+        return dest_path
+
+
+class LocalBatchBackend:
+    """
+    Stand-in backend that serves batch results from disk.
+
+    `submit` copies the input file next to the canned responses and completes immediately;
+    `fetch` emits one output line per submitted custom_id, taken from responses.jsonl,
+    or an error line if no canned response exists for it.
+    """
+
+    def __init__(self, results_dir: Path) -> None:
+        self.results_dir = Path(results_dir)
+        self.responses_path = self.results_dir / "responses.jsonl"
+
+    def submit(self, input_path: Path) -> str:
+        self.results_dir.mkdir(parents=True, exist_ok=True)
+        batch_id = f"local-{input_path.name.split('.')[0]}"
+        shutil.copyfile(input_path, self.results_dir / f"{batch_id}.input.jsonl")
+        return batch_id
+
+    def poll(self, batch_id: str) -> str:
+        return "completed"
+
+    def fetch(self, batch_id: str, dest_path: Path) -> Path:
+        canned: Dict[str, str] = {}
+        if self.responses_path.exists():
+            with open(self.responses_path, "r", encoding="utf-8") as f:
+                for raw in f:
+                    if raw.strip():
+                        canned[json.loads(raw)["custom_id"]] = raw.strip()
+
+        with open(self.results_dir / f"{batch_id}.input.jsonl", "r", encoding="utf-8") as src, \
+                open(dest_path, "w", encoding="utf-8") as out:
+            for raw in src:
+                if not raw.strip():
+                    continue
+                custom_id = json.loads(raw)["custom_id"]
+                line = canned.get(custom_id) or json.dumps({
+                    "custom_id": custom_id,
+                    "response": None,
+                    "error": {"code": "not_found", "message": f"No canned response in {self.responses_path}"},
+                })
+                out.write(line + "\n")
+        return dest_path
+
+
+def get_batch_backend(cfg: AppConfig):
+    backend = cfg.batch_backend
+    if backend == "local":
+        return LocalBatchBackend(Path(cfg.batch_local_dir))
+    if backend == "openai":
+        return OpenAIBatchBackend()
+    raise ValueError(f"Unknown batch_backend: {backend!r} (expected 'openai' or 'local')")
+
+
+# -----------------------------------------------------------------------------
+# Orchestration
+# -----------------------------------------------------------------------------
+
+def run_batch(requests: List[BatchRequest], cfg: AppConfig, name: str, backend=None) -> Dict[str, BatchResult]:
+    """
+    Write, submit, poll and ingest one batch. Blocks until the batch reaches a terminal status.
+
+    Args:
+        requests: prompts to run, each with a unique custom_id.
+        cfg:      app config (model, output_dir, batch_* keys).
+        name:     stage name used for the batch file names.
+        backend:  optional backend instance; defaults to the one selected by config.
+
+    Returns:
+        {custom_id: BatchResult}. Requests missing from the result file are absent.
+    """
+    backend = backend or get_batch_backend(cfg)
+    poll_interval = cfg.batch_poll_interval_s
+    timeout = cfg.batch_timeout_s
+
+    batch_dir = Path(cfg.output_dir) / "batches"
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    input_path = write_batch_file(batch_dir / f"{name}-{stamp}.input.jsonl", requests, cfg)
+    log.info(f"Wrote {len(requests)} batch requests to {input_path}", tag="BATCH")
+
+    batch_id = backend.submit(input_path)
+    log.info(f"Submitted batch {batch_id}", tag="BATCH")
+
+    deadline = time.monotonic() + timeout
+    status = backend.poll(batch_id)
+    while status not in TERMINAL_STATUSES:
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Batch {batch_id} still {status!r} after {timeout:.0f}s")
+        log.debug(f"Batch {batch_id} status: {status}", tag="BATCH")
+        time.sleep(poll_interval)
+        status = backend.poll(batch_id)
+
+    if status != "completed":
+        # Expired/cancelled batches can still carry partial results; ingest what exists.
+        log.warning(f"Batch {batch_id} finished with status {status!r}", tag="BATCH")
+
+    output_path = backend.fetch(batch_id, batch_dir / f"{name}-{stamp}.output.jsonl")
+    results = read_batch_results(output_path)
+    failed = sum(1 for r in results.values() if r.error)
+    # Requests can override the model (model_routing: tiered); label each result with its own.
+    models = {req.custom_id: req.options.get("model") or cfg.model or "unknown" for req in requests}
+    for r in results.values():
+        labels = {"model": models.get(r.custom_id, cfg.model or "unknown"), "mode": "batch"}
+        metrics.inc("llm_calls_total", labels=labels)
+        if r.error:
+            metrics.inc("llm_errors_total", labels=labels)
+            continue
+        input_tokens, output_tokens = usage_tokens(r.usage)
+        metrics.inc("llm_input_tokens_total", input_tokens, labels=labels)
+        metrics.inc("llm_output_tokens_total", output_tokens, labels=labels)
+    log.info(f"Batch {batch_id}: {len(results) - failed} ok, {failed} failed -> {output_path}", tag="BATCH")
+    return results
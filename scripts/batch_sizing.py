@@ -0,0 +1,170 @@
+# batch_sizing.py
+"""
+Adaptive persona batch sizing (persona_batch_sizing: adaptive).
+
+A fixed batch_size is either too large — the persona array runs into max_tokens, the JSON is
+cut off and the whole batch is lost — or too small, paying the ~1.4k-token persona prompt on
+every handful of personas. BatchSizer picks `n` for each request from what the previous
+responses showed:
+
+    ceiling     output tokens per valid persona (EWMA) against the output limit (max_tokens),
+                with headroom; a truncated response also caps the ceiling below its n
+    score       valid personas per second of LLM latency (objective: throughput) or per 1k
+                input+output tokens (objective: cost — model_pricing charges every token alike,
+                so this is proportional to personas per dollar), kept as an EWMA per n
+    search      hill-climb on the score: keep stepping while it improves, reverse and halve the
+                step when it gets worse, hold once the step is down to 1 and turned round
+    truncation  multiplicative decrease: n is halved and the search restarts below the cut
+
+    sizer = BatchSizer.from_config(cfg)
+    n = sizer.next_size(remaining)
+    ...                                    # call the LLM, parse
+    sizer.observe(n, valid=len(rows), latency_s=dt, usage=res.usage, truncated=...)
+
+Every change of n is logged under the BATCH_SIZER tag with its reason; requested sizes and
+truncations are recorded in persona_batch_size / persona_batch_truncations_total.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Dict, Optional
+
+from kirkomi_utils.logging.logger import log
+from .config import AppConfig
+from .metrics import metrics, usage_tokens
+
+# Share of the output limit a batch is sized to fill; the rest absorbs persona-length variance.
+HEADROOM = 0.85
+# Smoothing for tokens-per-persona and per-n scores.
+ALPHA = 0.5
+# A held (converged) size only moves to another explored size that scores this much better.
+HYSTERESIS = 1.05
+# Output this close to max_tokens counts as truncated when the client reports no finish_reason.
+_TRUNCATION_FILL = 0.98
+
+
+def is_truncated(res: Any, max_tokens: Optional[int]) -> bool:
+    """True when a response stopped at the output limit (finish_reason "length", or usage at max_tokens)."""
+    if getattr(res, "finish_reason", None) == "length":
+        return True
+    if not max_tokens:
+        return False
+    _, output_tokens = usage_tokens(getattr(res, "usage", None))
+    return output_tokens >= max_tokens * _TRUNCATION_FILL
+
+
+class BatchSizer:
+    """Feedback controller for the number of personas requested per LLM call."""
+
+    def __init__(self, initial: int, max_size: int, objective: str = "throughput",
+                 output_limit: Optional[int] = None) -> None:
+        self.max_size = max(1, max_size)
+        self.objective = objective
+        self.output_limit = output_limit
+        self.n = min(max(1, initial), self.max_size)
+        self.ceiling = self.max_size
+        self._cap = self.max_size           # lowered below every truncated n
+        self.tokens_per_persona: Optional[float] = None
+        self.scores: Dict[int, float] = {}
+        self.truncations = 0
+        self._step = max(1, self.n // 2)
+        self._direction = 1
+        self._last: Optional[int] = None
+        self._converged = False
+
+    @classmethod
+    def from_config(cls, cfg: AppConfig) -> "BatchSizer":
+        return cls(cfg.batch_size, cfg.persona_batch_max, cfg.persona_batch_objective, cfg.max_tokens)
+
+    @property
+    def calibrated(self) -> bool:
+        """Whether any response has been fed back yet (callers hold concurrency to 1 until then)."""
+        return self.tokens_per_persona is not None or self.truncations > 0
+
+    def next_size(self, remaining: int) -> int:
+        """Batch size for the next request (never more than the personas still to generate)."""
+        return max(1, min(self.n, remaining))
+
+    def _score(self, valid: int, latency_s: float, usage: Any) -> Optional[float]:
+        if self.objective == "cost":
+            tokens = sum(usage_tokens(usage))
+            return valid * 1000 / tokens if tokens else None
+        return valid / latency_s if latency_s > 0 else None
+
+    def _clamp(self, n: int) -> int:
+        return max(1, min(n, self.ceiling))
+
+    def _move(self, n: int, reason: str) -> None:
+        if n != self.n:
+            tpp = f"{self.tokens_per_persona:.0f}" if self.tokens_per_persona else "?"
+            log.info(f"n {self.n} -> {n} ({reason}); tokens/persona ~{tpp}, ceiling {self.ceiling}", tag="BATCH_SIZER")
+        self.n = n
+
+    def observe(self, n: int, valid: int, latency_s: float = 0.0, usage: Any = None,
+                truncated: bool = False) -> None:
+        """
+        Feed back one response: `n` requested, `valid` personas parsed from it, its latency
+        and usage, and whether it was cut off at the output limit.
+        """
+        metrics.observe("persona_batch_size", n)
+        if truncated:
+            self.truncations += 1
+            metrics.inc("persona_batch_truncations_total")
+            self._cap = max(1, min(self._cap, n - 1))
+            self.ceiling = min(self.ceiling, self._cap)
+            self.scores.pop(n, None)
+            self._last = None
+            self._converged = False
+            self._move(max(1, min(n // 2, self.n, self.ceiling)), f"batch of {n} truncated at the output limit")
+            self._step = max(1, self.n // 2)
+            self._direction = 1             # climb back towards the new ceiling
+            return
+
+        _, output_tokens = usage_tokens(usage)
+        if valid and output_tokens:
+            sample = output_tokens / valid
+            tpp = self.tokens_per_persona
+            self.tokens_per_persona = sample if tpp is None else ALPHA * sample + (1 - ALPHA) * tpp
+            if self.output_limit:
+                fit = int(HEADROOM * self.output_limit / self.tokens_per_persona)
+                self.ceiling = max(1, min(self._cap, fit))
+
+        score = self._score(valid, latency_s, usage)
+        if score is None:
+            return
+        previous = self.scores.get(n)
+        self.scores[n] = score if previous is None else ALPHA * score + (1 - ALPHA) * previous
+        log.debug(f"n={n}: {valid} valid, score {self.scores[n]:.3g} ({self.objective})", tag="BATCH_SIZER")
+
+        if n != self.n:
+            # Tail batch (fewer personas left than n) or a response to an older size: score it only.
+            if self.n > self.ceiling:
+                self._move(self.ceiling, "above the output-limit ceiling")
+            return
+        if self._converged:
+            best = max(self.scores, key=self.scores.get)
+            if self.n > self.ceiling:
+                self._move(self.ceiling, "above the output-limit ceiling")
+            elif best <= self.ceiling and self.scores[best] > HYSTERESIS * self.scores.get(self.n, 0.0):
+                self._move(best, "held size no longer scores best")
+            return
+
+        last = self._last
+        if last is not None and last != n and self.scores[n] < self.scores.get(last, 0.0):
+            if self._step == 1:
+                self._converged = True
+                best = max(self.scores, key=self.scores.get)
+                self._last = n
+                self._move(self._clamp(best), "converged")
+                return
+            self._direction = -self._direction
+            self._step = max(1, self._step // 2)
+        self._last = n
+        target = self._clamp(n + self._direction * self._step)
+        if target == n:
+            # Pinned at 1 or at the ceiling: turn round (with a shorter step) so the next worse score settles it.
+            self._direction = -self._direction
+            self._step = max(1, self._step // 2)
+            target = self._clamp(n + self._direction * self._step)
+        direction = "up" if target > n else "down"
+        self._move(target, f"exploring {direction}, score {self.scores[n]:.3g}")
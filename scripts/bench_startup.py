@@ -0,0 +1,94 @@
+# bench_startup.py
+"""
+CLI startup-time benchmark with per-subcommand regression budgets.
+
+Non-generation commands (--validate-config, --set-config, --dry-run, --help) run
+constantly in container orchestration, so they must not import the heavy generation
+stack. This script checks two things:
+
+1. Import hygiene: `import bankgen` must not load any module in HEAVY_MODULES.
+2. Wall time: the median of N cold runs of each subcommand must stay under its budget.
+
+Usage:
+    python -m scripts.bench_startup                 # 7 runs per command
+    python -m scripts.bench_startup --runs 15 --budget-scale 2.0   # slower CI boxes
+
+Exits non-zero if any check fails.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+# Modules that only generation stages may import.
+HEAVY_MODULES = ("pandas", "numpy", "tqdm", "kirkomi_utils.llm", "openai")
+
+# Median wall-clock budgets (seconds) per subcommand, including interpreter start-up.
+BUDGETS_S: Dict[str, float] = {
+    "--help": 0.6,
+    "--dry-run": 0.6,
+    "--validate-config": 0.6,
+    # Unknown key: exercises the full --set-config path without rewriting config.yaml.
+    "--set-config __bench_startup__ 0": 0.6,
+}
+
+
+def _heavy_imports() -> List[str]:
+    probe = (
+        "import sys, json, bankgen; "
+        f"print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))"
+    )
+    out = subprocess.run(
+        [sys.executable, "-c", probe], cwd=REPO_ROOT, capture_output=True, text=True, check=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def _time_command(args: str, runs: int) -> List[float]:
+    samples = []
+    cmd = [sys.executable, "bankgen.py", *args.split()]
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        subprocess.run(cmd, cwd=REPO_ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+        samples.append(time.perf_counter() - t0)
+    return samples
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="bankgen CLI startup benchmark")
+    parser.add_argument("--runs", type=int, default=7, help="Runs per subcommand (median is compared)")
+    parser.add_argument("--budget-scale", type=float, default=1.0, help="Multiply all budgets (slow machines)")
+    args = parser.parse_args(argv)
+
+    failed = False
+
+    heavy = _heavy_imports()
+    if heavy:
+        print(f"FAIL  import bankgen loaded heavy modules: {', '.join(heavy)}")
+        failed = True
+    else:
+        print("ok    import bankgen loads no heavy modules")
+
+    for command, budget in BUDGETS_S.items():
+        budget *= args.budget_scale
+        samples = _time_command(command, args.runs)
+        median = statistics.median(samples)
+        status = "ok  " if median <= budget else "FAIL"
+        failed |= median > budget
+        print(f"{status}  bankgen {command:<36} median={median * 1000:7.1f} ms  "
+              f"min={min(samples) * 1000:7.1f} ms  budget={budget * 1000:7.1f} ms")
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,243 @@
+# build.py
+"""
+Incremental, build-system-style regeneration (`bankgen build`).
+
+Phase 1 — persona batches: each batch (start, n) is hashed from its rendered prompt,
+model and temperature. Batches whose manifest hash matches and whose file exists are
+reused as-is; the rest are regenerated. Batches saved by adaptive sizing keep their own
+(start, n) — the size is stamped in the manifest — and only the ranges no up-to-date batch
+covers are rebuilt on the batch_size grid. personas.csv is then re-assembled from all batches.
+
+Phase 2 — transactions: each user's history is hashed from the rendered prompt (which
+embeds the persona and months), model and temperature. Only users whose hash changed —
+because the prompt template, model/temperature, months or their persona changed — are
+regenerated; every other CSV is left untouched.
+
+With persona_source: sampler, phase 1 re-samples personas.csv locally instead: sampling is
+deterministic for a given seed and set of component pools (themselves stamped in the
+manifest), so unchanged personas hash the same and phase 2 skips their transactions.
+
+`--plan` reports what would be rebuilt without calling the LLM.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from tqdm import tqdm
+from tqdm.asyncio import tqdm_asyncio
+
+from .config import AppConfig, get_config
+from .helpers import log, get_llm
+from .manifest import get_manifest
+from . import generate_personas as gp
+from . import generate_transactions as gt
+from . import persona_sampler, routing
+from .writer import TransactionWriter
+
+
+@dataclass
+class BuildPlan:
+    persona_fresh: List[Tuple[int, int]] = field(default_factory=list)
+    persona_stale: List[Tuple[int, int]] = field(default_factory=list)
+    tx_fresh: List[str] = field(default_factory=list)
+    tx_stale: List[Dict[str, Any]] = field(default_factory=list)
+
+
+def _existing_batches(cfg: AppConfig) -> Dict[int, int]:
+    """start -> requested size of every persona batch file on disk (adaptive sizing saves arbitrary ranges)."""
+    manifest = get_manifest(cfg)
+    batch_size = min(cfg.batch_size, cfg.num_users)
+    batches = {}
+    for path in (Path(cfg.output_dir) / gp.PERSONA_BATCH_DIR).glob("batch_*.json"):
+        try:
+            start = int(path.stem.split("_", 1)[1])
+        except ValueError:
+            continue
+        entry = manifest.get(gp.persona_batch_artifact(start)) or {}
+        batches[start] = entry.get("size") or batch_size     # stamped before sizes were recorded: the grid
+    return batches
+
+
+def _persona_batches(cfg: AppConfig) -> List[Tuple[int, int, bool]]:
+    """
+    (start, n, fresh) covering users 0..num_users-1. Up-to-date batches on disk are kept at the
+    size they were generated with; the gaps between them are split on the batch_size grid, never
+    past the start of the next batch file so no user is generated or assembled twice.
+    """
+    manifest = get_manifest(cfg)
+    existing = _existing_batches(cfg)
+    batch_size = min(cfg.batch_size, cfg.num_users)
+    batches = []
+    start = 0
+    while start < cfg.num_users:
+        n = existing.get(start)
+        if n and start + n <= cfg.num_users and \
+                manifest.is_fresh(gp.persona_batch_artifact(start), gp.persona_batch_hash(cfg, start, n)):
+            batches.append((start, n, True))
+        else:
+            end = min([s for s in existing if s > start] + [cfg.num_users])
+            n = min(batch_size, end - start)
+            batches.append((start, n, False))
+        start += n
+    return batches
+
+
+def plan_personas(cfg: AppConfig, plan: BuildPlan) -> None:
+    for start, n, fresh in _persona_batches(cfg):
+        (plan.persona_fresh if fresh else plan.persona_stale).append((start, n))
+
+
+def plan_transactions(cfg: AppConfig, plan: BuildPlan) -> None:
+    personas = gt._load_personas(cfg)
+    if personas is None:
+        return
+    manifest = get_manifest(cfg)
+    for _, user_row in personas.iterrows():
+        user = user_row.to_dict()
+        if manifest.is_fresh(gt.transaction_artifact(user["user_id"]), gt.transaction_hash(cfg, user)):
+            plan.tx_fresh.append(user["user_id"])
+        else:
+            plan.tx_stale.append(user)
+
+
+def rebuild_persona_batches(cfg: AppConfig, stale: List[Tuple[int, int]], mode: str) -> None:
+    llm = get_llm()
+
+    if mode == "async":
+        async def _safe(start: int, n: int):
+            try:
+                return await gp.request_batch_async(cfg, llm, start, n)
+            except Exception as e:
+                log.exception(f"Persona batch {start} failed: {e}", tag="BUILD")
+                return None
+
+        async def _run():
+            tasks = [_safe(start, n) for start, n in stale]
+            return await tqdm_asyncio.gather(*tasks, desc="Rebuilding Persona Batches", total=len(tasks))
+
+        for (start, n), rows in zip(stale, asyncio.run(_run())):
+            if rows is not None:
+                gp._save_persona_batch(cfg, start, n, rows)
+        return
+
+    for start, n in tqdm(stale, desc="Rebuilding Persona Batches"):
+        try:
+            rows = gp.request_batch(cfg, llm, start, n)
+        except Exception as e:
+            log.exception(f"Persona batch {start} failed: {e}", tag="BUILD")
+            continue
+        gp._save_persona_batch(cfg, start, n, rows)
+
+
+def assemble_personas(cfg: AppConfig) -> None:
+    """Rebuild personas.csv from the persona batch files that cover 0..num_users-1 (see _persona_batches)."""
+    all_rows = []
+    for start, n, _fresh in _persona_batches(cfg):
+        path = Path(cfg.output_dir) / gp.persona_batch_artifact(start)
+        if path.exists():
+            # A stale file left by a failed rebuild may be larger than its slot.
+            all_rows.extend(gp.load_persona_batch(cfg, start)[:n])
+        else:
+            log.warning(f"Persona batch {start} is missing; its users are skipped.", tag="BUILD")
+    gp._write_personas(all_rows, cfg)
+
+
+def rebuild_transactions(cfg: AppConfig, stale: List[Dict[str, Any]], mode: str) -> None:
+    llm = get_llm()
+
+    if mode == "async":
+        async def _run():
+            tasks = [gt._simulate_with_summary_async(cfg, llm, user) for user in stale]
+            return await tqdm_asyncio.gather(*tasks, desc="Rebuilding Tx", total=len(tasks))
+        results = asyncio.run(_run())
+    else:
+        def _sync():
+            for user in tqdm(stale, desc="Rebuilding Tx"):
+                user = persona_sampler.ensure_summary(cfg, user, llm)
+                yield user, gt.simulate_transactions(llm, user, months=cfg.months, output_format=cfg.llm_output_format)
+        results = _sync()
+
+    with TransactionWriter(cfg) as writer:
+        for user, txns in results:
+            writer.submit(user["user_id"], txns, user)
+
+
+@log.log_timed("BUILD")
+def build(mode: str = "sync", plan_only: bool = False,
+          confirm: Optional[Callable[[str, int], None]] = None) -> BuildPlan:
+    """
+    Regenerate only stale artifacts. Returns the plan that was executed (or would be, with plan_only).
+
+    Args:
+        mode:      "sync" or "async" LLM calls for the stale work.
+        plan_only: report fresh/stale counts without calling the LLM.
+        confirm:   optional callback(stage, llm_calls) invoked before each phase that spends money.
+    """
+    cfg = get_config()
+    plan = BuildPlan()
+
+    if cfg.persona_source == "sampler":
+        return _build_sampled(cfg, plan, mode, plan_only, confirm)
+
+    plan_personas(cfg, plan)
+    log.info(
+        f"Persona batches: {len(plan.persona_fresh)} up to date, {len(plan.persona_stale)} to rebuild",
+        tag="BUILD",
+    )
+
+    if plan_only:
+        if plan.persona_stale:
+            stale_users = sum(n for _, n in plan.persona_stale)
+            log.info(f"Transactions: at least {stale_users} users will rebuild after their personas change", tag="BUILD")
+        if (Path(cfg.output_dir) / "personas.csv").exists():
+            plan_transactions(cfg, plan)
+            log.info(f"Transactions (current personas): {len(plan.tx_fresh)} up to date, {len(plan.tx_stale)} to rebuild", tag="BUILD")
+        return plan
+
+    if plan.persona_stale:
+        if confirm:
+            confirm("personas", len(plan.persona_stale))
+        rebuild_persona_batches(cfg, plan.persona_stale, mode)
+    assemble_personas(cfg)
+
+    return _build_transactions(cfg, plan, mode, confirm)
+
+
+def _build_sampled(cfg: AppConfig, plan: BuildPlan, mode: str, plan_only: bool,
+                   confirm: Optional[Callable[[str, int], None]]) -> BuildPlan:
+    stale = persona_sampler.stale_pools(cfg)
+    log.info(
+        f"Personas: sampled locally; {len(persona_sampler.persona_pool_prompts) - len(stale)} component pools "
+        f"up to date, {len(stale)} to rebuild",
+        tag="BUILD",
+    )
+    if plan_only:
+        if (Path(cfg.output_dir) / "personas.csv").exists():
+            plan_transactions(cfg, plan)
+            log.info(f"Transactions (current personas): {len(plan.tx_fresh)} up to date, {len(plan.tx_stale)} to rebuild", tag="BUILD")
+        return plan
+
+    if stale and confirm:
+        confirm("persona pools", len(stale))
+    gp.generate_personas_sampled(mode)
+    return _build_transactions(cfg, plan, mode, confirm)
+
+
+def _build_transactions(cfg: AppConfig, plan: BuildPlan, mode: str,
+                        confirm: Optional[Callable[[str, int], None]]) -> BuildPlan:
+    plan_transactions(cfg, plan)
+    log.info(f"Transactions: {len(plan.tx_fresh)} up to date, {len(plan.tx_stale)} to rebuild", tag="BUILD")
+    if plan.tx_stale:
+        if confirm:
+            confirm("transactions", len(plan.tx_stale))
+        rebuild_transactions(cfg, plan.tx_stale, mode)
+
+    get_manifest(cfg).compact()
+    for kind in ("personas", "transactions"):
+        routing.report(kind)
+    log.info("✅ Build complete.", tag="BUILD")
+    return plan
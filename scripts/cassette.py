@@ -0,0 +1,153 @@
+# cassette.py
+"""
+Record / replay of LLM traffic (llm_cassette_mode).
+
+    record   every live chat/chat_async response is appended to the cassette together with
+             its usage, model and latency, keyed by helpers.request_key(messages, overrides)
+    replay   responses are served from the cassette without building a provider client or
+             touching the network; a request that was never recorded raises CassetteMiss
+
+The cassette is one gzip'd JSON-lines file (default cassettes/llm.jsonl.gz), one line per
+response:
+
+    {"key": "<sha256>", "content": "...", "usage": {...}, "model": "gpt-5", "latency_s": 41.2}
+
+Recording appends (and flushes) line by line, so an interrupted run keeps everything it
+got; recording again into a cleanly closed cassette adds to it. A key recorded several times (e.g.
+coalesce=False samples of one prompt) is replayed in recorded order, cycling when exhausted.
+
+Replay speed (llm_cassette_speed): 0 serves as fast as possible; N > 0 sleeps for the
+recorded latency / N (1 = recorded latencies), so concurrency and event-loop behaviour can
+be reproduced offline. Both clients sit below helpers.InstrumentedLLM, so metrics,
+coalescing and everything downstream of parsing run exactly as in a live run.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import gzip
+import json
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from kirkomi_utils.logging.logger import log
+from .helpers import request_key
+from .metrics import metrics
+
+
+class CassetteMiss(LookupError):
+    """A replayed request that the cassette has no recording for."""
+
+
+@dataclass
+class CassetteResponse:
+    """Replayed response; exposes the attributes callers read from LLMClient results."""
+    content: str
+    usage: Dict[str, Any] = field(default_factory=dict)
+    model: Optional[str] = None
+    latency_s: float = 0.0
+    replayed: bool = True
+
+
+class RecordingClient:
+    """Wraps a live LLMClient and appends every fresh (non-cached) response to the cassette."""
+
+    def __init__(self, client, path: str | Path) -> None:
+        self._client = client
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._file = gzip.open(self.path, "at", encoding="utf-8")
+
+    def __getattr__(self, name: str):
+        return getattr(self._client, name)
+
+    def _save(self, messages, kwargs: Dict[str, Any], res, latency_s: float) -> None:
+        if getattr(res, "cached", False) or getattr(res, "from_cache", False):
+            return
+        usage = getattr(res, "usage", None)
+        line = json.dumps({
+            "key": request_key(messages, kwargs),
+            "content": getattr(res, "content", None) or "",
+            "usage": dict(usage) if isinstance(usage, dict) else {},
+            "model": getattr(res, "model", None) or kwargs.get("model"),
+            "latency_s": round(latency_s, 4),
+        }, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+        metrics.inc("llm_cassette_recorded_total")
+
+    def chat(self, messages, **kwargs):
+        t0 = time.perf_counter()
+        res = self._client.chat(messages, **kwargs)
+        self._save(messages, kwargs, res, time.perf_counter() - t0)
+        return res
+
+    async def chat_async(self, messages, **kwargs):
+        t0 = time.perf_counter()
+        res = await self._client.chat_async(messages, **kwargs)
+        self._save(messages, kwargs, res, time.perf_counter() - t0)
+        return res
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+class ReplayClient:
+    """Serves recorded responses by request key; no provider client is created."""
+
+    def __init__(self, path: str | Path, speed: float = 0.0) -> None:
+        self.path = Path(path)
+        self.speed = speed
+        self._lock = threading.Lock()
+        self._entries: Dict[str, List[Dict[str, Any]]] = {}
+        self._next: Dict[str, int] = {}
+        if not self.path.exists():
+            raise FileNotFoundError(f"LLM cassette not found: {self.path} (record one with llm_cassette_mode=record)")
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            try:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._entries.setdefault(entry["key"], []).append(entry)
+            except (EOFError, json.JSONDecodeError):
+                # A recording that was killed mid-write: keep every complete line before it.
+                log.warning(f"Cassette {self.path} ends in a truncated record; using what precedes it.", tag="CASSETTE")
+        log.info(f"Replaying {sum(map(len, self._entries.values()))} recorded LLM responses from {self.path}", tag="CASSETTE")
+
+    def _take(self, messages, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        key = request_key(messages, kwargs)
+        entries = self._entries.get(key)
+        if not entries:
+            metrics.inc("llm_cassette_misses_total")
+            raise CassetteMiss(f"no recorded response for request {key[:12]} in {self.path}")
+        with self._lock:
+            i = self._next.get(key, 0)
+            self._next[key] = i + 1
+        return entries[i % len(entries)]
+
+    def _response(self, entry: Dict[str, Any]) -> CassetteResponse:
+        metrics.inc("llm_cassette_replayed_total")
+        return CassetteResponse(entry["content"], entry.get("usage") or {}, entry.get("model"), entry.get("latency_s", 0.0))
+
+    def _delay(self, entry: Dict[str, Any]) -> float:
+        return entry.get("latency_s", 0.0) / self.speed if self.speed > 0 else 0.0
+
+    def chat(self, messages, **kwargs) -> CassetteResponse:
+        entry = self._take(messages, kwargs)
+        delay = self._delay(entry)
+        if delay:
+            time.sleep(delay)
+        return self._response(entry)
+
+    async def chat_async(self, messages, **kwargs) -> CassetteResponse:
+        entry = self._take(messages, kwargs)
+        delay = self._delay(entry)
+        if delay:
+            await asyncio.sleep(delay)
+        return self._response(entry)
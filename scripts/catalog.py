@@ -0,0 +1,473 @@
+# catalog.py
+"""
+Dictionary-encoded merchant / payer catalog (`bankgen catalog`).
+
+Every transaction row repeats free text — merchant_name, description_cleaned, currency,
+source_type, the user_id — and the same payee is spelled several ways across users
+("Tesco", "TESCO STORES LTD", "POS spend at Tesco"). This stage builds one global catalog
+and a compact, integer-coded copy of the transactions:
+
+    <output_dir>/catalog/
+        merchants.csv       merchant_id, key, name (canonical), role (merchant | payer | both),
+                            mcc, source_type (dominant), rows, users
+        names.csv           merchant_name_id, merchant_name (as written), merchant_id
+        descriptions.csv    description_id, description_cleaned, merchant_id
+        transactions.csv    one row per transaction: ids / dictionary codes instead of strings
+        meta.json           small dictionaries (user_id, transaction_type, currency, is_income,
+                            risk_flag, source_type), source signature, row counts
+
+Payees are grouped by a normalised key (uppercased, accents / punctuation / "POS spend at" /
+LTD-PLC suffixes dropped, spaces removed); the canonical name is the group's most frequent
+spelling. A row's merchant is its merchant_name, or the payer in description_cleaned when
+the model left merchant_name empty. Each merchant gets one MCC: the model's own `mcc`
+values if it emitted any (majority vote), else a name keyword table, else its source_type.
+
+Ids are stable: a rebuild reads the previous catalog, keeps every id it assigned and only
+appends new values, so merchant_id can be stored downstream. Id 0 is always "" / no merchant.
+
+    load_transactions(output_dir)      # join back to the full view (pandas, categoricals)
+    restore_dataset(dest)              # per-user CSVs with the original columns
+
+Timestamps are stored as epoch seconds (`ts`); the original string is only kept, in
+`timestamp`, for rows where "<date>T<time>+00:00" would not reproduce it exactly. amount and
+description_raw stay inline; fields outside the contract are kept in an `extra` JSON
+column, except `mcc`, which moves to the catalog.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import re
+import shutil
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from kirkomi_utils.logging.logger import log
+from .config import get_config
+from .dataset import TRANSACTION_COLUMNS, transaction_files
+from .metrics import metrics
+from .noise import clean_payer, is_credit, payer_name
+from .tx_index import source_signature
+
+CATALOG_VERSION = 1
+CATALOG_DIR = "catalog"
+FILES_PER_CHUNK = 2_000
+
+# Low-cardinality columns coded against dictionaries kept in meta.json.
+CODED_COLUMNS = ("user_id", "transaction_type", "currency", "is_income", "risk_flag", "source_type")
+ENCODED_COLUMNS = (
+    "user_id", "ts", "timestamp", "amount", "transaction_type", "currency", "description_raw",
+    "description_id", "merchant_name_id", "merchant_id", "is_income", "risk_flag", "source_type", "extra",
+)
+_ID_COLUMNS = ("description_id", "merchant_name_id", "merchant_id") + CODED_COLUMNS
+_UTC_SUFFIX = "+00:00"
+
+# Trailing legal-form words ignored when grouping payee spellings.
+_SUFFIXES = {"LTD", "LIMITED", "PLC", "LLP", "INC", "CO", "UK", "GB", "COM", "STORES", "STORE", "GROUP"}
+_MCC = re.compile(r"^\d{4}$")
+
+# MCC by canonical key prefix; keys of 3 characters or fewer must match exactly.
+MCC_KEYWORDS: Dict[str, Tuple[str, ...]] = {
+    "5411": ("TESCO", "SAINSBURY", "ASDA", "MORRISONS", "ALDI", "LIDL", "COOP", "CO-OP", "WAITROSE", "ICELAND",
+             "M&S", "MARKS&SPENCER", "MARKSANDSPENCER", "OCADO"),
+    "5814": ("GREGGS", "MCDONALD", "KFC", "SUBWAY", "COSTA", "STARBUCKS", "PRET", "CAFFENERO", "CAFENERO",
+             "NANDO", "BURGERKING", "DOMINO", "JUSTEAT", "DELIVEROO", "UBEREATS"),
+    "5541": ("SHELL", "BP", "ESSO", "TEXACO", "JET"),
+    "4121": ("UBER", "BOLT", "ADDISONLEE"),
+    "4111": ("TFL", "TRAINLINE", "NATIONALRAIL", "NATIONALEXPRESS", "STAGECOACH", "ARRIVA"),
+    "4814": ("EE", "O2", "THREE", "VODAFONE", "GIFFGAFF", "BT", "TALKTALK"),
+    "4899": ("SKY", "VIRGINMEDIA", "NETFLIX", "SPOTIFY", "DISNEY", "NOWTV", "AMAZONPRIME"),
+    "4900": ("BRITISHGAS", "EDF", "OCTOPUS", "EON", "OVO", "SCOTTISHPOWER", "THAMESWATER", "SEVERNTRENT",
+             "UNITEDUTILITIES", "YORKSHIREWATER"),
+    "5912": ("BOOTS", "SUPERDRUG", "LLOYDSPHARMACY"),
+    "5999": ("AMAZON", "EBAY", "ARGOS"),
+    "7995": ("BET365", "PADDYPOWER", "WILLIAMHILL", "LADBROKES", "SKYBET", "BETFAIR", "CORAL", "BETFRED",
+             "CASUMO", "NATIONALLOTTERY"),
+    "7997": ("PUREGYM", "THEGYM", "DAVIDLLOYD", "NUFFIELD"),
+    "6300": ("ADMIRAL", "AVIVA", "DIRECTLINE", "LVINSURANCE"),
+}
+# Fallback for merchants (debit side) with no keyword match.
+SOURCE_TYPE_MCC = {"pos": "5999", "atm": "6011"}
+
+_KEYWORD_MCC = [(kw, mcc) for mcc, kws in MCC_KEYWORDS.items() for kw in kws]
+
+
+def catalog_dir(output_dir: str | Path) -> Path:
+    return Path(output_dir) / CATALOG_DIR
+
+
+def merchant_key(text: str) -> str:
+    """Grouping key for one payee spelling: 'POS spend at Tesco Stores Ltd.' -> 'TESCOSTORES'."""
+    words = clean_payer(text).replace("-", " ").split()
+    while len(words) > 1 and words[-1] in _SUFFIXES:
+        words.pop()
+    return "".join(words)
+
+
+def iso_timestamps(ts: np.ndarray) -> np.ndarray:
+    """Epoch seconds -> '2025-03-11T14:32:00+00:00' strings, vectorised."""
+    return np.char.add(np.datetime_as_string(ts.astype("datetime64[s]"), unit="s"), _UTC_SUFFIX)
+
+
+def _epoch(column: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+    """(epoch seconds, original string where iso_timestamps would not reproduce it, else "")."""
+    parsed = pd.to_datetime(column, format="ISO8601", utc=True, errors="coerce")
+    missing = parsed.isna().to_numpy()
+    ts = parsed.dt.tz_localize(None).to_numpy().astype("datetime64[s]").astype(np.int64)
+    ts[missing] = 0
+    original = column.to_numpy(dtype=object)
+    exact = (iso_timestamps(ts) == original.astype(str)) & ~missing
+    return ts, np.where(exact, "", original)
+
+
+def keyword_mcc(key: str) -> str:
+    for keyword, mcc in _KEYWORD_MCC:
+        if key == keyword or (len(keyword) > 3 and key.startswith(keyword)):
+            return mcc
+    return ""
+
+
+class _Dictionary:
+    """value <-> id, id 0 = "". Ids survive rebuilds (seeded from the previous catalog)."""
+
+    def __init__(self, values: Sequence[str] = ()) -> None:
+        self.values: List[str] = [""]
+        self.ids: Dict[str, int] = {"": 0}
+        for value in values:
+            if value not in self.ids:
+                self.ids[value] = len(self.values)
+                self.values.append(value)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def id(self, value: str) -> int:
+        i = self.ids.get(value)
+        if i is None:
+            i = self.ids[value] = len(self.values)
+            self.values.append(value)
+        return i
+
+    def encode(self, column: pd.Series) -> np.ndarray:
+        """Codes for a string column; Python work is per distinct value only."""
+        codes, uniques = pd.factorize(column, sort=False)
+        lookup = np.fromiter((self.id(str(v)) for v in uniques), dtype=np.int64, count=len(uniques))
+        return lookup[codes] if len(uniques) else np.zeros(len(column), dtype=np.int64)
+
+
+class _Merchants:
+    """Payee entities keyed by merchant_key, with per-entity row statistics."""
+
+    def __init__(self, previous: Optional[pd.DataFrame] = None) -> None:
+        self.keys = _Dictionary(() if previous is None else previous.sort_values("merchant_id")["key"].tolist())
+        self.spellings: Dict[int, Counter] = {}
+        self.rows = Counter()
+        self.users = Counter()
+        self.credits = Counter()
+        self.debits = Counter()
+        self.sources: Dict[int, Counter] = {}
+        self.mcc_votes: Dict[int, Counter] = {}
+
+    def entity(self, spelling: str) -> int:
+        key = merchant_key(spelling)
+        return self.keys.id(key) if key else 0
+
+    @staticmethod
+    def _count(target: Dict[int, Counter], pairs: np.ndarray, labels: Sequence[str]) -> None:
+        """Add counts of (entity, label code) pairs (an (n, 2) array) into per-entity Counters."""
+        if not len(pairs):
+            return
+        uniq, counts = np.unique(pairs, axis=0, return_counts=True)
+        for (entity, code), n in zip(uniq.tolist(), counts.tolist()):
+            if entity:
+                target.setdefault(entity, Counter())[labels[code]] += n
+
+    def add_chunk(self, entity: np.ndarray, spelling: np.ndarray, spellings: List[str], user: np.ndarray,
+                  credit: np.ndarray, source: np.ndarray, sources: List[str],
+                  mcc: Optional[np.ndarray], mccs: List[str]) -> None:
+        for counter, mask in ((self.rows, None), (self.credits, credit), (self.debits, ~credit)):
+            ids, counts = np.unique(entity if mask is None else entity[mask], return_counts=True)
+            counter.update(dict(zip(ids.tolist(), counts.tolist())))
+        # Chunks hold whole users, so distinct (user, entity) pairs per chunk add up.
+        pairs = np.unique(np.stack([user, entity], axis=1), axis=0)
+        self.users.update(Counter(pairs[:, 1].tolist()))
+        self._count(self.spellings, np.stack([entity, spelling], axis=1), spellings)
+        self._count(self.sources, np.stack([entity, source], axis=1), sources)
+        if mcc is not None:
+            self._count(self.mcc_votes, np.stack([entity, mcc], axis=1), mccs)
+
+    def frame(self) -> pd.DataFrame:
+        out = []
+        for merchant_id, key in enumerate(self.keys.values):
+            if not merchant_id:
+                continue
+            spellings = self.spellings.get(merchant_id)
+            name = spellings.most_common(1)[0][0] if spellings else key
+            credits, debits = self.credits[merchant_id], self.debits[merchant_id]
+            role = "both" if credits and debits else "payer" if credits else "merchant"
+            sources = self.sources.get(merchant_id)
+            source_type = sources.most_common(1)[0][0] if sources else ""
+            votes = Counter({m: n for m, n in (self.mcc_votes.get(merchant_id) or {}).items() if _MCC.match(m)})
+            if votes:
+                mcc = votes.most_common(1)[0][0]
+            else:
+                mcc = (keyword_mcc(key) or SOURCE_TYPE_MCC.get(source_type, "")) if debits else ""
+            out.append({
+                "merchant_id": merchant_id, "key": key, "name": name, "role": role, "mcc": mcc,
+                "source_type": source_type, "rows": self.rows[merchant_id], "users": self.users[merchant_id],
+            })
+        columns = ["merchant_id", "key", "name", "role", "mcc", "source_type", "rows", "users"]
+        return pd.DataFrame(out, columns=columns)
+
+
+def _read(path: Path) -> pd.DataFrame:
+    return pd.read_csv(path, dtype=str, keep_default_na=False)
+
+
+def _read_previous(out_dir: Path) -> Tuple[Dict[str, Any], Optional[pd.DataFrame], List[str], List[str]]:
+    """meta, merchants, names and descriptions of an existing catalog (empty when there is none)."""
+    if not (out_dir / "meta.json").exists():
+        return {}, None, [], []
+    meta = json.loads((out_dir / "meta.json").read_text(encoding="utf-8"))
+    merchants = _read(out_dir / "merchants.csv").astype({"merchant_id": int})
+    names = _read(out_dir / "names.csv")["merchant_name"].tolist()[1:]
+    descriptions = _read(out_dir / "descriptions.csv")["description_cleaned"].tolist()[1:]
+    return meta, merchants, names, descriptions
+
+
+def _extra_column(frame: pd.DataFrame) -> np.ndarray:
+    """JSON object of non-empty out-of-contract fields per row ("" when there are none); mcc excluded."""
+    extra_cols = [c for c in frame.columns if c not in TRANSACTION_COLUMNS and c != "mcc"]
+    out = np.full(len(frame), "", dtype=object)
+    if not extra_cols:
+        return out
+    values = frame[extra_cols]
+    present = (values != "").any(axis=1).to_numpy()
+    for i, row in zip(np.flatnonzero(present), values[present].to_dict(orient="records")):
+        out[i] = json.dumps({k: v for k, v in row.items() if v != ""}, ensure_ascii=False)
+    return out
+
+
+def _write_dictionary(path: Path, id_name: str, value_name: str, values: List[str],
+                      entities: Optional[List[int]] = None) -> None:
+    frame = pd.DataFrame({id_name: range(len(values)), value_name: values})
+    if entities is not None:
+        frame["merchant_id"] = entities
+    frame.to_csv(path, index=False)
+
+
+@log.log_timed("CATALOG")
+def build_catalog(output_dir: Optional[str] = None) -> Path:
+    """
+    Build <output_dir>/catalog/ from the per-user transaction CSVs. Written to a temporary
+    directory and swapped in, like the transaction index.
+    """
+    src_dir = Path(output_dir or get_config().output_dir)
+    files = transaction_files(src_dir)
+    if not files:
+        raise FileNotFoundError(f"No transactions under {src_dir / 'transactions'}; generate data first.")
+    final_dir = catalog_dir(src_dir)
+    tmp_dir = final_dir.with_name(final_dir.name + ".tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+
+    meta, previous, prev_names, prev_descriptions = _read_previous(final_dir)
+    if meta and meta.get("version") != CATALOG_VERSION:
+        meta, previous, prev_names, prev_descriptions = {}, None, [], []
+    coded = {name: _Dictionary(meta.get("dictionaries", {}).get(name, [])[1:]) for name in CODED_COLUMNS}
+    names = _Dictionary(prev_names)
+    descriptions = _Dictionary(prev_descriptions)
+    merchants = _Merchants(previous)
+    mccs = _Dictionary()
+    # merchant_id of each names / descriptions entry, filled in as values are first seen.
+    name_entity: List[int] = [0]
+    description_entity: List[int] = [0]
+
+    signature = source_signature(src_dir)
+    rows_total = 0
+    src_bytes = 0
+    out_path = tmp_dir / "transactions.csv"
+    t0 = time.perf_counter()
+    for c0 in range(0, len(files), FILES_PER_CHUNK):
+        chunk = files[c0:c0 + FILES_PER_CHUNK]
+        src_bytes += sum(p.stat().st_size for p in chunk)
+        # Columns only some users have (extras such as mcc) are NaN elsewhere after the concat.
+        frame = pd.concat([_read(p) for p in chunk], ignore_index=True).fillna("")
+        if frame.empty:
+            continue
+        for column in TRANSACTION_COLUMNS:
+            if column not in frame:
+                frame[column] = ""
+
+        name_ids = names.encode(frame["merchant_name"])
+        description_ids = descriptions.encode(frame["description_cleaned"])
+        name_entity.extend(merchants.entity(v) for v in names.values[len(name_entity):])
+        description_entity.extend(merchants.entity(payer_name(v)) for v in descriptions.values[len(description_entity):])
+        from_name = np.asarray(name_entity)[name_ids]
+        entity = np.where(from_name > 0, from_name, np.asarray(description_entity)[description_ids])
+        # Spelling of each row's payee: its merchant_name, else its description_cleaned (offset past the names).
+        spelling = np.where(from_name > 0, name_ids, len(names) + description_ids)
+        spellings = names.values + [payer_name(v) for v in descriptions.values]
+
+        encoded = {name: coded[name].encode(frame[name]) for name in CODED_COLUMNS}
+        ts, timestamp = _epoch(frame["timestamp"])
+        mcc = mccs.encode(frame["mcc"].str.strip()) if "mcc" in frame else None
+        merchants.add_chunk(entity, spelling, spellings, encoded["user_id"], is_credit(frame),
+                            encoded["source_type"], coded["source_type"].values, mcc, mccs.values)
+
+        out = pd.DataFrame({
+            "user_id": encoded["user_id"],
+            "ts": ts,
+            "timestamp": timestamp,
+            "amount": frame["amount"],
+            "transaction_type": encoded["transaction_type"],
+            "currency": encoded["currency"],
+            "description_raw": frame["description_raw"],
+            "description_id": description_ids,
+            "merchant_name_id": name_ids,
+            "merchant_id": entity,
+            "is_income": encoded["is_income"],
+            "risk_flag": encoded["risk_flag"],
+            "source_type": encoded["source_type"],
+            "extra": _extra_column(frame),
+        }, columns=list(ENCODED_COLUMNS))
+        out.to_csv(out_path, mode="a", header=not rows_total, index=False)
+        rows_total += len(out)
+
+    merchants_frame = merchants.frame()
+    merchants_frame.to_csv(tmp_dir / "merchants.csv", index=False)
+    _write_dictionary(tmp_dir / "names.csv", "merchant_name_id", "merchant_name", names.values, name_entity)
+    _write_dictionary(tmp_dir / "descriptions.csv", "description_id", "description_cleaned",
+                      descriptions.values, description_entity)
+    meta = {
+        "version": CATALOG_VERSION,
+        "built_at": time.time(),
+        "source_signature": signature,
+        "rows": rows_total,
+        "dictionaries": {name: d.values for name, d in coded.items()},
+    }
+    (tmp_dir / "meta.json").write_text(json.dumps(meta), encoding="utf-8")
+    nbytes = sum(p.stat().st_size for p in tmp_dir.iterdir())
+    metrics.record_write(rows_total, time.perf_counter() - t0, nbytes)
+
+    if final_dir.exists():
+        old_dir = final_dir.with_name(final_dir.name + ".old")
+        shutil.rmtree(old_dir, ignore_errors=True)
+        os.replace(final_dir, old_dir)
+        os.replace(tmp_dir, final_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+    else:
+        os.replace(tmp_dir, final_dir)
+
+    active = merchants_frame[merchants_frame["rows"] > 0]
+    log.info(
+        f"✅ Catalogued {rows_total} transactions: {len(active)} merchants/payers "
+        f"({(active['role'] != 'merchant').sum()} paying in), {len(names) - 1} merchant_name spellings, "
+        f"{len(descriptions) - 1} cleaned descriptions; {src_bytes / 1e6:.1f} MB -> {nbytes / 1e6:.1f} MB -> {final_dir}",
+        tag="CATALOG",
+    )
+    return final_dir
+
+
+def catalog_is_fresh(output_dir: str | Path) -> bool:
+    meta_path = catalog_dir(output_dir) / "meta.json"
+    if not meta_path.exists():
+        return False
+    meta = json.loads(meta_path.read_text(encoding="utf-8"))
+    return meta.get("version") == CATALOG_VERSION and meta.get("source_signature") == source_signature(output_dir)
+
+
+def load_merchants(output_dir: str | Path) -> pd.DataFrame:
+    """merchants.csv with typed columns (merchant_id 0 is not listed)."""
+    return pd.read_csv(catalog_dir(output_dir) / "merchants.csv", dtype={"mcc": str}, keep_default_na=False)
+
+
+def load_transactions(output_dir: str | Path, full: bool = True) -> pd.DataFrame:
+    """
+    The catalogued transactions. With full=True (default) every code is joined back: the
+    original columns as categoricals, plus merchant_id, merchant (canonical name), mcc and
+    merchant_role, and any `extra` fields as their own columns. With full=False the coded
+    table is returned as stored (integer ids), which is the cheap form for cross-user
+    aggregation by merchant_id.
+    """
+    directory = catalog_dir(output_dir)
+    if not catalog_is_fresh(output_dir):
+        log.warning(f"{directory} is missing or older than the transactions; run `bankgen catalog`", tag="CATALOG")
+    meta = json.loads((directory / "meta.json").read_text(encoding="utf-8"))
+    dtypes = {name: str for name in ENCODED_COLUMNS}
+    dtypes.update({name: np.int32 for name in _ID_COLUMNS})
+    dtypes["ts"] = np.int64
+    coded = pd.read_csv(directory / "transactions.csv", dtype=dtypes, keep_default_na=False)
+    if not full:
+        return coded
+
+    def categories(path: str, column: str) -> List[str]:
+        return pd.read_csv(directory / path, dtype=str, keep_default_na=False)[column].tolist()
+
+    lookups = dict(meta["dictionaries"])
+    lookups["merchant_name"] = categories("names.csv", "merchant_name")
+    lookups["description_cleaned"] = categories("descriptions.csv", "description_cleaned")
+    sources = {"merchant_name": "merchant_name_id", "description_cleaned": "description_id"}
+    out = pd.DataFrame(index=coded.index)
+    for column in TRANSACTION_COLUMNS:
+        if column in lookups:
+            out[column] = pd.Categorical.from_codes(coded[sources.get(column, column)], lookups[column])
+        elif column == "timestamp":
+            raw = coded["timestamp"].to_numpy(dtype=object)
+            out[column] = np.where(raw != "", raw, iso_timestamps(coded["ts"].to_numpy()).astype(object))
+        else:
+            out[column] = coded[column]
+
+    merchants = load_merchants(output_dir).set_index("merchant_id")
+    size = int(max(merchants.index.max() if len(merchants) else 0, coded["merchant_id"].max() or 0)) + 1
+    ids = coded["merchant_id"].to_numpy()
+    out["merchant_id"] = ids
+    for column, target in (("name", "merchant"), ("mcc", "mcc"), ("role", "merchant_role")):
+        table = np.full(size, "", dtype=object)
+        table[merchants.index.to_numpy()] = merchants[column].to_numpy()
+        out[target] = table[ids]
+
+    has_extra = coded["extra"] != ""
+    if has_extra.any():
+        extra = pd.DataFrame([json.loads(s) for s in coded.loc[has_extra, "extra"]], index=coded.index[has_extra])
+        out = out.join(extra.reindex(coded.index).fillna(""))
+    return out
+
+
+@log.log_timed("CATALOG")
+def restore_dataset(dest: str | Path, output_dir: Optional[str] = None) -> Path:
+    """
+    Write <dest>/transactions/<user_id>.csv from the catalog: the original columns plus any
+    `extra` fields that user's rows carry (a model-emitted `mcc` is only kept in the catalog).
+    """
+    src_dir = Path(output_dir or get_config().output_dir)
+    frame = load_transactions(src_dir)
+    dest = Path(dest)
+    (dest / "transactions").mkdir(parents=True, exist_ok=True)
+    if (src_dir / "personas.csv").exists() and dest.resolve() != src_dir.resolve():
+        shutil.copyfile(src_dir / "personas.csv", dest / "personas.csv")
+
+    extras = [c for c in frame.columns if c not in TRANSACTION_COLUMNS and c not in ("merchant_id", "merchant", "mcc", "merchant_role")]
+    base = [c for c in TRANSACTION_COLUMNS if c != "user_id"]
+    codes = frame["user_id"].cat.codes.to_numpy()
+    bounds = np.flatnonzero(np.diff(codes)) + 1
+    starts = np.concatenate([[0], bounds])
+    ends = np.concatenate([bounds, [len(frame)]])
+    t0 = time.perf_counter()
+    nbytes = 0
+    for lo, hi in zip(starts.tolist(), ends.tolist()):
+        part = frame.iloc[lo:hi]
+        keep = [c for c in extras if (part[c] != "").any()]
+        user_id = part["user_id"].iat[0]
+        path = dest / "transactions" / f"{user_id}.csv"
+        part[base + keep + ["user_id"]].to_csv(path, index=False)
+        nbytes += path.stat().st_size
+    metrics.record_write(len(frame), time.perf_counter() - t0, nbytes)
+    log.info(f"✅ Restored {len(frame)} transactions for {len(starts)} users -> {dest}", tag="CATALOG")
+    return dest
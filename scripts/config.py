@@ -1,11 +1,38 @@
-import yaml
+"""
+Project configuration.
+
+`scripts/config.yaml` is parsed and validated once per process into a typed, immutable
+`AppConfig` (see `get_config()`). Per-run overrides never touch the file, so any number of
+concurrent workers can share one config.yaml with different parameters:
+
+    precedence (lowest -> highest):
+        config.yaml  <  BANKGEN_* environment variables  <  CLI overrides (--override KEY=VALUE)
+
+Environment variables use the upper-cased key, e.g. BANKGEN_NUM_USERS=500,
+BANKGEN_OUTPUT_DIR=/scratch/shard-3. Nested provider options use double underscores:
+BANKGEN_PROVIDER_OPTIONS__OPENAI__REQUEST_TIMEOUT_S=60 (CLI: provider_options.openai.request_timeout_s=60).
+BANKGEN_CONFIG points at an alternative config file.
+
+`load_config()` / `save_config()` still read and write the raw YAML dict; they are only
+used by `bankgen --set-config`, which deliberately persists a change to the shared file.
+"""
+
+import copy
+import dataclasses
 import os
 import sys
+import typing
+from dataclasses import dataclass, field
+from typing import Any, Dict, Mapping, Optional
+
+import yaml
 
 CONFIG_PATH = os.path.join(os.path.dirname(__file__), "config.yaml")
 
 LOG_DIR = "logs"
 
+ENV_PREFIX = "BANKGEN_"
+
 class QuotedStringDumper(yaml.SafeDumper):
     pass
 
@@ -15,17 +42,364 @@ def quoted_str_representer(dumper, data):
 QuotedStringDumper.add_representer(str, quoted_str_representer)
 
 
-def load_config():
-    if not os.path.exists(CONFIG_PATH):
-        print(f"❌ ERROR: config.yaml not found at {CONFIG_PATH}")
+class ConfigError(ValueError):
+    """Raised when config.yaml (plus overrides) fails validation. `errors` lists every problem."""
+
+    def __init__(self, errors):
+        self.errors = list(errors)
+        super().__init__("; ".join(self.errors))
+
+
+@dataclass(frozen=True)
+class ProviderOptions:
+    """Per-provider client settings (config.yaml: provider_options.<provider>.*)."""
+    request_timeout_s: Optional[float] = None
+    max_retries: Optional[int] = None
+    watchdog_timeout_s: Optional[float] = None
+    enable_fallback: Optional[bool] = None
+    structured_output: Optional[bool] = None     # enforces JSON Schema response_format (default: scripts/structured.py)
+
+
+@dataclass(frozen=True)
+class AppConfig:
+    """Validated project configuration. Field names match the config.yaml keys."""
+    # Dataset shape
+    num_users: int
+    months: int
+    batch_size: int
+    tx_batch_size: int
+    output_dir: str = "data"
+
+    # LLM
+    provider: str = "openai"
+    model: Optional[str] = None
+    temperature: Optional[float] = None
+    max_tokens: Optional[int] = None
+    client_retry_attempts: Optional[int] = None
+    client_retry_backoff_min_s: Optional[float] = None
+    client_retry_backoff_max_s: Optional[float] = None
+    provider_options: Dict[str, ProviderOptions] = field(default_factory=dict)
+    # Output contract for full_persona_1_shot / full_transaction_1_shot: "json", "tabular"
+    # (header + pipe-delimited rows with short enum codes, decoded locally by scripts/tabular.py)
+    # or "structured" (JSON Schema response_format + local validation, scripts/structured.py)
+    llm_output_format: str = "json"
+    # Tiered model routing (scripts/routing.py): "off" sends every call to `model`; "tiered" sends
+    # simple jobs to model_draft first and escalates to `model` when the draft fails validation
+    model_routing: str = "off"
+    model_draft: Optional[str] = None
+    routing_max_income_streams: int = 3     # more income sources than this -> premium tier
+    routing_max_variance_pct: float = 35.0  # declared monthly income variance above this -> premium tier
+    # Record / replay LLM responses (scripts/cassette.py): "off", "record" or "replay"
+    llm_cassette_mode: str = "off"
+    llm_cassette_path: str = "cassettes/llm.jsonl.gz"
+    llm_cassette_speed: float = 0.0     # replay: 0 = as fast as possible, 1 = recorded latencies, 2 = twice as fast
+
+    # Persona source: "llm" (full_persona_1_shot batches) or "sampler" (LLM component pools + local sampler)
+    persona_source: str = "llm"
+    persona_seed: int = 0
+    persona_pool_size: int = 40
+    persona_summary_mode: str = "template"
+    # LLM persona batches: "fixed" (batch_size per call) or "adaptive" (scripts/batch_sizing.py,
+    # starting from batch_size and tuned per call towards the best valid personas per second / per token)
+    persona_batch_sizing: str = "fixed"
+    persona_batch_objective: str = "throughput"
+    persona_batch_max: int = 50
+    persona_batch_window: int = 8       # adaptive async: requests in flight while sizes are tuned
+
+    # Transaction output (scripts/writer.py): "files" (transactions/<user_id>.csv) or "shards"
+    # (compressed multi-user CSV shards under shards/, expanded with `bankgen unshard`)
+    output_layout: str = "files"
+    shard_compression: str = "gzip"       # "gzip" or "zstd" (needs the zstandard package)
+    shard_max_mb: float = 64.0            # rotate a shard at this many compressed MB ...
+    shard_max_seconds: float = 300.0      # ... or once it has been open this long
+    writer_queue_size: int = 256          # users queued for the background writer before generation waits
+
+    # Semantic near-duplicate cache (scripts/semantic_cache.py): reuse and adapt the history of
+    # a sufficiently similar, already generated persona instead of calling the LLM
+    semantic_cache: bool = False
+    semantic_cache_threshold: float = 0.9
+    semantic_cache_max_reuse: int = 5
+    semantic_cache_max_entries: int = 20000
+
+    # description_raw noise engine (bankgen noise)
+    noise_seed: int = 0
+
+    # Variant multiplier (bankgen augment)
+    augment_variants: int = 10
+    augment_seed: int = 0
+
+    # Offline Batch API (bankgen --mode batch)
+    batch_backend: str = "openai"
+    batch_local_dir: str = "batch_local"
+    batch_poll_interval_s: float = 30.0
+    batch_timeout_s: float = 86400.0
+
+    # Durable job queue (bankgen queue / bankgen worker)
+    queue_path: Optional[str] = None      # default: <output_dir>/queue.sqlite
+    queue_lease_s: float = 300.0
+    queue_heartbeat_s: float = 30.0
+    queue_max_attempts: int = 3
+    queue_poll_interval_s: float = 5.0
+
+    # Statement rendering (bankgen render)
+    render_format: str = "html"
+    render_workers: Optional[int] = None
+    render_rows_per_page: int = 40
+    render_opening_balance: float = 250.0
+    render_bank_name: str = "Synthetic Bank plc"
+
+    # Open Banking mock API (bankgen serve)
+    serve_host: str = "127.0.0.1"
+    serve_port: int = 8080
+    serve_page_size: int = 100
+
+    @classmethod
+    def from_dict(cls, raw: Mapping[str, Any]) -> "AppConfig":
+        """Coerce + validate a raw mapping (YAML values or override strings). Raises ConfigError."""
+        errors = []
+        hints = typing.get_type_hints(cls)
+        known = {f.name: f for f in dataclasses.fields(cls)}
+        values: Dict[str, Any] = {}
+
+        for key, value in raw.items():
+            if key not in known:
+                errors.append(f"Unknown key: {key}")
+            elif key == "provider_options":
+                values[key] = _coerce_provider_options(value, errors)
+            else:
+                try:
+                    values[key] = _coerce(value, hints[key])
+                except (TypeError, ValueError) as e:
+                    errors.append(f"Invalid value for {key}: {e}")
+
+        for name, f in known.items():
+            if f.default is dataclasses.MISSING and f.default_factory is dataclasses.MISSING and name not in raw:
+                errors.append(f"Missing key: {name}")
+
+        for name in ("num_users", "months", "batch_size", "tx_batch_size", "render_rows_per_page",
+                     "serve_port", "serve_page_size", "persona_pool_size", "augment_variants",
+                     "persona_batch_max", "persona_batch_window", "queue_max_attempts", "writer_queue_size",
+                     "semantic_cache_max_reuse", "semantic_cache_max_entries", "routing_max_income_streams"):
+            if isinstance(values.get(name), int) and values[name] <= 0:
+                errors.append(f"{name} must be a positive integer. Got: {values[name]!r}")
+        if values.get("llm_output_format", "json") not in {"json", "tabular", "structured"}:
+            errors.append(f"llm_output_format must be 'json', 'tabular' or 'structured'. Got: {values['llm_output_format']!r}")
+        if values.get("model_routing", "off") not in {"off", "tiered"}:
+            errors.append(f"model_routing must be 'off' or 'tiered'. Got: {values['model_routing']!r}")
+        elif values.get("model_routing") == "tiered" and not values.get("model_draft"):
+            errors.append("model_routing: tiered needs model_draft (the cheaper model for draft jobs).")
+        if values.get("llm_cassette_mode", "off") not in {"off", "record", "replay"}:
+            errors.append(f"llm_cassette_mode must be 'off', 'record' or 'replay'. Got: {values['llm_cassette_mode']!r}")
+        if values.get("llm_cassette_speed", 0.0) < 0:
+            errors.append(f"llm_cassette_speed must be >= 0. Got: {values['llm_cassette_speed']!r}")
+        if values.get("persona_source", "llm") not in {"llm", "sampler"}:
+            errors.append(f"persona_source must be 'llm' or 'sampler'. Got: {values['persona_source']!r}")
+        if values.get("persona_summary_mode", "template") not in {"template", "llm", "none"}:
+            errors.append(f"persona_summary_mode must be 'template', 'llm' or 'none'. Got: {values['persona_summary_mode']!r}")
+        if values.get("persona_batch_sizing", "fixed") not in {"fixed", "adaptive"}:
+            errors.append(f"persona_batch_sizing must be 'fixed' or 'adaptive'. Got: {values['persona_batch_sizing']!r}")
+        if values.get("persona_batch_objective", "throughput") not in {"throughput", "cost"}:
+            errors.append(f"persona_batch_objective must be 'throughput' or 'cost'. Got: {values['persona_batch_objective']!r}")
+        if values.get("batch_backend", "openai") not in {"openai", "local"}:
+            errors.append(f"batch_backend must be 'openai' or 'local'. Got: {values['batch_backend']!r}")
+        if values.get("queue_heartbeat_s", 30.0) >= values.get("queue_lease_s", 300.0):
+            errors.append("queue_heartbeat_s must be shorter than queue_lease_s, or leases expire while jobs run.")
+        if values.get("output_layout", "files") not in {"files", "shards"}:
+            errors.append(f"output_layout must be 'files' or 'shards'. Got: {values['output_layout']!r}")
+        if values.get("shard_compression", "gzip") not in {"gzip", "zstd"}:
+            errors.append(f"shard_compression must be 'gzip' or 'zstd'. Got: {values['shard_compression']!r}")
+        for name in ("shard_max_mb", "shard_max_seconds"):
+            if values.get(name, 1.0) <= 0:
+                errors.append(f"{name} must be > 0. Got: {values[name]!r}")
+        if not 0 < values.get("semantic_cache_threshold", 0.9) <= 1:
+            errors.append(f"semantic_cache_threshold must be in (0, 1]. Got: {values['semantic_cache_threshold']!r}")
+        if values.get("render_format", "html") not in {"html", "pdf"}:
+            errors.append(f"render_format must be 'html' or 'pdf'. Got: {values['render_format']!r}")
+
+        if errors:
+            raise ConfigError(errors)
+        return cls(**values)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dataclasses.asdict(self)
+
+
+# -----------------------------------------------------------------------------
+# Coercion helpers
+# -----------------------------------------------------------------------------
+
+_TRUE = {"true", "1", "yes", "y"}
+_FALSE = {"false", "0", "no", "n"}
+_NULL = {"null", "none", "~", ""}
+
+
+def _coerce(value: Any, tp: Any) -> Any:
+    """Coerce a YAML value or CLI/env string to the annotated type `tp`."""
+    args = typing.get_args(tp)
+    if typing.get_origin(tp) is typing.Union and type(None) in args:
+        if value is None or (isinstance(value, str) and value.strip().lower() in _NULL):
+            return None
+        tp = next(a for a in args if a is not type(None))
+
+    if tp is bool:
+        if isinstance(value, bool):
+            return value
+        if isinstance(value, str) and value.strip().lower() in _TRUE | _FALSE:
+            return value.strip().lower() in _TRUE
+        raise TypeError(f"expected bool, got {value!r}")
+    if tp is int:
+        if isinstance(value, bool):
+            raise TypeError(f"expected int, got {value!r}")
+        if isinstance(value, int):
+            return value
+        if isinstance(value, str):
+            return int(value.strip())
+        raise TypeError(f"expected int, got {type(value).__name__}")
+    if tp is float:
+        if isinstance(value, bool):
+            raise TypeError(f"expected float, got {value!r}")
+        if isinstance(value, (int, float)):
+            return float(value)
+        if isinstance(value, str):
+            return float(value.strip())
+        raise TypeError(f"expected float, got {type(value).__name__}")
+    if tp is str:
+        if isinstance(value, str):
+            return value
+        raise TypeError(f"expected str, got {type(value).__name__}")
+    return value
+
+
+def _coerce_provider_options(value: Any, errors) -> Dict[str, ProviderOptions]:
+    if value is None:
+        return {}
+    if not isinstance(value, Mapping):
+        errors.append(f"provider_options must be a mapping of provider -> options. Got: {type(value).__name__}")
+        return {}
+    hints = typing.get_type_hints(ProviderOptions)
+    out = {}
+    for provider, opts in value.items():
+        if not isinstance(opts, Mapping):
+            errors.append(f"provider_options.{provider} must be a mapping")
+            continue
+        coerced = {}
+        for k, v in opts.items():
+            if k not in hints:
+                errors.append(f"Unknown key: provider_options.{provider}.{k}")
+                continue
+            try:
+                coerced[k] = _coerce(v, hints[k])
+            except (TypeError, ValueError) as e:
+                errors.append(f"Invalid value for provider_options.{provider}.{k}: {e}")
+        out[provider] = ProviderOptions(**coerced)
+    return out
+
+
+def coerce_value(key: str, value: str) -> Any:
+    """Coerce a single CLI string for top-level `key` to its declared type (raises ConfigError)."""
+    hints = typing.get_type_hints(AppConfig)
+    if key not in hints or key == "provider_options":
+        raise ConfigError([f"Invalid config key: {key}"])
+    try:
+        return _coerce(value, hints[key])
+    except (TypeError, ValueError) as e:
+        raise ConfigError([f"Invalid value for {key}: {e}"])
+
+
+# -----------------------------------------------------------------------------
+# Overrides
+# -----------------------------------------------------------------------------
+
+def _set_dotted(raw: Dict[str, Any], dotted_key: str, value: Any) -> None:
+    parts = dotted_key.split(".")
+    node = raw
+    for part in parts[:-1]:
+        child = node.get(part)
+        if not isinstance(child, dict):
+            child = node[part] = {}
+        node = child
+    node[parts[-1]] = value
+
+
+def env_overrides(environ: Optional[Mapping[str, str]] = None) -> Dict[str, str]:
+    """Collect BANKGEN_* variables as dotted override keys (BANKGEN_CONFIG excluded)."""
+    environ = os.environ if environ is None else environ
+    out = {}
+    for name, value in environ.items():
+        if name.startswith(ENV_PREFIX) and name != f"{ENV_PREFIX}CONFIG":
+            out[name[len(ENV_PREFIX):].lower().replace("__", ".")] = value
+    return out
+
+
+def parse_overrides(pairs) -> Dict[str, str]:
+    """Parse CLI ["key=value", ...] pairs into a dict (raises ConfigError on malformed pairs)."""
+    out = {}
+    for pair in pairs or []:
+        key, sep, value = pair.partition("=")
+        if not sep or not key.strip():
+            raise ConfigError([f"Override must look like KEY=VALUE, got {pair!r}"])
+        out[key.strip()] = value
+    return out
+
+
+# -----------------------------------------------------------------------------
+# Load-once accessors
+# -----------------------------------------------------------------------------
+
+_CONFIG: Optional[AppConfig] = None
+_CLI_OVERRIDES: Dict[str, str] = {}
+_CONFIG_PATH_OVERRIDE: Optional[str] = None
+
+
+def config_path() -> str:
+    return _CONFIG_PATH_OVERRIDE or os.environ.get(f"{ENV_PREFIX}CONFIG") or CONFIG_PATH
+
+
+def configure(path: Optional[str] = None, overrides: Optional[Mapping[str, str]] = None) -> None:
+    """
+    Set the config file and CLI overrides for this process (call before first get_config()).
+    Resets any cached config.
+    """
+    global _CONFIG, _CONFIG_PATH_OVERRIDE, _CLI_OVERRIDES
+    _CONFIG_PATH_OVERRIDE = path
+    _CLI_OVERRIDES = dict(overrides or {})
+    _CONFIG = None
+
+
+def build_config(
+    raw: Mapping[str, Any],
+    overrides: Optional[Mapping[str, str]] = None,
+    environ: Optional[Mapping[str, str]] = None,
+) -> AppConfig:
+    """Apply env then explicit overrides on top of a raw YAML mapping and validate."""
+    merged: Dict[str, Any] = copy.deepcopy(dict(raw))
+    for key, value in {**env_overrides(environ), **(overrides or {})}.items():
+        _set_dotted(merged, key, value)
+    return AppConfig.from_dict(merged)
+
+
+def get_config() -> AppConfig:
+    """Return the process-wide AppConfig, loading + validating it on first use."""
+    global _CONFIG
+    if _CONFIG is None:
+        _CONFIG = build_config(load_config(), _CLI_OVERRIDES)
+    return _CONFIG
+
+
+def load_config(path: Optional[str] = None):
+    """Read the raw config.yaml mapping (no validation, no overrides)."""
+    path = path or config_path()
+    if not os.path.exists(path):
+        print(f"❌ ERROR: config.yaml not found at {path}")
         print("💡 Tip: Copy the default template or create a config.yaml with necessary keys.")
         sys.exit(1)
 
-    with open(CONFIG_PATH, "r") as f:
-        return yaml.safe_load(f)
+    with open(path, "r") as f:
+        return yaml.safe_load(f) or {}
 
-def save_config(config: dict, config_path="scripts/config.yaml"):
-    with open(config_path, "w") as f:
+def save_config(config: dict, path: Optional[str] = None):
+    """Persist a raw mapping to config.yaml (defaults to the active config file, not the CWD)."""
+    with open(path or config_path(), "w") as f:
         yaml.dump(
             config,
             f,
@@ -0,0 +1,108 @@
+# dataset.py
+"""
+Streaming readers for generated outputs.
+
+Downstream stages (render, serve, stats, replay, ...) read the dataset through these
+helpers instead of pandas so they can stream one user at a time with bounded memory:
+
+    <output_dir>/personas.csv
+    <output_dir>/transactions/<user_id>.csv
+"""
+
+from __future__ import annotations
+
+import csv
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# Transaction columns in the order the prompt contract defines them.
+TRANSACTION_COLUMNS = [
+    "timestamp",
+    "amount",
+    "transaction_type",
+    "currency",
+    "description_raw",
+    "description_cleaned",
+    "merchant_name",
+    "is_income",
+    "risk_flag",
+    "source_type",
+    "user_id",
+]
+
+# Persona descriptions can be long; lift csv's 128 KiB default field limit.
+csv.field_size_limit(min(sys.maxsize, 2**31 - 1))
+
+
+def transactions_dir(output_dir: str | Path) -> Path:
+    return Path(output_dir) / "transactions"
+
+
+def transaction_files(output_dir: str | Path) -> List[Path]:
+    """Per-user transaction CSVs, sorted by user_id."""
+    tx_dir = transactions_dir(output_dir)
+    if not tx_dir.exists():
+        return []
+    return sorted(tx_dir.glob("*.csv"))
+
+
+def read_user_transactions(path: str | Path) -> List[Dict[str, str]]:
+    """All rows of one user's CSV as string dicts (empty list for an empty file)."""
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def iter_user_transactions(output_dir: str | Path) -> Iterator[Tuple[str, List[Dict[str, str]]]]:
+    """Yield (user_id, rows) one user at a time."""
+    for path in transaction_files(output_dir):
+        yield path.stem, read_user_transactions(path)
+
+
+def read_personas(output_dir: str | Path, columns: Optional[List[str]] = None) -> Dict[str, Dict[str, str]]:
+    """
+    personas.csv keyed by user_id ({} if it does not exist).
+    Pass `columns` to keep only those fields (keeps memory flat for very large persona files).
+    """
+    path = Path(output_dir) / "personas.csv"
+    if not path.exists():
+        return {}
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if columns is None:
+            return {row["user_id"]: row for row in csv.DictReader(f)}
+        return {row["user_id"]: {c: row.get(c, "") for c in columns} for row in csv.DictReader(f)}
+
+
+def parse_timestamp(value: str) -> Optional[datetime]:
+    """
+    Parse an ISO-8601 timestamp from model output. Naive values are treated as UTC,
+    a trailing 'Z' is accepted, and unparseable values return None.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.endswith("Z"):
+        value = value[:-1] + "+00:00"
+    try:
+        ts = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return ts
+
+
+def parse_amount(value: Any) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def sort_by_time(rows: List[Dict[str, str]]) -> List[Tuple[datetime, Dict[str, str]]]:
+    """Return (timestamp, row) pairs in chronological order, dropping rows without a valid timestamp."""
+    pairs = [(parse_timestamp(r.get("timestamp", "")), r) for r in rows]
+    pairs = [(ts, r) for ts, r in pairs if ts is not None]
+    pairs.sort(key=lambda p: p[0])
+    return pairs
@@ -2,45 +2,265 @@
 
 import os
 import json
+import time
 import asyncio
 from pathlib import Path
-import pandas as pd
+from typing import List, Optional
 from tqdm import tqdm
 from tqdm.asyncio import tqdm_asyncio
-from .config import load_config
+from .config import AppConfig, get_config
 from .helpers import log, get_llm, generate_uuid, extract_json_block
-from promptlib.personas import full_persona_1_shot
+from .batch import BatchRequest, run_batch
+from .manifest import artifact_hash, get_manifest
+from .metrics import metrics
+from .profiling import watch_event_loop
+from . import batch_sizing, persona_sampler, records, routing, structured, tabular
+from promptlib.personas import full_persona_1_shot, full_persona_structured, full_persona_tabular
 
+# Raw per-batch outputs (stamped in the manifest) that personas.csv is assembled from.
+PERSONA_BATCH_DIR = "persona_batches"
 
-def create_prompt(n: int = 5):
+
+def create_prompt(n: int = 5, output_format: str = "json"):
     """
     Build an OpenAI-style messages array for generating `n` personas.
+    output_format "tabular" asks for the compact header + pipe-delimited rows contract,
+    "structured" for the JSON Schema contract (see chat_options).
     """
+    if output_format == "structured":
+        content = full_persona_structured.format(n=n, schema=structured.prompt_schema("personas"))
+    else:
+        content = (full_persona_tabular if output_format == "tabular" else full_persona_1_shot).format(n=n)
     return [
         {
             "role": "user",
-            "content": full_persona_1_shot.format(n=n),
+            "content": content,
         }
     ]
 
 
+def chat_options(cfg: AppConfig) -> dict:
+    """Extra request parameters for persona batch calls (response_format in structured mode)."""
+    return structured.chat_options("personas", cfg.llm_output_format, cfg)
+
+
 def _validate_positive_int(name: str, value):
     if not isinstance(value, int) or value <= 0:
         log.error(f"{name} must be a positive integer. Got: {value!r}")
         return False
     return True
 
+
+def _parse_persona_batch(text: str, start: int, output_format: str = "json") -> List[records.Persona]:
+    """
+    Parse one batch response into validated Persona records and assign sequential user_ids
+    from `start`. Raises on malformed output so callers can log and skip the batch;
+    individual invalid personas are dropped (records_invalid_total).
+    """
+    try:
+        if output_format == "tabular":
+            data = records.decode_personas(tabular.decode_personas(text))
+        elif output_format == "structured":
+            data = records.decode_personas(structured.decode(text, "personas"))
+        else:
+            data = records.decode_personas(json.loads(extract_json_block(text)))
+    except Exception:
+        metrics.inc("parse_failures_total")
+        raise
+    for j, persona in enumerate(data):
+        persona.user_id = generate_uuid("user", start + j)
+    return data
+
+
+def _record_batch_output(cfg: AppConfig, res, latency_s: float, n: int) -> None:
+    """Per-persona output tokens / latency for json vs tabular comparisons (cache hits excluded)."""
+    if getattr(res, "cached", False) or getattr(res, "from_cache", False):
+        return
+    metrics.record_user_output(cfg.llm_output_format, getattr(res, "usage", None), latency_s, users=n)
+
+
+def request_batch(cfg: AppConfig, llm, start: int, n: int) -> List[records.Persona]:
+    """
+    One fixed-size persona batch: call (draft tier first under model_routing: tiered) and
+    parse. Raises like llm.chat / _parse_persona_batch.
+    """
+    rows, res, latency_s = routing.chat(
+        llm, cfg, routing.persona_route(cfg), create_prompt(n, cfg.llm_output_format),
+        parse=lambda res: _parse_persona_batch(res.content or "", start, cfg.llm_output_format),
+        check=lambda rows: routing.check_personas(rows, n),
+        cache=True, **chat_options(cfg),
+    )
+    _record_batch_output(cfg, res, latency_s, n)
+    return rows
+
+
+async def request_batch_async(cfg: AppConfig, llm, start: int, n: int) -> List[records.Persona]:
+    """Async request_batch()."""
+    rows, res, latency_s = await routing.chat_async(
+        llm, cfg, routing.persona_route(cfg), create_prompt(n, cfg.llm_output_format),
+        parse=lambda res: _parse_persona_batch(res.content or "", start, cfg.llm_output_format),
+        check=lambda rows: routing.check_personas(rows, n),
+        cache=True, **chat_options(cfg),
+    )
+    _record_batch_output(cfg, res, latency_s, n)
+    return rows
+
+
+def persona_batch_artifact(start: int) -> str:
+    """Manifest artifact path (relative to output_dir) for the batch starting at `start`."""
+    return f"{PERSONA_BATCH_DIR}/batch_{start:05d}.json"
+
+
+def persona_batch_hash(cfg: AppConfig, start: int, n: int) -> str:
+    """Input hash for one persona batch: rendered prompt (incl. output contract) + model/temperature + start index."""
+    return artifact_hash(create_prompt(n, cfg.llm_output_format), cfg, start=start, **chat_options(cfg))
+
+
+def _save_persona_batch(cfg: AppConfig, start: int, n: int, rows: List[records.Persona]) -> None:
+    """
+    Persist one parsed batch and stamp it in the manifest so `bankgen build` can reuse it.
+    """
+    artifact = persona_batch_artifact(start)
+    path = Path(cfg.output_dir) / artifact
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps([p.to_dict() for p in rows], ensure_ascii=False), encoding="utf-8")
+    get_manifest(cfg).stamp(artifact, persona_batch_hash(cfg, start, n), len(rows), size=n)
+
+
+def load_persona_batch(cfg: AppConfig, start: int) -> List[records.Persona]:
+    path = Path(cfg.output_dir) / persona_batch_artifact(start)
+    return records.decode_personas(json.loads(path.read_text(encoding="utf-8")))
+
+
+def _adaptive_result(cfg: AppConfig, sizer: batch_sizing.BatchSizer, start: int, n: int, res,
+                     latency_s: float) -> Optional[List[records.Persona]]:
+    """
+    Parse and save one adaptively sized batch and feed the outcome back to the sizer.
+    Returns None when the batch was cut off at the output limit and its range should be
+    requested again at the (now smaller) size; [] when it is lost.
+    """
+    _record_batch_output(cfg, res, latency_s, n)
+    truncated = batch_sizing.is_truncated(res, cfg.max_tokens)
+    try:
+        rows = _parse_persona_batch(res.content or "", start, cfg.llm_output_format)
+    except Exception as e:
+        rows = None
+        if not (truncated and n > 1):
+            log.exception(f"JSON parse error for batch starting at index {start}: {e}", tag="PERSONA")
+
+    cached = getattr(res, "cached", False) or getattr(res, "from_cache", False)
+    sizer.observe(n, len(rows or ()), 0.0 if cached else latency_s, getattr(res, "usage", None), truncated)
+    if rows is None:
+        if truncated and n > 1:
+            log.warning(f"Batch of {n} starting at {start} was truncated; retrying in batches of {sizer.n}", tag="PERSONA")
+            return None
+        return []
+    _save_persona_batch(cfg, start, n, rows)
+    return rows
+
+
+def _generate_adaptive(cfg: AppConfig, llm) -> List[records.Persona]:
+    """persona_batch_sizing: adaptive — each call's size comes from the feedback so far."""
+    sizer = batch_sizing.BatchSizer.from_config(cfg)
+    all_rows = []
+    start = 0
+    with log.tag("PERSONA_GEN"), tqdm(total=cfg.num_users, desc="Generating Personas", unit="persona") as bar:
+        while start < cfg.num_users:
+            n = sizer.next_size(cfg.num_users - start)
+            with log.tag_timer("LLM", f"batch at {start} (n={n})"):
+                try:
+                    t0 = time.perf_counter()
+                    res = llm.chat(create_prompt(n, cfg.llm_output_format), cache=True, **chat_options(cfg))
+                    latency_s = time.perf_counter() - t0
+                except Exception as e:
+                    log.exception(f"LLM call failed for persona batch {start}: {e}", tag="PERSONA")
+                    start += n
+                    continue
+                rows = _adaptive_result(cfg, sizer, start, n, res, latency_s)
+            if rows is None:
+                continue
+            all_rows.extend(rows)
+            start += n
+            bar.update(n)
+    log.info(f"Adaptive batch size settled at {sizer.n} ({sizer.truncations} truncated batches)", tag="PERSONA")
+    return all_rows
+
+
+async def _generate_adaptive_async(cfg: AppConfig, llm) -> List[records.Persona]:
+    """
+    Async persona_batch_sizing: adaptive. Keeps persona_batch_window requests in flight (one
+    until the first response is back) and sizes each new one from the responses so far.
+    """
+    sizer = batch_sizing.BatchSizer.from_config(cfg)
+    ranges = [(0, cfg.num_users)]       # (start, count) not requested yet, or to retry after truncation
+    pending = {}
+    batches = []                        # (start, rows), completed out of order
+
+    async def call(n: int):
+        t0 = time.perf_counter()
+        res = await llm.chat_async(create_prompt(n, cfg.llm_output_format), cache=True, **chat_options(cfg))
+        return res, time.perf_counter() - t0
+
+    with tqdm(total=cfg.num_users, desc="Generating Persona Batches", unit="persona") as bar:
+        async with watch_event_loop():
+            while ranges or pending:
+                # One request until the first response has calibrated the sizer, then the full window.
+                window = cfg.persona_batch_window if sizer.calibrated else 1
+                while ranges and len(pending) < window:
+                    start, count = ranges.pop()
+                    n = sizer.next_size(count)
+                    if n < count:
+                        ranges.append((start + n, count - n))
+                    pending[asyncio.ensure_future(call(n))] = (start, n)
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    start, n = pending.pop(task)
+                    try:
+                        res, latency_s = task.result()
+                    except Exception as e:
+                        log.exception(f"LLM call failed for persona batch {start}: {e}", tag="PERSONA")
+                        continue
+                    rows = _adaptive_result(cfg, sizer, start, n, res, latency_s)
+                    if rows is None:
+                        ranges.append((start, n))
+                        continue
+                    batches.append((start, rows))
+                    bar.update(n)
+    log.info(f"Adaptive batch size settled at {sizer.n} ({sizer.truncations} truncated batches)", tag="PERSONA")
+    # Same order as the sync path: by batch start, then as generated.
+    batches.sort(key=lambda batch: batch[0])
+    return [persona for _, rows in batches for persona in rows]
+
+
+def _write_personas(all_rows: List[records.Persona], cfg: AppConfig) -> None:
+    """
+    Write all generated personas to output_dir/personas.csv.
+    """
+    if not all_rows:
+        log.error("No personas generated. Check your configuration and try again.", tag="PERSONA")
+        return
+
+    t0 = time.perf_counter()
+    output_dir = Path(cfg.output_dir).resolve()
+    output_dir.mkdir(parents=True, exist_ok=True)
+    out_path = output_dir / "personas.csv"
+
+    records.write_csv(out_path, all_rows, records.PERSONA_COLUMNS)
+    metrics.inc("rows_produced_total", len(all_rows))
+    metrics.record_write(len(all_rows), time.perf_counter() - t0, out_path.stat().st_size)
+    log.info(f"✅ Generated {len(all_rows)} personas. Saved to {out_path}", tag="PERSONA")
+
 @log.log_timed("PERSONA_GEN")
 def generate_personas():
     """
     Synchronous persona generation.
     Uses LLMClient.chat for each batch, writes a single personas.csv at the end.
     """
-    cfg = load_config()
+    cfg = get_config()
     llm = get_llm()
 
-    num_users = cfg["num_users"]
-    batch_size = cfg["batch_size"]
+    num_users = cfg.num_users
+    batch_size = cfg.batch_size
 
     if not (_validate_positive_int("num_users", num_users) and _validate_positive_int("batch_size", batch_size)):
         return
@@ -49,39 +269,30 @@ def generate_personas():
         log.warning(f"Reducing batch_size ({batch_size}) to num_users ({num_users}).")
         batch_size = num_users
 
+    if cfg.persona_batch_sizing == "adaptive":
+        log.info(f"Generating {num_users} personas in adaptive batches (from {batch_size}, "
+                 f"objective {cfg.persona_batch_objective})...", tag="PERSONA")
+        _write_personas(_generate_adaptive(cfg, llm), cfg)
+        return
+
     log.info(f"Generating {num_users} personas in batches of {batch_size}...", tag="PERSONA")
     all_rows = []
 
     with log.tag("PERSONA_GEN"):
         for i in tqdm(range(0, num_users, batch_size)):
             n = min(batch_size, num_users - i)
-            messages = create_prompt(n)
 
             with log.tag_timer("LLM", f"batch {i // batch_size + 1}"):
                 try:
-                    res = llm.chat(messages, cache=True)
-                    text = res.content or ""
-                    # Be tolerant of fenced JSON:
-                    data = json.loads(extract_json_block(text))
+                    data = request_batch(cfg, llm, i, n)
                 except Exception as e:
                     log.exception(f"JSON parse error for batch starting at index {i}: {e}", tag="PERSONA")
                     continue
 
-            for idx, persona in enumerate(data):
-                persona["user_id"] = generate_uuid("user", i + idx)
-                all_rows.append(persona)
-
-    if not all_rows:
-        log.error("No personas generated. Check your configuration and try again.", tag="PERSONA")
-        return
-
-    df = pd.DataFrame(all_rows)
-    output_dir = Path(cfg.get("output_dir", "data")).resolve()
-    output_dir.mkdir(parents=True, exist_ok=True)
-    out_path = output_dir / "personas.csv"
+            _save_persona_batch(cfg, i, n, data)
+            all_rows.extend(data)
 
-    df.to_csv(out_path, index=False)
-    log.info(f"✅ Generated {len(all_rows)} personas. Saved to {out_path}", tag="PERSONA")
+    _write_personas(all_rows, cfg)
 
 @log.log_timed("PERSONA_GEN_ASYNC")
 async def generate_personas_async():
@@ -90,11 +301,11 @@ async def generate_personas_async():
     Batches prompts + fires them concurrently with llm.chat_async,
     then writes personas.csv.
     """
-    cfg = load_config()
+    cfg = get_config()
     llm = get_llm()
 
-    num_users = cfg["num_users"]
-    batch_size = cfg["batch_size"]
+    num_users = cfg.num_users
+    batch_size = cfg.batch_size
 
     if not (_validate_positive_int("num_users", num_users) and _validate_positive_int("batch_size", batch_size)):
         return
@@ -103,55 +314,129 @@ async def generate_personas_async():
         log.warning(f"Reducing batch_size ({batch_size}) to num_users ({num_users}).")
         batch_size = num_users
 
+    if cfg.persona_batch_sizing == "adaptive":
+        log.info(f"Generating {num_users} personas asynchronously in adaptive batches (from {batch_size}, "
+                 f"objective {cfg.persona_batch_objective}, {cfg.persona_batch_window} in flight)...", tag="PERSONA")
+        with log.tag_timer("PERSONA_GEN"):
+            all_rows = await _generate_adaptive_async(cfg, llm)
+        _write_personas(all_rows, cfg)
+        return
+
     num_batches = (num_users + batch_size - 1) // batch_size
     log.info(f"Generating {num_users} personas asynchronously in {num_batches} batches of {batch_size}...", tag="PERSONA")
 
-    prompts = []
-    batch_sizes = []
-    for start in range(0, num_users, batch_size):
-        n = min(batch_size, num_users - start)
-        prompts.append(create_prompt(n))
-        batch_sizes.append((start, n))
+    batch_sizes = [(start, min(batch_size, num_users - start)) for start in range(0, num_users, batch_size)]
+
+    async def _one(start: int, n: int) -> Optional[List[records.Persona]]:
+        try:
+            return await request_batch_async(cfg, llm, start, n)
+        except Exception as e:
+            log.exception(f"JSON parse error for batch starting at {start}: {e}", tag="PERSONA")
+            return None
 
     with log.tag_timer("PERSONA_GEN"):
         # Launch async calls
         log.debug("Dispatching async LLM calls...", tag="LLM")
-        tasks = [llm.chat_async(p, cache=True) for p in prompts]
-        results = await tqdm_asyncio.gather(*tasks, desc="Generating Persona Batches", total=num_batches)
+        tasks = [_one(start, n) for start, n in batch_sizes]
+        async with watch_event_loop():
+            results = await tqdm_asyncio.gather(*tasks, desc="Generating Persona Batches", total=num_batches)
         log.debug("All LLM calls complete.", tag="LLM")
 
         # Process results
         all_rows = []
-        for (start, n), res in zip(batch_sizes, results):
-            try:
-                text = res.content or ""
-                parsed = json.loads(extract_json_block(text))
-            except Exception as e:
-                log.exception(f"JSON parse error for batch starting at {start}: {e}", tag="PERSONA")
+        for (start, n), parsed in zip(batch_sizes, results):
+            if parsed is None:
                 continue
+            _save_persona_batch(cfg, start, n, parsed)
+            all_rows.extend(parsed)
 
-            for j, persona in enumerate(parsed):
-                persona["user_id"] = generate_uuid("user", start + j)
-                all_rows.append(persona)
+    _write_personas(all_rows, cfg)
 
-    if not all_rows:
-        log.error("No personas generated. Check your configuration and try again.", tag="PERSONA")
+
+@log.log_timed("PERSONA_GEN_BATCH")
+def generate_personas_batch():
+    """
+    Offline Batch API persona generation.
+    Renders every batch prompt into one batch JSONL file, submits it, waits for the
+    results and then applies the normal parse + write path. custom_id encodes the
+    batch start index so user_ids are assigned exactly as in the live paths.
+    """
+    cfg = get_config()
+
+    num_users = cfg.num_users
+    batch_size = cfg.batch_size
+
+    if not (_validate_positive_int("num_users", num_users) and _validate_positive_int("batch_size", batch_size)):
         return
 
-    df = pd.DataFrame(all_rows)
-    output_dir = Path(cfg.get("output_dir", "data")).resolve()
-    output_dir.mkdir(parents=True, exist_ok=True)
-    out_path = output_dir / "personas.csv"
+    if batch_size > num_users:
+        log.warning(f"Reducing batch_size ({batch_size}) to num_users ({num_users}).")
+        batch_size = num_users
 
-    df.to_csv(out_path, index=False)
-    log.info(f"✅ Generated {len(all_rows)} personas. Saved to {out_path}", tag="PERSONA")
+    if cfg.persona_batch_sizing == "adaptive":
+        log.warning("persona_batch_sizing: adaptive needs per-call feedback; the Batch API path uses fixed "
+                    f"batches of {batch_size}.", tag="PERSONA")
+
+    requests = []
+    sizes = {}
+    for start in range(0, num_users, batch_size):
+        n = min(batch_size, num_users - start)
+        sizes[start] = n
+        requests.append(BatchRequest(custom_id=f"personas-{start:05d}", messages=create_prompt(n, cfg.llm_output_format),
+                                     options=chat_options(cfg)))
+
+    log.info(f"Submitting {len(requests)} persona batches via the Batch API...", tag="PERSONA")
+    results = run_batch(requests, cfg, name="personas")
+
+    all_rows = []
+    for req in requests:
+        start = int(req.custom_id.rsplit("-", 1)[1])
+        result = results.get(req.custom_id)
+        if result is None or result.error:
+            log.error(f"Batch request {req.custom_id} failed: {result.error if result else 'missing from results'}", tag="PERSONA")
+            continue
+        metrics.record_user_output(cfg.llm_output_format, result.usage, users=sizes[start])
+        try:
+            parsed = _parse_persona_batch(result.content, start, cfg.llm_output_format)
+        except Exception as e:
+            log.exception(f"JSON parse error for batch starting at {start}: {e}", tag="PERSONA")
+            continue
+        _save_persona_batch(cfg, start, sizes[start], parsed)
+        all_rows.extend(parsed)
+
+    _write_personas(all_rows, cfg)
+
+
+@log.log_timed("PERSONA_GEN_SAMPLER")
+def generate_personas_sampled(mode: str = "sync"):
+    """
+    Combinatorial persona generation (persona_source: sampler).
+    Builds (or reuses) the LLM component pools with the requested call mode, then samples
+    num_users personas locally and writes personas.csv. No per-persona LLM calls.
+    """
+    cfg = get_config()
+    if not _validate_positive_int("num_users", cfg.num_users):
+        return
+
+    pools = persona_sampler.build_pools(cfg, mode)
+    log.info(f"Sampling {cfg.num_users} personas from component pools (seed={cfg.persona_seed})...", tag="PERSONA")
+    with log.tag_timer("PERSONA_GEN", "sampling"):
+        all_rows = persona_sampler.sample_personas(cfg, pools)
+    _write_personas(all_rows, cfg)
 
 
-def main():
+def main(mode: str = "sync"):
     log.info("Starting persona generation...", tag="APP")
-    # Choose sync or async path:
-    generate_personas()
-    # asyncio.run(generate_personas_async())
+    # Choose sync, async or offline batch path:
+    if get_config().persona_source == "sampler":
+        generate_personas_sampled(mode)
+    elif mode == "async":
+        asyncio.run(generate_personas_async())
+    elif mode == "batch":
+        generate_personas_batch()
+    else:
+        generate_personas()
+    routing.report("personas")
     log.info("Persona generation complete.", tag="APP")
 
 
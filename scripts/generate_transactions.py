@@ -2,163 +2,362 @@
 
 import os
 import json
+import time
 import asyncio
 from pathlib import Path
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 
 import pandas as pd
 from tqdm import tqdm
 from tqdm.asyncio import tqdm_asyncio
-from .config import load_config
+from .config import AppConfig, get_config
 from .helpers import log, get_llm, extract_json_block
+from .batch import BatchRequest, run_batch
+from .manifest import artifact_hash, get_manifest
+from .metrics import metrics
+from .profiling import watch_event_loop
+from .semantic_cache import get_semantic_cache
+from . import persona_sampler, records, routing, structured, tabular
+from .writer import TransactionWriter
 # from kirkomi_utils.logging.logger import log
 from kirkomi_utils.llm import LLMClient
-from promptlib.transactions import full_transaction_1_shot
+from promptlib.transactions import full_transaction_1_shot, full_transaction_structured, full_transaction_tabular
 
 
-def create_prompt(user: Dict[str, Any], months: int = 6) -> List[Dict[str, str]]:
+def create_prompt(user: Dict[str, Any], months: int = 6, output_format: str = "json") -> List[Dict[str, str]]:
     """
     Build an OpenAI-style messages array to generate transactions for a user.
+    output_format "tabular" asks for the compact header + pipe-delimited rows contract,
+    "structured" for the JSON Schema contract (see chat_options).
     """
+    persona = json.dumps(user, indent=2)
+    if output_format == "structured":
+        content = full_transaction_structured.format(
+            months=months, persona=persona, schema=structured.prompt_schema("transactions")
+        )
+    else:
+        template = full_transaction_tabular if output_format == "tabular" else full_transaction_1_shot
+        content = template.format(months=months, persona=persona)
     return [
         {
             "role": "user",
-            "content": full_transaction_1_shot.format(
-                months=months,
-                persona=json.dumps(user, indent=2)
-            ),
+            "content": content,
         }
     ]
 
+
+def chat_options(output_format: str = "json") -> Dict[str, Any]:
+    """Extra request parameters for transaction calls (response_format in structured mode)."""
+    return structured.chat_options("transactions", output_format)
+
+def _parse_transactions(text: str, user: Dict[str, Any], output_format: str = "json") -> List[records.Transaction]:
+    """
+    Parse a transactions response into validated Transaction records (user_id is added at write time).
+    Raises on malformed output so callers can log and fall back to an empty history;
+    individual invalid transactions are dropped (records_invalid_total).
+    """
+    try:
+        if output_format == "tabular":
+            return records.decode_transactions(tabular.decode_transactions(text))
+        if output_format == "structured":
+            return records.decode_transactions(structured.decode(text, "transactions"))
+        return records.decode_transactions(json.loads(extract_json_block(text)))
+    except Exception:
+        metrics.inc("parse_failures_total")
+        raise
+
+
+def transaction_artifact(user_id: str) -> str:
+    """Manifest artifact path (relative to output_dir) for one user's transactions."""
+    return f"transactions/{user_id}.csv"
+
+
+def transaction_hash(cfg: AppConfig, user: Dict[str, Any]) -> str:
+    """Input hash for one user's history: rendered prompt (persona + months + output contract) + model/temperature."""
+    user = persona_sampler.with_cached_summary(cfg, user)
+    return artifact_hash(create_prompt(user, cfg.months, cfg.llm_output_format), cfg, **chat_options(cfg.llm_output_format))
+
+
+def _write_user_transactions(tx_dir: Path, user_id: str, txns: List[records.Transaction],
+                             cfg: Optional[AppConfig] = None, user: Optional[Dict[str, Any]] = None) -> None:
+    """
+    Write one user's transactions to tx_dir/<user_id>.csv.
+    With cfg + user, a non-empty history is also stamped in the manifest; failed (empty)
+    histories are left unstamped so `bankgen build` retries them.
+    """
+    t0 = time.perf_counter()
+    out_path = tx_dir / f"{user_id}.csv"
+    records.write_csv(out_path, txns, records.TRANSACTION_COLUMNS, constants={"user_id": user_id})
+    metrics.inc("rows_produced_total", len(txns))
+    metrics.record_write(len(txns), time.perf_counter() - t0, out_path.stat().st_size)
+    if cfg is not None and user is not None and txns:
+        get_manifest(cfg).stamp(transaction_artifact(user_id), transaction_hash(cfg, user), len(txns))
+
+
+def _output_location(cfg: AppConfig) -> Path:
+    return Path(cfg.output_dir) / ("shards" if cfg.output_layout == "shards" else "transactions")
+
+
+def _load_personas(cfg: AppConfig):
+    """
+    Read output_dir/personas.csv. Returns None (after logging) if it is missing or empty.
+    """
+    personas_path = Path(cfg.output_dir) / "personas.csv"
+    if not personas_path.exists():
+        log.error(f"❌ personas.csv not found at {personas_path}", tag="TXN")
+        return None
+
+    personas = pd.read_csv(personas_path)
+    if personas.empty:
+        log.error("❌ personas.csv is empty. Nothing to process.", tag="TXN")
+        return None
+    return personas
+
+
+def _record_user_output(res, latency_s: float, output_format: str) -> None:
+    """Per-user output tokens / latency for json vs tabular comparisons (cache hits excluded)."""
+    if getattr(res, "cached", False) or getattr(res, "from_cache", False):
+        return
+    metrics.record_user_output(output_format, getattr(res, "usage", None), latency_s)
+
+
 @log.log_timed("SIMULATE_TXN")
-def simulate_transactions(llm: LLMClient, user: Dict[str, Any], months: int = 6) -> List[Dict[str, Any]]:
+def simulate_transactions(llm: LLMClient, user: Dict[str, Any], months: int = 6,
+                          output_format: str = "json") -> List[records.Transaction]:
     """
     Synchronous: generate transactions for a single user.
     """
-    messages = create_prompt(user, months)
+    cfg = get_config()
+    cache = get_semantic_cache(cfg)
+    if cache is not None:
+        cached = cache.lookup(user)
+        if cached is not None:
+            return cached
+    messages = create_prompt(user, months, output_format)
     with log.tag_timer("LLM", f"simulate txns for {user.get('user_id','<unknown>')}"):
         try:
             with log.tag_timer("LLM_CALL"):
-                res = llm.chat(messages, cache=True)
-            text = res.content or ""
-            txns = json.loads(extract_json_block(text))
+                txns, res, latency_s = routing.chat(
+                    llm, cfg, routing.transaction_route(cfg, user), messages,
+                    parse=lambda res: _parse_transactions(res.content or "", user, output_format),
+                    check=lambda txns: routing.check_transactions(cfg, user, txns),
+                    cache=True, **chat_options(output_format),
+                )
+            _record_user_output(res, latency_s, output_format)
         except Exception as e:
             log.exception(f"JSON parse error while generating txns for {user.get('user_id')}: {e}", tag="TXN")
             return []
-
-    # Ensure user_id is attached (if not already in template response)
-    for txn in txns:
-        txn["user_id"] = user["user_id"]
+    if cache is not None:
+        cache.add(user, txns)
     return txns
 
 
-async def simulate_transactions_async(llm: LLMClient, user: Dict[str, Any], months: int = 6) -> List[Dict[str, Any]]:
+async def simulate_transactions_async(llm: LLMClient, user: Dict[str, Any], months: int = 6,
+                                      output_format: str = "json") -> List[records.Transaction]:
     """
     Asynchronous: generate transactions for a single user.
     """
-    messages = create_prompt(user, months)
-    with log.tag("LLM"):
-        try:
-            res = await llm.chat_async(messages, cache=True)
-            text = res.content or ""
-            txns = json.loads(extract_json_block(text))
-        except Exception as e:
-            log.exception(f"[async] JSON parse error for {user.get('user_id')}: {e}", tag="TXN")
-            return []
-
-    for txn in txns:
-        txn["user_id"] = user["user_id"]
+    cfg = get_config()
+    cache = get_semantic_cache(cfg)
+    if cache is not None:
+        # Waits instead when a similar persona's history is still being generated.
+        cached = await cache.lookup_async(user)
+        if cached is not None:
+            return cached
+    txns: List[records.Transaction] = []
+    try:
+        messages = create_prompt(user, months, output_format)
+        with log.tag("LLM"):
+            try:
+                txns, res, latency_s = await routing.chat_async(
+                    llm, cfg, routing.transaction_route(cfg, user), messages,
+                    parse=lambda res: _parse_transactions(res.content or "", user, output_format),
+                    check=lambda txns: routing.check_transactions(cfg, user, txns),
+                    cache=True, **chat_options(output_format),
+                )
+                _record_user_output(res, latency_s, output_format)
+            except Exception as e:
+                log.exception(f"[async] JSON parse error for {user.get('user_id')}: {e}", tag="TXN")
+    finally:
+        if cache is not None:
+            cache.add(user, txns)   # also releases users waiting on this one, whatever failed above
     return txns
 
 
 def generate_transactions():
     """
-    Synchronous batch: read personas.csv, generate per-user CSVs under output_dir/transactions/.
+    Synchronous batch: read personas.csv, generate per-user transactions (written by the
+    background TransactionWriter, in the configured output_layout).
     """
-    cfg = load_config()
+    cfg = get_config()
     llm = get_llm()
 
-    personas_path = Path(cfg["output_dir"]) / "personas.csv"
-    if not personas_path.exists():
-        log.error(f"personas.csv not found at {personas_path}", tag="TXN")
-        return
-
-    personas = pd.read_csv(personas_path)
-    if personas.empty:
-        log.error("❌ personas.csv is empty. Nothing to process.", tag="TXN")
+    personas = _load_personas(cfg)
+    if personas is None:
         return
 
-    tx_dir = Path(cfg["output_dir"]) / "transactions"
-    tx_dir.mkdir(parents=True, exist_ok=True)
-
     log.info(f"Generating transactions (sync) for {len(personas)} users...", tag="TXN")
-    with log.tag("TXN_GEN_SYNC"):
+    with log.tag("TXN_GEN_SYNC"), TransactionWriter(cfg) as writer:
         for _, user_row in tqdm(personas.iterrows(), total=personas.shape[0]):
-            user = user_row.to_dict()
-            txns = simulate_transactions(llm, user, months=cfg["months"])
-            df = pd.DataFrame(txns)
-            out_path = tx_dir / f"{user['user_id']}.csv"
-            df.to_csv(out_path, index=False)
+            user = persona_sampler.ensure_summary(cfg, user_row.to_dict(), llm)
+            txns = simulate_transactions(llm, user, months=cfg.months, output_format=cfg.llm_output_format)
+            writer.submit(user["user_id"], txns, user)
+
+    log.info(f"✅ Transactions written to {_output_location(cfg)}", tag="TXN")
+
+async def _simulate_with_summary_async(cfg: AppConfig, llm: LLMClient, user: Dict[str, Any]):
+    """Fill a lazily generated persona_summary (sampler personas) first, then simulate. Returns (user, txns)."""
+    user = await persona_sampler.ensure_summary_async(cfg, user, llm)
+    return user, await simulate_transactions_async(llm, user, months=cfg.months, output_format=cfg.llm_output_format)
 
-    log.info(f"✅ Transactions written to {tx_dir}", tag="TXN")
 
 @log.log_timed("TXN_GEN_ASYNC")
 async def generate_transactions_async():
     """
-    Asynchronous batch: read personas.csv, generate per-user CSVs concurrently.
+    Asynchronous batch: read personas.csv, generate per-user transactions concurrently.
+    Each user is handed to the background writer as soon as its call completes.
     """
-    cfg = load_config()
+    cfg = get_config()
     llm = get_llm()
 
     log.debug("Config and LLM client loaded.", tag="TXN")
 
-    personas_path = Path(cfg["output_dir"]) / "personas.csv"
-    if not personas_path.exists():
-        log.error(f"❌ personas.csv not found at {personas_path}", tag="TXN")
-        return
-
-    personas = pd.read_csv(personas_path)
-    if personas.empty:
-        log.error("❌ personas.csv is empty. Nothing to process.", tag="TXN")
+    personas = _load_personas(cfg)
+    if personas is None:
         return
 
     log.debug(f"Loaded {len(personas)} personas.", tag="TXN")
 
-    tx_dir = Path(cfg["output_dir"]) / "transactions"
-    tx_dir.mkdir(parents=True, exist_ok=True)
-
     log.info(f"Generating transactions (async) for {len(personas)} users...", tag="TXN")
 
     # Build all tasks
-    tasks = []
-    users: List[Dict[str, Any]] = []
-    for _, user_row in personas.iterrows():
-        user = user_row.to_dict()
-        users.append(user)
-        tasks.append(simulate_transactions_async(llm, user, months=cfg["months"]))
+    tasks = [_simulate_with_summary_async(cfg, llm, user_row.to_dict()) for _, user_row in personas.iterrows()]
 
     # Dispatch and show progress
-    with log.tag("TXN_GEN_ASYNC"):
-    
-        log.debug("Dispatching async LLM calls...", tag="TXN")
-    
-        results = await tqdm_asyncio.gather(*tasks, desc="Generating Tx Batches", total=len(tasks))
+    async with watch_event_loop():
+        with log.tag("TXN_GEN_ASYNC"), TransactionWriter(cfg) as writer:
+
+            log.debug("Dispatching async LLM calls...", tag="TXN")
+
+            for completed in tqdm_asyncio.as_completed(tasks, desc="Generating Tx Batches", total=len(tasks)):
+                user, txns = await completed
+                await writer.submit_async(user["user_id"], txns, user)
+
+        log.debug("All async LLM calls complete.", tag="TXN")
+
+    log.info(f"✅ Transactions written to {_output_location(cfg)}", tag="TXN")
+
+
+def _batch_transactions(cfg: AppConfig, user: Dict[str, Any], result) -> List[records.Transaction]:
+    """Parse one Batch API result ([] when it failed or is malformed)."""
+    user_id = user["user_id"]
+    if result is None or result.error:
+        log.error(f"Batch request for {user_id} failed: {result.error if result else 'missing from results'}", tag="TXN")
+        return []
+    metrics.record_user_output(cfg.llm_output_format, result.usage)
+    try:
+        return _parse_transactions(result.content, user, cfg.llm_output_format)
+    except Exception as e:
+        log.exception(f"[batch] JSON parse error for {user_id}: {e}", tag="TXN")
+        return []
 
-    log.debug("All async LLM calls complete.", tag="TXN")
 
-    # Write each user's CSV
-    for user, txns in zip(users, results):
-        df = pd.DataFrame(txns)
-        out_path = tx_dir / f"{user['user_id']}.csv"
-        df.to_csv(out_path, index=False)
+def _escalate_batch(cfg: AppConfig, users: Dict[str, Dict[str, Any]], routes: Dict[str, routing.Route],
+                    results, parsed: Dict[str, List[records.Transaction]]) -> None:
+    """
+    model_routing: tiered in batch mode. Draft histories that fail validation are requested
+    again from the premium model in a second batch; `parsed` is updated in place.
+    """
+    escalate = []
+    for user_id, user in users.items():
+        route = routes[user_id]
+        routing.record_job(route)
+        result = results.get(user_id)
+        if result is not None and not result.error:
+            routing.record_attempt(route, route.tier, result, 0.0,
+                                   cfg.model_draft if route.tier == "draft" else cfg.model, batch=True)
+        if route.tier == "draft":
+            problems = routing.check_transactions(cfg, user, parsed[user_id])
+            if problems:
+                routing.record_escalation(route, problems)
+                escalate.append(user_id)
+    if not escalate:
+        return
+
+    log.info(f"Escalating {len(escalate)} draft histories to {cfg.model} via the Batch API...", tag="TXN")
+    requests = [BatchRequest(custom_id=user_id, messages=create_prompt(users[user_id], cfg.months, cfg.llm_output_format),
+                             options=chat_options(cfg.llm_output_format)) for user_id in escalate]
+    premium = run_batch(requests, cfg, name="transactions-escalated")
+    for user_id in escalate:
+        result = premium.get(user_id)
+        if result is not None and not result.error:
+            routing.record_attempt(routes[user_id], "premium", result, 0.0, cfg.model, batch=True)
+        parsed[user_id] = _batch_transactions(cfg, users[user_id], result)
 
-    log.info(f"✅ Transactions written to {tx_dir}", tag="TXN")
 
+@log.log_timed("TXN_GEN_BATCH")
+def generate_transactions_batch():
+    """
+    Offline Batch API: one request per user (custom_id = user_id), submitted as a single
+    batch file. Results are mapped back to personas by custom_id and written through the
+    same parse + write path as the live modes.
+    """
+    cfg = get_config()
+
+    personas = _load_personas(cfg)
+    if personas is None:
+        return
 
-def main():
+    users: Dict[str, Dict[str, Any]] = {}
+    routes: Dict[str, routing.Route] = {}
+    reused: Dict[str, List[records.Transaction]] = {}
+    requests = []
+    cache = get_semantic_cache(cfg)
+    rows = persona_sampler.ensure_summaries_batch(cfg, [user_row.to_dict() for _, user_row in personas.iterrows()])
+    for user in rows:
+        # Only histories from earlier runs can be reused here: the whole batch is submitted at once.
+        cached = cache.lookup(user) if cache is not None else None
+        if cached is not None:
+            reused[user["user_id"]] = cached
+            continue
+        users[user["user_id"]] = user
+        routes[user["user_id"]] = route = routing.transaction_route(cfg, user)
+        requests.append(BatchRequest(custom_id=user["user_id"], messages=create_prompt(user, cfg.months, cfg.llm_output_format),
+                                     options={**chat_options(cfg.llm_output_format), **routing.model_overrides(cfg, route.tier)}))
+
+    log.info(f"Submitting transaction requests for {len(requests)} users via the Batch API...", tag="TXN")
+    results = run_batch(requests, cfg, name="transactions") if requests else {}
+    parsed = {user_id: _batch_transactions(cfg, user, results.get(user_id)) for user_id, user in users.items()}
+    if routing.enabled(cfg):
+        _escalate_batch(cfg, users, routes, results, parsed)
+
+    with TransactionWriter(cfg) as writer:
+        for user in rows:
+            if user["user_id"] in reused:
+                writer.submit(user["user_id"], reused[user["user_id"]], user)
+        for user_id, user in users.items():
+            txns = parsed[user_id]
+            if cache is not None:
+                cache.add(user, txns)
+            writer.submit(user_id, txns, user)
+
+    log.info(f"✅ Transactions written to {_output_location(cfg)}", tag="TXN")
+
+
+def main(mode: str = "sync"):
     log.info("🔍 Generating transactions...", tag="APP")
-    generate_transactions()  # sync path if preferred
-    # asyncio.run(generate_transactions_async())  # async path
+    if mode == "async":
+        asyncio.run(generate_transactions_async())  # async path
+    elif mode == "batch":
+        generate_transactions_batch()  # offline Batch API path
+    else:
+        generate_transactions()  # sync path
+    cfg = get_config()
+    cache = get_semantic_cache(cfg)
+    if cache is not None:
+        cache.report()
+    if routing.enabled(cfg):
+        routing.report("transactions")
     log.info("✅ Transactions generation complete.", tag="APP")
 
 
@@ -30,11 +30,21 @@ If you want direct access to the facade:
 """
 
 from __future__ import annotations
-from typing import Optional, Sequence, Dict, Any
-from kirkomi_utils.llm import LLMClient, estimate_prompt_cost_by_tokens
+import asyncio
+import atexit
+import hashlib
+import json
+import threading
+import time
+from typing import TYPE_CHECKING, Optional, Sequence, Dict, Any
 from kirkomi_utils.logging.logger import log
-from .config import load_config
-from .model_pricing import price_per_1k
+from .config import AppConfig, get_config
+from .model_pricing import price_per_1k, BATCH_DISCOUNT
+from .metrics import metrics, usage_tokens
+
+if TYPE_CHECKING:
+    # The provider stack is heavy to import; it is loaded on first LLM/cost use instead.
+    from kirkomi_utils.llm import LLMClient
 
 
     # price_per_1k = {
@@ -56,31 +66,171 @@ from .model_pricing import price_per_1k
 _DEFAULT_CACHE_TTL_SECONDS = 3600
 
 # Internal singleton
-__LLM_SINGLETON: Optional[LLMClient] = None
+__LLM_SINGLETON: Optional["InstrumentedLLM"] = None
+
+
+def request_key(messages, kwargs: Dict[str, Any]) -> str:
+    """Stable hash of a chat request (messages + per-call overrides), used to coalesce identical calls."""
+    body = {"messages": messages, **{k: v for k, v in kwargs.items() if k != "cache"}}
+    return hashlib.sha256(json.dumps(body, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def call_cost(res, model: Optional[str], batch: bool = False) -> float:
+    """Estimated USD cost of one response (0 for cache hits), from its usage and the pricing table."""
+    usage = getattr(res, "usage", None)
+    if not usage or getattr(res, "cached", False) or getattr(res, "from_cache", False):
+        return 0.0
+    from kirkomi_utils.llm import estimate_prompt_cost_by_tokens
+    cost = estimate_prompt_cost_by_tokens(sum(usage_tokens(usage)), model, price_per_1k)
+    return cost * BATCH_DISCOUNT if batch else cost
+
+
+class _Flight:
+    """One in-flight synchronous request that other threads can wait on."""
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+
+class InstrumentedLLM:
+    """
+    Thin proxy around LLMClient that records every chat/chat_async call into
+    scripts.metrics (latency, tokens, tokens/sec, cache hits, retries, errors, cost).
+    Any other attribute is delegated to the wrapped client unchanged.
+
+    Single-flight: concurrent `cache=True` calls with identical messages/overrides share one
+    in-flight request (the cache only helps once the first response has landed). Followers
+    get the leader's response (or exception) and are counted in llm_coalesced_total instead
+    of llm_calls_total. Pass coalesce=False for independent samples of the same prompt.
+    """
 
+    def __init__(self, client: LLMClient, default_model: Optional[str] = None) -> None:
+        self._client = client
+        self._default_model = default_model
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, _Flight] = {}
+        self._inflight_async: Dict[tuple, asyncio.Future] = {}
+
+    def __getattr__(self, name: str):
+        return getattr(self._client, name)
+
+    def _record(self, res, latency_s: float, model: Optional[str], error: bool = False) -> None:
+        model = model or getattr(res, "model", None) or self._default_model
+        usage = getattr(res, "usage", None) if res is not None else None
+        cache_hit = bool(getattr(res, "cached", False) or getattr(res, "from_cache", False))
+        retries = int(getattr(res, "retries", 0) or 0)
+        cost = call_cost(res, model)
+        metrics.record_llm_call(
+            latency_s, model, usage=usage, cache_hit=cache_hit, retries=retries, error=error, cost_usd=cost,
+        )
 
-def _build_llm_from_app_config() -> LLMClient:
+    def _coalesced(self, kwargs: Dict[str, Any]) -> None:
+        metrics.inc("llm_coalesced_total", labels={"model": kwargs.get("model") or self._default_model or "unknown"})
+
+    def _chat(self, messages, kwargs: Dict[str, Any]):
+        t0 = time.perf_counter()
+        try:
+            res = self._client.chat(messages, **kwargs)
+        except Exception:
+            self._record(None, time.perf_counter() - t0, kwargs.get("model"), error=True)
+            raise
+        self._record(res, time.perf_counter() - t0, kwargs.get("model"))
+        return res
+
+    async def _chat_async(self, messages, kwargs: Dict[str, Any]):
+        t0 = time.perf_counter()
+        try:
+            res = await self._client.chat_async(messages, **kwargs)
+        except Exception:
+            self._record(None, time.perf_counter() - t0, kwargs.get("model"), error=True)
+            raise
+        self._record(res, time.perf_counter() - t0, kwargs.get("model"))
+        return res
+
+    def chat(self, messages, coalesce: bool = True, **kwargs):
+        if not (coalesce and kwargs.get("cache")):
+            return self._chat(messages, kwargs)
+
+        key = request_key(messages, kwargs)
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+        if not leader:
+            self._coalesced(kwargs)
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = self._chat(messages, kwargs)
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.done.set()
+
+    async def chat_async(self, messages, coalesce: bool = True, **kwargs):
+        if not (coalesce and kwargs.get("cache")):
+            return await self._chat_async(messages, kwargs)
+
+        # The shared request runs as its own task so a cancelled caller cannot cancel it for the others.
+        key = (asyncio.get_running_loop(), request_key(messages, kwargs))
+        task = self._inflight_async.get(key)
+        if task is None:
+            task = self._inflight_async[key] = asyncio.ensure_future(self._chat_async(messages, kwargs))
+            task.add_done_callback(lambda _: self._inflight_async.pop(key, None))
+        else:
+            self._coalesced(kwargs)
+        return await asyncio.shield(task)
+
+
+def _build_llm_from_app_config() -> InstrumentedLLM:
     """
     Construct an LLMClient using overrides from the app's own config
     (model/temperature/max_tokens), while credentials/provider come from env/.env.
 
+    With llm_cassette_mode=record the provider client is wrapped so every response is
+    saved to llm_cassette_path; with replay no provider client is built at all and
+    responses come from the cassette (see scripts/cassette.py).
+
     Returns:
-        LLMClient: ready-to-use client with retries + optional in-memory caching.
+        InstrumentedLLM: ready-to-use client with retries + optional in-memory caching,
+        wrapped so every call is recorded in scripts.metrics.
     """
-    cfg = load_config()  # your app’s domain config (num_users, months, model, etc.)
+    cfg = get_config()  # your app’s domain config (num_users, months, model, etc.)
+    if cfg.llm_cassette_mode == "replay":
+        from .cassette import ReplayClient
+        return InstrumentedLLM(ReplayClient(cfg.llm_cassette_path, cfg.llm_cassette_speed), default_model=cfg.model)
+
+    from kirkomi_utils.llm import LLMClient
+
     overrides = {
-        "model": cfg.get("model"),
-        "temperature": cfg.get("temperature"),
-        "max_tokens": cfg.get("max_tokens"),
+        "model": cfg.model,
+        "temperature": cfg.temperature,
+        "max_tokens": cfg.max_tokens,
         # You can add "provider" here if you want to select a non-default provider from app config:
-        # "provider": cfg.get("llm_provider", "openai"),
+        # "provider": cfg.provider,
     }
     # Create facade; all provider keys (e.g., OPENAI_API_KEY) are read from env/.env.
     llm = LLMClient(cfg_overrides=overrides, log=log, cache_ttl=_DEFAULT_CACHE_TTL_SECONDS)
-    return llm
+    if cfg.llm_cassette_mode == "record":
+        from .cassette import RecordingClient
+        llm = RecordingClient(llm, cfg.llm_cassette_path)
+        atexit.register(llm.close)
+        log.info(f"Recording LLM responses to {cfg.llm_cassette_path}", tag="CASSETTE")
+    return InstrumentedLLM(llm, default_model=cfg.model)
 
 
-def get_llm(force_new: bool = False) -> LLMClient:
+def get_llm(force_new: bool = False) -> InstrumentedLLM:
     """
     Return the process-wide LLMClient singleton. Create it lazily on first use.
 
@@ -88,7 +238,7 @@ def get_llm(force_new: bool = False) -> LLMClient:
         force_new: if True, rebuild the client (e.g., after changing env/config).
 
     Returns:
-        LLMClient
+        InstrumentedLLM (LLMClient-compatible)
     """
     global __LLM_SINGLETON
     if force_new or __LLM_SINGLETON is None:
@@ -180,13 +330,14 @@ def generate_uuid(prefix: str, i: int) -> str:
     return f"{prefix}_{str(i).zfill(5)}"
 
 
-def estimate_cost_tokens(stage: str, cfg: Dict[str, Any]) -> tuple[int, float]:
+def estimate_cost_tokens(stage: str, cfg: AppConfig, mode: str = "sync") -> tuple[int, float]:
     """
     Estimate total tokens and approximate cost based on your app's configuration.
 
     Args:
         stage: one of {"personas", "transactions"}
-        cfg:   app config dict (expects: model, max_tokens, num_users, months, batch_size)
+        cfg:   AppConfig (uses: model, max_tokens, num_users, months, batch_size)
+        mode:  "sync" | "async" | "batch" (batch applies BATCH_DISCOUNT)
 
     Returns:
         (tokens: int, cost_usd: float)
@@ -195,22 +346,38 @@ def estimate_cost_tokens(stage: str, cfg: Dict[str, Any]) -> tuple[int, float]:
         - Uses scripts.model_pricing.price_per_1k if available; otherwise a small fallback table.
         - This is a *rough* estimate using your max_tokens as the per-call token size.
     """
-    model = cfg.get("model", "gpt-4")
-    max_tokens = int(cfg.get("max_tokens", 4096))
-    num_users = int(cfg["num_users"])
-    months = int(cfg["months"])
-
-    if stage == "personas":
-        calls = (num_users / float(cfg["batch_size"]))
-        tokens = int(calls * max_tokens)
+    num_users = cfg.num_users
+    months = cfg.months
+
+    if stage == "personas" and cfg.persona_source == "sampler":
+        from promptlib.personas import persona_pool_prompts
+        calls = len(persona_pool_prompts)  # upper bound: cached pools are not re-fetched
+    elif stage == "personas":
+        calls = (num_users / float(cfg.batch_size))
     elif stage == "transactions":
         calls = int(num_users) * int(months)
-        tokens = int(calls * max_tokens)
+        if cfg.persona_source == "sampler" and cfg.persona_summary_mode == "llm":
+            calls += int(num_users)  # lazy persona_summary, once per user
     else:
         raise ValueError("Invalid stage for estimation")
 
+    return estimate_cost_for_calls(calls, cfg, mode)
+
+
+def estimate_cost_for_calls(calls: float, cfg: AppConfig, mode: str = "sync") -> tuple[int, float]:
+    """
+    Rough (tokens, cost_usd) for a known number of LLM calls, using max_tokens per call.
+    Used directly by `bankgen build`, which knows exactly how many artifacts are stale.
+    """
+    model = cfg.model or "gpt-4"
+    max_tokens = cfg.max_tokens or 4096
+    tokens = int(calls * max_tokens)
+
     # Use your project’s pricing table:
+    from kirkomi_utils.llm import estimate_prompt_cost_by_tokens
     cost = estimate_prompt_cost_by_tokens(tokens, model, price_per_1k)
+    if mode == "batch":
+        cost *= BATCH_DISCOUNT
     return tokens, cost
 
 
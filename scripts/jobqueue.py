@@ -0,0 +1,259 @@
+# jobqueue.py
+"""
+Durable lease-based work queue for elastic worker pools (`bankgen queue`, `bankgen worker`).
+
+A static split of users across processes cannot rebalance when one worker is slow or dies.
+Instead, one job per stale persona batch or per stale user is seeded into a SQLite file
+(<output_dir>/queue.sqlite by default, no broker), and any number of `bankgen worker`
+processes — on one host or several sharing the filesystem — pull from it:
+
+    claim       BEGIN IMMEDIATE; take the oldest pending job, or one whose lease expired,
+                and lease it to this worker for queue_lease_s (attempts += 1)
+    heartbeat   a background thread extends the lease every queue_heartbeat_s while the
+                job runs; a worker that dies stops heartbeating and its job is reclaimed
+    complete    done — only if this worker still holds the lease
+    fail        back to pending, or failed once queue_max_attempts is reached
+
+Jobs run through the normal generation code (prompt, LLM call, parse, write, manifest
+stamp), so artifacts are identical to a `bankgen build` and a finished queue leaves
+`bankgen build --plan` reporting everything fresh.
+
+    bankgen queue seed personas        # one job per stale persona batch
+    bankgen worker &  bankgen worker & # as many as you like, anywhere the output_dir is shared
+    bankgen queue seed transactions    # assembles personas.csv, one job per stale user
+    bankgen worker --wait              # keep polling until the queue is drained
+    bankgen queue status
+
+SQLite's own locking serialises claims. Over NFS-style network filesystems the database is
+opened in rollback-journal mode (not WAL, which needs shared memory on one host); byte-range
+locking must work on that mount.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from kirkomi_utils.logging.logger import log
+from .config import AppConfig
+from .metrics import metrics
+
+JOB_KINDS = ("personas", "transactions")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id          TEXT PRIMARY KEY,
+    kind        TEXT NOT NULL,
+    payload     TEXT NOT NULL,
+    state       TEXT NOT NULL DEFAULT 'pending',   -- pending | leased | done | failed
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    worker      TEXT,
+    lease_until REAL,
+    last_error  TEXT,
+    updated_at  REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (kind, state, lease_until);
+"""
+
+
+@dataclass
+class Job:
+    id: str
+    kind: str
+    payload: Dict[str, Any]
+    attempts: int
+
+
+def default_queue_path(cfg: AppConfig) -> Path:
+    return Path(cfg.queue_path) if cfg.queue_path else Path(cfg.output_dir) / "queue.sqlite"
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class JobQueue:
+    """SQLite-backed job table. Every call opens its own short-lived connection (thread/process safe)."""
+
+    def __init__(self, path: str | Path, lease_s: float = 300.0, max_attempts: int = 3) -> None:
+        self.path = Path(path)
+        self.lease_s = lease_s
+        self.max_attempts = max_attempts
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=60)
+        try:
+            conn.execute("PRAGMA journal_mode=DELETE")
+            conn.executescript(_SCHEMA)
+        finally:
+            conn.close()
+
+    @classmethod
+    def from_config(cls, cfg: AppConfig) -> "JobQueue":
+        return cls(default_queue_path(cfg), cfg.queue_lease_s, cfg.queue_max_attempts)
+
+    @contextmanager
+    def _tx(self, immediate: bool = False) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        try:
+            conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def seed(self, kind: str, jobs: Iterable[Tuple[str, Dict[str, Any]]]) -> int:
+        """
+        Add (job_id, payload) pairs. A job id already in the queue is reset to pending with
+        the new payload unless it is currently leased. Returns the number of jobs (re)queued.
+        """
+        now = time.time()
+        rows = [(f"{kind}:{job_id}", kind, json.dumps(payload), now) for job_id, payload in jobs]
+        with self._tx(immediate=True) as conn:
+            before = conn.total_changes
+            conn.executemany(
+                """
+                INSERT INTO jobs (id, kind, payload, state, attempts, updated_at) VALUES (?, ?, ?, 'pending', 0, ?)
+                ON CONFLICT(id) DO UPDATE SET payload = excluded.payload, state = 'pending', attempts = 0,
+                    worker = NULL, lease_until = NULL, last_error = NULL, updated_at = excluded.updated_at
+                WHERE jobs.state != 'leased'
+                """,
+                rows,
+            )
+            added = conn.total_changes - before
+        metrics.inc("queue_jobs_seeded_total", added, labels={"kind": kind})
+        return added
+
+    def claim(self, worker: str, kinds: Sequence[str] = JOB_KINDS) -> Optional[Job]:
+        """Lease the oldest claimable job of `kinds` to `worker`, or return None if there is none."""
+        now = time.time()
+        marks = ",".join("?" * len(kinds))
+        with self._tx(immediate=True) as conn:
+            # Expired leases that already used their last attempt are not retried again.
+            expired = conn.execute(
+                f"""UPDATE jobs SET state = 'failed', last_error = 'lease expired', updated_at = ?
+                    WHERE kind IN ({marks}) AND state = 'leased' AND lease_until < ? AND attempts >= ?""",
+                (now, *kinds, now, self.max_attempts),
+            ).rowcount
+            row = conn.execute(
+                f"""SELECT id, kind, payload, attempts, state FROM jobs
+                    WHERE kind IN ({marks}) AND (state = 'pending' OR (state = 'leased' AND lease_until < ?))
+                    ORDER BY rowid LIMIT 1""",
+                (*kinds, now),
+            ).fetchone()
+            if row is None:
+                job = None
+            else:
+                conn.execute(
+                    "UPDATE jobs SET state = 'leased', worker = ?, lease_until = ?, attempts = attempts + 1, updated_at = ? "
+                    "WHERE id = ?",
+                    (worker, now + self.lease_s, now, row[0]),
+                )
+                job = Job(row[0], row[1], json.loads(row[2]), row[3] + 1)
+        if expired:
+            metrics.inc("queue_jobs_failed_total", expired)
+            log.warning(f"{expired} jobs failed after their last lease expired", tag="QUEUE")
+        if job and row[4] == "leased":
+            metrics.inc("queue_leases_reclaimed_total", labels={"kind": job.kind})
+            log.warning(f"Reclaimed expired lease on {job.id} (attempt {job.attempts})", tag="QUEUE")
+        return job
+
+    def heartbeat(self, job: Job, worker: str) -> bool:
+        """Extend the lease. False if this worker no longer holds it (expired and reclaimed)."""
+        now = time.time()
+        with self._tx() as conn:
+            return conn.execute(
+                "UPDATE jobs SET lease_until = ?, updated_at = ? WHERE id = ? AND worker = ? AND state = 'leased'",
+                (now + self.lease_s, now, job.id, worker),
+            ).rowcount == 1
+
+    def complete(self, job: Job, worker: str) -> bool:
+        with self._tx() as conn:
+            done = conn.execute(
+                "UPDATE jobs SET state = 'done', lease_until = NULL, updated_at = ? "
+                "WHERE id = ? AND worker = ? AND state = 'leased'",
+                (time.time(), job.id, worker),
+            ).rowcount == 1
+        if done:
+            metrics.inc("queue_jobs_completed_total", labels={"kind": job.kind})
+        return done
+
+    def fail(self, job: Job, worker: str, error: str) -> str:
+        """Record a failed attempt; the job goes back to pending until queue_max_attempts. Returns the new state."""
+        state = "failed" if job.attempts >= self.max_attempts else "pending"
+        with self._tx() as conn:
+            conn.execute(
+                "UPDATE jobs SET state = ?, lease_until = NULL, last_error = ?, updated_at = ? "
+                "WHERE id = ? AND worker = ? AND state = 'leased'",
+                (state, error[:2000], time.time(), job.id, worker),
+            )
+        metrics.inc("queue_jobs_failed_total" if state == "failed" else "queue_jobs_retried_total", labels={"kind": job.kind})
+        return state
+
+    def requeue_failed(self, kinds: Sequence[str] = JOB_KINDS) -> int:
+        marks = ",".join("?" * len(kinds))
+        with self._tx(immediate=True) as conn:
+            return conn.execute(
+                f"UPDATE jobs SET state = 'pending', attempts = 0, worker = NULL, updated_at = ? "
+                f"WHERE kind IN ({marks}) AND state = 'failed'",
+                (time.time(), *kinds),
+            ).rowcount
+
+    def counts(self) -> Dict[str, Dict[str, int]]:
+        """kind -> state -> jobs."""
+        out: Dict[str, Dict[str, int]] = {}
+        with self._tx() as conn:
+            for kind, state, n in conn.execute("SELECT kind, state, COUNT(*) FROM jobs GROUP BY kind, state"):
+                out.setdefault(kind, {})[state] = n
+        return out
+
+    def outstanding(self, kinds: Sequence[str] = JOB_KINDS) -> int:
+        """Jobs of `kinds` not yet done or failed (pending or leased)."""
+        return sum(n for kind, states in self.counts().items() if kind in kinds
+                   for state, n in states.items() if state in {"pending", "leased"})
+
+    def failures(self, limit: int = 20) -> List[Tuple[str, int, str]]:
+        with self._tx() as conn:
+            return conn.execute(
+                "SELECT id, attempts, last_error FROM jobs WHERE state = 'failed' ORDER BY updated_at DESC LIMIT ?",
+                (limit,),
+            ).fetchall()
+
+
+class Heartbeat:
+    """Background thread extending a job's lease while it runs; `lost` is set if the lease was taken away."""
+
+    def __init__(self, queue: JobQueue, job: Job, worker: str, interval_s: float) -> None:
+        self.queue, self.job, self.worker, self.interval_s = queue, job, worker, interval_s
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"heartbeat-{job.id}", daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval_s):
+            try:
+                if not self.queue.heartbeat(self.job, self.worker):
+                    self.lost = True
+                    log.warning(f"Lost the lease on {self.job.id}; another worker may redo it", tag="QUEUE")
+                    return
+            except sqlite3.Error as e:
+                log.warning(f"Heartbeat for {self.job.id} failed: {e}", tag="QUEUE")
+
+    def __enter__(self) -> "Heartbeat":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
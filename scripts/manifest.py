@@ -0,0 +1,116 @@
+# manifest.py
+"""
+Content-addressed run manifest.
+
+Every generated artifact (persona batch file, per-user transaction CSV) is stamped with a
+hash of everything that determines its content: the fully rendered prompt (template +
+persona + months + n), model and temperature. `bankgen build` compares those hashes with
+what the current code/config would render and regenerates only the artifacts that differ.
+
+The manifest lives at <output_dir>/manifest.jsonl as an append-only log — one JSON line
+per stamp, last line per artifact wins — so stamping 50k users is O(n) and concurrent
+writers never rewrite each other's entries. `compact()` rewrites it to one line per artifact.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional, Sequence
+
+from .config import AppConfig
+
+MANIFEST_NAME = "manifest.jsonl"
+
+# Bump to invalidate every artifact when the hashing scheme itself changes.
+HASH_VERSION = 1
+
+
+def artifact_hash(messages: Sequence[Dict[str, str]], cfg: AppConfig, **extra: Any) -> str:
+    """
+    Hash the rendered prompt + generation parameters that determine an artifact's content.
+    `extra` carries anything else that changes the output (e.g. the persona batch start index).
+    """
+    payload = {
+        "v": HASH_VERSION,
+        "messages": list(messages),
+        "model": cfg.model,
+        "temperature": cfg.temperature,
+        **extra,
+    }
+    blob = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class Manifest:
+    """artifact path (relative to output_dir) -> {"hash", "rows", "built_at"}."""
+
+    def __init__(self, output_dir: str | Path) -> None:
+        self.output_dir = Path(output_dir)
+        self.path = self.output_dir / MANIFEST_NAME
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.reload()
+
+    def reload(self) -> None:
+        self.entries = {}
+        if not self.path.exists():
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for raw in f:
+                raw = raw.strip()
+                if not raw:
+                    continue
+                try:
+                    entry = json.loads(raw)
+                except json.JSONDecodeError:
+                    continue  # torn final line from an interrupted writer
+                self.entries[entry["artifact"]] = entry
+
+    def stamp(self, artifact: str, input_hash: str, rows: int, location: Optional[str] = None,
+              size: Optional[int] = None) -> None:
+        """
+        `location`: file (relative to output_dir) holding the artifact when it is not at its own path, e.g. a shard.
+        `size`: how many rows were requested, when that is not fixed by the artifact name (persona batches).
+        """
+        entry = {"artifact": artifact, "hash": input_hash, "rows": rows, "built_at": time.time()}
+        if location:
+            entry["location"] = location
+        if size is not None:
+            entry["size"] = size
+        self.entries[artifact] = entry
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Single small O_APPEND write per line: safe with concurrent writers on a local FS.
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+
+    def is_fresh(self, artifact: str, input_hash: str) -> bool:
+        """True if the artifact (or the shard holding it) exists on disk and was built from exactly this input."""
+        entry = self.entries.get(artifact)
+        if not (entry and entry["hash"] == input_hash):
+            return False
+        location = entry.get("location")
+        return (self.output_dir / artifact).exists() or bool(location and (self.output_dir / location).exists())
+
+    def get(self, artifact: str) -> Optional[Dict[str, Any]]:
+        return self.entries.get(artifact)
+
+    def compact(self) -> None:
+        tmp = self.path.with_suffix(".jsonl.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            for entry in self.entries.values():
+                f.write(json.dumps(entry) + "\n")
+        os.replace(tmp, self.path)
+
+
+_MANIFESTS: Dict[Path, Manifest] = {}
+
+
+def get_manifest(cfg: AppConfig) -> Manifest:
+    """Process-wide Manifest for cfg.output_dir (loaded once)."""
+    key = Path(cfg.output_dir).resolve()
+    if key not in _MANIFESTS:
+        _MANIFESTS[key] = Manifest(cfg.output_dir)
+    return _MANIFESTS[key]
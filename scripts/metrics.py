@@ -0,0 +1,325 @@
+# metrics.py
+"""
+Structured run metrics.
+
+A small in-process registry (counters + histograms, labelled) that every stage and
+LLM call reports into. At the end of a `bankgen` run the registry is exported as:
+
+    logs/metrics/bankgen.prom              Prometheus textfile (node_exporter textfile collector)
+    logs/metrics/run-<YYYYmmdd-HHMMSS>.json  JSON run report (per-stage summary + raw series)
+
+Usage:
+    from scripts.metrics import metrics
+
+    with metrics.stage("personas"):          # times the stage, labels everything inside it
+        ...
+        metrics.inc("parse_failures_total")
+        metrics.observe("writer_seconds", 0.02)
+
+LLM calls are recorded automatically by the client returned from helpers.get_llm()
+(requests coalesced onto an identical in-flight call count in llm_coalesced_total).
+"""
+
+from __future__ import annotations
+
+import json
+import math
+import threading
+import time
+import contextvars
+from bisect import bisect_left
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from .config import LOG_DIR
+
+
+# Latency-style buckets (seconds); wide enough for multi-minute LLM calls.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600)
+# Throughput buckets (tokens/sec, rows/sec).
+RATE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 50000, 100000)
+
+# Output-token buckets (tokens per generated user).
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000)
+
+# Batch-size buckets (personas per request).
+BATCH_SIZE_BUCKETS = (1, 2, 5, 10, 15, 20, 30, 50, 75, 100, 200)
+
+# Queue-depth buckets (items waiting, e.g. users queued for the background writer).
+QUEUE_DEPTH_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+# Similarity-score buckets (semantic cache hits, 0..1).
+SIMILARITY_BUCKETS = (0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.925, 0.95, 0.975, 0.99, 1.0)
+
+# Memory buckets (MiB).
+MEMORY_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+_HISTOGRAM_BUCKETS = {
+    "llm_tokens_per_second": RATE_BUCKETS,
+    "writer_rows_per_second": RATE_BUCKETS,
+    "render_worker_peak_rss_mib": MEMORY_BUCKETS,
+    "llm_output_tokens_per_user": TOKEN_BUCKETS,
+    "persona_batch_size": BATCH_SIZE_BUCKETS,
+    "writer_queue_depth": QUEUE_DEPTH_BUCKETS,
+    "semantic_cache_similarity": SIMILARITY_BUCKETS,
+}
+
+_current_stage: contextvars.ContextVar[str] = contextvars.ContextVar("bankgen_stage", default="none")
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Optional[Dict[str, Any]]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in (labels or {}).items()))
+
+
+class _Histogram:
+    __slots__ = ("buckets", "counts", "count", "sum", "min", "max")
+
+    def __init__(self, buckets) -> None:
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last slot = +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Bucket-interpolated quantile estimate (same approach as PromQL histogram_quantile)."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        lower = 0.0
+        for upper, n in zip(self.buckets + (self.max,), self.counts):
+            if cumulative + n >= rank and n:
+                frac = (rank - cumulative) / n
+                return min(self.max, max(self.min, lower + (upper - lower) * frac))
+            cumulative += n
+            lower = upper
+        return self.max
+
+    def summary(self) -> Dict[str, Any]:
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "mean": round(self.sum / self.count, 6),
+            "min": round(self.min, 6),
+            "max": round(self.max, 6),
+            "p50": round(self.quantile(0.50), 6),
+            "p95": round(self.quantile(0.95), 6),
+            "p99": round(self.quantile(0.99), 6),
+        }
+
+
+class MetricsRegistry:
+    """
+    Thread-safe registry of labelled counters and histograms.
+    Every series implicitly carries a `stage` label taken from the active `stage()` block.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._histograms: Dict[str, Dict[LabelKey, _Histogram]] = {}
+        self.started_at = time.time()
+
+    # -- recording -----------------------------------------------------------
+
+    def _labels(self, labels: Optional[Dict[str, Any]]) -> LabelKey:
+        merged = {"stage": _current_stage.get()}
+        merged.update(labels or {})
+        return _label_key(merged)
+
+    def inc(self, name: str, value: float = 1, labels: Optional[Dict[str, Any]] = None) -> None:
+        key = self._labels(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, labels: Optional[Dict[str, Any]] = None) -> None:
+        key = self._labels(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            hist = series.get(key)
+            if hist is None:
+                hist = series[key] = _Histogram(_HISTOGRAM_BUCKETS.get(name, DEFAULT_BUCKETS))
+            hist.observe(value)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Time a pipeline stage and label all metrics recorded inside it with stage=name."""
+        token = _current_stage.set(name)
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe("stage_seconds", time.perf_counter() - t0)
+            _current_stage.reset(token)
+
+    def record_llm_call(
+        self,
+        latency_s: float,
+        model: Optional[str],
+        usage: Optional[Dict[str, Any]] = None,
+        cache_hit: bool = False,
+        retries: int = 0,
+        error: bool = False,
+        cost_usd: float = 0.0,
+    ) -> None:
+        """Record one LLM request (successful or not)."""
+        labels = {"model": model or "unknown"}
+        self.inc("llm_calls_total", labels=labels)
+        self.observe("llm_latency_seconds", latency_s, labels=labels)
+        if retries:
+            self.inc("llm_retries_total", retries, labels=labels)
+        if error:
+            self.inc("llm_errors_total", labels=labels)
+            return
+        if cache_hit:
+            self.inc("llm_cache_hits_total", labels=labels)
+
+        input_tokens, output_tokens = usage_tokens(usage)
+        self.inc("llm_input_tokens_total", input_tokens, labels=labels)
+        self.inc("llm_output_tokens_total", output_tokens, labels=labels)
+        if cost_usd:
+            self.inc("llm_cost_usd_total", cost_usd, labels=labels)
+        if output_tokens and latency_s > 0 and not cache_hit:
+            self.observe("llm_tokens_per_second", output_tokens / latency_s, labels=labels)
+
+    def record_user_output(self, output_format: str, usage: Optional[Dict[str, Any]], latency_s: float = 0.0,
+                           users: int = 1) -> None:
+        """
+        Record output tokens and LLM latency per generated user, labelled by output contract
+        (llm_output_format), so json and tabular runs can be compared. A persona batch
+        response is spread over the `users` it produced; pass latency_s=0 when it is unknown.
+        """
+        if users <= 0:
+            return
+        labels = {"format": output_format}
+        _, output_tokens = usage_tokens(usage)
+        self.observe("llm_output_tokens_per_user", output_tokens / users, labels=labels)
+        if latency_s > 0:
+            self.observe("llm_seconds_per_user", latency_s / users, labels=labels)
+
+    def record_write(self, rows: int, seconds: float, nbytes: int = 0) -> None:
+        """Record one output write (rows, wall time, bytes on disk)."""
+        self.inc("writer_rows_total", rows)
+        self.inc("writer_bytes_total", nbytes)
+        self.observe("writer_seconds", seconds)
+        if seconds > 0 and rows:
+            self.observe("writer_rows_per_second", rows / seconds)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self.started_at = time.time()
+
+    # -- export --------------------------------------------------------------
+
+    def to_prometheus(self, prefix: str = "bankgen_") -> str:
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                lines.append(f"# TYPE {prefix}{name} counter")
+                for key, value in sorted(series.items()):
+                    lines.append(f"{prefix}{name}{_fmt_labels(key)} {value:g}")
+            for name, series in sorted(self._histograms.items()):
+                lines.append(f"# TYPE {prefix}{name} histogram")
+                for key, hist in sorted(series.items()):
+                    cumulative = 0
+                    for upper, n in zip(hist.buckets, hist.counts):
+                        cumulative += n
+                        lines.append(f"{prefix}{name}_bucket{_fmt_labels(key + (('le', f'{upper:g}'),))} {cumulative}")
+                    lines.append(f"{prefix}{name}_bucket{_fmt_labels(key + (('le', '+Inf'),))} {hist.count}")
+                    lines.append(f"{prefix}{name}_sum{_fmt_labels(key)} {hist.sum:g}")
+                    lines.append(f"{prefix}{name}_count{_fmt_labels(key)} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+    def report(self) -> Dict[str, Any]:
+        """JSON-serialisable run report: raw series plus a per-stage rollup."""
+        with self._lock:
+            counters = {
+                name: [{"labels": dict(k), "value": v} for k, v in sorted(series.items())]
+                for name, series in sorted(self._counters.items())
+            }
+            histograms = {
+                name: [{"labels": dict(k), **h.summary()} for k, h in sorted(series.items())]
+                for name, series in sorted(self._histograms.items())
+            }
+            stages: Dict[str, Dict[str, Any]] = {}
+            for name, series in self._counters.items():
+                for key, value in series.items():
+                    stage = dict(key).get("stage", "none")
+                    stages.setdefault(stage, {})[name] = stages.get(stage, {}).get(name, 0) + value
+
+        for stage, totals in stages.items():
+            calls = totals.get("llm_calls_total", 0)
+            if calls:
+                totals["cache_hit_rate"] = round(totals.get("llm_cache_hits_total", 0) / calls, 4)
+                totals["failure_rate"] = round(totals.get("llm_errors_total", 0) / calls, 4)
+            jobs = totals.get("routing_jobs_total", 0)
+            if jobs:
+                totals["escalation_rate"] = round(totals.get("routing_escalations_total", 0) / jobs, 4)
+            coalesced = totals.get("llm_coalesced_total", 0)
+            if coalesced:
+                totals["coalesce_rate"] = round(coalesced / (calls + coalesced), 4)
+
+        return {
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started_at)),
+            "wall_seconds": round(time.time() - self.started_at, 3),
+            "stages": stages,
+            "counters": counters,
+            "histograms": histograms,
+        }
+
+    def write_reports(self, log_dir: str = LOG_DIR) -> Tuple[Path, Path]:
+        """Write the Prometheus textfile and JSON run report; returns both paths."""
+        out_dir = Path(log_dir) / "metrics"
+        out_dir.mkdir(parents=True, exist_ok=True)
+
+        prom_path = out_dir / "bankgen.prom"
+        tmp = prom_path.with_suffix(".prom.tmp")
+        tmp.write_text(self.to_prometheus(), encoding="utf-8")
+        tmp.replace(prom_path)  # atomic swap so the textfile collector never reads a partial file
+
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(self.started_at))
+        json_path = out_dir / f"run-{stamp}.json"
+        json_path.write_text(json.dumps(self.report(), indent=2), encoding="utf-8")
+        return prom_path, json_path
+
+
+def _fmt_labels(key: LabelKey) -> str:
+    if not key:
+        return ""
+    body = ",".join(f'{k}="{v.replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for k, v in key)
+    return "{" + body + "}"
+
+
+def usage_tokens(usage: Any) -> Tuple[int, int]:
+    """
+    Normalise provider usage into (input_tokens, output_tokens).
+    Accepts OpenAI-style (prompt/completion) and Anthropic-style (input/output) keys,
+    as a dict or an object with attributes.
+    """
+    if not usage:
+        return 0, 0
+    get = usage.get if isinstance(usage, dict) else (lambda k, d=None: getattr(usage, k, d))
+    input_tokens = get("prompt_tokens") or get("input_tokens") or 0
+    output_tokens = get("completion_tokens") or get("output_tokens") or 0
+    return int(input_tokens), int(output_tokens)
+
+
+# Process-wide registry
+metrics = MetricsRegistry()
@@ -4,5 +4,10 @@ price_per_1k = {
     "gpt-4": 0.03,             # $0.03 per 1K output tokens
     "gpt-4o": 0.01,            # $0.01 per 1K output tokens
     "gpt-3.5-turbo": 0.0015,    # $0.0015 per 1K output tokens
-    "gpt-5": 0.01             # $0.01 per 1K output tokens
+    "gpt-5": 0.01,            # $0.01 per 1K output tokens
+    "gpt-5-mini": 0.002,      # $0.002 per 1K output tokens
+    "gpt-5-nano": 0.0004      # $0.0004 per 1K output tokens
 }
+
+# Batch API requests are billed at a discount relative to live calls.
+BATCH_DISCOUNT = 0.5                # 50% of the live price
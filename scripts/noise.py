@@ -0,0 +1,373 @@
+# noise.py
+"""
+Seeded, vectorised description_raw noise engine (`bankgen noise`).
+
+Applies the mangling that rules_old section 6 in promptlib/transactions.py asks the model
+for — UPPERCASE, payer aliases and partial names, truncation, missing spaces, reordered
+parts, REF codes in varying places — to description_cleaned / merchant_name locally, so
+description_raw variants can be regenerated or multiplied without new LLM calls:
+
+    POS spend at Greggs    ->  POS GREGGS 1023LDN | POSGREGGS1023LDN | GREGGS POS REF:8K2Q
+    Payment from NHS Lee   ->  BACS NHS-LEE WK11 REF:TSH32 | REF/7731 BGC NHS L
+    Transfer from Sarah M  ->  FPS CR SARAH M | TFR FROM S M REF9918
+
+How it stays fast: payer text repeats heavily, so it is factorised first and the
+(Python) cleaning and alias forms are computed once per distinct value. Everything
+per-row — choosing prefix/alias/tag/REF, reordering, stripping spaces, truncating — is
+numpy over fixed-width uint8 matrices, one array operation per step for the whole column.
+
+Output is a function of (rows, seed, variant): the same inputs always give the same
+strings, and each variant number gives an independent rendering.
+"""
+
+from __future__ import annotations
+
+import re
+import shutil
+import time
+import unicodedata
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from kirkomi_utils.logging.logger import log
+from .config import AppConfig, get_config
+from .dataset import transaction_files
+from .metrics import metrics
+
+FILES_PER_CHUNK = 2_000
+ASSEMBLE_ROWS = 1 << 15
+
+# UK Faster Payments / BACS references are cut at 18 characters.
+TRUNCATE_AT = 18
+
+# Transaction-type prefixes per source_type: (credit variants, debit variants).
+PREFIXES: Dict[str, Tuple[Tuple[str, ...], Tuple[str, ...]]] = {
+    "platform": (("FPS CREDIT", "FPS", "BACS", "FP CR"), ("FPS", "DEB")),
+    "agency": (("BACS", "BACS CREDIT", "BGC", "FPS"), ("FPS", "DEB")),
+    "tuition": (("FPS", "FPS CR", "BACS FROM", "TFR"), ("FPS", "TFR")),
+    "govt": (("BACS", "BGC", "BACS CREDIT", "FPS"), ("DD", "DDR")),
+    "refund": (("REFUND", "RFND", "POS REFUND", "CR"), ("DEB",)),
+    "dd": (("DD RTN", "DD REFUND"), ("DD", "DDR", "DIRECT DEBIT", "D/D")),
+    "pos": (("POS REFUND", "CR"), ("POS", "CARD PAYMENT", "VIS", "CONTACTLESS", "DEB")),
+    "atm": (("ATM DEP",), ("ATM", "CASH WDL", "LNK", "CASH")),
+    "cash_deposit": (("CASH DEP", "CSH DEP", "CASH IN", "CDM"), ("CASH",)),
+    "cheque": (("CHQ DEP", "CHQ", "CHEQUE DEP", "CHQ IN"), ("CHQ",)),
+    "p2p": (("FPS", "FPS CR", "FPS FROM", "TFR FROM"), ("FPS", "FPS DR", "FPS TO", "TFR TO")),
+    "fraud_like": (("FPS", "FPS CREDIT", "TFR", "BACS"), ("FPS", "TFR", "ATM")),
+}
+DEFAULT_PREFIXES = (("FPS", "BACS", "TFR"), ("FPS", "DEB", "TFR"))
+
+# Probability of an embedded REF code, per source_type.
+REF_RATE = {
+    "dd": 0.8, "govt": 0.7, "agency": 0.6, "platform": 0.5, "p2p": 0.5, "refund": 0.5,
+    "fraud_like": 0.5, "tuition": 0.4, "cheque": 0.3, "cash_deposit": 0.3, "atm": 0.2, "pos": 0.1,
+}
+DEFAULT_REF_RATE = 0.4
+REF_FORMATS = ("REF:", "REF/", "REF ", "REF", "")
+
+# Pay-week tags on payroll-like credits ("WK11"), store/terminal tags on card spends ("1023LDN").
+WEEK_TAG_SOURCES = {"platform": 0.5, "agency": 0.5}
+STORE_TAG_SOURCES = {"pos": 0.6, "atm": 0.5}
+TOWN_CODES = ("LDN", "MCR", "BHM", "LDS", "GLA", "BRS", "LPL", "NCL", "SHF", "NTT", "CDF", "EDI", "LEI", "NHM")
+
+# Payer alias forms (see _aliases) and how often each is used.
+ALIAS_WEIGHTS = (0.35, 0.20, 0.10, 0.10, 0.10, 0.05, 0.10)
+
+# Segment orders over (prefix, payer, tag, REF label, REF code): "FPS CREDIT NHS LEE WK11 REF:TSH32",
+# "NHS LEE FPS CREDIT WK11 REF:TSH32", "REF:TSH32 FPS CREDIT NHS LEE WK11", ...
+ORDERS = np.array([(0, 1, 2, 3, 4), (1, 0, 2, 3, 4), (3, 4, 0, 1, 2), (0, 3, 4, 1, 2), (0, 1, 3, 4, 2)])
+ORDER_WEIGHTS = (0.55, 0.10, 0.10, 0.10, 0.15)
+
+NO_SPACE_RATE = 0.12   # "POSGREGGS1023LDN", "DDVODAFONEREF9918"
+HYPHEN_RATE = 0.05     # "UBER-BACS-UK"
+TRUNCATE_RATE = 0.10
+
+# Leading phrases description_cleaned uses that are not part of the payer's name.
+_LEAD = re.compile(
+    r"^(?:(?:payment|transfer|refund|credit|deposit|withdrawal|spend|purchase|direct debit|dd|pos spend|"
+    r"pos purchase|card payment|salary|wages|cash deposit|cheque deposit|atm withdrawal)(?:\s+|$)"
+    r"(?:from|to|at|by|for)?\s*)+",
+    re.IGNORECASE,
+)
+_NON_NAME = re.compile(r"[^A-Z0-9&\- ]+")
+_SPACES = re.compile(r"\s+")
+
+# 64 symbols (letters without I/O, digits weighted x4) so a random byte & 63 picks one.
+_REF_ALPHABET = np.frombuffer(b"ABCDEFGHJKLMNPQRSTUVWXYZ0123456789012345678901234567890123456789", dtype=np.uint8)
+_SPACE, _HYPHEN = ord(" "), ord("-")
+
+Segment = Tuple[np.ndarray, np.ndarray]  # (n, width) uint8 bytes, zero-padded; (n,) lengths
+
+
+# -- fixed-width byte matrices ------------------------------------------------
+
+def _table(strings: Sequence[str]) -> Segment:
+    """Byte matrix + lengths for a small table of ASCII strings."""
+    raw = np.array([s.encode("ascii", "ignore") for s in strings] or [b""], dtype=bytes)
+    width = max(1, raw.dtype.itemsize)
+    mat = np.frombuffer(raw.astype(f"S{width}").tobytes(), dtype=np.uint8).reshape(len(raw), width)
+    return mat, (mat != 0).sum(axis=1)
+
+
+def _take(table: Segment, idx: np.ndarray) -> Segment:
+    return table[0][idx], table[1][idx]
+
+
+def _compact(mat: np.ndarray, keep: np.ndarray) -> Segment:
+    """Left-align the kept bytes of every row (one boolean gather + one flat scatter)."""
+    n, width = mat.shape
+    lengths = keep.sum(axis=1)
+    values = mat[keep]
+    dest = np.arange(len(values)) + np.repeat(np.arange(n) * width - (np.cumsum(lengths) - lengths), lengths)
+    out = np.zeros_like(mat)
+    out.ravel()[dest] = values
+    return out, lengths
+
+
+def _assemble(segments: List[Segment], spaced: Sequence[bool], orders: np.ndarray, pick: np.ndarray,
+              no_space: np.ndarray, truncate: np.ndarray, hyphen: np.ndarray) -> Segment:
+    """
+    Join zero-padded segments in a per-row order (orders[pick]); a space follows every
+    non-empty segment flagged in `spaced`. Spaces are then dropped on no_space rows,
+    truncate rows are cut at TRUNCATE_AT and remaining spaces become '-' on hyphen rows —
+    all in a single compaction of the (n, total width) byte matrix.
+    """
+    n = len(pick)
+    blocks = []
+    for (mat, lengths), sep in zip(segments, spaced):
+        if sep:
+            mat = np.hstack([mat, np.where(lengths > 0, _SPACE, 0).astype(np.uint8)[:, None]])
+        blocks.append(mat)
+    wide = np.empty((n, sum(b.shape[1] for b in blocks)), dtype=np.uint8)
+    for p, order in enumerate(orders):
+        rows = np.flatnonzero(pick == p)
+        col = 0
+        for j in order:
+            width = blocks[j].shape[1]
+            wide[rows, col:col + width] = blocks[j][rows]
+            col += width
+
+    keep = wide != 0
+    keep[no_space] &= wide[no_space] != _SPACE
+    keep[truncate] &= np.cumsum(keep[truncate], axis=1) <= TRUNCATE_AT
+    out, lengths = _compact(wide, keep)
+
+    rows = np.arange(n)
+    trailing = (lengths > 0) & (out[rows, np.maximum(lengths - 1, 0)] == _SPACE)
+    lengths = lengths - trailing
+    out[rows[trailing], lengths[trailing]] = 0
+    hyphenated = out[hyphen]
+    hyphenated[hyphenated == _SPACE] = _HYPHEN
+    out[hyphen] = hyphenated
+    return out[:, :max(1, int(lengths.max(initial=0)))], lengths
+
+
+def _to_str(seg: Segment) -> np.ndarray:
+    """uint8 matrix -> numpy unicode array (trailing NULs are dropped by the dtype)."""
+    mat = np.ascontiguousarray(seg[0], dtype=np.uint32)
+    return mat.view(f"<U{mat.shape[1]}").ravel()
+
+
+# -- payer text -----------------------------------------------------------------
+
+def payer_name(text: str) -> str:
+    """'POS spend at Café Nero Ltd.' -> 'Café Nero Ltd.' (casing and punctuation kept)."""
+    return _LEAD.sub("", text.strip()).strip()
+
+
+def clean_payer(text: str) -> str:
+    """'POS spend at Café Nero Ltd.' -> 'CAFE NERO LTD'."""
+    text = unicodedata.normalize("NFKD", payer_name(text)).encode("ascii", "ignore").decode()
+    return _SPACES.sub(" ", _NON_NAME.sub(" ", text.upper())).strip()
+
+
+def _aliases(name: str) -> List[str]:
+    """The ALIAS_WEIGHTS forms of one payer: full, first word, hyphenated, no spaces,
+    first word + initials ('JOHN M'), initial + last word ('M STOKES'), truncated."""
+    words = name.split()
+    if not words:
+        return [""] * len(ALIAS_WEIGHTS)
+    return [
+        name,
+        words[0],
+        "-".join(words),
+        "".join(words),
+        " ".join([words[0], *(w[0] for w in words[1:])]),
+        " ".join([*(w[0] for w in words[:-1]), words[-1]]),
+        name[:10].rstrip(),
+    ]
+
+
+def _factorize(frame: pd.DataFrame, name: str) -> Tuple[np.ndarray, List[str]]:
+    """
+    (codes, distinct values) for one column; missing values and a missing column map
+    to a trailing "" entry, so every code indexes the returned list.
+    """
+    if name not in frame:
+        return np.zeros(len(frame), dtype=np.int64), [""]
+    codes, uniques = pd.factorize(frame[name], sort=False)
+    values = [str(v) for v in uniques] + [""]
+    return np.where(codes < 0, len(values) - 1, codes), values
+
+
+def _payers(frame: pd.DataFrame) -> Tuple[np.ndarray, Segment]:
+    """Per-row payer code (merchant_name, else description_cleaned) + the alias byte table
+    (len(ALIAS_WEIGHTS) rows per distinct payer)."""
+    m_codes, merchants = _factorize(frame, "merchant_name")
+    c_codes, cleaned = _factorize(frame, "description_cleaned")
+    has_merchant = np.array([bool(m.strip()) for m in merchants])
+    codes = np.where(has_merchant[m_codes], m_codes, len(merchants) + c_codes)
+    aliases = [a for value in merchants + cleaned for a in _aliases(clean_payer(value))]
+    return codes, _table(aliases)
+
+
+def is_credit(frame: pd.DataFrame) -> np.ndarray:
+    """transaction_type == CREDIT; rows without a type fall back to the amount's sign."""
+    codes, types = _factorize(frame, "transaction_type")
+    types = [t.strip().upper() for t in types]
+    credit = np.array([t == "CREDIT" for t in types])[codes]
+    untyped = np.array([not t for t in types])[codes]
+    if untyped.any() and "amount" in frame:
+        amount = pd.to_numeric(frame["amount"][untyped], errors="coerce").fillna(0).to_numpy()
+        credit[untyped] = amount > 0
+    return credit
+
+
+# -- engine -----------------------------------------------------------------------
+
+def noisy_descriptions(frame: pd.DataFrame, seed: int = 0, variant: int = 0) -> np.ndarray:
+    """
+    description_raw for every row of a transactions frame (needs source_type,
+    description_cleaned / merchant_name, and transaction_type or amount).
+    """
+    n = len(frame)
+    if n == 0:
+        return np.array([], dtype=str)
+    rng = np.random.default_rng([seed, variant])
+
+    # Per-source lookup tables, indexed by the frame's own source_type codes.
+    src, src_names = _factorize(frame, "source_type")
+    src_names = [s.strip().lower() for s in src_names]
+    credit = is_credit(frame)
+
+    prefix_strings: List[str] = []
+    prefix_start = np.zeros((len(src_names), 2), dtype=np.int64)
+    prefix_count = np.zeros((len(src_names), 2), dtype=np.int64)
+    for s, name in enumerate(src_names):
+        for side, variants in enumerate(PREFIXES.get(name, DEFAULT_PREFIXES)[::-1]):  # side 1 = credit
+            prefix_start[s, side], prefix_count[s, side] = len(prefix_strings), len(variants)
+            prefix_strings.extend(variants)
+    ref_rate = np.array([REF_RATE.get(s, DEFAULT_REF_RATE) for s in src_names])
+    week_rate = np.array([WEEK_TAG_SOURCES.get(s, 0.0) for s in src_names])
+    store_rate = np.array([STORE_TAG_SOURCES.get(s, 0.0) for s in src_names])
+    side = credit.astype(np.int64)
+
+    # All random draws up front, whole-column.
+    u = rng.random((n, 13), dtype=np.float32)
+    alias_pick = np.searchsorted(np.cumsum(ALIAS_WEIGHTS)[:-1], u[:, 8], side="right")
+    order_pick = np.searchsorted(np.cumsum(ORDER_WEIGHTS)[:-1], u[:, 9], side="right")
+    ref_len = 4 + (u[:, 10] * 4).astype(np.int64)
+    week = 1 + (u[:, 11] * 52).astype(np.int64)
+    store = (u[:, 12] * 10_000).astype(np.int64)
+    ref_chars = _REF_ALPHABET[np.frombuffer(rng.bytes(n * 7), dtype=np.uint8).reshape(n, 7) & 63]
+
+    # Segment 0: transaction-type prefix.
+    prefix_idx = prefix_start[src, side] + (u[:, 0] * prefix_count[src, side]).astype(np.int64)
+    prefix = _take(_table(prefix_strings), prefix_idx)
+
+    # Segment 1: payer alias.
+    payer_codes, alias_table = _payers(frame)
+    payer = _take(alias_table, payer_codes * len(ALIAS_WEIGHTS) + alias_pick)
+
+    # Segment 2: WKnn on payroll-like credits, nnnnTWN on card spends.
+    use_week = credit & (u[:, 2] < week_rate[src])
+    use_store = ~credit & (u[:, 2] < store_rate[src])
+    two_digit = week >= 10
+    tens, ones = (week // 10 + ord("0")).astype(np.uint8), (week % 10 + ord("0")).astype(np.uint8)
+    zeros = np.zeros(n, dtype=np.uint8)
+    week_tag = np.stack([np.full(n, ord("W"), dtype=np.uint8), np.full(n, ord("K"), dtype=np.uint8),
+                         np.where(two_digit, tens, ones), np.where(two_digit, ones, zeros), zeros, zeros, zeros], axis=1)
+    store_tag = np.hstack([
+        (np.stack([store // 1000, store // 100 % 10, store // 10 % 10, store % 10], axis=1) + ord("0")).astype(np.uint8),
+        _table(TOWN_CODES)[0][(u[:, 1] * len(TOWN_CODES)).astype(np.int64)],
+    ])
+    tag = np.where(use_week[:, None], week_tag, np.where(use_store[:, None], store_tag, 0)).astype(np.uint8)
+    tag_len = np.select([use_week, use_store], [3 + two_digit, 7], 0)
+
+    # Segments 3 + 4: REF label in one of several house styles, glued to the code.
+    has_ref = u[:, 4] < ref_rate[src]
+    label_idx = np.where(has_ref, (u[:, 3] * len(REF_FORMATS)).astype(np.int64), len(REF_FORMATS))
+    label = _take(_table(REF_FORMATS + ("",)), label_idx)
+    code_len = np.where(has_ref, ref_len, 0)
+    code = np.where(np.arange(ref_chars.shape[1]) < code_len[:, None], ref_chars, 0).astype(np.uint8)
+
+    segments = [prefix, payer, (tag, tag_len), label, (code, code_len)]
+    no_space, truncate, hyphen = u[:, 6] < NO_SPACE_RATE, u[:, 7] < TRUNCATE_RATE, u[:, 5] < HYPHEN_RATE
+    # Assemble in cache-sized row blocks: the byte matrices of a whole column would not fit.
+    parts = []
+    for r0 in range(0, n, ASSEMBLE_ROWS):
+        rows = slice(r0, r0 + ASSEMBLE_ROWS)
+        parts.append(_to_str(_assemble(
+            [(mat[rows], lengths[rows]) for mat, lengths in segments],
+            spaced=(True, True, True, False, True),
+            orders=ORDERS, pick=order_pick[rows],
+            no_space=no_space[rows], truncate=truncate[rows], hyphen=hyphen[rows],
+        )))
+    return np.concatenate(parts)
+
+
+# -- dataset rewrite -----------------------------------------------------------------
+
+def _read(path: Path) -> pd.DataFrame:
+    return pd.read_csv(path, dtype=str, keep_default_na=False)
+
+
+@log.log_timed("NOISE")
+def renoise_dataset(out_dir: Optional[str] = None, seed: Optional[int] = None, variant: int = 0,
+                    in_place: bool = False, cfg: Optional[AppConfig] = None) -> Path:
+    """
+    Rewrite description_raw for every generated transaction. Writes a complete dataset
+    (personas.csv + transactions/) to out_dir (default <output_dir>/noise-<seed>-<variant>),
+    or overwrites the source CSVs with in_place=True.
+    """
+    cfg = cfg or get_config()
+    seed = cfg.noise_seed if seed is None else seed
+    src_dir = Path(cfg.output_dir)
+    dest = src_dir if in_place else Path(out_dir or src_dir / f"noise-{seed}-{variant}")
+    files = transaction_files(src_dir)
+    if not files:
+        log.warning(f"No transactions found under {src_dir / 'transactions'}", tag="NOISE")
+        return dest
+    (dest / "transactions").mkdir(parents=True, exist_ok=True)
+    if not in_place and (src_dir / "personas.csv").exists():
+        shutil.copyfile(src_dir / "personas.csv", dest / "personas.csv")
+
+    rows = 0
+    engine_s = 0.0
+    for c0 in range(0, len(files), FILES_PER_CHUNK):
+        chunk = files[c0:c0 + FILES_PER_CHUNK]
+        frames = [_read(p) for p in chunk]
+        frame = pd.concat(frames, ignore_index=True)
+        t0 = time.perf_counter()
+        # Variant mixes in the chunk offset so chunks draw independent streams.
+        frame["description_raw"] = noisy_descriptions(frame, seed, variant * 1_000_003 + c0)
+        engine_s += time.perf_counter() - t0
+
+        t1 = time.perf_counter()
+        nbytes = 0
+        offset = 0
+        for path, part in zip(chunk, frames):
+            out_path = dest / "transactions" / path.name
+            frame.iloc[offset:offset + len(part)].to_csv(out_path, index=False)
+            offset += len(part)
+            nbytes += out_path.stat().st_size
+        metrics.record_write(len(frame), time.perf_counter() - t1, nbytes)
+        rows += len(frame)
+
+    metrics.inc("noise_rows_total", rows)
+    rate = rows / engine_s if engine_s else float("inf")
+    log.info(f"✅ Rewrote description_raw for {rows} rows ({rate:,.0f} rows/s in the engine) -> {dest}", tag="NOISE")
+    return dest
@@ -0,0 +1,485 @@
+# persona_sampler.py
+"""
+Combinatorial persona sampler (persona_source: sampler).
+
+Instead of asking the LLM for every persona, a handful of calls build component pools
+(names by ethnicity, UK towns, occupations + employers, income archetypes, notable-event
+templates — see promptlib.personas.persona_pool_prompts). A seeded numpy sampler then
+combines them into any number of personas with the same schema as full_persona_1_shot,
+drawing income figures from the archetypes' calibrated distributions:
+
+    average_monthly_income_in_gbp            ~ LogNormal(log(archetype median), 0.2)
+    monthly_income_variance_in_percent       ~ archetype income_cv x LogNormal(0, 0.25), as %
+    monthly_income_standard_deviation_in_gbp = average x cv
+    income_events_last_6_months              4-8 individual payments ~ average x Gamma(3, 0.1)
+
+Pools are stored under <output_dir>/persona_pools/ and stamped in the manifest, so they
+are fetched once per (prompt, model, temperature). Sampling is seeded per chunk of
+SAMPLER_CHUNK users from (persona_seed, chunk start): the same seed and pools always give
+the same personas, and growing num_users keeps the existing ones.
+
+persona_summary (persona_summary_mode):
+    template  deterministic one-paragraph summary built from the sampled fields (no LLM)
+    llm       left empty in personas.csv and written lazily by the LLM the first time the
+              persona is used for transaction generation; cached in persona_summaries/
+    none      left empty
+"""
+
+from __future__ import annotations
+
+import asyncio
+import calendar
+import json
+from datetime import date
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+
+from promptlib.personas import persona_pool_prompts, persona_summary_prompt
+from .batch import BatchRequest, run_batch
+from .config import AppConfig
+from .helpers import log, get_llm, generate_uuid, extract_json_block
+from .manifest import artifact_hash, get_manifest
+from .metrics import metrics
+from .records import IncomeEvent, Persona
+
+POOL_DIR = "persona_pools"
+SUMMARY_DIR = "persona_summaries"
+
+SAMPLER_CHUNK = 10_000
+
+# End of the income_events_last_6_months window (the prompt's few-shot examples use H1 2025).
+REFERENCE_END = date(2025, 6, 30)
+WINDOW_DAYS = 181
+
+ARCHETYPES = ("gig", "freelance", "side_hustle", "self_employed", "seasonal", "commission", "cash_heavy", "blended")
+_FORMAL_TYPES = ("BACS", "FPS")
+_INFORMAL_TYPES = ("FPS", "CASH", "CHQ")
+_MONTHS = tuple(calendar.month_name[m] for m in range(1, 13))
+
+# Minimal shape checks per pool; malformed items are dropped rather than failing the pool.
+_REQUIRED_KEYS = {
+    "towns": ("town",),
+    "occupations": ("occupation", "formal_sources"),
+    "income_archetypes": ("name", "median_monthly_income_gbp", "income_cv"),
+}
+
+
+# -- component pools -----------------------------------------------------------
+
+def pool_artifact(kind: str) -> str:
+    return f"{POOL_DIR}/{kind}.json"
+
+
+def pool_messages(kind: str, cfg: AppConfig) -> List[Dict[str, str]]:
+    return [{"role": "user", "content": persona_pool_prompts[kind].format(n=cfg.persona_pool_size)}]
+
+
+def pool_hash(cfg: AppConfig, kind: str) -> str:
+    return artifact_hash(pool_messages(kind, cfg), cfg, pool=kind)
+
+
+def _parse_pool(kind: str, text: str) -> Any:
+    """Parse and sanity-check one pool response. Raises ValueError if nothing usable is left."""
+    try:
+        data = json.loads(extract_json_block(text))
+    except Exception:
+        metrics.inc("parse_failures_total")
+        raise
+
+    if kind == "names":
+        data = {
+            eth: v for eth, v in (data.items() if isinstance(data, dict) else [])
+            if isinstance(v, dict) and all(isinstance(v.get(k), list) and v[k] for k in ("male", "female", "surnames"))
+        }
+    elif kind == "event_templates":
+        data = [t for t in (data if isinstance(data, list) else []) if isinstance(t, str) and t.strip()]
+    else:
+        required = _REQUIRED_KEYS[kind]
+        data = [item for item in (data if isinstance(data, list) else [])
+                if isinstance(item, dict) and all(item.get(k) not in (None, "", []) for k in required)]
+        if kind == "income_archetypes":
+            for item in data:
+                item["median_monthly_income_gbp"] = float(item["median_monthly_income_gbp"])
+                item["income_cv"] = float(item["income_cv"])
+    if not data:
+        raise ValueError(f"Persona pool {kind!r} has no usable items")
+    return data
+
+
+def _save_pool(cfg: AppConfig, kind: str, data: Any) -> None:
+    artifact = pool_artifact(kind)
+    path = Path(cfg.output_dir) / artifact
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+    get_manifest(cfg).stamp(artifact, pool_hash(cfg, kind), len(data))
+
+
+def stale_pools(cfg: AppConfig) -> List[str]:
+    manifest = get_manifest(cfg)
+    return [kind for kind in persona_pool_prompts if not manifest.is_fresh(pool_artifact(kind), pool_hash(cfg, kind))]
+
+
+def build_pools(cfg: AppConfig, mode: str = "sync") -> Dict[str, Any]:
+    """
+    Load every component pool, calling the LLM only for pools that are missing or stale.
+    Raises RuntimeError if a pool cannot be built (the sampler cannot run without it).
+    """
+    missing = stale_pools(cfg)
+    if missing:
+        log.info(f"Building persona component pools: {', '.join(missing)}", tag="SAMPLER")
+        responses = _fetch_pools(cfg, missing, mode)
+        for kind in missing:
+            text = responses.get(kind)
+            if text is None:
+                continue
+            try:
+                _save_pool(cfg, kind, _parse_pool(kind, text))
+            except Exception as e:
+                log.exception(f"Could not parse persona pool {kind!r}: {e}", tag="SAMPLER")
+
+    still_missing = stale_pools(cfg)
+    if still_missing:
+        raise RuntimeError(f"Persona pools unavailable: {', '.join(still_missing)}")
+    return {
+        kind: json.loads((Path(cfg.output_dir) / pool_artifact(kind)).read_text(encoding="utf-8"))
+        for kind in persona_pool_prompts
+    }
+
+
+def _fetch_pools(cfg: AppConfig, kinds: List[str], mode: str) -> Dict[str, str]:
+    """Raw LLM responses per pool kind (failed calls are logged and omitted)."""
+    if mode == "batch":
+        requests = [BatchRequest(custom_id=f"pool-{kind}", messages=pool_messages(kind, cfg)) for kind in kinds]
+        results = run_batch(requests, cfg, name="persona-pools")
+        out = {}
+        for kind in kinds:
+            result = results.get(f"pool-{kind}")
+            if result is None or result.error:
+                log.error(f"Batch request for pool {kind!r} failed: {result.error if result else 'missing'}", tag="SAMPLER")
+                continue
+            out[kind] = result.content
+        return out
+
+    llm = get_llm()
+    if mode == "async":
+        async def _one(kind: str):
+            try:
+                return (await llm.chat_async(pool_messages(kind, cfg), cache=True)).content or ""
+            except Exception as e:
+                log.exception(f"LLM call failed for pool {kind!r}: {e}", tag="SAMPLER")
+                return None
+
+        async def _run():
+            return await asyncio.gather(*[_one(kind) for kind in kinds])
+
+        return {kind: text for kind, text in zip(kinds, asyncio.run(_run())) if text is not None}
+
+    out = {}
+    for kind in kinds:
+        try:
+            out[kind] = llm.chat(pool_messages(kind, cfg), cache=True).content or ""
+        except Exception as e:
+            log.exception(f"LLM call failed for pool {kind!r}: {e}", tag="SAMPLER")
+    return out
+
+
+# -- sampling ------------------------------------------------------------------
+
+class PersonaSampler:
+    """Seeded, vectorised combination of component pools into full personas."""
+
+    def __init__(self, pools: Dict[str, Any], seed: int = 0, summary_mode: str = "template") -> None:
+        self.seed = seed
+        self.summary_mode = summary_mode
+        self.names = pools["names"]
+        self.ethnicities = sorted(self.names)
+        self.towns = pools["towns"]
+        self.occupations = pools["occupations"]
+        self.archetypes = pools["income_archetypes"]
+        self.event_templates = pools["event_templates"]
+
+        self.median_income = np.array([a["median_monthly_income_gbp"] for a in self.archetypes], dtype=float)
+        self.income_cv = np.array([a["income_cv"] for a in self.archetypes], dtype=float)
+        # Occupations grouped by archetype so the primary job matches the income shape.
+        self.occupations_by_archetype = {
+            key: [i for i, o in enumerate(self.occupations) if o.get("archetype") == key]
+            for key in ARCHETYPES
+        }
+
+    def sample(self, start: int, n: int) -> List[Persona]:
+        """Personas for user indices [start, start + n), identical for the same seed and pools."""
+        rows: List[Persona] = []
+        first_chunk = start - start % SAMPLER_CHUNK
+        for chunk in range(first_chunk, start + n, SAMPLER_CHUNK):
+            lo, hi = max(start, chunk), min(start + n, chunk + SAMPLER_CHUNK)
+            rows.extend(self._sample_chunk(chunk, lo - chunk, hi - chunk))
+        return rows
+
+    def _sample_chunk(self, chunk_start: int, lo: int, hi: int) -> List[Persona]:
+        """
+        Draw every random array for the whole chunk (so draws never depend on how many users
+        were requested), then assemble only personas [lo, hi) of it.
+        """
+        n = SAMPLER_CHUNK
+        rng = np.random.default_rng([self.seed, chunk_start])
+
+        eth = rng.integers(0, len(self.ethnicities), n)
+        gender = rng.choice(np.array(["Male", "Female", "Non-binary"]), n, p=[0.49, 0.49, 0.02])
+        age = rng.integers(19, 66, n)
+        town = rng.integers(0, len(self.towns), n)
+        arch = rng.integers(0, len(self.archetypes), n)
+        name_draws = rng.random((n, 3))
+
+        income = np.clip(self.median_income[arch] * np.exp(rng.normal(0.0, 0.2, n)), 800, 20_000).round(2)
+        cv = np.clip(self.income_cv[arch] * np.exp(rng.normal(0.0, 0.25, n)), 0.03, 1.2)
+        std = (income * cv).round(2)
+
+        n_jobs = rng.choice([1, 2, 3], n, p=[0.35, 0.45, 0.20])
+        job_draws = rng.integers(0, len(self.occupations), (n, 3))
+        primary_draw = rng.random(n)
+        support_draw = rng.random(n)
+        employer_local = rng.random(n) < 0.3
+
+        # Income events: 4-8 individual payments per persona (~30% of a month's income each).
+        n_events = rng.integers(4, 9, n)
+        total_events = int(n_events.sum())
+        event_user = np.repeat(np.arange(n), n_events)
+        event_amounts = (income[event_user] * rng.gamma(3.0, 0.1, total_events)).round(2)
+        event_days = rng.integers(0, WINDOW_DAYS, total_events)
+        event_formal = rng.random(total_events) < 0.7
+        event_pick = rng.random((total_events, 2))
+
+        n_notable = rng.integers(1, 4, n)
+        notable_draws = rng.random((n, 3, 4))
+        challenge_draws = rng.random((n, 3))
+
+        # Vectorised formatting: events sorted by (user, date), dates and notable-event fields
+        # rendered for the whole chunk, then everything converted to Python lists once — the
+        # per-persona loop below only slices lists and builds dicts.
+        order = np.lexsort((event_days, event_user))
+        end = np.datetime64(REFERENCE_END.isoformat(), "D")
+        event_dates = (end - (WINDOW_DAYS - 1 - event_days[order]).astype("timedelta64[D]")).astype(str).tolist()
+        event_amounts = event_amounts[order].tolist()
+        event_formal = event_formal[order].tolist()
+        event_type_u, event_source_u = event_pick[order].T.tolist()
+        event_offsets = np.concatenate(([0], np.cumsum(n_events))).tolist()
+
+        notable_template = (notable_draws[:, :, 0] * len(self.event_templates)).astype(np.int64).tolist()
+        notable_amount = np.round(income[:, None] * (0.1 + 1.5 * notable_draws[:, :, 1]), -1).tolist()
+        notable_source_u = notable_draws[:, :, 2].tolist()
+        notable_months = (end - (notable_draws[:, :, 3] * WINDOW_DAYS).astype("timedelta64[D]")).astype("datetime64[M]")
+        notable_month = (notable_months.astype(np.int64) % 12).tolist()
+
+        variance_pct = (cv * 100).round(1).tolist()
+        eth, gender, age, town, arch = eth.tolist(), gender.tolist(), age.tolist(), town.tolist(), arch.tolist()
+        income, std, n_jobs, n_notable = income.tolist(), std.tolist(), n_jobs.tolist(), n_notable.tolist()
+        job_draws, primary_draw, support_draw = job_draws.tolist(), primary_draw.tolist(), support_draw.tolist()
+        employer_local, name_draws, challenge_draws = employer_local.tolist(), name_draws.tolist(), challenge_draws.tolist()
+
+        rows = []
+        for i in range(lo, hi):
+            archetype = self.archetypes[arch[i]]
+            jobs = self._jobs(archetype, n_jobs[i], job_draws[i], primary_draw[i])
+            formal = _unique(s for j in jobs for s in j.get("formal_sources") or [])
+            informal = _unique(s for j in jobs for s in j.get("informal_sources") or [])
+            place = self.towns[town[i]]
+            support = list(archetype.get("government_support") or []) if support_draw[i] < 0.4 else []
+            employers = list(formal)
+            if employers and employer_local[i]:
+                employers[0] = f"{employers[0]} - {place['town']}"
+
+            events = []
+            for k in range(event_offsets[i], event_offsets[i + 1]):
+                use_formal = (event_formal[k] and bool(formal)) or not informal
+                sources = formal if use_formal else informal
+                types = _FORMAL_TYPES if use_formal else _INFORMAL_TYPES
+                events.append(IncomeEvent(
+                    event_dates[k],
+                    event_amounts[k],
+                    _pick(types, event_type_u[k]),
+                    _pick(sources, event_source_u[k]) if sources else "Unknown Transfer",
+                ))
+
+            names = self.names[self.ethnicities[eth[i]]]
+            first_pool = names["female"] if gender[i] == "Female" else names["male"]
+            if gender[i] == "Non-binary" and name_draws[i][2] < 0.5:
+                first_pool = names["female"]
+            full_name = f"{_pick(first_pool, name_draws[i][0])} {_pick(names['surnames'], name_draws[i][1])}"
+
+            all_sources = formal + informal
+            notable = []
+            for k in range(n_notable[i]):
+                source = _pick(all_sources, notable_source_u[i][k]) if all_sources else "Unknown Transfer"
+                # Plain replacement: templates come from the model and may contain other braces.
+                notable.append(
+                    self.event_templates[notable_template[i][k]]
+                    .replace("{amount}", f"{notable_amount[i][k]:,.0f}")
+                    .replace("{source}", source)
+                    .replace("{month}", _MONTHS[notable_month[i][k]])
+                )
+
+            persona = Persona(
+                full_name=full_name,
+                age=age[i],
+                gender=gender[i],
+                location=place["town"],
+                ethnicity=self.ethnicities[eth[i]],
+                occupations=[j["occupation"] for j in jobs],
+                persona_summary="",
+                income_streams={
+                    "formal_sources": formal,
+                    "informal_sources": informal,
+                    "government_support": support,
+                    "employers_last_6_months": employers,
+                    "payment_frequency": jobs[0].get("payment_frequency") or "",
+                    "average_monthly_income_in_gbp": income[i],
+                    "monthly_income_variance_in_percent": variance_pct[i],
+                    "monthly_income_standard_deviation_in_gbp": std[i],
+                    "income_events_last_6_months": events,
+                },
+                expense_behavior={
+                    "spend_categories": list(archetype.get("spend_categories") or []),
+                    "regular_obligations": list(archetype.get("regular_obligations") or []),
+                    "financial_stress_signals": list(archetype.get("financial_stress_signals") or []),
+                },
+                notable_events=notable,
+                income_estimation_challenges=_pick_some(archetype.get("income_estimation_challenges") or [],
+                                                        challenge_draws[i]),
+            )
+            if self.summary_mode == "template":
+                persona.persona_summary = template_summary(persona)
+            rows.append(persona)
+        return rows
+
+    def _jobs(self, archetype: Dict[str, Any], n_jobs: int, draws: List[int], primary_draw: float) -> List[Dict[str, Any]]:
+        matching = self.occupations_by_archetype.get(archetype.get("archetype"), [])
+        picked = [_pick(matching, primary_draw) if matching else draws[0]]
+        for d in draws[1:n_jobs]:
+            if d not in picked:
+                picked.append(d)
+        return [self.occupations[j] for j in picked]
+
+
+def _pick(items: List[Any], u: float) -> Any:
+    return items[min(int(u * len(items)), len(items) - 1)]
+
+
+def _pick_some(items: List[str], draws: List[float]) -> List[str]:
+    return _unique(_pick(items, u) for u in draws) if items else []
+
+
+def _unique(items) -> List[str]:
+    return list(dict.fromkeys(items))
+
+
+def template_summary(persona: Persona) -> str:
+    """Deterministic narrative from the sampled fields (persona_summary_mode: template)."""
+    streams = persona.income_streams
+    first = persona.full_name.split(" ")[0]
+    jobs = persona.occupations
+    job_text = jobs[0] if len(jobs) == 1 else ", ".join(jobs[:-1]) + f" and {jobs[-1]}"
+    sources = streams["formal_sources"] + streams["informal_sources"]
+    parts = [
+        f"{first} is a {persona.age}-year-old {persona.ethnicity} {job_text} in {persona.location}.",
+        f"Income averages £{streams['average_monthly_income_in_gbp']:,.0f}/month "
+        f"(std £{streams['monthly_income_standard_deviation_in_gbp']:,.0f}, "
+        f"{streams['monthly_income_variance_in_percent']}% variance)"
+        + (f" from {', '.join(sources[:4])}" if sources else "")
+        + (f"; pattern: {streams['payment_frequency']}." if streams["payment_frequency"] else "."),
+    ]
+    if streams["government_support"]:
+        parts.append(f"Also receives {', '.join(streams['government_support'])}.")
+    if persona.notable_events:
+        parts.append("Notable: " + "; ".join(persona.notable_events) + ".")
+    return " ".join(parts)
+
+
+def sample_personas(cfg: AppConfig, pools: Dict[str, Any]) -> List[Persona]:
+    """cfg.num_users personas with sequential user_ids (same ids as the LLM path)."""
+    sampler = PersonaSampler(pools, seed=cfg.persona_seed, summary_mode=cfg.persona_summary_mode)
+    rows = sampler.sample(0, cfg.num_users)
+    for j, persona in enumerate(rows):
+        persona.user_id = generate_uuid("user", j)
+    return rows
+
+
+# -- lazy persona_summary (persona_summary_mode: llm) --------------------------
+
+def _has_text(value: Any) -> bool:
+    return isinstance(value, str) and bool(value.strip())
+
+
+def needs_summary(cfg: AppConfig, user: Dict[str, Any]) -> bool:
+    return (cfg.persona_source == "sampler" and cfg.persona_summary_mode == "llm"
+            and not _has_text(user.get("persona_summary")))
+
+
+def _summary_path(cfg: AppConfig, user_id: str) -> Path:
+    return Path(cfg.output_dir) / SUMMARY_DIR / f"{user_id}.txt"
+
+
+def summary_messages(user: Dict[str, Any]) -> List[Dict[str, str]]:
+    fields = {k: v for k, v in user.items() if k != "persona_summary"}
+    return [{"role": "user", "content": persona_summary_prompt.format(persona=json.dumps(fields, indent=2, default=str))}]
+
+
+def with_cached_summary(cfg: AppConfig, user: Dict[str, Any]) -> Dict[str, Any]:
+    """user with its lazily generated summary filled in, if one has been generated already."""
+    if not needs_summary(cfg, user):
+        return user
+    path = _summary_path(cfg, user["user_id"])
+    if not path.exists():
+        return user
+    return {**user, "persona_summary": path.read_text(encoding="utf-8")}
+
+
+def _store_summary(cfg: AppConfig, user: Dict[str, Any], text: str) -> Dict[str, Any]:
+    text = (text or "").strip()
+    if not text:
+        return user
+    path = _summary_path(cfg, user["user_id"])
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text, encoding="utf-8")
+    metrics.inc("persona_summaries_generated_total")
+    return {**user, "persona_summary": text}
+
+
+def ensure_summary(cfg: AppConfig, user: Dict[str, Any], llm) -> Dict[str, Any]:
+    """Generate (once) and attach persona_summary when the sampler left it for lazy generation."""
+    user = with_cached_summary(cfg, user)
+    if not needs_summary(cfg, user):
+        return user
+    try:
+        return _store_summary(cfg, user, llm.chat(summary_messages(user), cache=True).content)
+    except Exception as e:
+        log.exception(f"persona_summary generation failed for {user.get('user_id')}: {e}", tag="SAMPLER")
+        return user
+
+
+async def ensure_summary_async(cfg: AppConfig, user: Dict[str, Any], llm) -> Dict[str, Any]:
+    user = with_cached_summary(cfg, user)
+    if not needs_summary(cfg, user):
+        return user
+    try:
+        return _store_summary(cfg, user, (await llm.chat_async(summary_messages(user), cache=True)).content)
+    except Exception as e:
+        log.exception(f"persona_summary generation failed for {user.get('user_id')}: {e}", tag="SAMPLER")
+        return user
+
+
+def ensure_summaries_batch(cfg: AppConfig, users: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Batch-mode counterpart: one Batch API submission for every user still missing a summary."""
+    users = [with_cached_summary(cfg, u) for u in users]
+    pending = [u for u in users if needs_summary(cfg, u)]
+    if not pending:
+        return users
+    log.info(f"Generating {len(pending)} persona summaries via the Batch API...", tag="SAMPLER")
+    results = run_batch([BatchRequest(custom_id=u["user_id"], messages=summary_messages(u)) for u in pending],
+                        cfg, name="persona-summaries")
+    out = []
+    for user in users:
+        result = results.get(user["user_id"]) if needs_summary(cfg, user) else None
+        out.append(_store_summary(cfg, user, result.content) if result and not result.error else user)
+    return out
@@ -0,0 +1,196 @@
+# profiling.py
+"""
+Opt-in profiling for pipeline stages (`bankgen --profile`).
+
+When enabled, each stage wrapped in `profile_stage(name)` runs under cProfile and
+tracemalloc, and async paths can run an event-loop lag monitor via `watch_event_loop()`.
+Per-stage reports land in logs/profile/<YYYYmmdd-HHMMSS>/:
+
+    <stage>.txt     top functions (cumulative + own time), hot-path breakdown,
+                    peak traced memory, top allocation sites, loop-blocking intervals
+    <stage>.pstats  raw cProfile dump (open with snakeviz / pstats)
+
+When profiling is disabled every helper here is a no-op, so the wrappers can stay in
+place permanently.
+"""
+
+from __future__ import annotations
+
+import cProfile
+import io
+import pstats
+import time
+import tracemalloc
+from contextlib import asynccontextmanager, contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from kirkomi_utils.logging.logger import log
+from .config import LOG_DIR
+
+
+# Hot paths we care about when a run is slow: label -> (filename fragment, function name).
+HOT_PATHS: Dict[str, Tuple[str, str]] = {
+    "llm_chat (sync)": ("helpers.py", "chat"),
+    "llm_chat (async)": ("helpers.py", "chat_async"),
+    "json.loads": ("json/__init__.py", "loads"),
+    "DataFrame construction": ("pandas/core/frame.py", "__init__"),
+    "DataFrame.to_csv": ("pandas/core/generic.py", "to_csv"),
+    "read_csv": ("pandas/io/parsers/readers.py", "read_csv"),
+}
+
+TOP_FUNCTIONS = 25
+TOP_ALLOCATIONS = 15
+
+# Event-loop lag sampling
+LOOP_SAMPLE_INTERVAL_S = 0.05
+LOOP_BLOCK_THRESHOLD_S = 0.1
+
+
+class _ProfilerState:
+    def __init__(self) -> None:
+        self.enabled = False
+        self.out_dir: Optional[Path] = None
+        # stage -> list of (offset_s, lag_s) loop-blocking intervals
+        self.loop_blocks: Dict[str, List[Tuple[float, float]]] = {}
+        self.current_stage: Optional[str] = None
+
+
+_state = _ProfilerState()
+
+
+def enable(log_dir: str = LOG_DIR) -> Path:
+    """Turn profiling on for this process; returns the report directory."""
+    _state.enabled = True
+    _state.out_dir = Path(log_dir) / "profile" / time.strftime("%Y%m%d-%H%M%S")
+    _state.out_dir.mkdir(parents=True, exist_ok=True)
+    return _state.out_dir
+
+
+def is_enabled() -> bool:
+    return _state.enabled
+
+
+@contextmanager
+def profile_stage(name: str) -> Iterator[None]:
+    """
+    Profile a stage (CPU + allocations) and write its report. No-op unless enable() was called.
+    """
+    if not _state.enabled:
+        yield
+        return
+
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start(10)
+    tracemalloc.reset_peak()
+    before = tracemalloc.take_snapshot()
+
+    _state.current_stage = name
+    _state.loop_blocks[name] = []
+    profiler = cProfile.Profile()
+    t0 = time.perf_counter()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        wall = time.perf_counter() - t0
+        after = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        if started_tracing:
+            tracemalloc.stop()
+        _state.current_stage = None
+        try:
+            path = _write_stage_report(name, profiler, wall, before, after, current, peak)
+            log.info(f"🧪 Profile for stage '{name}' written to {path}", tag="PROFILE")
+        except Exception as e:
+            log.exception(f"Failed to write profile report for {name}: {e}", tag="PROFILE")
+
+
+@asynccontextmanager
+async def watch_event_loop(interval_s: float = LOOP_SAMPLE_INTERVAL_S, threshold_s: float = LOOP_BLOCK_THRESHOLD_S):
+    """
+    Sample event-loop responsiveness while the block runs. A sample that wakes up more
+    than `threshold_s` late means something blocked the loop (sync I/O, big json.loads,
+    DataFrame work) for that long. No-op unless profiling is enabled.
+    """
+    if not _state.enabled:
+        yield
+        return
+
+    import asyncio  # only reached from async paths, where asyncio is already loaded
+
+    blocks = _state.loop_blocks.setdefault(_state.current_stage or "async", [])
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+
+    async def _monitor() -> None:
+        while True:
+            expected = loop.time() + interval_s
+            await asyncio.sleep(interval_s)
+            lag = loop.time() - expected
+            if lag > threshold_s:
+                blocks.append((round(expected - start, 3), round(lag, 3)))
+
+    task = asyncio.create_task(_monitor())
+    try:
+        yield
+    finally:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+
+def _hot_path_times(stats: pstats.Stats) -> Dict[str, Tuple[int, float, float]]:
+    """label -> (calls, own_time_s, cumulative_s) summed over matching functions."""
+    out: Dict[str, Tuple[int, float, float]] = {}
+    for (filename, _lineno, func), (_cc, ncalls, tottime, cumtime, _callers) in stats.stats.items():
+        for label, (fragment, func_name) in HOT_PATHS.items():
+            if func == func_name and filename.replace("\\", "/").endswith(fragment):
+                calls, own, cum = out.get(label, (0, 0.0, 0.0))
+                out[label] = (calls + ncalls, own + tottime, cum + cumtime)
+    return out
+
+
+def _write_stage_report(name, profiler, wall, before, after, current, peak) -> Path:
+    out_dir = _state.out_dir
+    profiler.dump_stats(str(out_dir / f"{name}.pstats"))
+
+    buf = io.StringIO()
+    buf.write(f"Stage: {name}\n")
+    buf.write(f"Wall time: {wall:.3f}s\n")
+    buf.write(f"Peak traced memory: {peak / 1024 / 1024:.2f} MiB (current {current / 1024 / 1024:.2f} MiB)\n\n")
+
+    stats = pstats.Stats(profiler, stream=buf)
+    buf.write("== Hot paths ==\n")
+    hot = _hot_path_times(stats)
+    if hot:
+        for label, (calls, own, cum) in sorted(hot.items(), key=lambda kv: -kv[1][2]):
+            buf.write(f"{label:<26} calls={calls:<8} own={own:9.3f}s  cumulative={cum:9.3f}s  ({cum / wall:6.1%} of wall)\n")
+    else:
+        buf.write("(none of the tracked hot paths ran)\n")
+
+    buf.write(f"\n== Top {TOP_FUNCTIONS} functions by cumulative time ==\n")
+    stats.sort_stats("cumulative").print_stats(TOP_FUNCTIONS)
+    buf.write(f"\n== Top {TOP_FUNCTIONS} functions by own time ==\n")
+    stats.sort_stats("tottime").print_stats(TOP_FUNCTIONS)
+
+    buf.write(f"\n== Top {TOP_ALLOCATIONS} allocation sites (net growth during stage) ==\n")
+    for diff in after.compare_to(before, "lineno")[:TOP_ALLOCATIONS]:
+        buf.write(f"{diff}\n")
+
+    blocks = _state.loop_blocks.get(name, [])
+    buf.write(f"\n== Event-loop blocking intervals (> {LOOP_BLOCK_THRESHOLD_S * 1000:.0f} ms) ==\n")
+    if blocks:
+        buf.write(f"count={len(blocks)}  total={sum(l for _, l in blocks):.3f}s  worst={max(l for _, l in blocks):.3f}s\n")
+        for offset, lag in sorted(blocks, key=lambda b: -b[1])[:50]:
+            buf.write(f"  t+{offset:9.3f}s  blocked {lag * 1000:8.1f} ms\n")
+    else:
+        buf.write("(none recorded — stage was synchronous or the loop never blocked)\n")
+
+    path = out_dir / f"{name}.txt"
+    path.write_text(buf.getvalue(), encoding="utf-8")
+    return path
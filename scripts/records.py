@@ -0,0 +1,361 @@
+# records.py
+"""
+Typed records for generated data: Persona, IncomeEvent and Transaction.
+
+LLM output is decoded straight into slotted dataclasses, validating and coercing each field
+as it goes (numbers given as strings, "true"/"false" flags, null-ish enums, a missing
+transaction_type derived from the sign of the amount). Objects that cannot be repaired are
+dropped and counted in records_invalid_total{record=...} instead of failing the whole
+response; fields outside the schema (e.g. an `mcc` the model adds) are kept in `extra`.
+
+Writing goes the other way in bulk: `to_columns` turns a list of records into one list per
+column and `write_csv` streams the columns with the csv module. The CSVs are the same as the
+pandas writer produced (str() of floats, bools, lists and dicts; None as an empty cell),
+without building a DataFrame per user.
+
+    txns = decode_transactions(json.loads(text))
+    write_csv(path, txns, TRANSACTION_COLUMNS, constants={"user_id": user_id})
+"""
+
+from __future__ import annotations
+
+import ast
+import csv
+from dataclasses import dataclass
+from datetime import date, datetime
+from operator import attrgetter
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+from kirkomi_utils.logging.logger import log
+from .metrics import metrics
+
+TRANSACTION_COLUMNS = (
+    "timestamp", "amount", "transaction_type", "currency", "description_raw",
+    "description_cleaned", "merchant_name", "is_income", "risk_flag", "source_type",
+)
+
+PERSONA_COLUMNS = (
+    "full_name", "age", "gender", "location", "ethnicity", "occupations", "persona_summary",
+    "income_streams", "expense_behavior", "notable_events", "income_estimation_challenges", "user_id",
+)
+
+INCOME_EVENTS_KEY = "income_events_last_6_months"
+
+# income_streams figures coerced to float; the prompt's schema and its few-shot examples
+# disagree on the names, so both spellings are accepted (and kept as given).
+_INCOME_FIGURES = (
+    "average_monthly_income_in_gbp", "average_monthly_income_gbp",
+    "monthly_income_variance_in_percent", "monthly_income_variance_pct",
+    "monthly_income_standard_deviation_in_gbp", "monthly_income_std_dev_gbp",
+)
+
+_TRUE = {"true", "1", "yes", "y"}
+_FALSE = {"false", "0", "no", "n", ""}
+_NULLS = {"", "null", "none", "nan"}
+
+
+class RecordError(ValueError):
+    """An LLM object that cannot be coerced into a record."""
+
+
+def _float(value: Any, name: str) -> float:
+    if isinstance(value, float):
+        return value
+    if isinstance(value, int) and not isinstance(value, bool):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return float(value.strip().replace("£", "").replace(",", ""))
+        except ValueError:
+            pass
+    raise RecordError(f"{name}: expected a number, got {value!r}")
+
+
+def _text(value: Any) -> str:
+    return "" if value is None else value if isinstance(value, str) else str(value)
+
+
+def _optional(value: Any) -> Optional[str]:
+    if value is None:
+        return None
+    value = _text(value).strip()
+    return None if value.lower() in _NULLS else value
+
+
+def _bool(value: Any, name: str) -> bool:
+    if isinstance(value, bool):
+        return value
+    if value is None:
+        return False
+    if isinstance(value, (int, float)):
+        return bool(value)
+    text = str(value).strip().lower()
+    if text in _TRUE:
+        return True
+    if text in _FALSE:
+        return False
+    raise RecordError(f"{name}: expected a boolean, got {value!r}")
+
+
+def _strings(value: Any) -> List[str]:
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [value] if value.strip() else []
+    if isinstance(value, (list, tuple)):
+        return [_text(item) for item in value]
+    return [_text(value)]
+
+
+def _object(value: Any, name: str) -> Dict[str, Any]:
+    if value is None:
+        return {}
+    if isinstance(value, dict):
+        return dict(value)
+    raise RecordError(f"{name}: expected an object, got {type(value).__name__}")
+
+
+@dataclass(slots=True)
+class Transaction:
+    timestamp: str
+    amount: float
+    transaction_type: str
+    currency: str = "GBP"
+    description_raw: str = ""
+    description_cleaned: str = ""
+    merchant_name: Optional[str] = None
+    is_income: bool = False
+    risk_flag: Optional[str] = None
+    source_type: Optional[str] = None
+    extra: Optional[Dict[str, Any]] = None
+
+    @classmethod
+    def from_dict(cls, obj: Dict[str, Any]) -> "Transaction":
+        """Validate and coerce one decoded JSON object. Raises RecordError."""
+        if not isinstance(obj, dict):
+            raise RecordError(f"expected an object, got {type(obj).__name__}")
+        timestamp = obj.get("timestamp")
+        if not isinstance(timestamp, str):
+            raise RecordError(f"timestamp: expected a string, got {timestamp!r}")
+        try:
+            datetime.fromisoformat(timestamp)
+        except ValueError:
+            raise RecordError(f"timestamp: not ISO 8601: {timestamp!r}") from None
+        amount = _float(obj.get("amount"), "amount")
+        kind = _text(obj.get("transaction_type")).upper()
+        if kind not in ("CREDIT", "DEBIT"):
+            kind = "CREDIT" if amount > 0 else "DEBIT"
+        extra = None
+        if not _TRANSACTION_KEYS.issuperset(obj):
+            extra = {k: v for k, v in obj.items() if k not in _TRANSACTION_KEYS}
+        return cls(
+            timestamp,
+            amount,
+            kind,
+            _text(obj.get("currency")).upper() or "GBP",
+            _text(obj.get("description_raw")),
+            _text(obj.get("description_cleaned")),
+            _optional(obj.get("merchant_name")),
+            _bool(obj.get("is_income"), "is_income"),
+            _optional(obj.get("risk_flag")),
+            _optional(obj.get("source_type")),
+            extra,
+        )
+
+
+_TRANSACTION_KEYS = frozenset(TRANSACTION_COLUMNS) | {"user_id"}
+
+
+@dataclass(slots=True)
+class IncomeEvent:
+    date: str
+    amount: float
+    type: str
+    source: str
+
+    @classmethod
+    def from_dict(cls, obj: Dict[str, Any]) -> "IncomeEvent":
+        if not isinstance(obj, dict):
+            raise RecordError(f"income event: expected an object, got {type(obj).__name__}")
+        day = _text(obj.get("date"))
+        try:
+            date.fromisoformat(day[:10])
+        except ValueError:
+            raise RecordError(f"income event date: not ISO 8601: {day!r}") from None
+        return cls(day, _float(obj.get("amount"), "income event amount"),
+                   _text(obj.get("type")).upper(), _text(obj.get("source")))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"date": self.date, "amount": self.amount, "type": self.type, "source": self.source}
+
+
+@dataclass(slots=True)
+class Persona:
+    full_name: str
+    age: Optional[int]
+    gender: str
+    location: str
+    ethnicity: str
+    occupations: List[str]
+    persona_summary: str
+    income_streams: Dict[str, Any]      # income_events_last_6_months holds IncomeEvent records
+    expense_behavior: Dict[str, Any]
+    notable_events: List[str]
+    income_estimation_challenges: List[str]
+    user_id: Optional[str] = None
+    extra: Optional[Dict[str, Any]] = None
+
+    @classmethod
+    def from_dict(cls, obj: Dict[str, Any]) -> "Persona":
+        """Validate and coerce one decoded persona object. Raises RecordError."""
+        if not isinstance(obj, dict):
+            raise RecordError(f"expected an object, got {type(obj).__name__}")
+        name = _text(obj.get("full_name")).strip()
+        if not name:
+            raise RecordError("full_name: missing")
+        age = obj.get("age")
+        if age is None or (isinstance(age, str) and age.strip().lower() in _NULLS):
+            age = None
+        else:
+            age = _float(age, "age")
+            age = int(age) if age == age else None  # NaN from a CSV round trip
+
+        streams = _object(obj.get("income_streams"), "income_streams")
+        for key in _INCOME_FIGURES:
+            if streams.get(key) is not None:
+                streams[key] = _float(streams[key], key)
+        events = []
+        raw_events = streams.get(INCOME_EVENTS_KEY)
+        for event in raw_events if isinstance(raw_events, list) else ():
+            try:
+                events.append(IncomeEvent.from_dict(event))
+            except RecordError:
+                metrics.inc("records_invalid_total", labels={"record": "income_event"})
+        streams[INCOME_EVENTS_KEY] = events
+
+        extra = {k: v for k, v in obj.items() if k not in _PERSONA_KEYS}
+        return cls(
+            full_name=name,
+            age=age,
+            gender=_text(obj.get("gender")),
+            location=_text(obj.get("location")),
+            ethnicity=_text(obj.get("ethnicity")),
+            occupations=_strings(obj.get("occupations")),
+            persona_summary=_text(obj.get("persona_summary")),
+            income_streams=streams,
+            expense_behavior=_object(obj.get("expense_behavior"), "expense_behavior"),
+            notable_events=_strings(obj.get("notable_events")),
+            income_estimation_challenges=_strings(obj.get("income_estimation_challenges")),
+            user_id=_optional(obj.get("user_id")),
+            extra=extra or None,
+        )
+
+    @property
+    def income_events(self) -> List[IncomeEvent]:
+        return self.income_streams.get(INCOME_EVENTS_KEY, [])
+
+    def plain_income_streams(self) -> Dict[str, Any]:
+        """income_streams with income events as plain dicts (the JSON / personas.csv form)."""
+        streams = dict(self.income_streams)
+        streams[INCOME_EVENTS_KEY] = [event.to_dict() for event in self.income_events]
+        return streams
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Plain JSON-compatible dict in the prompt schema."""
+        out = {
+            name: self.plain_income_streams() if name == "income_streams" else getattr(self, name)
+            for name in PERSONA_COLUMNS
+        }
+        if out["user_id"] is None:
+            del out["user_id"]
+        if self.extra:
+            out.update(self.extra)
+        return out
+
+
+_PERSONA_KEYS = frozenset(PERSONA_COLUMNS)
+
+
+def _decode(cls, objs: Any, record: str) -> list:
+    if not isinstance(objs, list):
+        raise RecordError(f"expected a JSON array of {record}s, got {type(objs).__name__}")
+    out = []
+    for obj in objs:
+        try:
+            out.append(cls.from_dict(obj))
+        except RecordError as e:
+            metrics.inc("records_invalid_total", labels={"record": record})
+            log.debug(f"Dropped invalid {record}: {e}", tag="RECORDS")
+    return out
+
+
+def decode_transactions(objs: Any) -> List[Transaction]:
+    """Validate a decoded JSON array into Transaction records; invalid objects are dropped and counted."""
+    return _decode(Transaction, objs, "transaction")
+
+
+def decode_personas(objs: Any) -> List[Persona]:
+    """Validate a decoded JSON array into Persona records; invalid objects are dropped and counted."""
+    return _decode(Persona, objs, "persona")
+
+
+# -- persona fields read back from personas.csv --------------------------------
+
+def persona_field(value: Any) -> Any:
+    """A persona field as loaded from personas.csv (Python repr of a list / dict) or already decoded."""
+    if isinstance(value, str) and value.strip()[:1] in ("[", "{"):
+        try:
+            return ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            return value
+    return value
+
+
+def declared_number(streams: Dict[str, Any], names: Sequence[str]) -> Optional[float]:
+    """The first of `names` (aliases of one declared income figure) in `streams` that is a number."""
+    for name in names:
+        try:
+            value = float(streams.get(name))
+        except (TypeError, ValueError):
+            continue
+        if value == value:
+            return value
+    return None
+
+
+# -- columnar write ------------------------------------------------------------
+
+def to_columns(records: Sequence[Any], columns: Sequence[str]) -> Dict[str, list]:
+    """
+    One list per column. Schema fields are read with attrgetter in a single pass per column;
+    keys from `extra` become additional columns (None where a record lacks them).
+    """
+    out: Dict[str, list] = {}
+    for name in columns:
+        if name == "income_streams":
+            out[name] = [r.plain_income_streams() for r in records]
+        else:
+            out[name] = list(map(attrgetter(name), records))
+    extra_keys: Dict[str, None] = {}
+    for r in records:
+        if r.extra:
+            extra_keys.update(dict.fromkeys(r.extra))
+    for key in extra_keys:
+        out[key] = [r.extra.get(key) if r.extra else None for r in records]
+    return out
+
+
+def write_csv(path: Path, records: Sequence[Any], columns: Sequence[str],
+              constants: Optional[Dict[str, Any]] = None) -> None:
+    """
+    Write records as CSV via to_columns. `constants` are appended as columns with one value
+    for every row (e.g. the user_id of a per-user transactions file).
+    """
+    cols = to_columns(records, columns)
+    for key, value in (constants or {}).items():
+        cols[key] = [value] * len(records)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(cols)
+        writer.writerows(zip(*cols.values()))
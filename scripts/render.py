@@ -0,0 +1,345 @@
+# render.py
+"""
+UK-style bank statement rendering (`bankgen render`).
+
+Turns each user's transactions into a multi-page statement (HTML or PDF) with a bank
+header, account details, statement period, running balance and page breaks.
+
+Throughput design:
+    - Templates are compiled once per process (string.Template); no template engine.
+    - PDFs are written directly (Courier/Helvetica base-14 fonts, WinAnsi encoding),
+      so there is no HTML->PDF conversion step and no extra dependency.
+    - Users are streamed to a process pool as file paths; each worker reads, sorts,
+      paginates and writes one statement and returns timing/memory stats.
+
+Output: <output_dir>/statements/<user_id>.html|pdf
+Metrics: render_pages_total, render_page_seconds, render_statement_seconds,
+render_worker_peak_rss_mib (see scripts/metrics.py).
+"""
+
+from __future__ import annotations
+
+import hashlib
+import html
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from string import Template
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from kirkomi_utils.logging.logger import log
+from .config import AppConfig, get_config
+from .dataset import parse_amount, read_personas, read_user_transactions, sort_by_time, transaction_files
+from .metrics import metrics
+
+try:
+    import resource  # POSIX only; peak RSS is reported as 0 elsewhere
+except ImportError:  # pragma: no cover
+    resource = None
+
+
+@dataclass(frozen=True)
+class StatementOptions:
+    fmt: str
+    bank_name: str
+    opening_balance: float
+    rows_per_page: int
+    out_dir: str
+
+
+@dataclass
+class RenderResult:
+    user_id: str
+    pages: int
+    rows: int
+    seconds: float
+    page_seconds: List[float]
+    peak_rss_mib: float
+    error: Optional[str] = None
+
+
+# -----------------------------------------------------------------------------
+# Statement model
+# -----------------------------------------------------------------------------
+
+def account_details(user_id: str) -> Tuple[str, str]:
+    """Deterministic, obviously-synthetic sort code + account number derived from user_id."""
+    digest = int(hashlib.sha1(user_id.encode("utf-8")).hexdigest(), 16)
+    sort_code = f"04-{(digest // 100) % 100:02d}-{digest % 100:02d}"
+    account_no = f"{(digest // 10_000) % 100_000_000:08d}"
+    return sort_code, account_no
+
+
+def build_lines(rows, opening_balance: float) -> Tuple[List[Tuple[str, str, str, str, str]], float, float, float,
+                                                       datetime, datetime]:
+    """
+    Chronological statement lines (date, description, paid out, paid in, balance), the closing
+    balance and money in / out. Rows without a parseable timestamp are left out of all of them,
+    so opening + in - out always equals closing.
+    """
+    pairs = sort_by_time(rows)
+    balance = opening_balance
+    money_in = money_out = 0.0
+    lines = []
+    for ts, row in pairs:
+        amount = parse_amount(row.get("amount"))
+        balance += amount
+        if amount > 0:
+            money_in += amount
+        else:
+            money_out -= amount
+        desc = (row.get("description_raw") or row.get("description_cleaned") or "").strip()
+        lines.append((
+            ts.strftime("%d %b %y"),
+            desc,
+            f"{-amount:,.2f}" if amount < 0 else "",
+            f"{amount:,.2f}" if amount > 0 else "",
+            f"{balance:,.2f}",
+        ))
+    first = pairs[0][0] if pairs else None
+    last = pairs[-1][0] if pairs else None
+    return lines, balance, money_in, money_out, first, last
+
+
+def paginate(lines: List, rows_per_page: int) -> List[List]:
+    return [lines[i:i + rows_per_page] for i in range(0, len(lines), rows_per_page)] or [[]]
+
+
+# -----------------------------------------------------------------------------
+# HTML
+# -----------------------------------------------------------------------------
+
+_HTML_DOC = Template("""<!DOCTYPE html>
+<html lang="en-GB"><head><meta charset="utf-8"><title>Statement $account_no</title>
+<style>
+body{font-family:Arial,Helvetica,sans-serif;font-size:11px;color:#222;margin:0}
+.page{width:190mm;min-height:270mm;padding:10mm;page-break-after:always;position:relative}
+.page:last-child{page-break-after:auto}
+.hdr{display:flex;justify-content:space-between;border-bottom:2px solid #0b3d6b;padding-bottom:6px}
+.bank{font-size:18px;font-weight:bold;color:#0b3d6b}
+table{width:100%;border-collapse:collapse;margin-top:8px}
+th{background:#0b3d6b;color:#fff;text-align:left;padding:3px}
+td{padding:2px 3px;border-bottom:1px solid #e3e3e3}
+td.n,th.n{text-align:right;white-space:nowrap}
+.ftr{position:absolute;bottom:8mm;right:10mm;font-size:9px;color:#666}
+</style></head><body>
+$pages
+</body></html>
+""")
+
+_HTML_PAGE = Template("""<div class="page">
+<div class="hdr"><div><div class="bank">$bank_name</div><div>$holder<br>$location</div></div>
+<div>Sort code $sort_code<br>Account $account_no<br>Statement period $period</div></div>
+$summary<table><thead><tr><th>Date</th><th>Description</th><th class="n">Paid out (£)</th><th class="n">Paid in (£)</th><th class="n">Balance (£)</th></tr></thead>
+<tbody>
+$rows
+</tbody></table>
+<div class="ftr">Page $page of $page_count</div>
+</div>""")
+
+_HTML_SUMMARY = Template("""<p>Opening balance £$opening &nbsp;·&nbsp; Money in £$money_in &nbsp;·&nbsp; Money out £$money_out &nbsp;·&nbsp; Closing balance £$closing</p>
+""")
+
+_HTML_ROW = Template('<tr><td>$date</td><td>$desc</td><td class="n">$out</td><td class="n">$in_</td><td class="n">$bal</td></tr>')
+
+
+def render_html(header: Dict[str, str], pages: List[List], summary: Dict[str, str], page_times: List[float]) -> bytes:
+    esc = html.escape
+    # Holder, location and bank name come from LLM personas / config: escape them like the descriptions.
+    header = {k: esc(v) for k, v in header.items()}
+    rendered = []
+    for i, page in enumerate(pages, start=1):
+        t0 = time.perf_counter()
+        rows = "\n".join(
+            _HTML_ROW.substitute(date=d, desc=esc(desc), out=o, in_=n, bal=b) for d, desc, o, n, b in page
+        )
+        rendered.append(_HTML_PAGE.substitute(
+            header, page=i, page_count=len(pages), rows=rows,
+            summary=_HTML_SUMMARY.substitute(summary) if i == 1 else "",
+        ))
+        page_times.append(time.perf_counter() - t0)
+    return _HTML_DOC.substitute(account_no=header["account_no"], pages="\n".join(rendered)).encode("utf-8")
+
+
+# -----------------------------------------------------------------------------
+# PDF (minimal writer: A4, base-14 fonts, text only)
+# -----------------------------------------------------------------------------
+
+_PAGE_W, _PAGE_H = 595, 842  # A4 in points
+_ROW_FMT = "{:<9} {:<44.44} {:>11} {:>11} {:>12}"
+
+
+def _pdf_text(value: str) -> str:
+    raw = value.encode("cp1252", errors="replace").decode("latin-1")
+    return raw.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def _pdf_page_stream(header: Dict[str, str], page: List, page_no: int, page_count: int,
+                     summary: Optional[Dict[str, str]]) -> bytes:
+    ops = ["BT", "/F2 16 Tf", f"40 {_PAGE_H - 50} Td", f"({_pdf_text(header['bank_name'])}) Tj", "ET"]
+    left = [header["holder"], header["location"]]
+    right = [f"Sort code {header['sort_code']}", f"Account {header['account_no']}", f"Period {header['period']}"]
+    for i, text in enumerate(left):
+        ops += ["BT", "/F1 9 Tf", f"40 {_PAGE_H - 70 - 12 * i} Td", f"({_pdf_text(text)}) Tj", "ET"]
+    for i, text in enumerate(right):
+        ops += ["BT", "/F1 9 Tf", f"380 {_PAGE_H - 50 - 12 * i} Td", f"({_pdf_text(text)}) Tj", "ET"]
+    ops.append(f"40 {_PAGE_H - 100} m {_PAGE_W - 40} {_PAGE_H - 100} l S")
+
+    y = _PAGE_H - 118
+    if summary:
+        line = (f"Opening £{summary['opening']}   Money in £{summary['money_in']}   "
+                f"Money out £{summary['money_out']}   Closing £{summary['closing']}")
+        ops += ["BT", "/F1 9 Tf", f"40 {y} Td", f"({_pdf_text(line)}) Tj", "ET"]
+        y -= 18
+
+    ops += ["BT", "/F3 8 Tf", "10 TL", f"40 {y} Td",
+            f"({_pdf_text(_ROW_FMT.format('Date', 'Description', 'Paid out', 'Paid in', 'Balance'))}) Tj"]
+    for d, desc, o, n, b in page:
+        ops.append(f"T* ({_pdf_text(_ROW_FMT.format(d, desc, o, n, b))}) Tj")
+    ops.append("ET")
+    ops += ["BT", "/F1 8 Tf", f"{_PAGE_W - 100} 30 Td", f"(Page {page_no} of {page_count}) Tj", "ET"]
+    return "\n".join(ops).encode("latin-1")
+
+
+def render_pdf(header: Dict[str, str], pages: List[List], summary: Dict[str, str], page_times: List[float]) -> bytes:
+    # Object layout: 1 catalog, 2 pages, 3-5 fonts, then (page, contents) pairs.
+    objects: List[bytes] = [b"", b"",
+                            b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+                            b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>",
+                            b"<< /Type /Font /Subtype /Type1 /BaseFont /Courier /Encoding /WinAnsiEncoding >>"]
+    kids = []
+    for i, page in enumerate(pages, start=1):
+        t0 = time.perf_counter()
+        stream = _pdf_page_stream(header, page, i, len(pages), summary if i == 1 else None)
+        page_id, content_id = len(objects) + 1, len(objects) + 2
+        kids.append(f"{page_id} 0 R")
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {_PAGE_W} {_PAGE_H}] "
+            f"/Resources << /Font << /F1 3 0 R /F2 4 0 R /F3 5 0 R >> >> /Contents {content_id} 0 R >>".encode("ascii")
+        )
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        page_times.append(time.perf_counter() - t0)
+    objects[0] = b"<< /Type /Catalog /Pages 2 0 R >>"
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>".encode("ascii")
+
+    out = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for num, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % num + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % off for off in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+_RENDERERS = {"html": render_html, "pdf": render_pdf}
+
+
+# -----------------------------------------------------------------------------
+# Worker
+# -----------------------------------------------------------------------------
+
+def _peak_rss_mib() -> float:
+    if resource is None:
+        return 0.0
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    scale = 1 if os.uname().sysname == "Darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / (1024 * 1024)
+
+
+def render_statement(path: str, persona: Dict[str, str], opts: StatementOptions) -> RenderResult:
+    """Render one user's statement to disk. Runs inside pool workers."""
+    t0 = time.perf_counter()
+    user_id = Path(path).stem
+    page_times: List[float] = []
+    try:
+        rows = read_user_transactions(path)
+        lines, closing, money_in, money_out, first, last = build_lines(rows, opts.opening_balance)
+        pages = paginate(lines, opts.rows_per_page)
+        sort_code, account_no = account_details(user_id)
+        header = {
+            "bank_name": opts.bank_name,
+            "holder": persona.get("full_name") or user_id,
+            "location": persona.get("location") or "",
+            "sort_code": sort_code,
+            "account_no": account_no,
+            "period": f"{first:%d %b %Y} to {last:%d %b %Y}" if first else "no transactions",
+        }
+        summary = {
+            "opening": f"{opts.opening_balance:,.2f}",
+            "money_in": f"{money_in:,.2f}",
+            "money_out": f"{money_out:,.2f}",
+            "closing": f"{closing:,.2f}",
+        }
+        data = _RENDERERS[opts.fmt](header, pages, summary, page_times)
+        out_path = Path(opts.out_dir) / f"{user_id}.{opts.fmt}"
+        out_path.write_bytes(data)
+        return RenderResult(user_id, len(pages), len(lines), time.perf_counter() - t0, page_times, _peak_rss_mib())
+    except Exception as e:
+        return RenderResult(user_id, 0, 0, time.perf_counter() - t0, page_times, _peak_rss_mib(), error=repr(e))
+
+
+def _render_task(args) -> RenderResult:
+    return render_statement(*args)
+
+
+# -----------------------------------------------------------------------------
+# Orchestration
+# -----------------------------------------------------------------------------
+
+def _tasks(cfg: AppConfig, opts: StatementOptions, limit: Optional[int]) -> Iterator[tuple]:
+    personas = read_personas(cfg.output_dir, columns=["full_name", "location"])
+    for i, path in enumerate(transaction_files(cfg.output_dir)):
+        if limit is not None and i >= limit:
+            return
+        yield str(path), personas.get(path.stem, {}), opts
+
+
+@log.log_timed("RENDER")
+def render_all(fmt: Optional[str] = None, workers: Optional[int] = None, limit: Optional[int] = None) -> None:
+    """
+    Render statements for every user under output_dir/transactions with a process pool.
+    """
+    cfg = get_config()
+    fmt = fmt or cfg.render_format
+    if fmt not in _RENDERERS:
+        raise ValueError(f"Unknown render format {fmt!r}; expected one of {sorted(_RENDERERS)}")
+    workers = workers or cfg.render_workers or os.cpu_count() or 1
+
+    out_dir = Path(cfg.output_dir) / "statements"
+    out_dir.mkdir(parents=True, exist_ok=True)
+    opts = StatementOptions(fmt, cfg.render_bank_name, cfg.render_opening_balance, cfg.render_rows_per_page, str(out_dir))
+
+    log.info(f"Rendering {fmt.upper()} statements with {workers} workers -> {out_dir}", tag="RENDER")
+    t0 = time.perf_counter()
+    done = pages = failed = 0
+    peak_rss = 0.0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for res in pool.map(_render_task, _tasks(cfg, opts, limit), chunksize=32):
+            if res.error:
+                failed += 1
+                metrics.inc("render_failures_total")
+                log.error(f"Failed to render {res.user_id}: {res.error}", tag="RENDER")
+                continue
+            done += 1
+            pages += res.pages
+            peak_rss = max(peak_rss, res.peak_rss_mib)
+            metrics.inc("render_statements_total")
+            metrics.inc("render_pages_total", res.pages)
+            metrics.observe("render_statement_seconds", res.seconds)
+            for page_s in res.page_seconds:
+                metrics.observe("render_page_seconds", page_s)
+            metrics.observe("render_worker_peak_rss_mib", res.peak_rss_mib)
+
+    wall = time.perf_counter() - t0
+    rate = done / wall * 3600 if wall > 0 else 0.0
+    log.info(
+        f"✅ Rendered {done} statements ({pages} pages, {failed} failed) in {wall:.1f}s "
+        f"≈ {rate:,.0f} statements/hour; peak worker RSS {peak_rss:.1f} MiB",
+        tag="RENDER",
+    )
@@ -0,0 +1,256 @@
+# replay.py
+"""
+Time-ordered global event stream (`bankgen replay`).
+
+Streaming consumers (fraud-detection prototypes, stream processors) want one live feed of
+transactions, not a directory of per-user files. replay k-way merges every user's
+time-sorted history into a single chronological stream of JSON Lines events:
+
+    {"AccountId":"user_00042","TransactionId":"user_00042-000017","CreditDebitIndicator":"Debit",...}
+
+Each event is the row's OBIE v3.1 Transaction object, pre-serialised in the transaction
+index (scripts/tx_index.py), so nothing is formatted per event. With `labels` the ground
+truth is appended as "Labels": {"risk_flag", "source_type", "is_income"}.
+
+The merge runs over the memory-mapped index, one time window at a time: each user keeps a
+cursor, every cursor whose next row falls inside the window is advanced (vectorised over
+users), the window's rows are sorted by timestamp (ties: index order) and emitted. The
+window is resized after each step to hold about WINDOW_EVENTS events, so memory is
+bounded by the window and the per-user cursors, whatever the dataset size.
+
+    speed 0      as fast as possible
+    speed N      N seconds of booking time per wall-clock second (86400 = one day per second)
+
+Sinks: stdout, a file, or a socket — `host:port` (TCP) or a filesystem path (Unix domain
+socket); replay listens there and streams to the first client that connects.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import socket
+import sys
+import time
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional
+
+import numpy as np
+
+from kirkomi_utils.logging.logger import log
+from .config import get_config
+from .dataset import parse_timestamp
+from .metrics import metrics
+from .tx_index import TransactionIndex, open_index
+
+WINDOW_EVENTS = 65_536
+# Longest single sleep while pacing, so interrupts and client disconnects are noticed.
+MAX_SLEEP_S = 0.25
+
+
+def _ranges(starts: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """Concatenated arange(start, start + count) for every pair (vectorised)."""
+    total = int(counts.sum())
+    return np.repeat(starts - (np.cumsum(counts) - counts), counts) + np.arange(total)
+
+
+def merge_windows(index: TransactionIndex, from_ts: Optional[int] = None, to_ts: Optional[int] = None,
+                  window_events: int = WINDOW_EVENTS) -> Iterator[np.ndarray]:
+    """
+    Yield row numbers of the index in global timestamp order, as consecutive windows
+    (from_ts / to_ts are inclusive epoch-second bounds).
+    """
+    ts = index.column("ts")
+    pos = np.fromiter((u.start for u in index.users), dtype=np.int64, count=len(index.users))
+    end = np.fromiter((u.end for u in index.users), dtype=np.int64, count=len(index.users))
+    if from_ts is not None or to_ts is not None:
+        for i, user in enumerate(index.users):
+            pos[i], end[i] = index.time_range(user, from_ts, to_ts)
+    live = np.flatnonzero(pos < end)
+    total = int((end - pos).sum())
+    if not total:
+        return
+    heads = ts[pos[live]]
+    t = int(heads.min())
+    span = max(1, int(ts[end[live] - 1].max()) - t + 1)
+    width = max(1, span * window_events // total)
+
+    while live.size:
+        hi = t + width
+        cur = pos[live]
+        stop = end[live]
+        step = np.flatnonzero(ts[cur] < hi)
+        while step.size:
+            cur[step] += 1
+            step = step[cur[step] < stop[step]]
+            step = step[ts[cur[step]] < hi]
+        counts = cur - pos[live]
+        moved = np.flatnonzero(counts)
+        if moved.size:
+            rows = _ranges(pos[live][moved], counts[moved])
+            yield rows[np.argsort(ts[rows], kind="stable")]
+        pos[live] = cur
+        live = live[cur < stop]
+        if not live.size:
+            break
+        n = int(counts.sum())
+        # Aim the next window at ~window_events rows; jump over empty stretches.
+        width = max(1, int(width * min(4.0, max(0.25, window_events / n)))) if n else width
+        t = hi if n else int(ts[pos[live]].min())
+
+
+class _LabelSuffix:
+    """`,"Labels":{...}}` byte strings per (risk_flag, source_type, is_income) code, built on first use."""
+
+    def __init__(self, index: TransactionIndex) -> None:
+        self.risk = index.column("risk_flag")
+        self.source = index.column("source_type")
+        self.income = index.column("is_income")
+        self.risk_values = index.dictionaries["risk_flag"]
+        self.source_values = index.dictionaries["source_type"]
+        self._cache: Dict[int, bytes] = {}
+
+    def __call__(self, rows: np.ndarray) -> list:
+        keys = ((self.risk[rows].astype(np.int64) << 17) | (self.source[rows].astype(np.int64) << 1)
+                | self.income[rows].astype(np.int64)).tolist()
+        cache = self._cache
+        out = []
+        for key in keys:
+            suffix = cache.get(key)
+            if suffix is None:
+                labels = {
+                    "risk_flag": self.risk_values[key >> 17] or None,
+                    "source_type": self.source_values[(key >> 1) & 0xFFFF] or None,
+                    "is_income": bool(key & 1),
+                }
+                suffix = cache[key] = (',"Labels":' + json.dumps(labels, separators=(",", ":")) + "}").encode()
+            out.append(suffix)
+        return out
+
+
+def _encode(index: TransactionIndex, rows: np.ndarray, labels: Optional[_LabelSuffix]) -> bytes:
+    objects = index.obie_objects(rows)
+    if labels is None:
+        return b"\n".join(objects) + b"\n"
+    return b"\n".join([obj[:-1] + suffix for obj, suffix in zip(objects, labels(rows))]) + b"\n"
+
+
+class _Sink:
+    """Where events go: stdout, a file, or the first client of a listening socket."""
+
+    def __init__(self, out: Optional[str] = None, address: Optional[str] = None) -> None:
+        self._cleanup: List[Callable[[], None]] = []
+        self._conn: Optional[socket.socket] = None
+        self._file: Optional[BinaryIO] = None
+        if address:
+            self._conn = self._accept(address)
+        elif out:
+            self._file = open(out, "wb", buffering=1 << 20)
+            self._cleanup.append(self._file.close)
+        else:
+            # Events get the original stdout; fd 1 is pointed at stderr so log output or stray
+            # prints cannot interleave with the stream.
+            sys.stdout.flush()
+            self._file = os.fdopen(os.dup(sys.stdout.fileno()), "wb", buffering=1 << 20)
+            os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+            self._cleanup.append(self._file.close)
+
+    def _accept(self, address: str) -> socket.socket:
+        host, _, port = address.rpartition(":")
+        if port.isdigit():
+            server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            server.bind((host or "127.0.0.1", int(port)))
+        else:
+            if os.path.exists(address):
+                os.unlink(address)
+            server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            server.bind(address)
+            self._cleanup.append(lambda: os.path.exists(address) and os.unlink(address))
+        server.listen(1)
+        log.info(f"Waiting for a consumer on {address}", tag="REPLAY")
+        conn, peer = server.accept()
+        server.close()
+        log.info(f"Consumer connected from {peer or address}", tag="REPLAY")
+        self._cleanup.append(conn.close)
+        return conn
+
+    def write(self, data: bytes) -> None:
+        if self._conn is not None:
+            self._conn.sendall(data)
+        else:
+            self._file.write(data)
+
+    def discard(self) -> None:
+        """The consumer went away: drop whatever is still buffered instead of failing on it."""
+        if self._file is not None:
+            devnull = os.open(os.devnull, os.O_WRONLY)
+            os.dup2(devnull, self._file.fileno())
+            os.close(devnull)
+
+    def close(self) -> None:
+        for cleanup in reversed(self._cleanup):
+            cleanup()
+
+
+def _epoch(value: Optional[str], name: str) -> Optional[int]:
+    if value is None:
+        return None
+    parsed = parse_timestamp(value)
+    if parsed is None:
+        raise ValueError(f"{name}: not an ISO 8601 date/time: {value!r}")
+    return int(parsed.timestamp())
+
+
+@log.log_timed("REPLAY")
+def replay(speed: float = 0.0, out: Optional[str] = None, address: Optional[str] = None,
+           labels: bool = False, from_time: Optional[str] = None, to_time: Optional[str] = None,
+           limit: Optional[int] = None, rebuild_index: bool = False) -> int:
+    """
+    Stream the dataset's transactions in global time order. Returns the number of events sent.
+    A consumer that goes away (closed pipe or socket) ends the replay quietly.
+    """
+    cfg = get_config()
+    index = open_index(cfg, rebuild=rebuild_index)
+    from_ts, to_ts = _epoch(from_time, "--from"), _epoch(to_time, "--to")
+    suffix = _LabelSuffix(index) if labels else None
+    ts = index.column("ts")
+    sink = _Sink(out, address)
+    sent = 0
+    t_start = time.perf_counter()
+    first_ts: Optional[int] = None
+    try:
+        for rows in merge_windows(index, from_ts, to_ts):
+            if limit is not None:
+                rows = rows[:limit - sent]
+            if speed <= 0:
+                sink.write(_encode(index, rows, suffix))
+                sent += len(rows)
+            else:
+                times = ts[rows]
+                if first_ts is None:
+                    first_ts = int(times[0])
+                i = 0
+                while i < len(rows):
+                    # Booking time reached by now; send everything due, else sleep until the next event.
+                    clock = first_ts + (time.perf_counter() - t_start) * speed
+                    j = int(np.searchsorted(times, clock, side="right"))
+                    if j > i:
+                        sink.write(_encode(index, rows[i:j], suffix))
+                        sent += j - i
+                        i = j
+                    else:
+                        time.sleep(min(MAX_SLEEP_S, (int(times[i]) - clock) / speed))
+            if limit is not None and sent >= limit:
+                break
+    except (BrokenPipeError, ConnectionResetError):
+        log.info("Consumer disconnected; stopping.", tag="REPLAY")
+        sink.discard()
+    finally:
+        sink.close()
+
+    elapsed = time.perf_counter() - t_start
+    metrics.inc("replay_events_total", sent)
+    rate = sent / elapsed if elapsed else float("inf")
+    target = address or out or "stdout"
+    log.info(f"✅ Replayed {sent} events to {target} in {elapsed:.2f}s ({rate:,.0f} events/s)", tag="REPLAY")
+    return sent
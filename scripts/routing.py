@@ -0,0 +1,279 @@
+# routing.py
+"""
+Tiered model routing (model_routing: tiered).
+
+Most personas are simple PAYE / gig blends that a cheaper, faster model handles fine, so
+every call going to `model` overpays for them. With tiered routing each job is sent to a
+tier first:
+
+    draft     model_draft: transaction jobs for simple personas, every fixed-size persona batch
+    premium   model: transaction jobs whose persona is complex, i.e. any of
+                - more than routing_max_income_streams formal / informal / government sources
+                - fraud-like or synthetic-loop events (RISK_EVENTS in notable_events,
+                  financial_stress_signals or income event sources)
+                - declared monthly income variance above routing_max_variance_pct
+
+A draft response is validated locally before it is used (check_transactions /
+check_personas: parses, enough rows, income present and near the declared level, no
+personas dropped or missing their income). When validation fails the job is escalated:
+the same prompt goes to the premium model, whose answer is used as is (as without routing).
+
+Premium calls carry no model override, so their request keys, cache entries and cassettes
+are exactly those of an unrouted run.
+
+Per-tier jobs, attempt latency and cost, and escalations (by reason) are recorded in
+scripts.metrics and summarised by report() at the end of each stage. Persona batches in
+adaptive sizing (which tunes the batch size to one model) and in batch mode stay on `model`.
+"""
+
+from __future__ import annotations
+
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, TypeVar
+
+from kirkomi_utils.logging.logger import log
+from .config import AppConfig
+from .features import DECLARED_FIELDS
+from .helpers import call_cost
+from .metrics import metrics
+from . import records
+
+T = TypeVar("T")
+
+TIERS = ("draft", "premium")
+
+RISK_EVENTS = re.compile(
+    r"fraud|synthetic|round[- ]?trip|\bloops?\b|\bmules?\b|unexplained|unknown (?:sender|transfer|source)|suspicious",
+    re.IGNORECASE,
+)
+STREAM_FIELDS = ("formal_sources", "informal_sources", "government_support")
+
+# Draft validation thresholds.
+MIN_ROWS_PER_MONTH = 5         # the prompt asks for 60–150 rows over 6 months
+INCOME_TOLERANCE = 0.35        # |generated - declared| income, as a share of declared (the prompt asks ±15%)
+
+
+@dataclass(frozen=True)
+class Route:
+    kind: str                   # "personas" | "transactions"
+    tier: str                   # "draft" | "premium"
+    reason: str = ""            # why premium: "streams", "risk_events", "variance"
+
+
+def enabled(cfg: AppConfig) -> bool:
+    return cfg.model_routing == "tiered"
+
+
+def _strings(value: Any) -> List[str]:
+    value = records.persona_field(value)
+    if isinstance(value, (list, tuple)):
+        return [str(v).strip() for v in value if str(v).strip()]
+    return [str(value).strip()] if isinstance(value, str) and value.strip() else []
+
+
+def _streams(user: Dict[str, Any]) -> Dict[str, Any]:
+    streams = records.persona_field(user.get("income_streams"))
+    return streams if isinstance(streams, dict) else {}
+
+
+def complexity(cfg: AppConfig, user: Dict[str, Any]) -> List[str]:
+    """Reasons `user` needs the premium tier (empty: the draft tier will do)."""
+    streams = _streams(user)
+    reasons = []
+    sources = {s.lower() for name in STREAM_FIELDS for s in _strings(streams.get(name))}
+    if len(sources) > cfg.routing_max_income_streams:
+        reasons.append("streams")
+    expense = records.persona_field(user.get("expense_behavior"))
+    events = _strings(user.get("notable_events"))
+    events += _strings(expense.get("financial_stress_signals")) if isinstance(expense, dict) else []
+    events += [str(e.get("source", "")) for e in records.persona_field(streams.get(records.INCOME_EVENTS_KEY)) or () if isinstance(e, dict)]
+    if any(RISK_EVENTS.search(event) for event in events):
+        reasons.append("risk_events")
+    variance = records.declared_number(streams, DECLARED_FIELDS["declared_monthly_income_variance_pct"])
+    if variance is not None and variance > cfg.routing_max_variance_pct:
+        reasons.append("variance")
+    return reasons
+
+
+def transaction_route(cfg: AppConfig, user: Dict[str, Any]) -> Route:
+    reasons = complexity(cfg, user)
+    return Route("transactions", "premium" if reasons else "draft", reasons[0] if reasons else "")
+
+
+def persona_route(cfg: AppConfig) -> Route:
+    """Persona batches have no input to score: every batch starts on the draft tier."""
+    return Route("personas", "draft")
+
+
+def model_overrides(cfg: AppConfig, tier: str) -> Dict[str, Any]:
+    """Per-call / batch-body model parameter for a tier (premium: none, i.e. `model`)."""
+    return {"model": cfg.model_draft} if tier == "draft" and enabled(cfg) else {}
+
+
+# -- draft validation ------------------------------------------------------------
+
+def check_transactions(cfg: AppConfig, user: Dict[str, Any], txns: Sequence[records.Transaction]) -> List[str]:
+    """Why a draft history is not good enough (empty: accept it)."""
+    if len(txns) < MIN_ROWS_PER_MONTH * cfg.months:
+        return ["too_few_rows"]
+    declared = records.declared_number(_streams(user), DECLARED_FIELDS["declared_monthly_income_gbp"])
+    income = sum(t.amount for t in txns if t.is_income and t.amount > 0)
+    if declared and not income:
+        return ["no_income"]
+    if declared and abs(income - declared * cfg.months) > INCOME_TOLERANCE * declared * cfg.months:
+        return ["income_mismatch"]
+    return []
+
+
+def check_personas(rows: Sequence[records.Persona], n: int) -> List[str]:
+    """Why a draft persona batch is not good enough (empty: accept it)."""
+    if len(rows) < n:
+        return ["missing_personas"]
+    for persona in rows:
+        streams = persona.income_streams
+        if not persona.occupations or not any(_strings(streams.get(name)) for name in STREAM_FIELDS):
+            return ["incomplete"]
+        if not records.declared_number(streams, DECLARED_FIELDS["declared_monthly_income_gbp"]):
+            return ["no_income"]
+    return []
+
+
+# -- per-tier statistics ---------------------------------------------------------
+
+class _Stats:
+    """Per (kind, tier): jobs, attempts, seconds, cost; per kind: escalations. Summarised by report()."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.jobs: Dict[Tuple[str, str], int] = {}
+        self.attempts: Dict[Tuple[str, str], List[float]] = {}      # [count, seconds, cost_usd]
+        self.escalations: Dict[str, int] = {}
+
+    def job(self, route: Route) -> None:
+        metrics.inc("routing_jobs_total", labels={"kind": route.kind, "tier": route.tier})
+        with self._lock:
+            self.jobs[(route.kind, route.tier)] = self.jobs.get((route.kind, route.tier), 0) + 1
+
+    def attempt(self, kind: str, tier: str, seconds: float, cost: float) -> None:
+        labels = {"kind": kind, "tier": tier}
+        metrics.observe("routing_attempt_seconds", seconds, labels=labels)
+        if cost:
+            metrics.inc("routing_cost_usd_total", cost, labels=labels)
+        with self._lock:
+            totals = self.attempts.setdefault((kind, tier), [0, 0.0, 0.0])
+            totals[0] += 1
+            totals[1] += seconds
+            totals[2] += cost
+
+    def escalation(self, kind: str, reason: str) -> None:
+        metrics.inc("routing_escalations_total", labels={"kind": kind, "reason": reason})
+        with self._lock:
+            self.escalations[kind] = self.escalations.get(kind, 0) + 1
+
+
+_stats = _Stats()
+
+
+def record_attempt(route: Route, tier: str, res: Any, seconds: float, model: Optional[str], batch: bool = False) -> None:
+    """Latency / cost of one attempt on `tier` (batch results: pass seconds=0)."""
+    _stats.attempt(route.kind, tier, seconds, call_cost(res, model, batch=batch))
+
+
+def record_job(route: Route) -> None:
+    _stats.job(route)
+
+
+def record_escalation(route: Route, problems: Sequence[str]) -> None:
+    _stats.escalation(route.kind, problems[0] if problems else "invalid")
+
+
+def report(kind: str) -> None:
+    """Log jobs per tier, escalation rate and mean latency / cost per attempt for one job kind."""
+    with _stats._lock:
+        draft = _stats.jobs.get((kind, "draft"), 0)
+        premium = _stats.jobs.get((kind, "premium"), 0)
+        escalated = _stats.escalations.get(kind, 0)
+        attempts = {tier: _stats.attempts.get((kind, tier), (0, 0.0, 0.0)) for tier in TIERS}
+    if not draft and not premium:
+        return
+    parts = [f"{tier} {n} calls, {seconds / n:.1f}s / ${cost / n:.4f} per call"
+             for tier, (n, seconds, cost) in attempts.items() if n]
+    rate = f"{escalated / draft:.1%}" if draft else "n/a"
+    log.info(
+        f"Routing ({kind}): {draft} draft / {premium} premium jobs, {escalated} escalated ({rate} of drafts); "
+        + "; ".join(parts),
+        tag="ROUTING",
+    )
+
+
+# -- routed calls ----------------------------------------------------------------
+
+def chat(llm, cfg: AppConfig, route: Route, messages, parse: Callable[[Any], T],
+         check: Callable[[T], List[str]], **kwargs) -> Tuple[T, Any, float]:
+    """
+    Call the LLM on the route's tier and parse the response; a draft that fails to parse or
+    `check` is escalated to premium. Returns (parsed, response, latency_s) of the attempt
+    used. Without routing this is a plain llm.chat + parse.
+    """
+    if not enabled(cfg):
+        t0 = time.perf_counter()
+        res = llm.chat(messages, **kwargs)
+        latency_s = time.perf_counter() - t0
+        return parse(res), res, latency_s
+
+    record_job(route)
+    if route.tier == "draft":
+        try:
+            t0 = time.perf_counter()
+            res = llm.chat(messages, **kwargs, **model_overrides(cfg, "draft"))
+            latency_s = time.perf_counter() - t0
+            record_attempt(route, "draft", res, latency_s, cfg.model_draft)
+            value = parse(res)
+            problems = check(value)
+        except Exception as e:
+            problems = ["error"]
+            log.debug(f"Draft {route.kind} call failed: {e}", tag="ROUTING")
+        if not problems:
+            return value, res, latency_s
+        record_escalation(route, problems)
+
+    t0 = time.perf_counter()
+    res = llm.chat(messages, **kwargs)
+    latency_s = time.perf_counter() - t0
+    record_attempt(route, "premium", res, latency_s, cfg.model)
+    return parse(res), res, latency_s
+
+
+async def chat_async(llm, cfg: AppConfig, route: Route, messages, parse: Callable[[Any], T],
+                     check: Callable[[T], List[str]], **kwargs) -> Tuple[T, Any, float]:
+    """Async chat(): same routing, escalation and recording."""
+    if not enabled(cfg):
+        t0 = time.perf_counter()
+        res = await llm.chat_async(messages, **kwargs)
+        latency_s = time.perf_counter() - t0
+        return parse(res), res, latency_s
+
+    record_job(route)
+    if route.tier == "draft":
+        try:
+            t0 = time.perf_counter()
+            res = await llm.chat_async(messages, **kwargs, **model_overrides(cfg, "draft"))
+            latency_s = time.perf_counter() - t0
+            record_attempt(route, "draft", res, latency_s, cfg.model_draft)
+            value = parse(res)
+            problems = check(value)
+        except Exception as e:
+            problems = ["error"]
+            log.debug(f"Draft {route.kind} call failed: {e}", tag="ROUTING")
+        if not problems:
+            return value, res, latency_s
+        record_escalation(route, problems)
+
+    t0 = time.perf_counter()
+    res = await llm.chat_async(messages, **kwargs)
+    latency_s = time.perf_counter() - t0
+    record_attempt(route, "premium", res, latency_s, cfg.model)
+    return parse(res), res, latency_s
@@ -0,0 +1,474 @@
+# semantic_cache.py
+"""
+Semantic near-duplicate cache for persona -> transactions (semantic_cache: true).
+
+The LLM client's cache only helps when a prompt is byte-identical. Sampled and augmented
+personas are often near-identical instead: same occupations and sources, same town, a
+similar income. For those users this cache reuses a history already generated for a
+similar persona and adapts it locally, without an LLM call:
+
+    vector      persona tokens (occupations, location, formal / informal sources, employers,
+                government support, payment frequency, spend / obligation / stress lists)
+                hashed into DIMENSIONS signed buckets, weighted per field, L2-normalised
+    similarity  cosine(vectors) x min(income) / max(income) x (1 - |cv difference|),
+                income and cv being the declared monthly income and its variance
+    hit         best entry with similarity >= semantic_cache_threshold, in the same scope
+                (cache_scope: the transaction prompt minus the persona, i.e. template, output
+                contract and months, plus model / temperature), reused fewer than
+                semantic_cache_max_reuse times
+    adapt       amounts rescaled by the income ratio (with ROW_SIGMA per-row noise, seeded
+                by user_id); the source persona's employers and formal / informal sources
+                renamed to the target's, in full and in the bank-feed forms the noise engine
+                uses (first word, hyphenated, no spaces, truncated)
+
+Only LLM-generated histories become entries (adapting an adaptation would compound drift).
+In async runs a user that matches a history still being generated waits for it instead
+of making its own call, like the client's single-flight for identical requests. Batch mode
+only reuses histories from earlier runs.
+
+Storage (<output_dir>/semantic_cache/): index.jsonl, one line per entry (vector, income,
+names, offset into histories.bin) or per reuse; histories.bin, zlib-compressed JSON
+histories. Both are append-only and only touched under an exclusive flock, which also
+re-reads the index lines other processes appended since, before every lookup and add. Concurrent
+workers therefore share entries as soon as they are written, and semantic_cache_max_reuse holds
+across all of them.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import fcntl
+import json
+import math
+import re
+import threading
+import zlib
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from kirkomi_utils.logging.logger import log
+from .config import AppConfig
+from .features import DECLARED_FIELDS
+from .manifest import artifact_hash
+from .metrics import metrics
+from . import records
+
+SEMANTIC_CACHE_DIR = "semantic_cache"
+DIMENSIONS = 256
+ROW_SIGMA = 0.03           # per-row amount noise on adapted histories
+DEFAULT_CV = 0.15          # when the persona does not declare its income variance
+
+# Persona list / text fields (dotted = nested in income_streams / expense_behavior) and their weights.
+TOKEN_FIELDS = {
+    "occupations": 3.0,
+    "location": 1.0,
+    "income_streams.formal_sources": 2.0,
+    "income_streams.employers_last_6_months": 1.5,
+    "income_streams.informal_sources": 1.5,
+    "income_streams.government_support": 1.5,
+    "income_streams.payment_frequency": 1.0,
+    "expense_behavior.spend_categories": 0.5,
+    "expense_behavior.regular_obligations": 0.5,
+    "expense_behavior.financial_stress_signals": 0.5,
+}
+# Name lists renamed source -> target, position by position.
+RENAME_FIELDS = ("employers_last_6_months", "formal_sources", "informal_sources")
+
+_WORD = re.compile(r"[a-z0-9]+")
+_GENERIC = {"the", "ltd", "limited", "plc", "and", "from", "cash", "private", "client", "clients", "payroll", "pay"}
+
+
+def _items(value: Any) -> List[str]:
+    if isinstance(value, (list, tuple)):
+        return [str(v).strip() for v in value if str(v).strip()]
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return []
+    value = str(value).strip()
+    return [value] if value else []
+
+
+@dataclass
+class PersonaKey:
+    """What the cache compares: hashed token vector, declared income / cv and payee names."""
+    vector: np.ndarray
+    income: float
+    cv: float
+    names: Dict[str, List[str]]
+
+
+def persona_key(user: Dict[str, Any]) -> PersonaKey:
+    objects = {name: records.persona_field(user.get(name)) for name in ("income_streams", "expense_behavior")}
+    streams = objects["income_streams"] if isinstance(objects["income_streams"], dict) else {}
+    vector = np.zeros(DIMENSIONS, dtype=np.float32)
+    for path, weight in TOKEN_FIELDS.items():
+        parent, _, key = path.rpartition(".")
+        source = objects.get(parent) if parent else user
+        value = records.persona_field(source.get(key)) if isinstance(source, dict) else None
+        for item in _items(value):
+            # The whole item and each of its words, prefixed with the field.
+            for token in (item.lower(), *_WORD.findall(item.lower())):
+                h = zlib.crc32(f"{path}:{token}".encode("utf-8"))
+                vector[h % DIMENSIONS] += weight if h & 0x10000 else -weight
+    norm = float(np.linalg.norm(vector))
+    if norm:
+        vector /= norm
+    income = records.declared_number(streams, DECLARED_FIELDS["declared_monthly_income_gbp"]) or 0.0
+    variance = records.declared_number(streams, DECLARED_FIELDS["declared_monthly_income_variance_pct"])
+    cv = variance / 100 if variance is not None and 0 < variance < 200 else DEFAULT_CV
+    names = {name: _items(records.persona_field(streams.get(name))) for name in RENAME_FIELDS}
+    return PersonaKey(vector, income, cv, names)
+
+
+def similarity(key: PersonaKey, vectors: np.ndarray, incomes: np.ndarray, cvs: np.ndarray) -> np.ndarray:
+    """Similarity of one persona to every row of (vectors, incomes, cvs)."""
+    cosine = vectors @ key.vector
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # Undeclared on both sides compares equal; on one side only, never.
+        income = np.where((incomes > 0) & (key.income > 0),
+                          np.minimum(incomes, key.income) / np.maximum(incomes, key.income),
+                          np.where((incomes > 0) | (key.income > 0), 0.0, 1.0))
+    return cosine * income * np.clip(1.0 - np.abs(cvs - key.cv), 0.0, 1.0)
+
+
+# -- adaptation ------------------------------------------------------------------
+
+def _forms(name: str) -> List[Tuple[str, int]]:
+    """(form, position) of a payer name as it appears in bank feeds: full, hyphenated, no spaces, first word, truncated."""
+    words = re.sub(r"[^A-Za-z0-9& ]+", " ", name).split()
+    if not words:
+        return []
+    forms = [(" ".join(words), 0), ("-".join(words), 1), ("".join(words), 2)]
+    if len(words[0]) >= 3 and words[0].lower() not in _GENERIC:
+        forms.append((words[0], 3))
+    if len(name) > 10:
+        forms.append((name[:10].rstrip(), 4))
+    return forms
+
+
+def rename_map(source: Dict[str, List[str]], target: Dict[str, List[str]]) -> Dict[str, str]:
+    """Lower-cased source payer form -> replacement target form (same shape)."""
+    out: Dict[str, str] = {}
+    for name in RENAME_FIELDS:
+        for old, new in zip(source.get(name, ()), target.get(name, ())):
+            if old.lower() == new.lower():
+                continue
+            new_forms = dict((pos, form) for form, pos in _forms(new))
+            for form, pos in _forms(old):
+                if pos in new_forms:
+                    out.setdefault(form.lower(), new_forms[pos])
+    return out
+
+
+def _styled(new: str, matched: str) -> str:
+    return new.upper() if matched.isupper() else new
+
+
+def adapt(history: List[records.Transaction], source: PersonaKey, target: PersonaKey,
+          seed: str) -> List[records.Transaction]:
+    """A cached history rewritten for another persona (amounts rescaled, payees renamed)."""
+    factor = target.income / source.income if source.income > 0 and target.income > 0 else 1.0
+    rng = np.random.default_rng(zlib.crc32(seed.encode("utf-8")))
+    noise = np.exp(rng.normal(0, ROW_SIGMA, len(history)))
+    renames = rename_map(source.names, target.names)
+    pattern = None
+    if renames:
+        alternatives = "|".join(re.escape(form) for form in sorted(renames, key=len, reverse=True))
+        pattern = re.compile(rf"(?<![A-Za-z0-9])(?:{alternatives})(?![A-Za-z0-9])", re.IGNORECASE)
+
+    def rename(text: Optional[str]) -> Optional[str]:
+        if not text or pattern is None:
+            return text
+        return pattern.sub(lambda m: _styled(renames[m.group(0).lower()], m.group(0)), text)
+
+    out = []
+    for txn, n in zip(history, noise.tolist()):
+        out.append(records.Transaction(
+            txn.timestamp,
+            round(txn.amount * factor * n, 2),
+            txn.transaction_type,
+            txn.currency,
+            rename(txn.description_raw),
+            rename(txn.description_cleaned),
+            rename(txn.merchant_name),
+            txn.is_income,
+            txn.risk_flag,
+            txn.source_type,
+            dict(txn.extra) if txn.extra else None,
+        ))
+    return out
+
+
+# -- the cache -------------------------------------------------------------------
+
+@dataclass
+class _Entry:
+    user_id: str
+    key: PersonaKey
+    offset: int = -1                 # into histories.bin; -1 while the history is being generated
+    length: int = 0
+    row: int = -1                    # in the cache's vector / income / cv / live arrays
+    reused: int = 0
+    ready: Optional[asyncio.Event] = field(default=None, repr=False)
+    history: Optional[List[records.Transaction]] = field(default=None, repr=False)
+
+
+def _history_json(txns: List[records.Transaction]) -> bytes:
+    cols = records.to_columns(txns, records.TRANSACTION_COLUMNS)
+    rows = [{k: v[i] for k, v in cols.items()} for i in range(len(txns))]
+    return zlib.compress(json.dumps(rows, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), 6)
+
+
+def cache_scope(cfg: AppConfig) -> Dict[str, Any]:
+    """
+    What a reusable history must have been generated under: the inputs of the manifest's
+    transaction hash without the persona, so a prompt or contract change retires old entries.
+    """
+    from .generate_transactions import chat_options, create_prompt
+
+    prompt = create_prompt({}, cfg.months, cfg.llm_output_format)
+    return {"months": cfg.months, "model": cfg.model,
+            "prompt": artifact_hash(prompt, cfg, **chat_options(cfg.llm_output_format))}
+
+
+def _grown(array: np.ndarray, size: int) -> np.ndarray:
+    out = np.zeros((size, *array.shape[1:]), dtype=array.dtype)
+    out[:len(array)] = array
+    return out
+
+
+class SemanticCache:
+    """Entries for one output_dir and cache_scope(); see the module docstring."""
+
+    def __init__(self, cfg: AppConfig) -> None:
+        self.cfg = cfg
+        self.dir = Path(cfg.output_dir) / SEMANTIC_CACHE_DIR
+        self.index_path = self.dir / "index.jsonl"
+        self.data_path = self.dir / "histories.bin"
+        self.scope = cache_scope(cfg)
+        self.threshold = cfg.semantic_cache_threshold
+        self.max_reuse = cfg.semantic_cache_max_reuse
+        self.max_entries = cfg.semantic_cache_max_entries
+        self._lock = threading.Lock()
+        self._entries: List[_Entry] = []
+        self._by_user: Dict[str, _Entry] = {}
+        # Preallocated, doubled when full; rows past len(self._entries) are unused.
+        self._vectors = np.zeros((0, DIMENSIONS), dtype=np.float32)
+        self._incomes = np.zeros(0)
+        self._cvs = np.zeros(0)
+        self._live = np.zeros(0, dtype=bool)
+        self._index_pos = 0
+        self.lookups = 0
+        self.hits = 0
+        self._load()
+
+    # -- storage -----------------------------------------------------------------
+
+    def _load(self) -> None:
+        if not self.index_path.exists():
+            return
+        with open(self.index_path, "rb") as index:
+            self._read_index(index)
+        log.debug(f"Semantic cache: {len(self._entries)} entries from {self.index_path}", tag="SEMCACHE")
+
+    def _read_index(self, index) -> None:
+        """Apply the index lines past self._index_pos: entries and reuses written since (by any process)."""
+        index.seek(self._index_pos)
+        for raw in index:
+            if not raw.endswith(b"\n"):
+                break  # a line still being written (or torn by an interrupted writer)
+            self._index_pos += len(raw)
+            try:
+                line = json.loads(raw)
+            except json.JSONDecodeError:
+                continue
+            if "reused" in line:
+                entry = self._by_user.get(line["reused"])
+                if entry is not None and entry.offset >= 0:
+                    entry.reused += 1
+                    if entry.reused >= self.max_reuse:
+                        self._live[entry.row] = False
+            elif line.get("scope") == self.scope:
+                own = self._by_user.get(line["user_id"])
+                if own is not None and own.offset < 0:
+                    continue  # this process is generating the user too; waiters keep waiting for it
+                vector = np.zeros(DIMENSIONS, dtype=np.float32)
+                vector[np.asarray(line["idx"], dtype=np.int64)] = line["val"]
+                key = PersonaKey(vector, line["income"], line["cv"], line["names"])
+                self._append(_Entry(line["user_id"], key, line["offset"], line["length"]))
+
+    @contextmanager
+    def _shared(self):
+        """
+        Exclusive lock on the cache files, with what other processes appended applied first.
+        Yields (histories.bin, index.jsonl), both opened for appending in binary mode.
+        """
+        self.dir.mkdir(parents=True, exist_ok=True)
+        with open(self.data_path, "ab") as data, open(self.index_path, "a+b") as index:
+            fcntl.flock(data.fileno(), fcntl.LOCK_EX)
+            try:
+                self._read_index(index)
+                if index.seek(0, 2) > self._index_pos:
+                    index.write(b"\n")  # end a line torn by an interrupted writer before appending
+                yield data, index
+            finally:
+                index.flush()
+                self._index_pos = index.seek(0, 2)   # past this process's own lines
+                fcntl.flock(data.fileno(), fcntl.LOCK_UN)
+
+    def _append(self, entry: _Entry) -> None:
+        entry.row = len(self._entries)
+        if entry.row == len(self._incomes):
+            size = max(64, 2 * entry.row)
+            self._vectors, self._incomes, self._cvs, self._live = (
+                _grown(a, size) for a in (self._vectors, self._incomes, self._cvs, self._live)
+            )
+        self._entries.append(entry)
+        self._by_user[entry.user_id] = entry
+        self._vectors[entry.row] = entry.key.vector
+        self._incomes[entry.row] = entry.key.income
+        self._cvs[entry.row] = entry.key.cv
+        self._live[entry.row] = True
+
+    def _write(self, files, entry: _Entry, txns: List[records.Transaction]) -> None:
+        data, index = files
+        blob = _history_json(txns)
+        entry.offset, entry.length = data.seek(0, 2), len(blob)
+        data.write(blob)
+        data.flush()
+        nonzero = np.flatnonzero(entry.key.vector)
+        index.write(json.dumps({
+            "user_id": entry.user_id, "scope": self.scope, "offset": entry.offset, "length": entry.length,
+            "income": entry.key.income, "cv": entry.key.cv, "names": entry.key.names,
+            "idx": nonzero.tolist(), "val": [round(float(v), 5) for v in entry.key.vector[nonzero]],
+        }, ensure_ascii=False).encode("utf-8") + b"\n")
+
+    def _history(self, entry: _Entry) -> List[records.Transaction]:
+        if entry.history is None:
+            with open(self.data_path, "rb") as f:
+                f.seek(entry.offset)
+                blob = f.read(entry.length)
+            entry.history = records.decode_transactions(json.loads(zlib.decompress(blob)))
+        return entry.history
+
+    def _note_reuse(self, files, entry: _Entry) -> None:
+        entry.reused += 1
+        if entry.reused >= self.max_reuse:
+            self._live[entry.row] = False
+        files[1].write(json.dumps({"reused": entry.user_id}).encode("utf-8") + b"\n")
+
+    # -- lookups -----------------------------------------------------------------
+
+    def _best(self, user_id: str, key: PersonaKey, include_pending: bool) -> Optional[_Entry]:
+        n = len(self._entries)
+        if not n:
+            return None
+        scores = similarity(key, self._vectors[:n], self._incomes[:n], self._cvs[:n])
+        usable = self._live[:n].copy()
+        if not include_pending:
+            usable &= np.array([e.offset >= 0 for e in self._entries], dtype=bool)
+        own = self._by_user.get(user_id)
+        if own is not None:
+            # A regenerated user never gets its own (stale) history back.
+            usable[own.row] = False
+        scores = np.where(usable, scores, -1.0)
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            return None
+        metrics.observe("semantic_cache_similarity", float(scores[best]))
+        return self._entries[best]
+
+    def _hit(self, files, entry: _Entry, user: Dict[str, Any], key: PersonaKey) -> List[records.Transaction]:
+        txns = adapt(self._history(entry), entry.key, key, user["user_id"])
+        self._note_reuse(files, entry)
+        self.hits += 1
+        metrics.inc("semantic_cache_lookups_total", labels={"result": "hit"})
+        log.debug(f"{user['user_id']}: reusing the history of {entry.user_id} ({len(txns)} rows)", tag="SEMCACHE")
+        return txns
+
+    def _miss(self) -> None:
+        metrics.inc("semantic_cache_lookups_total", labels={"result": "miss"})
+
+    def lookup(self, user: Dict[str, Any]) -> Optional[List[records.Transaction]]:
+        """An adapted history for `user` from a stored entry, or None (generate it, then add())."""
+        key = persona_key(user)
+        with self._lock, self._shared() as files:
+            self.lookups += 1
+            entry = self._best(user["user_id"], key, include_pending=False)
+            if entry is None:
+                self._miss()
+                return None
+            return self._hit(files, entry, user, key)
+
+    async def lookup_async(self, user: Dict[str, Any]) -> Optional[List[records.Transaction]]:
+        """
+        Like lookup(), but a match that is still being generated is awaited. On a miss the
+        user is registered as pending, so similar users wait for it; the caller must add()
+        its result (an empty history releases the waiters, who then generate their own).
+        """
+        key = persona_key(user)
+        with self._lock, self._shared() as files:
+            self.lookups += 1
+            entry = self._best(user["user_id"], key, include_pending=True)
+            if entry is None:
+                self._miss()
+                if len(self._entries) < self.max_entries and user["user_id"] not in self._by_user:
+                    self._append(_Entry(user["user_id"], key, ready=asyncio.Event()))
+                return None
+            if entry.offset >= 0:
+                return self._hit(files, entry, user, key)
+        await entry.ready.wait()
+        with self._lock, self._shared() as files:
+            if entry.offset < 0 or not self._live[entry.row]:
+                self._miss()
+                return None
+            return self._hit(files, entry, user, key)
+
+    def add(self, user: Dict[str, Any], txns: List[records.Transaction]) -> None:
+        """Store a freshly generated history (no-op once max_entries is reached)."""
+        with self._lock, self._shared() as files:
+            entry = self._by_user.get(user["user_id"])
+            pending = entry is not None and entry.offset < 0
+            try:
+                if not txns:
+                    if pending:
+                        self._live[entry.row] = False
+                    return
+                if entry is None:
+                    if len(self._entries) >= self.max_entries:
+                        return
+                    entry = _Entry(user["user_id"], persona_key(user))
+                    self._append(entry)
+                elif not pending:
+                    return
+                self._write(files, entry, txns)
+                entry.history = txns
+                metrics.inc("semantic_cache_entries_total")
+            finally:
+                if pending and entry.ready is not None:
+                    entry.ready.set()
+
+    def report(self) -> None:
+        if not self.lookups:
+            return
+        log.info(
+            f"Semantic cache: {self.hits}/{self.lookups} users served from similar personas "
+            f"({self.hits / self.lookups:.1%} hit rate, {len(self._entries)} entries)",
+            tag="SEMCACHE",
+        )
+
+
+_CACHES: Dict[Tuple[Path, str], SemanticCache] = {}
+
+
+def get_semantic_cache(cfg: AppConfig) -> Optional[SemanticCache]:
+    """Process-wide SemanticCache for cfg (None unless semantic_cache is enabled)."""
+    if not cfg.semantic_cache:
+        return None
+    key = (Path(cfg.output_dir).resolve(), json.dumps(cache_scope(cfg), sort_keys=True))
+    if key not in _CACHES:
+        _CACHES[key] = SemanticCache(cfg)
+    return _CACHES[key]
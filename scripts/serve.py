@@ -0,0 +1,250 @@
+# serve.py
+"""
+Local Open Banking (OBIE Read/Write API v3.1, AISP) shaped mock server (`bankgen serve`).
+
+Exposes the generated dataset for load-testing Open Banking parsers:
+
+    GET /open-banking/v3.1/aisp/accounts[?page=N]
+    GET /open-banking/v3.1/aisp/accounts/{AccountId}
+    GET /open-banking/v3.1/aisp/accounts/{AccountId}/transactions
+            ?fromBookingDateTime=...&toBookingDateTime=...&page=N
+
+AccountId is the user_id. Responses use the OBIE envelope (Data / Links / Meta) with
+Links.Next/Prev/Last for pagination and OBIE error bodies for 400/404. Every query is
+answered from the memory-mapped index in scripts/tx_index.py: a time filter is two binary
+searches and a page is one contiguous slice of pre-serialised transaction JSON, so no CSV
+is read and no row is formatted per request.
+
+This is a test double: there is no auth, consent or mTLS.
+"""
+
+from __future__ import annotations
+
+import contextvars
+import json
+import signal
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+from kirkomi_utils.logging.logger import log
+from .config import AppConfig, get_config
+from .dataset import parse_timestamp
+from .metrics import metrics
+from .render import account_details
+from .tx_index import DEFAULT_CURRENCY, TransactionIndex, iso_utc, open_index
+
+API_PREFIX = "/open-banking/v3.1/aisp"
+
+
+class ApiError(Exception):
+    def __init__(self, status: int, code: str, message: str, path: Optional[str] = None) -> None:
+        super().__init__(message)
+        self.status = status
+        self.code = code
+        self.message = message
+        self.path = path
+
+    def body(self) -> Dict[str, Any]:
+        error = {"ErrorCode": self.code, "Message": self.message}
+        if self.path:
+            error["Path"] = self.path
+        reason = {400: "BadRequest", 404: "NotFound"}.get(self.status, "Error")
+        return {"Code": f"{self.status} {reason}", "Id": str(uuid.uuid4()), "Message": self.message, "Errors": [error]}
+
+
+def _json(body: Dict[str, Any]) -> bytes:
+    return json.dumps(body, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def _page_param(query: Dict[str, list]) -> int:
+    raw = query.get("page", ["1"])[0]
+    try:
+        page = int(raw)
+    except ValueError:
+        page = 0
+    if page < 1:
+        raise ApiError(400, "UK.OBIE.Field.Invalid", f"page must be a positive integer. Got: {raw!r}", "page")
+    return page
+
+
+def _time_param(query: Dict[str, list], name: str) -> Optional[int]:
+    if name not in query:
+        return None
+    ts = parse_timestamp(query[name][0])
+    if ts is None:
+        raise ApiError(400, "UK.OBIE.Field.InvalidDate", f"{name} must be an ISO-8601 date-time", name)
+    return int(ts.timestamp())
+
+
+class OpenBankingApi:
+    """Request routing and response shaping over a TransactionIndex (no HTTP concerns)."""
+
+    def __init__(self, index: TransactionIndex, cfg: AppConfig) -> None:
+        self.index = index
+        self.page_size = cfg.serve_page_size
+
+    def handle(self, raw_path: str, base_url: str) -> Tuple[str, bytes]:
+        """Returns (endpoint label, JSON response body). Raises ApiError."""
+        split = urlsplit(raw_path)
+        query = parse_qs(split.query)
+        parts = [p for p in split.path[len(API_PREFIX):].split("/") if p] if split.path.startswith(API_PREFIX) else None
+
+        if parts == ["accounts"]:
+            return "accounts", self.accounts(query, base_url + split.path)
+        if parts and len(parts) == 2 and parts[0] == "accounts":
+            return "account", self.account(parts[1], base_url + split.path)
+        if parts and len(parts) == 3 and parts[0] == "accounts" and parts[2] == "transactions":
+            return "transactions", self.transactions(parts[1], query, base_url + split.path)
+        raise ApiError(404, "UK.OBIE.Resource.NotFound", f"No route for {split.path}")
+
+    # -- resources -----------------------------------------------------------
+
+    def _account(self, user_id: str) -> Dict[str, Any]:
+        sort_code, account_no = account_details(user_id)
+        return {
+            "AccountId": user_id,
+            "Currency": DEFAULT_CURRENCY,
+            "AccountType": "Personal",
+            "AccountSubType": "CurrentAccount",
+            "Nickname": "Current Account",
+            "Account": [{
+                "SchemeName": "UK.OBIE.SortCodeAccountNumber",
+                "Identification": sort_code.replace("-", "") + account_no,
+                "Name": user_id,
+            }],
+        }
+
+    def _user(self, account_id: str):
+        user = self.index.user(account_id)
+        if user is None:
+            raise ApiError(404, "UK.OBIE.Resource.NotFound", f"Account {account_id} not found", "AccountId")
+        return user
+
+    def accounts(self, query: Dict[str, list], self_url: str) -> bytes:
+        page = _page_param(query)
+        users = self.index.users
+        lo, hi, links, meta = self._paginate(len(users), page, self_url, query)
+        return _json({"Data": {"Account": [self._account(u.user_id) for u in users[lo:hi]]}, "Links": links, "Meta": meta})
+
+    def account(self, account_id: str, self_url: str) -> bytes:
+        user = self._user(account_id)
+        return _json({"Data": {"Account": [self._account(user.user_id)]}, "Links": {"Self": self_url}, "Meta": {"TotalPages": 1}})
+
+    def transactions(self, account_id: str, query: Dict[str, list], self_url: str) -> bytes:
+        user = self._user(account_id)
+        page = _page_param(query)
+        from_ts = _time_param(query, "fromBookingDateTime")
+        to_ts = _time_param(query, "toBookingDateTime")
+        if from_ts is not None and to_ts is not None and from_ts > to_ts:
+            raise ApiError(400, "UK.OBIE.Field.Invalid", "fromBookingDateTime is after toBookingDateTime",
+                           "fromBookingDateTime")
+
+        row_lo, row_hi = self.index.time_range(user, from_ts, to_ts)
+        lo, hi, links, meta = self._paginate(row_hi - row_lo, page, self_url, query)
+        meta["FirstAvailableDateTime"] = iso_utc(user.first_ts)
+        meta["LastAvailableDateTime"] = iso_utc(user.last_ts)
+        return b"".join((
+            b'{"Data":{"Transaction":[',
+            self.index.obie_json(row_lo + lo, row_lo + hi),
+            b']},"Links":', _json(links),
+            b',"Meta":', _json(meta),
+            b"}",
+        ))
+
+    def _paginate(self, total: int, page: int, self_url: str, query: Dict[str, list]):
+        pages = max(1, -(-total // self.page_size))
+        if page > pages:
+            raise ApiError(400, "UK.OBIE.Field.Invalid", f"page {page} is out of range (1..{pages})", "page")
+
+        def url(p: int) -> str:
+            params = {k: v[0] for k, v in query.items() if k != "page"}
+            params["page"] = str(p)
+            return f"{self_url}?{urlencode(params)}"
+
+        links = {"Self": url(page), "First": url(1), "Last": url(pages)}
+        if page > 1:
+            links["Prev"] = url(page - 1)
+        if page < pages:
+            links["Next"] = url(page + 1)
+        lo = (page - 1) * self.page_size
+        return lo, min(total, lo + self.page_size), links, {"TotalPages": pages}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive: load generators reuse connections
+    disable_nagle_algorithm = True  # headers and body are separate writes; avoid the 40ms delayed-ACK stall
+    api: OpenBankingApi
+    base_url: str
+
+    def do_GET(self) -> None:
+        t0 = time.perf_counter()
+        endpoint = "unknown"
+        try:
+            endpoint, payload = self.api.handle(self.path, self.base_url)
+            status = 200
+        except ApiError as e:
+            status, payload = e.status, _json(e.body())
+        except Exception as e:
+            log.exception(f"Unhandled error for {self.path}: {e}", tag="SERVE")
+            status, payload = 500, _json(ApiError(500, "UK.OBIE.UnexpectedError", "Internal error").body())
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        self.send_header("x-fapi-interaction-id", self.headers.get("x-fapi-interaction-id") or str(uuid.uuid4()))
+        self.end_headers()
+        self.wfile.write(payload)
+
+        labels = {"endpoint": endpoint, "status": status}
+        metrics.inc("serve_requests_total", labels=labels)
+        metrics.observe("serve_request_seconds", time.perf_counter() - t0, labels={"endpoint": endpoint})
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass  # per-request access logs would dominate CPU under load; see serve_* metrics instead
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        # Request threads start with an empty context; carry the caller's metrics stage label into them.
+        self._context = contextvars.copy_context()
+
+    def process_request_thread(self, request, client_address) -> None:
+        self._context.copy().run(super().process_request_thread, request, client_address)
+
+
+def make_server(cfg: AppConfig, index: TransactionIndex,
+                host: Optional[str] = None, port: Optional[int] = None) -> ThreadingHTTPServer:
+    host = host or cfg.serve_host
+    port = cfg.serve_port if port is None else port
+    handler = type("OpenBankingHandler", (_Handler,), {"api": OpenBankingApi(index, cfg)})
+    server = _Server((host, port), handler)
+    handler.base_url = f"http://{host}:{server.server_address[1]}"
+    return server
+
+
+def _interrupt(signum, frame) -> None:
+    raise KeyboardInterrupt
+
+
+def serve(host: Optional[str] = None, port: Optional[int] = None, rebuild_index: bool = False) -> None:
+    """Build/open the index and serve until interrupted."""
+    cfg = get_config()
+    index = open_index(cfg, rebuild=rebuild_index)
+    server = make_server(cfg, index, host, port)
+    log.info(
+        f"🏦 Serving {len(index.users)} accounts / {index.rows} transactions at "
+        f"{server.RequestHandlerClass.base_url}{API_PREFIX}/accounts (Ctrl+C to stop)",
+        tag="SERVE",
+    )
+    signal.signal(signal.SIGTERM, _interrupt)  # docker stop / kill: shut down cleanly and flush metrics
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        log.info("Shutting down.", tag="SERVE")
+    finally:
+        server.server_close()
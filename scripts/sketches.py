@@ -0,0 +1,197 @@
+# sketches.py
+"""
+Bounded-memory streaming sketches for dataset statistics (`bankgen stats`).
+
+    TDigest      quantiles of a numeric stream (merging t-digest, k1 scale function):
+                 ~compression/2 centroids however many values are added, most accurate
+                 in the tails, where a collapsed amount distribution shows first
+    HyperLogLog  distinct-count estimate from 2**p one-byte registers (p=14: 16 KiB,
+                 ~0.8% standard error); strings are hashed with blake2b so estimates are
+                 reproducible across processes
+    SpaceSaving  heavy hitters (Metwally et al.) with `capacity` counters: every value
+                 whose true count exceeds total / capacity is kept, and each reported
+                 count overestimates by at most its `error`
+
+All three are mergeable (`merge`), so per-chunk or per-worker sketches can be combined.
+Values are fed in batches (one user's rows at a time) to keep the per-row overhead down.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import heapq
+import math
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple
+
+import numpy as np
+
+QUANTILES = (0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)
+
+
+class TDigest:
+    """Merging t-digest over float values."""
+
+    def __init__(self, compression: int = 200) -> None:
+        self.compression = compression
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self._means = np.empty(0)
+        self._weights = np.empty(0)
+        self._buffer: List[Tuple[np.ndarray, np.ndarray]] = []
+        self._buffered = 0
+
+    def update(self, values: Iterable[float]) -> None:
+        v = np.asarray(values if isinstance(values, np.ndarray) else list(values), dtype=float)
+        v = v[np.isfinite(v)]
+        if not v.size:
+            return
+        self.count += int(v.size)
+        self.sum += float(v.sum())
+        self.min = min(self.min, float(v.min()))
+        self.max = max(self.max, float(v.max()))
+        self._add(v, np.ones(v.size))
+
+    def _add(self, means: np.ndarray, weights: np.ndarray) -> None:
+        self._buffer.append((means, weights))
+        self._buffered += means.size
+        if self._buffered >= 20 * self.compression:
+            self._compress()
+
+    def _compress(self) -> None:
+        """Merge the buffer into the centroids: points whose k1(q) fall in the same unit share a centroid."""
+        if not self._buffer:
+            return
+        means = np.concatenate([self._means, *(m for m, _ in self._buffer)])
+        weights = np.concatenate([self._weights, *(w for _, w in self._buffer)])
+        self._buffer.clear()
+        self._buffered = 0
+        order = np.argsort(means, kind="stable")
+        means, weights = means[order], weights[order]
+        total = weights.sum()
+        q = (np.cumsum(weights) - weights / 2) / total
+        k = self.compression / (2 * math.pi) * np.arcsin(np.clip(2 * q - 1, -1.0, 1.0))
+        bucket = np.floor(k - k[0]).astype(np.int64)
+        _, bucket = np.unique(bucket, return_inverse=True)
+        self._weights = np.bincount(bucket, weights=weights)
+        self._means = np.bincount(bucket, weights=means * weights) / self._weights
+
+    def merge(self, other: "TDigest") -> None:
+        other._compress()
+        if not other.count:
+            return
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._add(other._means.copy(), other._weights.copy())
+
+    def quantile(self, q: float) -> Optional[float]:
+        self._compress()
+        if not self.count:
+            return None
+        centers = np.cumsum(self._weights) - self._weights / 2
+        x = np.concatenate([[0.0], centers, [float(self.count)]])
+        y = np.concatenate([[self.min], self._means, [self.max]])
+        return float(np.interp(q * self.count, x, y))
+
+    def summary(self) -> Dict[str, Any]:
+        if not self.count:
+            return {"count": 0}
+        out = {"count": self.count, "min": self.min, "max": self.max, "mean": self.sum / self.count}
+        for q in QUANTILES:
+            out[f"p{round(q * 100):02d}"] = self.quantile(q)
+        return {k: round(v, 4) if isinstance(v, float) else v for k, v in out.items()}
+
+
+def _hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HyperLogLog:
+    """HyperLogLog distinct counter with 2**p registers."""
+
+    def __init__(self, p: int = 14) -> None:
+        self.p = p
+        self.m = 1 << p
+        self.registers = bytearray(self.m)
+        self._shift = 64 - p
+        self._mask = (1 << self._shift) - 1
+
+    def update(self, values: Iterable[str]) -> None:
+        registers, shift, mask = self.registers, self._shift, self._mask
+        for value in values:
+            h = _hash64(value)
+            idx = h >> shift
+            rank = shift - (h & mask).bit_length() + 1
+            if rank > registers[idx]:
+                registers[idx] = rank
+
+    def merge(self, other: "HyperLogLog") -> None:
+        if other.p != self.p:
+            raise ValueError(f"cannot merge HyperLogLog p={other.p} into p={self.p}")
+        np.maximum(np.frombuffer(self.registers, dtype=np.uint8), np.frombuffer(other.registers, dtype=np.uint8),
+                   out=np.frombuffer(self.registers, dtype=np.uint8))
+
+    def estimate(self) -> int:
+        regs = np.frombuffer(self.registers, dtype=np.uint8)
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / float(np.sum(np.ldexp(1.0, -regs.astype(np.int64))))
+        zeros = int(np.count_nonzero(regs == 0))
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)  # linear counting for small cardinalities
+        return int(round(estimate))
+
+
+class SpaceSaving:
+    """Space-Saving heavy-hitter counter with at most `capacity` tracked values."""
+
+    def __init__(self, capacity: int = 1000) -> None:
+        self.capacity = capacity
+        self.total = 0
+        self.counts: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+        self._heap: List[Tuple[int, str]] = []   # lazy min-heap; stale entries skipped on pop
+
+    def add(self, value: str, count: int = 1) -> None:
+        self.total += count
+        counts = self.counts
+        if value in counts:
+            counts[value] += count
+        elif len(counts) < self.capacity:
+            counts[value] = count
+            self.errors[value] = 0
+        else:
+            floor_value, floor = self._pop_min()
+            del counts[floor_value]
+            del self.errors[floor_value]
+            counts[value] = floor + count
+            self.errors[value] = floor
+        heapq.heappush(self._heap, (counts[value], value))
+        if len(self._heap) > 4 * self.capacity:
+            self._heap = [(c, v) for v, c in counts.items()]
+            heapq.heapify(self._heap)
+
+    def _pop_min(self) -> Tuple[str, int]:
+        while True:
+            count, value = heapq.heappop(self._heap)
+            if self.counts.get(value) == count:
+                return value, count
+
+    def update(self, counts: Mapping[str, int]) -> None:
+        for value, count in counts.items():
+            self.add(value, count)
+
+    def merge(self, other: "SpaceSaving") -> None:
+        self.update(other.counts)
+
+    def top(self, k: int = 20) -> List[Dict[str, Any]]:
+        """The k largest counters: value, count (upper bound), error (count - error is a lower bound), share."""
+        best = heapq.nlargest(k, self.counts.items(), key=lambda item: item[1])
+        return [
+            {"value": value, "count": count, "error": self.errors[value],
+             "share": round(count / self.total, 6) if self.total else 0.0}
+            for value, count in best
+        ]
@@ -0,0 +1,332 @@
+# stats.py
+"""
+Single-pass dataset statistics (`bankgen stats`).
+
+Streams <output_dir>/transactions/*.csv one user at a time and personas.csv one row at a
+time into bounded-memory sketches (scripts/sketches.py), so a multi-million-row run can be
+profiled without loading it into pandas:
+
+    amount, income amount, rows per user, persona age / declared income   TDigest quantiles
+    merchant_name, description_raw / _cleaned, full_name, persona_summary  HyperLogLog distinct counts
+    merchants (debits), payers (credits), locations, occupations            SpaceSaving heavy hitters
+    risk_flag, source_type, transaction_type, is_income, currency, month    exact counts
+
+The profile is written as JSON (default <output_dir>/stats/profile.json) with a stable
+layout, so two runs can be compared with `bankgen stats --diff OLD.json`. The diff reports
+every changed figure and warns on the usual signs of mode collapse: fewer distinct
+descriptions / merchants per row, a top merchant or payer taking a much larger share, a
+categorical distribution that moved (total variation distance) or amount quantiles that
+shifted.
+"""
+
+from __future__ import annotations
+
+import ast
+import csv
+import json
+import re
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from kirkomi_utils.logging.logger import log
+from .config import get_config
+from .dataset import parse_timestamp, transaction_files
+from .metrics import metrics
+from .sketches import HyperLogLog, SpaceSaving, TDigest
+
+PROFILE_VERSION = 1
+HEAVY_HITTER_CAPACITY = 2000
+
+# Exact-count columns (low cardinality by contract) and distinct-count columns.
+COUNT_COLUMNS = ("risk_flag", "source_type", "transaction_type", "is_income", "currency")
+DISTINCT_COLUMNS = ("merchant_name", "description_raw", "description_cleaned")
+PERSONA_DISTINCT = ("full_name", "persona_summary")
+
+# --diff warning thresholds.
+DISTINCT_RATIO_DROP = 0.2     # distinct values per row fell by more than 20%
+TOP_SHARE_GROWTH = 2.0        # top-1 share at least doubled
+TVD_LIMIT = 0.1               # categorical distribution moved by more than 0.1
+QUANTILE_SHIFT = 0.25         # p05/p50/p95 moved by more than 25%
+
+_NULLS = {"", "nan", "none", "null"}
+_TRUE = {"true", "1", "yes", "y"}
+_INCOME = re.compile(r"""['"]average_monthly_income(?:_in)?_gbp['"]\s*:\s*(-?\d+(?:\.\d+)?)""")
+
+
+def _category(value: Optional[str]) -> str:
+    value = (value or "").strip()
+    return "(none)" if value.lower() in _NULLS else value
+
+
+def _number(value: Optional[str]) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _items(value: Optional[str]) -> List[str]:
+    """A list column as written by the CSV writer (Python repr), or a single value."""
+    value = (value or "").strip()
+    if value.startswith("["):
+        try:
+            parsed = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            parsed = None
+        if isinstance(parsed, list):
+            return [str(item).strip() for item in parsed if str(item).strip()]
+    return [value] if value.lower() not in _NULLS else []
+
+
+class _TransactionStats:
+    def __init__(self) -> None:
+        self.users = 0
+        self.rows = 0
+        self.invalid = Counter()
+        self.amount = TDigest()
+        self.income_amount = TDigest()
+        self.rows_per_user = TDigest()
+        self.distinct = {name: HyperLogLog() for name in DISTINCT_COLUMNS}
+        self.merchants = SpaceSaving(HEAVY_HITTER_CAPACITY)
+        self.payers = SpaceSaving(HEAVY_HITTER_CAPACITY)
+        self.counts = {name: Counter() for name in COUNT_COLUMNS}
+        self.months = Counter()
+        self.first: Optional[datetime] = None
+        self.last: Optional[datetime] = None
+
+    def add_user(self, rows: List[Dict[str, str]]) -> None:
+        self.users += 1
+        self.rows += len(rows)
+        self.rows_per_user.update([len(rows)])
+        # Raw values are counted per user first, so normalisation runs once per distinct value.
+        for name in COUNT_COLUMNS:
+            for value, n in Counter(row.get(name) for row in rows).items():
+                value = _category(value)
+                self.counts[name][value.lower() if name == "is_income" else value] += n
+        for name, hll in self.distinct.items():
+            hll.update({value for value in (row.get(name) for row in rows) if value and value.strip()})
+
+        amounts, income, stamps = [], [], []
+        merchants, payers = Counter(), Counter()
+        for row in rows:
+            ts = parse_timestamp(row.get("timestamp", ""))
+            if ts is None:
+                self.invalid["timestamp"] += 1
+            else:
+                stamps.append(ts)
+            amount = _number(row.get("amount"))
+            if amount is None:
+                self.invalid["amount"] += 1
+                continue
+            amounts.append(amount)
+            kind = (row.get("transaction_type") or "").strip().upper()
+            credit = kind == "CREDIT" if kind else amount > 0
+            if (row.get("is_income") or "").strip().lower() in _TRUE:
+                income.append(amount)
+            merchant = (row.get("merchant_name") or "").strip()
+            if credit:
+                payers[merchant or (row.get("description_cleaned") or "").strip() or "(none)"] += 1
+            elif merchant:
+                merchants[merchant] += 1
+        self.amount.update(amounts)
+        self.income_amount.update(income)
+        self.merchants.update(merchants)
+        self.payers.update(payers)
+        if stamps:
+            self.months.update(f"{ts.year}-{ts.month:02d}" for ts in stamps)
+            first, last = min(stamps), max(stamps)
+            self.first = first if self.first is None or first < self.first else self.first
+            self.last = last if self.last is None or last > self.last else self.last
+
+    def profile(self, top: int) -> Dict[str, Any]:
+        distinct = {name: hll.estimate() for name, hll in self.distinct.items()}
+        return {
+            "users": self.users,
+            "rows": self.rows,
+            "first_timestamp": self.first.isoformat() if self.first else None,
+            "last_timestamp": self.last.isoformat() if self.last else None,
+            "invalid": dict(self.invalid),
+            "rows_per_user": self.rows_per_user.summary(),
+            "amount": self.amount.summary(),
+            "income_amount": self.income_amount.summary(),
+            "distinct": distinct,
+            "distinct_per_row": {name: round(n / self.rows, 6) if self.rows else 0.0 for name, n in distinct.items()},
+            "top_merchants": self.merchants.top(top),
+            "top_payers": self.payers.top(top),
+            "counts": {name: dict(counter.most_common()) for name, counter in self.counts.items()},
+            "months": dict(sorted(self.months.items())),
+        }
+
+
+class _PersonaStats:
+    def __init__(self) -> None:
+        self.rows = 0
+        self.age = TDigest()
+        self.declared_income = TDigest()
+        self.distinct = {name: HyperLogLog() for name in PERSONA_DISTINCT}
+        self.gender = Counter()
+        self.locations = SpaceSaving(HEAVY_HITTER_CAPACITY)
+        self.ethnicities = SpaceSaving(HEAVY_HITTER_CAPACITY)
+        self.occupations = SpaceSaving(HEAVY_HITTER_CAPACITY)
+
+    def add(self, row: Dict[str, str]) -> None:
+        self.rows += 1
+        age = _number(row.get("age"))
+        if age is not None:
+            self.age.update([age])
+        match = _INCOME.search(row.get("income_streams") or "")
+        if match:
+            self.declared_income.update([float(match.group(1))])
+        for name, hll in self.distinct.items():
+            if (row.get(name) or "").strip():
+                hll.update([row[name]])
+        self.gender[_category(row.get("gender"))] += 1
+        self.locations.add(_category(row.get("location")))
+        self.ethnicities.add(_category(row.get("ethnicity")))
+        for occupation in _items(row.get("occupations")):
+            self.occupations.add(occupation)
+
+    def profile(self, top: int) -> Dict[str, Any]:
+        distinct = {name: hll.estimate() for name, hll in self.distinct.items()}
+        return {
+            "rows": self.rows,
+            "age": self.age.summary(),
+            "declared_monthly_income_gbp": self.declared_income.summary(),
+            "distinct": distinct,
+            "distinct_per_row": {name: round(n / self.rows, 6) if self.rows else 0.0 for name, n in distinct.items()},
+            "counts": {"gender": dict(self.gender.most_common())},
+            "top_locations": self.locations.top(top),
+            "top_ethnicities": self.ethnicities.top(top),
+            "top_occupations": self.occupations.top(top),
+        }
+
+
+def profile_dataset(output_dir: str | Path, top: int = 20) -> Dict[str, Any]:
+    """One streaming pass over transactions + personas; returns the JSON-ready profile."""
+    tx = _TransactionStats()
+    for path in transaction_files(output_dir):
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            tx.add_user(list(csv.DictReader(f)))
+
+    personas = _PersonaStats()
+    persona_path = Path(output_dir) / "personas.csv"
+    if persona_path.exists():
+        with open(persona_path, "r", encoding="utf-8", newline="") as f:
+            for row in csv.DictReader(f):
+                personas.add(row)
+
+    metrics.inc("stats_rows_total", tx.rows + personas.rows)
+    return {
+        "version": PROFILE_VERSION,
+        "output_dir": str(output_dir),
+        "generated_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "transactions": tx.profile(top),
+        "personas": personas.profile(top),
+    }
+
+
+# -- diff ----------------------------------------------------------------------------
+
+def _flatten(obj: Any, prefix: str = "") -> Dict[str, float]:
+    """Numeric leaves by dotted path (categorical counts and top lists are compared separately)."""
+    out: Dict[str, float] = {}
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            if key in {"counts", "months"} or key.startswith("top_"):
+                continue
+            out.update(_flatten(value, f"{prefix}{key}."))
+    elif isinstance(obj, (int, float)) and not isinstance(obj, bool):
+        out[prefix[:-1]] = obj
+    return out
+
+
+def _tvd(a: Dict[str, int], b: Dict[str, int]) -> float:
+    """Total variation distance between two count distributions (0 = identical, 1 = disjoint)."""
+    ta, tb = sum(a.values()), sum(b.values())
+    if not ta or not tb:
+        return 0.0 if ta == tb else 1.0
+    return 0.5 * sum(abs(a.get(k, 0) / ta - b.get(k, 0) / tb) for k in set(a) | set(b))
+
+
+def _top_share(top: List[Dict[str, Any]]) -> float:
+    return top[0]["share"] if top else 0.0
+
+
+def diff_profiles(old: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, Any]:
+    """Changed figures, categorical distances and heavy-hitter shifts between two profiles, plus warnings."""
+    changes = {}
+    flat_old, flat_new = _flatten(old), _flatten(new)
+    for key in sorted(set(flat_old) | set(flat_new)):
+        if key == "version":
+            continue
+        a, b = flat_old.get(key), flat_new.get(key)
+        if a != b:
+            rel = (b - a) / abs(a) if a not in (None, 0) and b is not None else None
+            changes[key] = {"old": a, "new": b, "rel_change": round(rel, 4) if rel is not None else None}
+
+    warnings = []
+    distributions = {}
+    for section in ("transactions", "personas"):
+        o, n = old.get(section, {}), new.get(section, {})
+        for name in set(o.get("counts", {})) | set(n.get("counts", {})):
+            tvd = round(_tvd(o.get("counts", {}).get(name, {}), n.get("counts", {}).get(name, {})), 4)
+            distributions[f"{section}.counts.{name}"] = tvd
+            if tvd > TVD_LIMIT:
+                warnings.append(f"{section} {name} distribution moved (TVD {tvd:.3f})")
+        for name, ratio in o.get("distinct_per_row", {}).items():
+            new_ratio = n.get("distinct_per_row", {}).get(name)
+            if ratio and new_ratio is not None and new_ratio < ratio * (1 - DISTINCT_RATIO_DROP):
+                warnings.append(f"{section} {name}: distinct values per row fell {ratio:.4g} -> {new_ratio:.4g}")
+        for key in [k for k in set(o) | set(n) if k.startswith("top_")]:
+            a, b = _top_share(o.get(key, [])), _top_share(n.get(key, []))
+            distributions[f"{section}.{key}.top1_share"] = {"old": a, "new": b}
+            old_values = {item["value"] for item in o.get(key, [])}
+            new_values = {item["value"] for item in n.get(key, [])}
+            if old_values | new_values:
+                distributions[f"{section}.{key}.overlap"] = round(len(old_values & new_values) / len(old_values | new_values), 4)
+            if a and b >= a * TOP_SHARE_GROWTH:
+                warnings.append(f"{section} {key}: top value share grew {a:.3f} -> {b:.3f} ({n[key][0]['value']!r})")
+
+    for q in ("p05", "p50", "p95"):
+        for name in ("amount", "income_amount"):
+            key = f"transactions.{name}.{q}"
+            change = changes.get(key)
+            if change and change["rel_change"] is not None and abs(change["rel_change"]) > QUANTILE_SHIFT:
+                warnings.append(f"{key} shifted {change['old']} -> {change['new']}")
+
+    return {"changes": changes, "distributions": distributions, "warnings": warnings}
+
+
+@log.log_timed("STATS")
+def run_stats(out_path: Optional[str] = None, diff_path: Optional[str] = None, top: int = 20) -> Path:
+    """Profile the configured dataset, write the JSON profile and optionally diff it against an older one."""
+    cfg = get_config()
+    if not transaction_files(cfg.output_dir) and not (Path(cfg.output_dir) / "personas.csv").exists():
+        raise FileNotFoundError(f"No personas.csv or transactions under {cfg.output_dir}; generate data first.")
+
+    t0 = time.perf_counter()
+    profile = profile_dataset(cfg.output_dir, top=top)
+    elapsed = time.perf_counter() - t0
+
+    path = Path(out_path) if out_path else Path(cfg.output_dir) / "stats" / "profile.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(profile, indent=2, ensure_ascii=False), encoding="utf-8")
+    tx = profile["transactions"]
+    log.info(
+        f"✅ Profiled {tx['rows']} transactions / {tx['users']} users and {profile['personas']['rows']} personas "
+        f"in {elapsed:.2f}s -> {path}",
+        tag="STATS",
+    )
+
+    if diff_path:
+        old = json.loads(Path(diff_path).read_text(encoding="utf-8"))
+        diff = diff_profiles(old, profile)
+        diff_out = path.with_name(f"{path.stem}.diff.json")
+        diff_out.write_text(json.dumps(diff, indent=2, ensure_ascii=False), encoding="utf-8")
+        log.info(f"{len(diff['changes'])} figures changed vs {diff_path}; diff -> {diff_out}", tag="STATS")
+        for warning in diff["warnings"]:
+            log.warning(warning, tag="STATS")
+    return path
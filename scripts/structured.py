@@ -0,0 +1,157 @@
+# structured.py
+"""
+Schema-constrained LLM output (llm_output_format: structured).
+
+The json contract is prose in the prompt and hope in the parser: code fences are stripped,
+json.loads either succeeds or the whole paid call is lost. Here the persona and transaction
+contracts are JSON Schemas (PERSONA_SCHEMA / TRANSACTION_SCHEMA, next to the prompts in
+promptlib) and the same schema is used twice:
+
+    request   providers with structured output get it as an OpenAI-style response_format
+              ({"type": "json_schema", "json_schema": {..., "strict": true}}), so decoding is
+              constrained to valid JSON of that shape and the prompt no longer spells out the
+              fields; other providers get the schema as JSON in the prompt instead
+    response  every object is validated locally against the schema before records.py coerces
+              it; violations are counted in llm_schema_violations_total{record=...}, which
+              stays at zero while the provider really enforces the schema
+
+Strict mode needs an object at the root, so responses are {"personas": [...]} /
+{"transactions": [...]}; a bare array is accepted too (unconstrained providers).
+
+Whether a provider enforces schemas is provider_options.<provider>.structured_output, by
+default true for the providers in STRUCTURED_OUTPUT_PROVIDERS.
+"""
+
+from __future__ import annotations
+
+import json
+from typing import Any, Dict, List
+
+from kirkomi_utils.logging.logger import log
+from .config import AppConfig, get_config
+from .helpers import extract_json_block
+from .metrics import metrics
+from .records import RecordError
+from promptlib.personas import PERSONA_SCHEMA
+from promptlib.transactions import TRANSACTION_SCHEMA
+
+STRUCTURED_OUTPUT_PROVIDERS = {"openai"}
+
+# Response kind -> (root key, item schema, records.py record name).
+KINDS = {
+    "personas": ("personas", PERSONA_SCHEMA, "persona"),
+    "transactions": ("transactions", TRANSACTION_SCHEMA, "transaction"),
+}
+
+_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "number": (int, float),
+    "integer": int,
+    "boolean": bool,
+    "null": type(None),
+}
+
+
+def response_schema(kind: str) -> Dict[str, Any]:
+    """Root schema of a `kind` response: {"<kind>": [item, ...]}."""
+    key, item, _ = KINDS[kind]
+    return {
+        "type": "object",
+        "properties": {key: {"type": "array", "items": item}},
+        "required": [key],
+        "additionalProperties": False,
+    }
+
+
+def provider_enforces_schema(cfg: AppConfig) -> bool:
+    opts = cfg.provider_options.get(cfg.provider)
+    if opts is not None and opts.structured_output is not None:
+        return opts.structured_output
+    return cfg.provider in STRUCTURED_OUTPUT_PROVIDERS
+
+
+def chat_options(kind: str, output_format: str, cfg: AppConfig | None = None) -> Dict[str, Any]:
+    """
+    Extra chat / batch request parameters for a `kind` call: the response_format when the
+    output format is structured and the provider enforces schemas, else nothing.
+    """
+    cfg = cfg or get_config()
+    if output_format != "structured" or not provider_enforces_schema(cfg):
+        return {}
+    return {
+        "response_format": {
+            "type": "json_schema",
+            "json_schema": {"name": kind, "strict": True, "schema": response_schema(kind)},
+        }
+    }
+
+
+def prompt_schema(kind: str, cfg: AppConfig | None = None) -> str:
+    """The {schema} part of a structured prompt: empty when the provider enforces it."""
+    cfg = cfg or get_config()
+    if provider_enforces_schema(cfg):
+        return ""
+    return "JSON Schema of the response:\n" + json.dumps(response_schema(kind), ensure_ascii=False, separators=(",", ":")) + "\n"
+
+
+def _is_type(value: Any, name: str) -> bool:
+    if isinstance(value, bool) and name in ("number", "integer"):
+        return False
+    if name == "integer" and isinstance(value, float):
+        return value.is_integer()
+    return isinstance(value, _TYPES[name])
+
+
+def validate(value: Any, schema: Dict[str, Any], path: str = "$") -> List[str]:
+    """
+    Errors of `value` against `schema` (empty if valid). Covers the JSON Schema keywords the
+    promptlib schemas use: type (incl. lists), enum, properties, required,
+    additionalProperties: false and items.
+    """
+    types = schema.get("type")
+    if types is not None:
+        names = types if isinstance(types, list) else [types]
+        if not any(_is_type(value, name) for name in names):
+            return [f"{path}: expected {'/'.join(names)}, got {type(value).__name__}"]
+    if "enum" in schema and value not in schema["enum"]:
+        return [f"{path}: {value!r} is not one of {schema['enum']}"]
+
+    errors: List[str] = []
+    if isinstance(value, dict):
+        properties = schema.get("properties", {})
+        errors.extend(f"{path}.{key}: missing" for key in schema.get("required", ()) if key not in value)
+        if schema.get("additionalProperties") is False:
+            errors.extend(f"{path}.{key}: not in the schema" for key in value if key not in properties)
+        for key, sub in properties.items():
+            if key in value:
+                errors.extend(validate(value[key], sub, f"{path}.{key}"))
+    elif isinstance(value, list) and "items" in schema:
+        for i, item in enumerate(value):
+            errors.extend(validate(item, schema["items"], f"{path}[{i}]"))
+    return errors
+
+
+def decode(text: str, kind: str) -> List[Any]:
+    """
+    Decode a structured response into the list of `kind` objects, validating each against the
+    item schema. Invalid objects are counted and still returned: records.py repairs what it
+    can (numbers as strings, null-ish enums) and drops the rest. Raises RecordError when the
+    response is not a JSON object / array of the expected shape.
+    """
+    key, item_schema, record = KINDS[kind]
+    data = json.loads(extract_json_block(text))
+    if isinstance(data, dict):
+        if not isinstance(data.get(key), list):
+            raise RecordError(f"expected {{\"{key}\": [...]}}, got keys {sorted(data)[:5]}")
+        data = data[key]
+    elif not isinstance(data, list):
+        raise RecordError(f"expected a JSON object or array of {record}s, got {type(data).__name__}")
+
+    for obj in data:
+        errors = validate(obj, item_schema)
+        if errors:
+            metrics.inc("llm_schema_violations_total", labels={"record": record})
+            log.debug(f"{record} violates the schema ({len(errors)} errors): {'; '.join(errors[:3])}", tag="SCHEMA")
+    return data
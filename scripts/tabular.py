@@ -0,0 +1,189 @@
+# tabular.py
+"""
+Decoder for the compact tabular LLM output contract (llm_output_format: tabular).
+
+Instead of a JSON array that repeats every key on every object, the model returns one header
+line followed by pipe-delimited rows with enums as short codes:
+
+    ts|amt|cur|src|risk|inc|merchant|raw|clean
+    2025-03-11T14:32|412.50||AG||1||FPS CREDIT HAYSTEMPS WK12 REF:TS932|Payment from Hays Recruitment
+
+The header vocabularies and code tables live next to the prompts (promptlib.transactions,
+promptlib.personas); this module expands rows back into exactly the dicts the JSON contract
+produces, so everything downstream of parsing is unchanged.
+
+Decoding is tolerant of the usual model slips: markdown fences and table borders are stripped,
+the header may be missing (the prompt's column order is assumed) or reordered, surplus "|" are
+folded into the last (free-text) column, and full enum names are accepted in place of codes.
+Rows that still cannot be decoded are dropped and counted in tabular_rows_dropped_total.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Dict, Iterator, List
+
+from .metrics import metrics
+from promptlib.personas import TABULAR_PERSONA_COLUMNS
+from promptlib.transactions import RISK_FLAG_CODES, SOURCE_TYPE_CODES, TABULAR_TRANSACTION_COLUMNS
+
+# Persona fields (dotted paths) decoded as ";"-joined lists / numbers.
+_PERSONA_LISTS = {
+    "occupations", "income_streams.formal_sources", "income_streams.informal_sources",
+    "income_streams.government_support", "income_streams.employers_last_6_months",
+    "expense_behavior.spend_categories", "expense_behavior.regular_obligations",
+    "expense_behavior.financial_stress_signals", "notable_events", "income_estimation_challenges",
+}
+_PERSONA_FLOATS = {
+    "income_streams.average_monthly_income_in_gbp", "income_streams.monthly_income_variance_in_percent",
+    "income_streams.monthly_income_standard_deviation_in_gbp",
+}
+_PERSONA_EVENTS = "income_streams.income_events_last_6_months"
+# Top-level key order of the JSON contract (summary is last in the table so it can absorb stray "|").
+_PERSONA_ORDER = (
+    "full_name", "age", "gender", "location", "ethnicity", "occupations", "persona_summary",
+    "income_streams", "expense_behavior", "notable_events", "income_estimation_challenges",
+)
+
+_NULLS = {"", "null", "none", "-"}
+
+
+def _split(line: str) -> List[str]:
+    """Raw (unstripped) cells of one line, without markdown table borders."""
+    if line.startswith("|"):
+        line = line[1:]
+    if line.endswith("|"):
+        line = line[:-1]
+    return line.split("|")
+
+
+def _rows(text: str, columns: List[str]) -> Iterator[Dict[str, str]]:
+    """
+    Yield header-keyed cell dicts for every data line of a tabular response.
+    The first line whose cells are all known column names is taken as the header.
+    """
+    known = set(columns)
+    header = None
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not stripped or stripped.startswith("```") or "|" not in stripped:
+            continue
+        cells = _split(stripped)
+        if all(set(cell) <= set("-: ") for cell in cells):  # markdown separator row
+            continue
+        if header is None:
+            names = [cell.strip().lower() for cell in cells]
+            if known.issuperset(names) and len(set(names)) == len(names):
+                header = names
+                continue
+            header = columns
+        if len(cells) > len(header):
+            cells[len(header) - 1] = "|".join(cells[len(header) - 1:])
+            del cells[len(header):]
+        elif len(cells) < len(header):
+            metrics.inc("tabular_rows_dropped_total")
+            continue
+        yield {name: cell.strip() for name, cell in zip(header, cells)}
+
+
+def _amount(value: str) -> float:
+    return float(value.replace("£", "").replace(",", ""))
+
+
+def _code(value: str, codes: Dict[str, str]) -> Any:
+    if value.lower() in _NULLS:
+        return None
+    return codes.get(value.upper(), value)
+
+
+def _timestamp(value: str) -> str:
+    """Expand the compact UTC form (2025-03-11T14:32) to the JSON contract's ISO 8601 with offset."""
+    value = value.replace(" ", "T", 1)
+    date, _, time = value.partition("T")
+    if not time:
+        return f"{date}T00:00:00+00:00"
+    if time.endswith("Z"):
+        time = time[:-1]
+    elif "+" in time or time.count("-"):
+        return value  # already carries an offset
+    if len(time) == 5:
+        time += ":00"
+    return f"{date}T{time}+00:00"
+
+
+def decode_transactions(text: str) -> List[Dict[str, Any]]:
+    """Decode a tabular transactions response into json_transactions dicts. Raises ValueError if no row decodes."""
+    out = []
+    for row in _rows(text, list(TABULAR_TRANSACTION_COLUMNS)):
+        try:
+            amount = _amount(row["amt"])
+            timestamp = _timestamp(row["ts"])
+        except (KeyError, ValueError):
+            metrics.inc("tabular_rows_dropped_total")
+            continue
+        out.append({
+            "timestamp": timestamp,
+            "amount": amount,
+            "transaction_type": "CREDIT" if amount > 0 else "DEBIT",
+            "currency": row.get("cur") or "GBP",
+            "description_raw": row.get("raw", ""),
+            "description_cleaned": row.get("clean", ""),
+            "merchant_name": row.get("merchant") or None,
+            "is_income": row.get("inc", "").lower() in {"1", "y", "yes", "true"},
+            "risk_flag": _code(row.get("risk", ""), RISK_FLAG_CODES),
+            "source_type": _code(row.get("src", ""), SOURCE_TYPE_CODES),
+        })
+    if not out:
+        raise ValueError("no decodable rows in tabular transactions response")
+    return out
+
+
+def _income_events(value: str) -> List[Dict[str, Any]]:
+    """Parse "YYYY-MM-DD amount TYPE source;..." into income event dicts, skipping malformed items."""
+    events = []
+    for item in value.split(";"):
+        parts = item.split(None, 3)
+        if len(parts) < 3:
+            continue
+        try:
+            amount = _amount(parts[1])
+        except ValueError:
+            continue
+        events.append({"date": parts[0], "amount": amount, "type": parts[2].upper(),
+                       "source": parts[3] if len(parts) > 3 else ""})
+    return events
+
+
+def _persona_value(path: str, value: str) -> Any:
+    if path in _PERSONA_LISTS:
+        return [item.strip() for item in value.split(";") if item.strip()]
+    if path == _PERSONA_EVENTS:
+        return _income_events(value)
+    if path in _PERSONA_FLOATS:
+        return _amount(value) if value.lower() not in _NULLS else None
+    if path == "age":
+        return int(float(value))
+    return value
+
+
+def decode_personas(text: str) -> List[Dict[str, Any]]:
+    """Decode a tabular personas response into json_personas dicts. Raises ValueError if no row decodes."""
+    out = []
+    for row in _rows(text, list(TABULAR_PERSONA_COLUMNS)):
+        persona: Dict[str, Any] = {}
+        try:
+            for column, path in TABULAR_PERSONA_COLUMNS.items():
+                if column not in row:
+                    continue
+                key, _, sub = path.partition(".")
+                value = _persona_value(path, row[column])
+                if sub:
+                    persona.setdefault(key, {})[sub] = value
+                else:
+                    persona[key] = value
+        except ValueError:
+            metrics.inc("tabular_rows_dropped_total")
+            continue
+        out.append({key: persona[key] for key in _PERSONA_ORDER if key in persona})
+    if not out:
+        raise ValueError("no decodable rows in tabular personas response")
+    return out
@@ -0,0 +1,324 @@
+# tx_index.py
+"""
+Prebuilt, memory-mapped columnar transaction index.
+
+Built once from <output_dir>/transactions/*.csv and reused by every reader that needs
+random access by (user, time range) or a vectorised pass over every row — `bankgen serve`
+and `bankgen features`. Rows are grouped by user and
+sorted by timestamp within each user, so a time-range query is two binary searches over a
+contiguous slice and pages are plain slices.
+
+Layout (<output_dir>/index/):
+    meta.json               row count, source signature, per-user [start, end) row ranges
+    ts.i8                   int64 booking time, epoch seconds (UTC)
+    amount.f8               float64 absolute amount
+    credit.u1               uint8, 1 = CREDIT, 0 = DEBIT
+    is_income.u1            uint8, 1 = model marked the row as income
+    <col>.u2                uint16 dictionary codes for categorical columns (vocab in meta.json, 0 = empty)
+    <col>.off / <col>.bin   int64 offsets (rows + 1) into a UTF-8 heap, for each string column
+    obie.off / obie.bin     each row pre-serialised as an OBIE v3.1 Transaction JSON object + ","
+
+Rows are immutable once indexed, so their OBIE JSON is encoded at build time: a page of
+transactions is then one contiguous slice of obie.bin, with no per-request formatting.
+
+Numeric columns are raw little-endian arrays opened with numpy.memmap; string heaps are
+opened with mmap. Nothing is loaded eagerly, so opening a 50M-row index is instant and
+the OS page cache is shared between server threads.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from kirkomi_utils.logging.logger import log
+from .config import AppConfig
+from .dataset import parse_amount, read_user_transactions, sort_by_time, transaction_files
+
+INDEX_VERSION = 2
+INDEX_DIR = "index"
+
+STRING_COLUMNS = ("description_raw", "merchant_name", "currency")
+OBIE_COLUMN = "obie"
+DEFAULT_CURRENCY = "GBP"
+CATEGORICAL_COLUMNS = ("source_type", "risk_flag")
+_NUMERIC = {
+    "ts": ("ts.i8", "<i8"),
+    "amount": ("amount.f8", "<f8"),
+    "credit": ("credit.u1", "u1"),
+    "is_income": ("is_income.u1", "u1"),
+    **{name: (f"{name}.u2", "<u2") for name in CATEGORICAL_COLUMNS},
+}
+_NULLS = {"", "null", "none", "nan", "n/a"}
+
+
+def index_dir(output_dir: str | Path) -> Path:
+    return Path(output_dir) / INDEX_DIR
+
+
+def source_signature(output_dir: str | Path) -> str:
+    """Hash of (name, size, mtime) of every transaction CSV; changes whenever the dataset does."""
+    h = hashlib.sha256()
+    for path in transaction_files(output_dir):
+        st = path.stat()
+        h.update(f"{path.name}\0{st.st_size}\0{st.st_mtime_ns}\n".encode("utf-8"))
+    return h.hexdigest()
+
+
+class _StringHeapWriter:
+    def __init__(self, out_dir: Path, name: str) -> None:
+        self.off = open(out_dir / f"{name}.off", "wb")
+        self.bin = open(out_dir / f"{name}.bin", "wb")
+        self.pos = 0
+        np.array([0], dtype="<i8").tofile(self.off)
+
+    def extend(self, values: List[str]) -> None:
+        encoded = [(v or "").encode("utf-8") for v in values]
+        ends = np.cumsum([len(b) for b in encoded], dtype="<i8") + self.pos
+        self.bin.write(b"".join(encoded))
+        ends.tofile(self.off)
+        if len(ends):
+            self.pos = int(ends[-1])
+
+    def close(self) -> None:
+        self.off.close()
+        self.bin.close()
+
+
+def _is_credit(row: Dict[str, str], amount: float) -> bool:
+    tx_type = (row.get("transaction_type") or "").strip().upper()
+    return tx_type == "CREDIT" if tx_type else amount > 0
+
+
+def _is_true(value: Optional[str]) -> bool:
+    return (value or "").strip().lower() in {"true", "1", "yes", "y"}
+
+
+def _category(value: Optional[str]) -> str:
+    value = (value or "").strip()
+    return "" if value.lower() in _NULLS else value.lower()
+
+
+def _encode(values: List[str], vocab: Dict[str, int]) -> np.ndarray:
+    """Dictionary-encode values, growing vocab in place (code 0 is reserved for empty)."""
+    codes = np.empty(len(values), dtype="<u2")
+    for i, value in enumerate(values):
+        code = vocab.get(value)
+        if code is None:
+            if len(vocab) > np.iinfo(np.uint16).max:
+                raise ValueError("Too many distinct categorical values for a uint16 dictionary")
+            code = vocab[value] = len(vocab)
+        codes[i] = code
+    return codes
+
+
+def iso_utc(ts: int) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat()
+
+
+def obie_transaction(user_id: str, seq: int, ts: int, amount: float, credit: bool, row: Dict[str, str]) -> str:
+    """One row as a compact OBIE v3.1 Transaction object. seq is the row's position in the user's history."""
+    booked = iso_utc(ts)
+    txn: Dict[str, Any] = {
+        "AccountId": user_id,
+        "TransactionId": f"{user_id}-{seq:06d}",
+        "CreditDebitIndicator": "Credit" if credit else "Debit",
+        "Status": "Booked",
+        "BookingDateTime": booked,
+        "ValueDateTime": booked,
+        "TransactionInformation": row.get("description_raw") or "",
+        "Amount": {"Amount": f"{abs(amount):.2f}", "Currency": row.get("currency") or DEFAULT_CURRENCY},
+    }
+    if row.get("merchant_name"):
+        txn["MerchantDetails"] = {"MerchantName": row["merchant_name"]}
+    return json.dumps(txn, separators=(",", ":"), ensure_ascii=False)
+
+
+@log.log_timed("INDEX")
+def build_index(cfg: AppConfig) -> Path:
+    """
+    (Re)build the index from the transaction CSVs, streaming one user at a time.
+    Written to a temporary directory and swapped in, so readers never see a partial index.
+    """
+    final_dir = index_dir(cfg.output_dir)
+    tmp_dir = final_dir.with_name(final_dir.name + ".tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+
+    signature = source_signature(cfg.output_dir)
+    numeric = {name: open(tmp_dir / fname, "wb") for name, (fname, _) in _NUMERIC.items()}
+    heaps = {name: _StringHeapWriter(tmp_dir, name) for name in STRING_COLUMNS + (OBIE_COLUMN,)}
+    vocabs: Dict[str, Dict[str, int]] = {name: {"": 0} for name in CATEGORICAL_COLUMNS}
+    users: List[Dict[str, Any]] = []
+    rows_total = 0
+
+    try:
+        for path in transaction_files(cfg.output_dir):
+            pairs = sort_by_time(read_user_transactions(path))
+            if not pairs:
+                continue
+            rows = [r for _, r in pairs]
+            ts = np.fromiter((int(t.timestamp()) for t, _ in pairs), dtype="<i8", count=len(pairs))
+            amounts = np.fromiter((parse_amount(r.get("amount")) for r in rows), dtype="<f8", count=len(rows))
+            credit = np.fromiter((_is_credit(r, a) for r, a in zip(rows, amounts)), dtype="u1", count=len(rows))
+            ts.tofile(numeric["ts"])
+            np.abs(amounts).tofile(numeric["amount"])
+            credit.tofile(numeric["credit"])
+            np.fromiter((_is_true(r.get("is_income")) for r in rows), dtype="u1", count=len(rows)).tofile(numeric["is_income"])
+            for name in CATEGORICAL_COLUMNS:
+                _encode([_category(r.get(name)) for r in rows], vocabs[name]).tofile(numeric[name])
+            for name in STRING_COLUMNS:
+                heaps[name].extend([r.get(name) or "" for r in rows])
+            heaps[OBIE_COLUMN].extend([
+                obie_transaction(path.stem, i, t, a, c, r) + ","
+                for i, (t, a, c, r) in enumerate(zip(ts.tolist(), amounts.tolist(), credit.tolist(), rows))
+            ])
+
+            users.append({
+                "user_id": path.stem,
+                "start": rows_total,
+                "end": rows_total + len(rows),
+                "first_ts": int(ts[0]),
+                "last_ts": int(ts[-1]),
+            })
+            rows_total += len(rows)
+    finally:
+        for f in numeric.values():
+            f.close()
+        for heap in heaps.values():
+            heap.close()
+
+    meta = {
+        "version": INDEX_VERSION,
+        "built_at": time.time(),
+        "source_signature": signature,
+        "rows": rows_total,
+        "dictionaries": {name: sorted(vocab, key=vocab.get) for name, vocab in vocabs.items()},
+        "users": users,
+    }
+    (tmp_dir / "meta.json").write_text(json.dumps(meta), encoding="utf-8")
+
+    if final_dir.exists():
+        old_dir = final_dir.with_name(final_dir.name + ".old")
+        shutil.rmtree(old_dir, ignore_errors=True)
+        os.replace(final_dir, old_dir)
+        os.replace(tmp_dir, final_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+    else:
+        os.replace(tmp_dir, final_dir)
+
+    log.info(f"Indexed {rows_total} transactions for {len(users)} users -> {final_dir}", tag="INDEX")
+    return final_dir
+
+
+def index_is_fresh(cfg: AppConfig) -> bool:
+    meta_path = index_dir(cfg.output_dir) / "meta.json"
+    if not meta_path.exists():
+        return False
+    meta = json.loads(meta_path.read_text(encoding="utf-8"))
+    return meta.get("version") == INDEX_VERSION and meta.get("source_signature") == source_signature(cfg.output_dir)
+
+
+@dataclass(frozen=True)
+class UserRange:
+    user_id: str
+    start: int
+    end: int
+    first_ts: int
+    last_ts: int
+
+
+class TransactionIndex:
+    """Read-only view over a built index. Safe to share between threads."""
+
+    def __init__(self, path: str | Path) -> None:
+        self.path = Path(path)
+        meta = json.loads((self.path / "meta.json").read_text(encoding="utf-8"))
+        if meta.get("version") != INDEX_VERSION:
+            raise ValueError(f"Index at {self.path} has version {meta.get('version')}; rebuild it.")
+        self.rows: int = meta["rows"]
+        self.users: List[UserRange] = [UserRange(**u) for u in meta["users"]]
+        self.by_id: Dict[str, UserRange] = {u.user_id: u for u in self.users}
+        self.dictionaries: Dict[str, List[str]] = meta["dictionaries"]
+
+        self._numeric = {name: self._map_array(fname, dtype) for name, (fname, dtype) in _NUMERIC.items()}
+        self._offsets = {name: self._map_array(f"{name}.off", "<i8") for name in STRING_COLUMNS + (OBIE_COLUMN,)}
+        self._heaps = {name: self._map_bytes(f"{name}.bin") for name in STRING_COLUMNS + (OBIE_COLUMN,)}
+
+    def _map_array(self, fname: str, dtype: str) -> np.ndarray:
+        path = self.path / fname
+        if path.stat().st_size == 0:
+            return np.empty(0, dtype=dtype)  # mmap cannot map an empty file
+        return np.memmap(path, dtype=dtype, mode="r")
+
+    def _map_bytes(self, fname: str):
+        path = self.path / fname
+        if path.stat().st_size == 0:
+            return b""
+        with open(path, "rb") as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def user(self, user_id: str) -> Optional[UserRange]:
+        return self.by_id.get(user_id)
+
+    def column(self, name: str) -> np.ndarray:
+        """Whole numeric/categorical column (memory-mapped) across all users, in index order."""
+        return self._numeric[name]
+
+    def user_lengths(self) -> np.ndarray:
+        """Row count per user, in index order (np.repeat(arange, user_lengths()) gives the row -> user map)."""
+        return np.fromiter((u.end - u.start for u in self.users), dtype=np.int64, count=len(self.users))
+
+    def time_range(self, user: UserRange, from_ts: Optional[int] = None, to_ts: Optional[int] = None) -> Tuple[int, int]:
+        """Absolute row range [lo, hi) of the user's rows with from_ts <= ts <= to_ts (both inclusive)."""
+        ts = self._numeric["ts"][user.start:user.end]
+        lo = int(np.searchsorted(ts, from_ts, side="left")) if from_ts is not None else 0
+        hi = int(np.searchsorted(ts, to_ts, side="right")) if to_ts is not None else len(ts)
+        return user.start + lo, user.start + max(lo, hi)
+
+    def strings(self, name: str, lo: int, hi: int) -> List[str]:
+        offsets = self._offsets[name][lo:hi + 1].tolist()
+        heap = self._heaps[name]
+        return [heap[a:b].decode("utf-8") for a, b in zip(offsets, offsets[1:])]
+
+    def obie_json(self, lo: int, hi: int) -> bytes:
+        """Rows [lo, hi) as the body of a JSON array of OBIE Transaction objects (no brackets)."""
+        if hi <= lo:
+            return b""
+        offsets = self._offsets[OBIE_COLUMN]
+        return self._heaps[OBIE_COLUMN][int(offsets[lo]):int(offsets[hi]) - 1]  # drop the trailing ","
+
+    def obie_objects(self, rows: np.ndarray) -> List[bytes]:
+        """OBIE Transaction objects (UTF-8 JSON, no separator) for arbitrary row numbers."""
+        offsets = self._offsets[OBIE_COLUMN]
+        starts = offsets[rows].tolist()
+        ends = (offsets[rows + 1] - 1).tolist()  # drop the trailing ","
+        heap = self._heaps[OBIE_COLUMN]
+        return [heap[a:b] for a, b in zip(starts, ends)]
+
+    def slice(self, lo: int, hi: int) -> Dict[str, list]:
+        """Columns for rows [lo, hi) as Python lists."""
+        cols: Dict[str, list] = {name: arr[lo:hi].tolist() for name, arr in self._numeric.items()}
+        for name in STRING_COLUMNS:
+            cols[name] = self.strings(name, lo, hi)
+        return cols
+
+
+def open_index(cfg: AppConfig, rebuild: bool = False) -> TransactionIndex:
+    """Open the index for cfg.output_dir, (re)building it first if missing, stale or forced."""
+    if rebuild or not index_is_fresh(cfg):
+        if not transaction_files(cfg.output_dir):
+            raise FileNotFoundError(f"No transaction CSVs under {cfg.output_dir}/transactions; run generation first.")
+        log.info("Transaction index is missing or stale; building it.", tag="INDEX")
+        build_index(cfg)
+    return TransactionIndex(index_dir(cfg.output_dir))
@@ -0,0 +1,147 @@
+# worker.py
+"""
+Queue seeding and the worker loop behind `bankgen queue` / `bankgen worker`.
+
+Seeding reuses `bankgen build`'s planning: only persona batches / users whose manifest hash
+is stale get a job, so re-seeding after a partial run queues just the remainder. A job runs
+the same steps as build.rebuild_* for one artifact and raises when it produced nothing, so
+the queue retries it (up to queue_max_attempts) instead of stamping an empty result.
+"""
+
+from __future__ import annotations
+
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Sequence
+
+from kirkomi_utils.logging.logger import log
+from .build import BuildPlan, assemble_personas, plan_personas, plan_transactions
+from .config import AppConfig, get_config
+from .helpers import get_llm
+from .jobqueue import JOB_KINDS, Heartbeat, Job, JobQueue, worker_id
+from .metrics import metrics
+from . import generate_personas as gp
+from . import generate_transactions as gt
+from . import persona_sampler
+
+
+Confirm = Optional[Callable[[str, int], None]]
+
+
+def seed_personas(cfg: AppConfig, queue: JobQueue, confirm: Confirm = None) -> int:
+    """One job per stale persona batch (persona_source: llm). `confirm(stage, calls)` runs before seeding."""
+    if cfg.persona_source == "sampler":
+        log.error("persona_source: sampler samples personas locally; run `bankgen -r personas` instead.", tag="QUEUE")
+        return 0
+    plan = BuildPlan()
+    plan_personas(cfg, plan)
+    log.info(f"Persona batches: {len(plan.persona_fresh)} up to date, {len(plan.persona_stale)} to queue", tag="QUEUE")
+    if plan.persona_stale and confirm:
+        confirm("personas", len(plan.persona_stale))
+    return queue.seed("personas", ((f"{start:05d}", {"start": start, "n": n}) for start, n in plan.persona_stale))
+
+
+def seed_transactions(cfg: AppConfig, queue: JobQueue, confirm: Confirm = None) -> int:
+    """Assemble personas.csv from the persona batches (llm source), then one job per stale user."""
+    if cfg.persona_source == "llm" and queue.outstanding(["personas"]):
+        log.warning("Persona jobs are still outstanding; their users are not queued yet.", tag="QUEUE")
+    if cfg.persona_source == "llm" and (Path(cfg.output_dir) / gp.PERSONA_BATCH_DIR).exists():
+        assemble_personas(cfg)
+    plan = BuildPlan()
+    plan_transactions(cfg, plan)
+    log.info(f"Transactions: {len(plan.tx_fresh)} up to date, {len(plan.tx_stale)} to queue", tag="QUEUE")
+    if plan.tx_stale and confirm:
+        confirm("transactions", len(plan.tx_stale))
+    return queue.seed("transactions", ((u["user_id"], {"user_id": u["user_id"]}) for u in plan.tx_stale))
+
+
+class _Runner:
+    """Executes jobs in this process; the LLM client and personas are loaded once and reused."""
+
+    def __init__(self, cfg: AppConfig) -> None:
+        self.cfg = cfg
+        self.llm = get_llm()
+        self._personas: Optional[Dict[str, Dict[str, Any]]] = None
+        self._tx_dir = Path(cfg.output_dir) / "transactions"
+
+    def _persona(self, user_id: str) -> Dict[str, Any]:
+        if self._personas is None or user_id not in self._personas:
+            # (Re)load: personas.csv may have been re-assembled since this worker started.
+            personas = gt._load_personas(self.cfg)
+            self._personas = {} if personas is None else {
+                row["user_id"]: row for row in personas.to_dict(orient="records")
+            }
+        if user_id not in self._personas:
+            raise KeyError(f"{user_id} is not in personas.csv")
+        return self._personas[user_id]
+
+    def run(self, job: Job) -> int:
+        """Run one job; returns rows written. Raises if nothing usable was produced."""
+        cfg = self.cfg
+        if job.kind == "personas":
+            start, n = job.payload["start"], job.payload["n"]
+            rows = gp.request_batch(cfg, self.llm, start, n)
+            if not rows:
+                raise RuntimeError(f"no personas generated for batch {start}")
+            gp._save_persona_batch(cfg, start, n, rows)
+            return len(rows)
+
+        user = persona_sampler.ensure_summary(cfg, self._persona(job.payload["user_id"]), self.llm)
+        txns = gt.simulate_transactions(self.llm, user, months=cfg.months, output_format=cfg.llm_output_format)
+        if not txns:
+            raise RuntimeError(f"no transactions generated for {user['user_id']}")
+        self._tx_dir.mkdir(parents=True, exist_ok=True)
+        gt._write_user_transactions(self._tx_dir, user["user_id"], txns, cfg, user)
+        return len(txns)
+
+
+@log.log_timed("WORKER")
+def run_worker(kinds: Sequence[str] = JOB_KINDS, max_jobs: Optional[int] = None, wait: bool = False) -> int:
+    """
+    Pull and run jobs until the queue has nothing claimable (or `max_jobs` ran). With `wait`,
+    keep polling while other workers still hold leases or jobs are pending, so expired leases
+    are picked up. Returns the number of jobs completed by this worker.
+    """
+    cfg = get_config()
+    queue = JobQueue.from_config(cfg)
+    me = worker_id()
+    runner = _Runner(cfg)
+    completed = 0
+    log.info(f"Worker {me} pulling {'/'.join(kinds)} jobs from {queue.path}", tag="WORKER")
+
+    while max_jobs is None or completed < max_jobs:
+        job = queue.claim(me, kinds)
+        if job is None:
+            if wait and queue.outstanding(kinds):
+                time.sleep(cfg.queue_poll_interval_s)
+                continue
+            break
+
+        t0 = time.perf_counter()
+        with Heartbeat(queue, job, me, cfg.queue_heartbeat_s) as heartbeat:
+            try:
+                rows = runner.run(job)
+            except Exception as e:
+                state = queue.fail(job, me, f"{type(e).__name__}: {e}")
+                log.exception(f"{job.id} failed (attempt {job.attempts}/{queue.max_attempts}, now {state}): {e}", tag="WORKER")
+                continue
+        metrics.observe("queue_job_seconds", time.perf_counter() - t0, labels={"kind": job.kind})
+        if heartbeat.lost or not queue.complete(job, me):
+            log.warning(f"{job.id} finished after its lease was reclaimed by another worker", tag="WORKER")
+            continue
+        completed += 1
+        log.debug(f"{job.id} done ({rows} rows, {time.perf_counter() - t0:.1f}s)", tag="WORKER")
+
+    log.info(f"Worker {me} finished: {completed} jobs completed", tag="WORKER")
+    return completed
+
+
+def queue_status(queue: JobQueue) -> Dict[str, Dict[str, int]]:
+    counts = queue.counts()
+    for kind in JOB_KINDS:
+        states = counts.get(kind, {})
+        summary = ", ".join(f"{states.get(s, 0)} {s}" for s in ("pending", "leased", "done", "failed"))
+        log.info(f"{kind}: {summary}", tag="QUEUE")
+    for job_id, attempts, error in queue.failures():
+        log.warning(f"{job_id} failed after {attempts} attempts: {error}", tag="QUEUE")
+    return counts
@@ -0,0 +1,336 @@
+# writer.py
+"""
+Background transaction writer.
+
+Generation loops hand each user's parsed records to a TransactionWriter and move on; a
+single writer thread does the CSV encoding, disk I/O and manifest stamping. The queue is
+bounded (writer_queue_size), so a slow disk slows generation down instead of growing
+memory, and the async path awaits queue space without blocking the event loop.
+
+Two layouts (output_layout):
+
+    files    transactions/<user_id>.csv, exactly as before (the default; every downstream
+             stage reads this layout)
+    shards   shards/transactions-<ns>-<pid>.csv.gz (or .csv.zst) — many users per
+             compressed CSV, with user_id and an `extra` JSON column for fields outside
+             the contract. A shard is written under a temporary name and rotated once it
+             reaches shard_max_mb compressed or has been open shard_max_seconds: flushed,
+             fsynced, renamed into place. Users are stamped in the manifest only after
+             their shard is durable, so a crash loses at most the open shard and
+             `bankgen build` regenerates exactly those users.
+
+`bankgen unshard` expands shards into transactions/<user_id>.csv for render, serve, stats,
+catalog and the other per-user readers; when a user appears in several shards (it was
+regenerated) the newest copy wins.
+
+zstd needs the optional `zstandard` package; gzip is in the standard library.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import csv
+import gzip
+import io
+import json
+import os
+import queue
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple
+
+from kirkomi_utils.logging.logger import log
+from .config import AppConfig, get_config
+from .manifest import get_manifest
+from .metrics import metrics
+from . import records
+
+SHARD_DIR = "shards"
+SHARD_COLUMNS = (*records.TRANSACTION_COLUMNS, "user_id", "extra")
+_SUFFIX = {"gzip": ".csv.gz", "zstd": ".csv.zst"}
+_SHARD_NAME = re.compile(r"^transactions-(\d+)-(\d+)\.csv\.(gz|zst)$")
+# Longest the writer thread waits for work before checking shard age.
+_IDLE_S = 1.0
+_STOP = object()
+
+
+def shard_dir(output_dir: str | Path) -> Path:
+    return Path(output_dir) / SHARD_DIR
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError("shard_compression: zstd needs the zstandard package (pip install zstandard)") from None
+    return zstandard
+
+
+class _Shard:
+    """One open shard: raw file -> compressor -> text CSV writer."""
+
+    def __init__(self, directory: Path, compression: str) -> None:
+        self.name = f"transactions-{time.time_ns()}-{os.getpid()}{_SUFFIX[compression]}"
+        self.path = directory / self.name
+        self.tmp_path = directory / f".{self.name}.tmp"
+        self.opened = time.monotonic()
+        self.rows = 0
+        self.pending: List[Tuple[str, Dict[str, Any], int]] = []   # (user_id, user, rows) to stamp when durable
+        self._raw: BinaryIO = open(self.tmp_path, "wb")
+        if compression == "zstd":
+            self._compressed = _zstd().ZstdCompressor(level=6).stream_writer(self._raw, closefd=False)
+        else:
+            self._compressed = gzip.GzipFile(fileobj=self._raw, mode="wb", compresslevel=6)
+        self._text = io.TextIOWrapper(self._compressed, encoding="utf-8", newline="", write_through=False)
+        self._csv = csv.writer(self._text, lineterminator="\n")
+        self._csv.writerow(SHARD_COLUMNS)
+
+    def compressed_bytes(self) -> int:
+        return self._raw.tell()
+
+    def write(self, user_id: str, txns: List[records.Transaction]) -> None:
+        cols = records.to_columns(txns, records.TRANSACTION_COLUMNS)
+        base = [cols[name] for name in records.TRANSACTION_COLUMNS]
+        extra_keys = [k for k in cols if k not in records.TRANSACTION_COLUMNS]
+        if extra_keys:
+            extra = [
+                json.dumps({k: cols[k][i] for k in extra_keys}, ensure_ascii=False, default=str)
+                for i in range(len(txns))
+            ]
+        else:
+            extra = [""] * len(txns)
+        self._csv.writerows(zip(*base, [user_id] * len(txns), extra))
+        self.rows += len(txns)
+
+    def close(self) -> int:
+        """Flush, fsync and rename into place. Returns the shard's size in bytes."""
+        self._text.flush()
+        self._text.detach()
+        self._compressed.close()
+        self._raw.flush()
+        os.fsync(self._raw.fileno())
+        size = self._raw.tell()
+        self._raw.close()
+        os.replace(self.tmp_path, self.path)
+        dir_fd = os.open(self.path.parent, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+        return size
+
+
+class TransactionWriter:
+    """
+    Writes users' transactions from a background thread.
+
+        with TransactionWriter(cfg) as writer:
+            writer.submit(user_id, txns, user)          # sync loops
+            await writer.submit_async(user_id, txns, user)   # inside the event loop
+
+    `user` (the persona row) is needed to stamp the manifest; empty histories are never
+    stamped, as before (the files layout still writes a header-only CSV; a shard has no
+    rows to hold, so `bankgen unshard` produces no file for them). Leaving the block waits for every queued
+    write and closes the open shard; a write error is re-raised there (and from the next
+    submit, so generation stops early instead of producing output that is never saved).
+    """
+
+    def __init__(self, cfg: Optional[AppConfig] = None) -> None:
+        self.cfg = cfg or get_config()
+        self.layout = self.cfg.output_layout
+        self.tx_dir = Path(self.cfg.output_dir) / "transactions"
+        self.shard_dir = shard_dir(self.cfg.output_dir)
+        (self.shard_dir if self.layout == "shards" else self.tx_dir).mkdir(parents=True, exist_ok=True)
+        if self.layout == "shards" and self.cfg.shard_compression == "zstd":
+            _zstd()     # fail before any LLM call, not in the writer thread
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=self.cfg.writer_queue_size)
+        self._shard: Optional[_Shard] = None
+        self._error: Optional[BaseException] = None
+        self.users = 0
+        self.shards = 0
+        # Run in the caller's context so metrics recorded by the thread keep the current stage label.
+        context = contextvars.copy_context()
+        self._thread = threading.Thread(target=context.run, args=(self._run,), name="transaction-writer", daemon=True)
+        self._thread.start()
+
+    # -- producer side -----------------------------------------------------------
+
+    def _check(self) -> None:
+        if self._error is not None:
+            raise RuntimeError(f"transaction writer failed: {self._error}") from self._error
+
+    def submit(self, user_id: str, txns: List[records.Transaction], user: Optional[Dict[str, Any]] = None) -> None:
+        """Queue one user's records; blocks while the queue is full."""
+        self._check()
+        self._queue.put((user_id, txns, user))
+        metrics.observe("writer_queue_depth", self._queue.qsize())
+
+    async def submit_async(self, user_id: str, txns: List[records.Transaction],
+                           user: Optional[Dict[str, Any]] = None) -> None:
+        """Queue one user's records without blocking the event loop."""
+        self._check()
+        item = (user_id, txns, user)
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            await asyncio.to_thread(self._queue.put, item)
+        metrics.observe("writer_queue_depth", self._queue.qsize())
+
+    def close(self) -> None:
+        """Drain the queue, close the open shard and stop the thread. Re-raises a write error."""
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+        self._check()
+
+    def __enter__(self) -> "TransactionWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+            return
+        # Already failing: still save what was generated, but keep the original exception.
+        try:
+            self.close()
+        except Exception as e:
+            log.error(f"Transaction writer failed while shutting down: {e}", tag="WRITER")
+
+    # -- writer thread -----------------------------------------------------------
+
+    def _run(self) -> None:
+        while True:
+            try:
+                item = self._queue.get(timeout=_IDLE_S)
+            except queue.Empty:
+                self._rotate_if_due()
+                continue
+            if item is _STOP:
+                break
+            if self._error is not None:
+                continue    # drain so producers blocked on put() can finish
+            try:
+                self._write(*item)
+                self._rotate_if_due()
+            except BaseException as e:
+                self._error = e
+                log.exception(f"Writing transactions for {item[0]} failed: {e}", tag="WRITER")
+        try:
+            self._rotate()
+        except BaseException as e:
+            self._error = self._error or e
+            log.exception(f"Closing shard failed: {e}", tag="WRITER")
+
+    def _write(self, user_id: str, txns: List[records.Transaction], user: Optional[Dict[str, Any]]) -> None:
+        from . import generate_transactions as gt
+
+        if self.layout == "files":
+            gt._write_user_transactions(self.tx_dir, user_id, txns, self.cfg, user)
+            self.users += 1
+            return
+        t0 = time.perf_counter()
+        if self._shard is None:
+            self._shard = _Shard(self.shard_dir, self.cfg.shard_compression)
+        if txns:
+            self._shard.write(user_id, txns)
+            if user is not None:
+                self._shard.pending.append((user_id, user, len(txns)))
+        metrics.inc("rows_produced_total", len(txns))
+        metrics.record_write(len(txns), time.perf_counter() - t0)
+        self.users += 1
+
+    def _rotate_if_due(self) -> None:
+        shard = self._shard
+        if shard is None:
+            return
+        if (shard.compressed_bytes() >= self.cfg.shard_max_mb * 1e6
+                or time.monotonic() - shard.opened >= self.cfg.shard_max_seconds):
+            self._rotate()
+
+    def _rotate(self) -> None:
+        """Make the open shard durable, then stamp its users."""
+        from . import generate_transactions as gt
+
+        shard, self._shard = self._shard, None
+        if shard is None:
+            return
+        if not shard.rows:
+            shard.close()
+            os.unlink(shard.path)
+            return
+        t0 = time.perf_counter()
+        size = shard.close()
+        metrics.inc("writer_bytes_total", size)
+        metrics.inc("writer_shards_total")
+        metrics.observe("writer_seconds", time.perf_counter() - t0)
+        manifest = get_manifest(self.cfg)
+        for user_id, user, rows in shard.pending:
+            manifest.stamp(gt.transaction_artifact(user_id), gt.transaction_hash(self.cfg, user), rows,
+                           location=f"{SHARD_DIR}/{shard.name}")
+        self.shards += 1
+        log.debug(f"Shard {shard.name}: {shard.rows} rows, {len(shard.pending)} users, {size / 1e6:.1f} MB", tag="WRITER")
+
+
+def shard_files(output_dir: str | Path) -> List[Path]:
+    """Completed shards, oldest first."""
+    directory = shard_dir(output_dir)
+    if not directory.exists():
+        return []
+    found = [(int(m.group(1)), p) for p in directory.iterdir() if (m := _SHARD_NAME.match(p.name))]
+    return [p for _, p in sorted(found)]
+
+
+def _open_shard(path: Path) -> io.TextIOBase:
+    if path.suffix == ".zst":
+        return io.TextIOWrapper(_zstd().ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True),
+                                encoding="utf-8", newline="")
+    return gzip.open(path, "rt", encoding="utf-8", newline="")
+
+
+@log.log_timed("WRITER")
+def unshard(output_dir: Optional[str] = None, remove: bool = False) -> int:
+    """
+    Expand every shard into transactions/<user_id>.csv (newest copy of a user wins).
+    With `remove`, shards are deleted once expanded. Returns the number of users written.
+    """
+    out_dir = Path(output_dir or get_config().output_dir)
+    shards = shard_files(out_dir)
+    if not shards:
+        log.warning(f"No shards under {shard_dir(out_dir)}", tag="WRITER")
+        return 0
+    tx_dir = out_dir / "transactions"
+    tx_dir.mkdir(parents=True, exist_ok=True)
+    users: set = set()
+    rows_total = 0
+    t0 = time.perf_counter()
+    for path in shards:
+        by_user: Dict[str, List[Dict[str, str]]] = {}
+        with _open_shard(path) as f:
+            for row in csv.DictReader(f):
+                by_user.setdefault(row["user_id"], []).append(row)
+        for user_id, rows in by_user.items():
+            extra = [json.loads(r["extra"]) if r["extra"] else {} for r in rows]
+            extra_keys = list(dict.fromkeys(k for e in extra for k in e))
+            columns = [*records.TRANSACTION_COLUMNS, *extra_keys, "user_id"]
+            with open(tx_dir / f"{user_id}.csv", "w", newline="", encoding="utf-8") as out:
+                writer = csv.writer(out, lineterminator="\n")
+                writer.writerow(columns)
+                writer.writerows(
+                    [r[c] for c in records.TRANSACTION_COLUMNS] + [_cell(e.get(k)) for k in extra_keys] + [user_id]
+                    for r, e in zip(rows, extra)
+                )
+            rows_total += len(rows)
+            users.add(user_id)
+        if remove:
+            path.unlink()
+    metrics.record_write(rows_total, time.perf_counter() - t0)
+    log.info(f"✅ Expanded {len(shards)} shards into {len(users)} user files ({rows_total} rows) -> {tx_dir}", tag="WRITER")
+    return len(users)
+
+
+def _cell(value: Any) -> str:
+    """An extra field as records.write_csv would have written it (str(), None as empty)."""
+    return "" if value is None else str(value)
@@ -6,8 +6,11 @@ setup(
     py_modules=['bankgen'],
     packages=['scripts'],
     install_requires=[
-        'openai', 'pandas', 'tqdm', 'pyyaml', 'tenacity'
+        'openai', 'pandas', 'numpy', 'tqdm', 'pyyaml', 'tenacity'
     ],
+    extras_require={
+        'zstd': ['zstandard'],      # shard_compression: zstd
+    },
     entry_points={
         'console_scripts': [
             'bankgen = bankgen:main',